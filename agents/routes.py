@@ -4,6 +4,8 @@ from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
 from werkzeug.security import generate_password_hash
 from werkzeug.exceptions import HTTPException
 from db import get_connection
+from livraisons.events import record_agent_position, invalidate_timeline
+from cartographie.spatial_index import index as spatial_index
 import psycopg2
 from datetime import datetime
 
@@ -20,6 +22,7 @@ agent_model = agents_ns.model('Agent', {
     'password': fields.String(required=True, description='Mot de passe de l\'agent'),
     'telephone': fields.String(required=True, description='Téléphone de l\'agent'),
     'tricycle': fields.String(description='Numéro du tricycle'),
+    'capacite_tricycle': fields.Integer(description='Quantité transportable en une tournée'),
     'actif': fields.Boolean(description='Statut actif de l\'agent'),
     'latitude': fields.Float(description='Latitude GPS'),
     'longitude': fields.Float(description='Longitude GPS')
@@ -30,6 +33,7 @@ agent_update_model = agents_ns.model('AgentUpdate', {
     'email': fields.String(description='Email de l\'agent'),
     'telephone': fields.String(description='Téléphone de l\'agent'),
     'tricycle': fields.String(description='Numéro du tricycle'),
+    'capacite_tricycle': fields.Integer(description='Quantité transportable en une tournée'),
     'actif': fields.Boolean(description='Statut actif de l\'agent'),
     'latitude': fields.Float(description='Latitude GPS'),
     'longitude': fields.Float(description='Longitude GPS')
@@ -147,9 +151,9 @@ class AgentsList(Resource):
                 cur.execute(
                     """
                     INSERT INTO agents (
-                        nom, telephone, email, tricycle, actif, latitude, longitude, user_id
+                        nom, telephone, email, tricycle, capacite_tricycle, actif, latitude, longitude, user_id
                     )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
                     RETURNING id
                     """,
                     (
@@ -157,6 +161,7 @@ class AgentsList(Resource):
                         data['telephone'],
                         data.get('email'),
                         data.get('tricycle'),
+                        data.get('capacite_tricycle'),
                         data.get('actif', True),
                         data.get('latitude'),
                         data.get('longitude'),
@@ -175,6 +180,7 @@ class AgentsList(Resource):
 
             agent_id = cur.fetchone()["id"]
             conn.commit()
+            spatial_index.invalider("agent", agent_id)
 
             return {
                 "id": agent_id,
@@ -310,6 +316,10 @@ class AgentDetail(Resource):
                 update_fields.append("tricycle = %s")
                 update_values.append(data['tricycle'])
 
+            if 'capacite_tricycle' in data:
+                update_fields.append("capacite_tricycle = %s")
+                update_values.append(data['capacite_tricycle'])
+
             if 'actif' in data:
                 update_fields.append("actif = %s")
                 update_values.append(data['actif'])
@@ -330,6 +340,7 @@ class AgentDetail(Resource):
                 )
 
             conn.commit()
+            spatial_index.invalider("agent", agent_id)
             return {"message": "Agent mis à jour avec succès"}
 
         except Exception as e:
@@ -365,6 +376,7 @@ class AgentDetail(Resource):
             cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
 
             conn.commit()
+            spatial_index.invalider("agent", agent_id)
             return {"message": "Agent supprimé avec succès"}
 
         except Exception as e:
@@ -413,11 +425,16 @@ class AgentLocation(Resource):
                 UPDATE agents
                 SET latitude = %s, longitude = %s, last_location_update = CURRENT_TIMESTAMP
                 WHERE id = %s
+                RETURNING last_location_update
                 """,
                 (latitude, longitude, agent_id)
             )
+            last_location_update = cur.fetchone()["last_location_update"]
+            livraison_ids = record_agent_position(cur, agent_id, latitude, longitude)
 
             conn.commit()
+            invalidate_timeline(*livraison_ids)
+            spatial_index.position("agent", agent_id, latitude, longitude, last_location_update=last_location_update)
             return {"message": "Position mise à jour avec succès"}
 
         except Exception as e:
@@ -426,61 +443,71 @@ class AgentLocation(Resource):
         finally:
             conn.close()
 
+
+def compute_active_locations(conn=None):
+    """Positions des agents actifs mises à jour dans les dernières 24 h"""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        # Récupérer les agents actifs avec position récente (dernières 24h)
+        cur.execute(
+            """
+            SELECT
+                a.id,
+                u.nom as name,
+                a.telephone as phone,
+                a.tricycle,
+                a.latitude,
+                a.longitude,
+                a.last_location_update,
+                EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - a.last_location_update))/60 as minutes_since_update
+            FROM agents a
+            JOIN users u ON a.user_id = u.id
+            WHERE a.actif = TRUE
+            AND a.latitude IS NOT NULL
+            AND a.longitude IS NOT NULL
+            AND a.last_location_update > CURRENT_TIMESTAMP - INTERVAL '24 hours'
+            ORDER BY a.last_location_update DESC
+            """
+        )
+
+        agents = cur.fetchall()
+        result = []
+
+        for agent in agents:
+            result.append({
+                "id": agent['id'],
+                "matricule": f"AG-{agent['id']:03d}",
+                "name": agent["name"],
+                "phone": agent["phone"],
+                "tricycle": agent["tricycle"],
+                "latitude": float(agent["latitude"]),
+                "longitude": float(agent["longitude"]),
+                "lastLocationUpdate": agent["last_location_update"].strftime("%d/%m/%Y %H:%M:%S") if agent["last_location_update"] else None,
+                "minutesSinceUpdate": round(float(agent["minutes_since_update"]), 1),
+                "isOnline": float(agent["minutes_since_update"]) < 30,  # En ligne si MAJ < 30 min
+            })
+
+        return result
+
+    finally:
+        if own_conn:
+            conn.close()
+
+
 @agents_ns.route("/active-locations")
 class ActiveAgentsLocations(Resource):
     @agents_ns.doc(security="BearerAuth")
     @jwt_required()
     def get(self):
         """Récupérer les positions des agents actifs (mis à jour récemment)"""
-        conn = get_connection()
-        cur = conn.cursor()
-
         try:
-            # Récupérer les agents actifs avec position récente (dernières 24h)
-            cur.execute(
-                """
-                SELECT
-                    a.id,
-                    u.nom as name,
-                    a.telephone as phone,
-                    a.tricycle,
-                    a.latitude,
-                    a.longitude,
-                    a.last_location_update,
-                    EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - a.last_location_update))/60 as minutes_since_update
-                FROM agents a
-                JOIN users u ON a.user_id = u.id
-                WHERE a.actif = TRUE
-                AND a.latitude IS NOT NULL
-                AND a.longitude IS NOT NULL
-                AND a.last_location_update > CURRENT_TIMESTAMP - INTERVAL '24 hours'
-                ORDER BY a.last_location_update DESC
-                """
-            )
-
-            agents = cur.fetchall()
-            result = []
-
-            for agent in agents:
-                result.append({
-                    "id": agent['id'],
-                    "matricule": f"AG-{agent['id']:03d}",
-                    "name": agent["name"],
-                    "phone": agent["phone"],
-                    "tricycle": agent["tricycle"],
-                    "latitude": float(agent["latitude"]),
-                    "longitude": float(agent["longitude"]),
-                    "lastLocationUpdate": agent["last_location_update"].strftime("%d/%m/%Y %H:%M:%S") if agent["last_location_update"] else None,
-                    "minutesSinceUpdate": round(float(agent["minutes_since_update"]), 1),
-                    "isOnline": float(agent["minutes_since_update"]) < 30,  # En ligne si MAJ < 30 min
-                })
-
-            return result
-
+            return compute_active_locations()
         except Exception as e:
             agents_ns.abort(500, f"Erreur serveur: {str(e)}")
-        finally:
-            conn.close()
 
 
 @agents_ns.route("/<int:agent_id>/monthly-stats")
@@ -505,18 +532,18 @@ class AgentMonthlyStats(Resource):
             if not cur.fetchone():
                 agents_ns.abort(404, "Agent non trouvé")
 
-            # Statistiques des 6 derniers mois
+            # Statistiques des 6 derniers mois (agrégat journalier, voir rollups.py)
             cur.execute("""
                 SELECT
-                    TO_CHAR(DATE_TRUNC('month', l.created_at), 'Mon') as month,
-                    TO_CHAR(DATE_TRUNC('month', l.created_at), 'YYYY') as year,
-                    COUNT(*) as deliveries,
-                    COALESCE(SUM(l.montant_percu), 0) as revenue
-                FROM livraisons l
-                WHERE l.agent_id = %s
-                AND l.created_at > CURRENT_DATE - INTERVAL '6 months'
-                GROUP BY DATE_TRUNC('month', l.created_at), TO_CHAR(DATE_TRUNC('month', l.created_at), 'Mon'), TO_CHAR(DATE_TRUNC('month', l.created_at), 'YYYY')
-                ORDER BY DATE_TRUNC('month', l.created_at) DESC
+                    TO_CHAR(DATE_TRUNC('month', r.jour), 'Mon') as month,
+                    TO_CHAR(DATE_TRUNC('month', r.jour), 'YYYY') as year,
+                    SUM(r.nb_livraisons) as deliveries,
+                    COALESCE(SUM(r.montant), 0) as revenue
+                FROM livraisons_rollup_daily r
+                WHERE r.agent_id = %s
+                AND r.jour >= CURRENT_DATE - INTERVAL '6 months'
+                GROUP BY DATE_TRUNC('month', r.jour)
+                ORDER BY DATE_TRUNC('month', r.jour) DESC
             """, (agent_id,))
 
             monthly_data = cur.fetchall()
@@ -524,11 +551,11 @@ class AgentMonthlyStats(Resource):
             # Statistiques du mois en cours
             cur.execute("""
                 SELECT
-                    COUNT(*) as this_month_deliveries,
-                    COALESCE(SUM(montant_percu), 0) as this_month_revenue
-                FROM livraisons
+                    COALESCE(SUM(nb_livraisons), 0) as this_month_deliveries,
+                    COALESCE(SUM(montant), 0) as this_month_revenue
+                FROM livraisons_rollup_daily
                 WHERE agent_id = %s
-                AND DATE_TRUNC('month', created_at) = DATE_TRUNC('month', CURRENT_DATE)
+                AND jour >= DATE_TRUNC('month', CURRENT_DATE)
             """, (agent_id,))
 
             current_month = cur.fetchone()
@@ -536,10 +563,10 @@ class AgentMonthlyStats(Resource):
             # Statistiques globales pour calculer les taux
             cur.execute("""
                 SELECT
-                    COUNT(*) as total_deliveries,
-                    SUM(CASE WHEN statut = 'livree' THEN 1 ELSE 0 END) as completed_deliveries,
-                    COALESCE(SUM(montant_percu), 0) as total_revenue
-                FROM livraisons
+                    COALESCE(SUM(nb_livraisons), 0) as total_deliveries,
+                    COALESCE(SUM(nb_livraisons) FILTER (WHERE statut = 'livree'), 0) as completed_deliveries,
+                    COALESCE(SUM(montant), 0) as total_revenue
+                FROM livraisons_rollup_daily
                 WHERE agent_id = %s
             """, (agent_id,))
 
@@ -16,7 +16,11 @@ from notification.routes import notification_ns
 from user_notifications import user_notifications_ns
 from rapports.routes import rapports_ns
 from tours.blueprint import tours_bp
+from sync.routes import sync_ns
+from blobs.routes import blobs_ns
+from dashboard.routes import dashboard_ns
 from db import get_connection
+from entretien import demarrer_entretien
 from datetime import timedelta
 
 
@@ -62,7 +66,7 @@ CORS(
     app,
     supports_credentials=True,
     allow_headers=["Content-Type", "Authorization", "Accept"],
-    expose_headers=["Content-Type"],
+    expose_headers=["Content-Type", "ETag"],
     origins="*",
     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     max_age=3600
@@ -104,6 +108,9 @@ api.add_namespace(produits_ns)
 api.add_namespace(notification_ns)
 api.add_namespace(user_notifications_ns)
 api.add_namespace(rapports_ns)
+api.add_namespace(sync_ns)
+api.add_namespace(blobs_ns)
+api.add_namespace(dashboard_ns)
 
 # Enregistrer le blueprint notifications
 app.register_blueprint(notifications_bp)
@@ -111,6 +118,9 @@ app.register_blueprint(notifications_bp)
 # Enregistrer le blueprint tours
 app.register_blueprint(tours_bp)
 
+# Purge des fichiers du disque du service web (voir entretien.py)
+demarrer_entretien()
+
 # =========================
 # ROUTES
 # =========================
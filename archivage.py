@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Archivage des livraisons et commandes anciennes (données froides)
+
+Le job déplace vers les tables *_archive les livraisons et commandes clôturées
+plus anciennes que l'horizon configuré. Les rapports utilisent
+livraisons_source() / commandes_source() pour inclure l'archive uniquement
+quand la période demandée remonte avant la date de coupure.
+
+Usage:
+    python archivage.py [--horizon-jours 365] [--batch 5000] [--dry-run]
+"""
+import os
+import argparse
+from datetime import date, datetime, timedelta
+from db import get_connection
+
+ARCHIVE_HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "30"))
+
+# Seules les lignes qui n'évolueront plus sont archivées
+LIVRAISONS_STATUTS_FINAUX = ('livree', 'terminee', 'probleme')
+COMMANDES_STATUTS_FINAUX = ('livree', 'annulee')
+
+LIVRAISONS_UNION = "(SELECT * FROM livraisons UNION ALL SELECT * FROM livraisons_archive)"
+COMMANDES_UNION = "(SELECT * FROM commandes UNION ALL SELECT * FROM commandes_archive)"
+# Les lignes de détail suivent leur commande dans l'archive
+COMMANDE_DETAILS_UNION = "(SELECT * FROM commande_details UNION ALL SELECT * FROM commande_details_archive)"
+
+
+def get_archive_cutoff(cur):
+    """Date de coupure la plus récente (None si rien n'a jamais été archivé)"""
+    cur.execute("SELECT to_regclass('public.archive_runs') AS t")
+    if not cur.fetchone()["t"]:
+        return None
+    # Les passages en cours ou interrompus comptent aussi: leurs lots déjà
+    # validés sont dans l'archive
+    cur.execute("SELECT MAX(cutoff) AS cutoff FROM archive_runs")
+    row = cur.fetchone()
+    return row["cutoff"] if row else None
+
+
+def _needs_archive(cur, date_debut, marge_jours=0):
+    cutoff = get_archive_cutoff(cur)
+    if cutoff is None:
+        return False
+    if not date_debut:
+        return True
+    if isinstance(date_debut, str):
+        try:
+            date_debut = datetime.strptime(date_debut[:10], "%Y-%m-%d").date()
+        except ValueError:
+            return True
+    if isinstance(date_debut, datetime):
+        date_debut = date_debut.date()
+    # L'archivage se fait sur created_at: un rapport filtré sur date_livraison
+    # doit prévoir une marge pour les livraisons effectuées après leur création
+    return date_debut - timedelta(days=marge_jours) < cutoff
+
+
+def livraisons_source(cur, date_debut=None, marge_jours=0):
+    """
+    Source SQL à utiliser à la place de `livraisons` dans un FROM.
+    date_debut: début de la période du rapport (None = tout l'historique)
+    """
+    return LIVRAISONS_UNION if _needs_archive(cur, date_debut, marge_jours) else "livraisons"
+
+
+def commandes_source(cur, date_debut=None, marge_jours=0):
+    """Source SQL à utiliser à la place de `commandes` dans un FROM"""
+    return COMMANDES_UNION if _needs_archive(cur, date_debut, marge_jours) else "commandes"
+
+
+def commande_details_source(cur, date_debut=None, marge_jours=0):
+    """Source SQL à utiliser à la place de `commande_details`, avec commandes_source()"""
+    return COMMANDE_DETAILS_UNION if _needs_archive(cur, date_debut, marge_jours) else "commande_details"
+
+
+def _archiver_livraisons(conn, cutoff, batch_size):
+    cur = conn.cursor()
+    total = 0
+    while True:
+        cur.execute("SET LOCAL essivi.archivage = 'on'")
+        cur.execute("""
+            WITH moved AS (
+                DELETE FROM livraisons
+                WHERE id IN (
+                    SELECT id FROM livraisons
+                    WHERE created_at < %s AND statut IN %s
+                    ORDER BY id
+                    LIMIT %s
+                )
+                RETURNING *
+            )
+            INSERT INTO livraisons_archive SELECT * FROM moved
+        """, (cutoff, LIVRAISONS_STATUTS_FINAUX, batch_size))
+        moved = cur.rowcount
+        conn.commit()
+        total += moved
+        if moved:
+            print(f"   … {total} livraisons archivées")
+        if moved < batch_size:
+            return total
+
+
+def _archiver_commandes(conn, cutoff, batch_size):
+    cur = conn.cursor()
+    total = 0
+    while True:
+        cur.execute("SET LOCAL essivi.archivage = 'on'")
+        # Une commande n'est archivée que si plus aucune livraison chaude ne la référence
+        cur.execute("""
+            SELECT c.id FROM commandes c
+            WHERE c.created_at < %s AND c.statut IN %s
+            AND NOT EXISTS (SELECT 1 FROM livraisons l WHERE l.commande_id = c.id)
+            ORDER BY c.id
+            LIMIT %s
+        """, (cutoff, COMMANDES_STATUTS_FINAUX, batch_size))
+        ids = [row["id"] for row in cur.fetchall()]
+        if not ids:
+            conn.commit()
+            return total
+
+        # Copier d'abord: la suppression de la commande supprime en cascade
+        # ses lignes de détail et ses paiements
+        cur.execute("INSERT INTO commandes_archive SELECT * FROM commandes WHERE id = ANY(%s)", (ids,))
+        cur.execute("INSERT INTO commande_details_archive SELECT * FROM commande_details WHERE commande_id = ANY(%s)", (ids,))
+        cur.execute("INSERT INTO paiements_archive SELECT * FROM paiements WHERE commande_id = ANY(%s)", (ids,))
+        cur.execute("DELETE FROM commandes WHERE id = ANY(%s)", (ids,))
+        conn.commit()
+
+        total += len(ids)
+        print(f"   … {total} commandes archivées")
+        if len(ids) < batch_size:
+            return total
+
+
+def _purger_tombstones(conn):
+    """Les applications dont le watermark dépasse la rétention refont une synchro complète"""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('public.sync_tombstones') AS t")
+    if not cur.fetchone()["t"]:
+        return 0
+    cur.execute(
+        "DELETE FROM sync_tombstones WHERE deleted_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'",
+        (SYNC_TOMBSTONE_RETENTION_DAYS,)
+    )
+    purged = cur.rowcount
+    conn.commit()
+    return purged
+
+
+def archiver(horizon_jours=ARCHIVE_HORIZON_DAYS, batch_size=ARCHIVE_BATCH_SIZE, dry_run=False):
+    """Déplacer vers l'archive les lignes plus anciennes que l'horizon"""
+    cutoff = date.today() - timedelta(days=horizon_jours)
+    conn = get_connection()
+    cur = conn.cursor()
+    run_id = None
+
+    try:
+        print(f"📦 Archivage des données antérieures au {cutoff.isoformat()} (horizon {horizon_jours} jours)")
+
+        if dry_run:
+            cur.execute(
+                "SELECT COUNT(*) AS n FROM livraisons WHERE created_at < %s AND statut IN %s",
+                (cutoff, LIVRAISONS_STATUTS_FINAUX)
+            )
+            print(f"   Livraisons à archiver: {cur.fetchone()['n']}")
+            cur.execute(
+                "SELECT COUNT(*) AS n FROM commandes WHERE created_at < %s AND statut IN %s",
+                (cutoff, COMMANDES_STATUTS_FINAUX)
+            )
+            print(f"   Commandes candidates: {cur.fetchone()['n']}")
+            return None
+
+        # Enregistrer la coupure avant de déplacer quoi que ce soit, pour que
+        # les rapports incluent l'archive dès le premier lot
+        cur.execute(
+            "INSERT INTO archive_runs (cutoff) VALUES (%s) RETURNING id",
+            (cutoff,)
+        )
+        run_id = cur.fetchone()["id"]
+        conn.commit()
+
+        livraisons = _archiver_livraisons(conn, cutoff, batch_size)
+        commandes = _archiver_commandes(conn, cutoff, batch_size)
+        tombstones = _purger_tombstones(conn)
+
+        cur.execute("""
+            UPDATE archive_runs
+            SET statut = 'terminee', livraisons_archivees = %s, commandes_archivees = %s,
+                finished_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """, (livraisons, commandes, run_id))
+        conn.commit()
+
+        print(f"✓ {livraisons} livraisons et {commandes} commandes archivées, {tombstones} tombstones purgés")
+        return {"livraisons": livraisons, "commandes": commandes, "cutoff": cutoff.isoformat()}
+
+    except Exception as e:
+        conn.rollback()
+        # Les lots déjà validés restent dans l'archive: la coupure reste
+        # active pour que les rapports continuent de les voir
+        if run_id:
+            cur.execute(
+                "UPDATE archive_runs SET statut = 'interrompu', finished_at = CURRENT_TIMESTAMP WHERE id = %s",
+                (run_id,)
+            )
+            conn.commit()
+        print(f"✗ Archivage interrompu: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archiver les livraisons et commandes anciennes")
+    parser.add_argument("--horizon-jours", type=int, default=ARCHIVE_HORIZON_DAYS)
+    parser.add_argument("--batch", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    archiver(args.horizon_jours, args.batch, args.dry_run)
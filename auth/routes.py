@@ -8,6 +8,7 @@ from flask_jwt_extended import (
 )
 from werkzeug.exceptions import HTTPException
 from db import get_connection
+from cartographie.spatial_index import index as spatial_index
 
 auth_ns = Namespace(
     "authentication",
@@ -146,6 +147,7 @@ class CreateClient(Resource):
             client_id = cur.fetchone()["id"]
 
             conn.commit()
+            spatial_index.invalider("client", client_id)
 
             return {
                 "message": "Client créé avec succès",
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Mesurer le débit (lignes/s) et la mémoire des exports de rapports
+
+    --synthetique N : écrit N lignes générées en Python avec le moteur Excel
+                      (sans base de données)
+    --shards 1,2,4,8: CSV lu en tranches parallèles (même instantané), une
+                      mesure par nombre de tranches
+    --repartition N : sans base, taille des tranches (plus grosse / idéale)
+                      sur N dates de création synthétiques dont l'activité
+                      croît sur l'année: découpage en durées égales ou en
+                      quantiles (shard_ranges)
+    sinon           : exporte depuis la base (CSV par COPY et Excel) sur la période
+
+Mémoire: pic RSS du processus (ru_maxrss), à comparer entre tailles d'export.
+
+Usage:
+    python bench_exports.py --synthetique 200000
+    python bench_exports.py --type livraisons --start-date 2025-01-01 --end-date 2025-12-31
+    python bench_exports.py --shards 1,2,4,8 --start-date 2025-01-01 --end-date 2025-12-31
+    python bench_exports.py --repartition 1000000 --shards 2,4,8
+"""
+import os
+import time
+import bisect
+import random
+import resource
+import argparse
+import tempfile
+from datetime import date, time as dtime, timedelta
+from decimal import Decimal
+from db import get_connection
+from rapports.exports import (
+    build_export_query, stream_csv, export_xlsx, write_xlsx, ShardedCsvExport, EXPORT_COLUMNS,
+)
+
+
+def pic_memoire_mo():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def lignes_synthetiques(n):
+    statuts = ["livree", "terminee", "en_cours", "probleme"]
+    debut = date.today() - timedelta(days=365)
+    for i in range(n):
+        yield (
+            i + 1,
+            random.randint(1, 50000),
+            f"Agent {random.randint(1, 50)}",
+            f"Boutique {random.randint(1, 2000)}",
+            f"Quartier {random.randint(1, 300)}, Lomé",
+            random.choice(statuts),
+            Decimal(random.randint(500, 50000)),
+            debut + timedelta(days=random.randint(0, 365)),
+            dtime(random.randint(7, 19), random.randint(0, 59)),
+        )
+
+
+def bench_synthetique(n):
+    headers = [header for _, header in EXPORT_COLUMNS["livraisons"]]
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        debut = time.perf_counter()
+        count = write_xlsx(lignes_synthetiques(n), headers, path)
+        duree = time.perf_counter() - debut
+        taille = os.path.getsize(path) / 1024 / 1024
+    finally:
+        os.remove(path)
+    print(f"Excel (synthétique): {count} lignes en {duree:.1f} s = {count / duree:,.0f} lignes/s, "
+          f"fichier {taille:.1f} Mo, pic RSS {pic_memoire_mo():.0f} Mo")
+
+
+def bench_base(report_type, start_date, end_date):
+    conn = get_connection()
+    try:
+        sql, params, headers = build_export_query(conn.cursor(), report_type, start_date, end_date)
+    finally:
+        conn.close()
+
+    debut = time.perf_counter()
+    octets = 0
+    lignes = 0
+    for chunk in stream_csv(sql, params):
+        octets += len(chunk)
+        lignes += chunk.count(b"\n")
+    duree = time.perf_counter() - debut
+    print(f"CSV (COPY): {lignes - 1} lignes, {octets / 1024 / 1024:.1f} Mo en {duree:.1f} s "
+          f"= {(lignes - 1) / duree:,.0f} lignes/s, pic RSS {pic_memoire_mo():.0f} Mo")
+
+    debut = time.perf_counter()
+    path, _ = export_xlsx(sql, params, headers)
+    duree = time.perf_counter() - debut
+    try:
+        taille = os.path.getsize(path) / 1024 / 1024
+    finally:
+        os.remove(path)
+    print(f"Excel (write-only): {lignes - 1} lignes, {taille:.1f} Mo en {duree:.1f} s "
+          f"= {(lignes - 1) / duree:,.0f} lignes/s, pic RSS {pic_memoire_mo():.0f} Mo")
+
+
+def bench_shards(report_type, start_date, end_date, nombres):
+    reference = None
+    for shards in nombres:
+        export = ShardedCsvExport(report_type, start_date, end_date, shards)
+        debut = time.perf_counter()
+        export.start()
+        octets = 0
+        for chunk in export.chunks():
+            octets += len(chunk)
+        duree = time.perf_counter() - debut
+        reference = reference or duree
+        print(f"CSV {export.shards} tranche(s): {export.lignes} lignes, {octets / 1024 / 1024:.1f} Mo "
+              f"en {duree:.2f} s = {export.lignes / duree:,.0f} lignes/s, accélération x{reference / duree:.2f}")
+
+
+def dates_synthetiques(n):
+    """Dates de création sur un an, activité multipliée par ~10 entre janvier et décembre"""
+    debut = date.today() - timedelta(days=365)
+    rnd = random.Random(0)
+    # Densité linéaire croissante: tirage par la racine d'un uniforme
+    return sorted(debut + timedelta(days=365 * (0.1 + 0.9 * rnd.random() ** 0.5)) for _ in range(n))
+
+
+def bench_repartition(n, nombres):
+    dates = dates_synthetiques(n)
+    print(f"{n} livraisons synthétiques: plus grosse tranche / taille idéale")
+    for shards in nombres:
+        if shards <= 1:
+            continue
+        pas = (dates[-1] - dates[0]) / shards
+        durees = [dates[0] + pas * i for i in range(1, shards)]
+        # Mêmes coupures que percentile_disc dans shard_ranges
+        quantiles = sorted({dates[max(0, -(-n * i // shards) - 1)] for i in range(1, shards)})
+
+        ideal = n / shards
+        for nom, coupures in (("durées égales", durees), ("quantiles", quantiles)):
+            bornes = [0] + [bisect.bisect_left(dates, c) for c in coupures] + [n]
+            plus_grosse = max(b - a for a, b in zip(bornes, bornes[1:]))
+            # Les tranches tournent en parallèle: la plus grosse fixe la durée
+            print(f"   {shards} tranches, {nom:>13}: x{plus_grosse / ideal:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bench des exports de rapports")
+    parser.add_argument("--synthetique", type=int, help="Nombre de lignes générées (sans base)")
+    parser.add_argument("--type", default="livraisons")
+    parser.add_argument("--start-date")
+    parser.add_argument("--end-date")
+    parser.add_argument("--shards", help="Nombres de tranches à comparer, ex. 1,2,4,8")
+    parser.add_argument("--repartition", type=int, help="Nombre de dates synthétiques (sans base)")
+    args = parser.parse_args()
+
+    if args.repartition:
+        bench_repartition(args.repartition, [int(n) for n in (args.shards or "2,4,8").split(",")])
+    elif args.synthetique:
+        bench_synthetique(args.synthetique)
+    elif args.shards:
+        bench_shards(args.type, args.start_date, args.end_date, [int(n) for n in args.shards.split(",")])
+    else:
+        bench_base(args.type, args.start_date, args.end_date)
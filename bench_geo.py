@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Débit du calcul de distances (geo.py) à 100, 1 000 et 10 000 points
+
+Points aléatoires autour de Lomé. Pour chaque taille n, chronomètre:
+  - par paire:   un appel haversine_m par paire (ancien calcul des routes);
+  - python pur:  matrice_distances sans numpy;
+  - matrice:     matrice_distances n × n avec numpy;
+  - k plus proches: plus_proches(k=5) n × n par blocs, sans garder la matrice.
+Les calculs en Python sont limités à --python-max points (n² appels).
+
+Puis la latence (p50 / p99, en µs) des recherches de l'index spatial
+(cartographie/spatial_index.py) pour n clients et n agents: rayon de 1 km,
+k = 5 plus proches (/cartographie/nearby) et 5 agents à position récente
+(/commandes/<id>/candidates). La synchronisation tourne dans un thread à
+part: elle n'est pas sur le chemin des requêtes et n'est pas mesurée ici.
+
+Aucune base de données n'est nécessaire.
+
+Usage:
+    python bench_geo.py [--tailles 100,1000,10000] [--python-max 1000] [--repetitions 3] [--requetes 2000]
+"""
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+import geo
+from cartographie.spatial_index import IndexSpatial, Grille
+
+LOME = (6.1375, 1.2123)
+
+
+def points(n, graine=0):
+    rnd = random.Random(graine)
+    return [(LOME[0] + rnd.uniform(-0.15, 0.15), LOME[1] + rnd.uniform(-0.2, 0.2)) for _ in range(n)]
+
+
+def chronometrer(fonction, repetitions):
+    """Meilleur temps (secondes) sur les répétitions"""
+    meilleur = None
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        fonction()
+        duree = time.perf_counter() - debut
+        meilleur = duree if meilleur is None else min(meilleur, duree)
+    return meilleur
+
+
+def par_paire(pts):
+    return [[geo.haversine_m(p[0], p[1], q[0], q[1]) for q in pts] for p in pts]
+
+
+def python_pur(pts):
+    module_np, geo.np = geo.np, None
+    try:
+        return geo.matrice_distances(pts)
+    finally:
+        geo.np = module_np
+
+
+def _debit(paires, duree):
+    if duree is None:
+        return f"{'—':>22}"
+    return f"{duree * 1000:9.1f} ms {paires / duree / 1e6:7.1f} M/s"
+
+
+def index_spatial(n, graine=0):
+    """Index de n clients et n agents (positions mises à jour dans les 2 dernières heures)"""
+    rnd = random.Random(graine)
+    maintenant = datetime.now()
+    index = IndexSpatial()
+    clients, agents = Grille(), Grille()
+    for i, (lat, lon) in enumerate(points(n, graine)):
+        clients.placer(i, lat, lon, {"nom_point_vente": f"PDV {i}"})
+    for i, (lat, lon) in enumerate(points(n, graine + 1)):
+        vu = maintenant - timedelta(minutes=rnd.uniform(0, 120))
+        agents.placer(i, lat, lon, {"nom": f"Agent {i}", "capacite_tricycle": 100, "last_location_update": vu})
+    index.grilles = {"client": clients, "agent": agents}
+    return index, maintenant
+
+
+def percentiles(recherche, requetes):
+    """(p50, p99) en µs d'une recherche appelée sur chaque point"""
+    durees = []
+    for lat, lon in requetes:
+        debut = time.perf_counter()
+        recherche(lat, lon)
+        durees.append(time.perf_counter() - debut)
+    durees.sort()
+    return durees[len(durees) // 2] * 1e6, durees[min(len(durees) - 1, int(len(durees) * 0.99))] * 1e6
+
+
+def main_index(tailles, nombre):
+    print(f"\nIndex spatial: p50 / p99 par recherche ({nombre} requêtes)")
+    print(f"{'points':>7} {'rayon 1 km':>20} {'k = 5':>20} {'candidats':>20}")
+    requetes = points(nombre, graine=42)
+    for n in tailles:
+        index, maintenant = index_spatial(n)
+        limite = maintenant - timedelta(minutes=30)
+
+        def position_recente(ident, infos):
+            return infos["last_location_update"] >= limite
+
+        mesures = (
+            percentiles(lambda lat, lon: index.rayon(("client", "agent"), lat, lon, 1.0, 100), requetes),
+            percentiles(lambda lat, lon: index.plus_proches(("client", "agent"), lat, lon, 5), requetes),
+            percentiles(lambda lat, lon: index.plus_proches(("agent",), lat, lon, 5, None, position_recente), requetes),
+        )
+        print(f"{n:>7} " + " ".join(f"{p50:8.1f} / {p99:7.1f} µs" for p50, p99 in mesures))
+
+
+def main(tailles, python_max, repetitions):
+    if geo.np is None:
+        print("numpy absent: seul le calcul en Python pur est disponible\n")
+
+    print(f"{'points':>7} {'paires':>12} {'par paire':>22} {'python pur':>22} {'matrice numpy':>22} {'k plus proches':>22}")
+    for n in tailles:
+        pts = points(n)
+        paires = n * n
+        en_python = n <= python_max
+
+        t_paire = chronometrer(lambda: par_paire(pts), 1) if en_python else None
+        t_python = chronometrer(lambda: python_pur(pts), 1) if en_python else None
+        t_matrice = t_knn = None
+        if geo.np is not None:
+            coords = geo.np.array(pts)
+            t_matrice = chronometrer(lambda: geo.matrice_distances(coords), repetitions)
+            t_knn = chronometrer(lambda: geo.plus_proches(coords, coords, k=5), repetitions)
+
+        print(f"{n:>7} {paires:>12} {_debit(paires, t_paire)} {_debit(paires, t_python)} "
+              f"{_debit(paires, t_matrice)} {_debit(paires, t_knn)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bench des distances haversine (geo.py)")
+    parser.add_argument("--tailles", default="100,1000,10000", help="Nombres de points, séparés par des virgules")
+    parser.add_argument("--python-max", type=int, default=1000, help="Au-delà, pas de calcul en Python")
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--requetes", type=int, default=2000, help="Recherches par taille pour l'index spatial")
+    args = parser.parse_args()
+
+    tailles = [int(t) for t in args.tailles.split(",")]
+    main(tailles, args.python_max, args.repetitions)
+    main_index(tailles, args.requetes)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Latence de /clients/search et du filtre zone de /cartographie/clients/geo
+
+Génère N clients synthétiques dans un schéma temporaire (bench_recherche),
+applique migration_recherche_clients.sql (fonction et index trigrammes),
+puis chronomètre la requête de la route (clients/routes.py) sur des
+recherches exactes, avec faute de frappe et par téléphone. Objectif: moins
+de 20 ms sur 100 000 clients. Le schéma est supprimé à la fin (sauf --garder).
+
+Usage:
+    python bench_recherche.py [--clients 100000] [--repetitions 50]
+"""
+import os
+import time
+import argparse
+import statistics
+from db import get_connection, like_pattern
+from clients.routes import CLIENTS_SEARCH_SQL, CLIENTS_SEARCH_SEUIL
+
+SCHEMA = "bench_recherche"
+OBJECTIF_MS = 20
+MIGRATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migration_recherche_clients.sql")
+
+# (nom, texte recherché): les noms générés sont "Boutique <n> <quartier>"
+RECHERCHES = [
+    ("nom exact", "boutique 4242"),
+    ("quartier", "tokoin"),
+    ("faute de frappe", "boutiqe adidogome"),
+    ("responsable", "kossi mensah"),
+    ("téléphone", "90 42 42"),
+    ("sans résultat", "zzzz introuvable"),
+]
+
+QUARTIERS = ["Tokoin", "Bè", "Adidogomé", "Agoè", "Hédzranawoé", "Nyékonakpoè", "Kodjoviakopé", "Agbalépédo"]
+PRENOMS = ["Kossi", "Ama", "Kofi", "Akosua", "Yawa", "Komla", "Afi", "Edem"]
+NOMS = ["Mensah", "Agbeko", "Lawson", "Amegee", "Kpodar", "Dossou", "Akakpo", "Ekué"]
+
+
+def preparer(cur, clients):
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"SET search_path TO {SCHEMA}, public")
+
+    cur.execute("""
+        CREATE TABLE clients (
+            id SERIAL PRIMARY KEY,
+            nom_point_vente VARCHAR(150) NOT NULL,
+            responsable VARCHAR(100),
+            telephone VARCHAR(20),
+            adresse TEXT,
+            latitude DECIMAL(9,6),
+            longitude DECIMAL(9,6)
+        )
+    """)
+    cur.execute("""
+        INSERT INTO clients (nom_point_vente, responsable, telephone, adresse, latitude, longitude)
+        SELECT
+            'Boutique ' || n || ' ' || (%(quartiers)s::text[])[1 + n %% 8],
+            (%(prenoms)s::text[])[1 + (n / 8) %% 8] || ' ' || (%(noms)s::text[])[1 + (n / 64) %% 8],
+            '+228 90 ' || lpad((n %% 100)::text, 2, '0') || ' ' || lpad(((n / 100) %% 100)::text, 2, '0'),
+            'Rue ' || (n %% 500) || ', ' || (%(quartiers)s::text[])[1 + (n / 3) %% 8] || ', Lomé',
+            6.1375 + (random() - 0.5) * 0.3,
+            1.2123 + (random() - 0.5) * 0.4
+        FROM generate_series(1, %(total)s) n
+    """, {"quartiers": QUARTIERS, "prenoms": PRENOMS, "noms": NOMS, "total": clients})
+
+    # Fonction et index de la migration, créés dans le schéma du bench
+    with open(MIGRATION, encoding="utf-8") as f:
+        cur.execute(f.read())
+    cur.execute("ANALYZE clients")
+
+
+def chronometrer(cur, sql, params, repetitions):
+    cur.execute(sql, params)  # préchauffage du cache
+    lignes = len(cur.fetchall())
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        durees.append((time.perf_counter() - debut) * 1000)
+    durees.sort()
+    return lignes, statistics.median(durees), durees[max(0, int(len(durees) * 0.99) - 1)]
+
+
+def main(clients, repetitions, garder):
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        print(f"Génération de {clients} clients…")
+        preparer(cur, clients)
+        conn.commit()
+        cur.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, false)", (CLIENTS_SEARCH_SEUIL,))
+
+        print(f"\n{'recherche':20} {'lignes':>7} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+        for nom, q in RECHERCHES:
+            params = {"q": q, "like": like_pattern(q), "limit": 20}
+            lignes, p50, p99 = chronometrer(cur, CLIENTS_SEARCH_SQL, params, repetitions)
+            marque = "" if p99 < OBJECTIF_MS else f"  > {OBJECTIF_MS} ms"
+            print(f"{nom:20} {lignes:>7} {p50:10.2f} {p99:10.2f}{marque}")
+
+        # Filtre zone de /cartographie/clients/geo (index idx_clients_adresse_trgm)
+        lignes, p50, p99 = chronometrer(
+            cur, "SELECT id FROM clients WHERE adresse ILIKE %s", (like_pattern("tokoin"),), repetitions
+        )
+        print(f"{'zone (ILIKE)':20} {lignes:>7} {p50:10.2f} {p99:10.2f}")
+
+    finally:
+        if not garder:
+            conn.rollback()
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bench de la recherche de clients (index trigrammes)")
+    parser.add_argument("--clients", type=int, default=100000)
+    parser.add_argument("--repetitions", type=int, default=50)
+    parser.add_argument("--garder", action="store_true", help="Garder le schéma bench_recherche")
+    args = parser.parse_args()
+
+    main(args.clients, args.repetitions, args.garder)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Comparer la latence des agrégations avant / après l'agrégat journalier
+
+Génère une année de livraisons synthétiques dans un schéma temporaire
+(bench_rollup), construit l'agrégat avec la même requête que rollups.py,
+puis chronomètre les requêtes des tableaux de bord sur les deux sources.
+Le schéma est supprimé à la fin (sauf --garder).
+
+Usage:
+    python bench_rollup.py [--par-jour 400] [--agents 50] [--clients 500] [--repetitions 20]
+"""
+import time
+import argparse
+import statistics
+from db import get_connection
+from rollups import ROLLUP_SELECT, ROLLUP_COLUMNS
+
+SCHEMA = "bench_rollup"
+
+# (nom, requête sur livraisons, requête sur l'agrégat)
+REQUETES = [
+    (
+        "dashboard du jour",
+        """SELECT COUNT(*), SUM(CASE WHEN statut = 'terminee' THEN 1 ELSE 0 END), SUM(montant_percu)
+           FROM livraisons WHERE DATE(created_at) = CURRENT_DATE - 1""",
+        """SELECT SUM(nb_livraisons), SUM(nb_livraisons) FILTER (WHERE statut = 'terminee'), SUM(montant)
+           FROM livraisons_rollup_daily WHERE jour = CURRENT_DATE - 1""",
+    ),
+    (
+        "kpi du mois",
+        """SELECT COUNT(*), SUM(quantite), SUM(montant_percu) FROM livraisons
+           WHERE DATE_TRUNC('month', date_livraison) = DATE_TRUNC('month', CURRENT_DATE - 1)""",
+        """SELECT SUM(nb_livraisons), SUM(quantite), SUM(montant) FROM livraisons_rollup_daily
+           WHERE jour_livraison >= DATE_TRUNC('month', CURRENT_DATE - 1)
+           AND jour_livraison < DATE_TRUNC('month', CURRENT_DATE - 1) + INTERVAL '1 month'""",
+    ),
+    (
+        "résumé sur un an",
+        """SELECT COUNT(*), SUM(CASE WHEN statut = 'terminee' THEN 1 ELSE 0 END), SUM(montant_percu)
+           FROM livraisons WHERE DATE(created_at) BETWEEN CURRENT_DATE - 365 AND CURRENT_DATE""",
+        """SELECT SUM(nb_livraisons), SUM(nb_livraisons) FILTER (WHERE statut = 'terminee'), SUM(montant)
+           FROM livraisons_rollup_daily WHERE jour BETWEEN CURRENT_DATE - 365 AND CURRENT_DATE""",
+    ),
+    (
+        "tendances mensuelles",
+        """SELECT DATE_TRUNC('month', created_at), COUNT(*), SUM(montant_percu) FROM livraisons
+           WHERE created_at > CURRENT_DATE - INTERVAL '12 months' GROUP BY 1""",
+        """SELECT DATE_TRUNC('month', jour), SUM(nb_livraisons), SUM(montant) FROM livraisons_rollup_daily
+           WHERE jour >= CURRENT_DATE - INTERVAL '12 months' GROUP BY 1""",
+    ),
+    (
+        "stats mensuelles d'un agent",
+        """SELECT DATE_TRUNC('month', created_at), COUNT(*), SUM(montant_percu) FROM livraisons
+           WHERE agent_id = 7 AND created_at > CURRENT_DATE - INTERVAL '6 months' GROUP BY 1""",
+        """SELECT DATE_TRUNC('month', jour), SUM(nb_livraisons), SUM(montant) FROM livraisons_rollup_daily
+           WHERE agent_id = 7 AND jour >= CURRENT_DATE - INTERVAL '6 months' GROUP BY 1""",
+    ),
+    (
+        "tournées d'un agent (30 j)",
+        """SELECT DATE(date_livraison), COUNT(*), SUM(montant_percu), SUM(quantite) FROM livraisons
+           WHERE agent_id = 7 AND date_livraison >= CURRENT_DATE - INTERVAL '30 days' GROUP BY 1""",
+        """SELECT jour_livraison, SUM(nb_livraisons), SUM(montant), SUM(quantite) FROM livraisons_rollup_daily
+           WHERE agent_id = 7 AND jour_livraison >= CURRENT_DATE - INTERVAL '30 days' GROUP BY 1""",
+    ),
+]
+
+
+def preparer(cur, par_jour, agents, clients):
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"SET search_path TO {SCHEMA}")
+
+    # Mêmes colonnes et index utiles que la table de production
+    cur.execute("""
+        CREATE TABLE livraisons (
+            id SERIAL PRIMARY KEY,
+            agent_id INTEGER,
+            client_id INTEGER,
+            statut VARCHAR(20),
+            quantite INTEGER,
+            montant_percu DECIMAL(10,2),
+            date_livraison DATE,
+            created_at TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        INSERT INTO livraisons (agent_id, client_id, statut, quantite, montant_percu, date_livraison, created_at)
+        SELECT
+            1 + (random() * (%(agents)s - 1))::int,
+            1 + (random() * (%(clients)s - 1))::int,
+            (ARRAY['livree', 'livree', 'livree', 'terminee', 'en_cours', 'probleme'])[1 + (random() * 5)::int],
+            1 + (random() * 40)::int,
+            round((500 + random() * 20000)::numeric, 2),
+            (ts + (random() * INTERVAL '2 days'))::date,
+            ts
+        FROM (
+            SELECT CURRENT_DATE - (n %% 365) + random() * INTERVAL '1 day' AS ts
+            FROM generate_series(1, %(total)s) n
+        ) g
+    """, {"agents": agents, "clients": clients, "total": par_jour * 365})
+    cur.execute("CREATE INDEX ON livraisons(created_at)")
+    cur.execute("CREATE INDEX ON livraisons(agent_id)")
+    cur.execute("CREATE INDEX ON livraisons(date_livraison)")
+
+    cur.execute("""
+        CREATE TABLE livraisons_rollup_daily (
+            jour DATE NOT NULL,
+            jour_livraison DATE,
+            agent_id INTEGER NOT NULL DEFAULT 0,
+            client_id INTEGER NOT NULL DEFAULT 0,
+            statut VARCHAR(20) NOT NULL,
+            nb_livraisons INTEGER NOT NULL DEFAULT 0,
+            quantite BIGINT NOT NULL DEFAULT 0,
+            montant NUMERIC(14,2) NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute(f"""
+        INSERT INTO livraisons_rollup_daily ({ROLLUP_COLUMNS})
+        {ROLLUP_SELECT.format(source="livraisons", where="TRUE")}
+    """)
+    cur.execute("CREATE INDEX ON livraisons_rollup_daily(jour)")
+    cur.execute("CREATE INDEX ON livraisons_rollup_daily(jour_livraison)")
+    cur.execute("CREATE INDEX ON livraisons_rollup_daily(agent_id, jour)")
+    cur.execute("ANALYZE livraisons")
+    cur.execute("ANALYZE livraisons_rollup_daily")
+
+    cur.execute("SELECT (SELECT COUNT(*) FROM livraisons) AS faits, (SELECT COUNT(*) FROM livraisons_rollup_daily) AS agregat")
+    return cur.fetchone()
+
+
+def chronometrer(cur, sql, repetitions):
+    cur.execute(sql)  # préchauffage du cache
+    cur.fetchall()
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        cur.execute(sql)
+        cur.fetchall()
+        durees.append((time.perf_counter() - debut) * 1000)
+    durees.sort()
+    return statistics.median(durees), durees[int(len(durees) * 0.95) - 1]
+
+
+def main(par_jour, agents, clients, repetitions, garder):
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        print(f"Génération: {par_jour} livraisons/jour sur 365 jours…")
+        tailles = preparer(cur, par_jour, agents, clients)
+        conn.commit()
+        print(f"   livraisons: {tailles['faits']} lignes, agrégat: {tailles['agregat']} lignes\n")
+
+        print(f"{'requête':32} {'livraisons (ms)':>18} {'agrégat (ms)':>16} {'gain':>8}")
+        for nom, sql_brut, sql_agregat in REQUETES:
+            brut, brut_p95 = chronometrer(cur, sql_brut, repetitions)
+            agregat, agregat_p95 = chronometrer(cur, sql_agregat, repetitions)
+            print(f"{nom:32} {brut:8.2f} (p95 {brut_p95:6.2f}) {agregat:6.2f} (p95 {agregat_p95:6.2f}) "
+                  f"{brut / agregat if agregat else 0:7.1f}x")
+
+    finally:
+        if not garder:
+            conn.rollback()
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bench agrégat journalier vs livraisons")
+    parser.add_argument("--par-jour", type=int, default=400)
+    parser.add_argument("--agents", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--repetitions", type=int, default=20)
+    parser.add_argument("--garder", action="store_true", help="Garder le schéma bench_rollup")
+    args = parser.parse_args()
+
+    main(args.par_jour, args.agents, args.clients, args.repetitions, args.garder)
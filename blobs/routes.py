@@ -0,0 +1,443 @@
+from flask_restx import Namespace, Resource
+from flask import request, send_file, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt, verify_jwt_in_request
+from db import get_connection
+from blobs.storage import (
+    get_blob_storage, register_blob, sniff_content_type, is_blob_id, blob_url, BlobTooLarge,
+    verify_blob_signature,
+)
+from blobs.uploads import (
+    UploadError, UPLOAD_CHUNK_MAX, new_upload_id, parse_content_range, write_chunk,
+    finalize_upload, discard_part, validate_new_upload,
+)
+from blobs.variants import VARIANTES, generate_variants_async
+
+blobs_ns = Namespace(
+    "blobs",
+    path="/blobs",
+    description="Stockage des photos et signatures"
+)
+
+
+@blobs_ns.route("")
+class BlobUpload(Resource):
+    @blobs_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def post(self):
+        """
+        Envoyer un fichier (corps brut ou multipart, champ 'file').
+        Retourne la référence à passer dans photo_blob / signature_blob (admin, agent).
+        """
+        if get_jwt().get("role") not in ("admin", "agent"):
+            return {"error": "Accès réservé aux administrateurs et agents"}, 403
+
+        if request.files.get("file"):
+            upload = request.files["file"]
+            stream = upload.stream
+            content_type = upload.mimetype
+        else:
+            stream = request.stream
+            content_type = request.mimetype
+
+        try:
+            sha256, taille, head = get_blob_storage().put_stream(stream)
+        except BlobTooLarge as e:
+            return {"error": str(e)}, 413
+
+        if taille == 0:
+            return {"error": "Fichier vide"}, 400
+
+        if not content_type or content_type in ("application/octet-stream", "multipart/form-data"):
+            content_type = sniff_content_type(head)
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        try:
+            register_blob(cur, sha256, taille, content_type)
+            conn.commit()
+
+            return {
+                "sha256": sha256,
+                "url": blob_url(sha256),
+                "taille": taille,
+                "content_type": content_type,
+            }, 201
+
+        except Exception as e:
+            conn.rollback()
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+        finally:
+            conn.close()
+
+
+def upload_status(upload):
+    return {
+        "upload_id": upload["id"],
+        "livraison_id": upload["livraison_id"],
+        "champ": upload["champ"],
+        "taille": upload["taille_totale"],
+        "recu": upload["recu"],
+        "statut": upload["statut"],
+        "chunk_max": UPLOAD_CHUNK_MAX,
+        "url": blob_url(upload["blob_sha256"]) if upload.get("blob_sha256") else None,
+    }
+
+
+def check_livraison_access(cur, livraison_id):
+    """Admin: toutes les livraisons; agent: les siennes. Retourne une erreur ou None"""
+    cur.execute("SELECT id, agent_id FROM livraisons WHERE id = %s", (livraison_id,))
+    livraison = cur.fetchone()
+    if not livraison:
+        return {"error": "Livraison non trouvée"}, 404
+
+    if get_jwt().get("role") == "admin":
+        return None
+
+    cur.execute("SELECT id FROM agents WHERE user_id = %s", (get_jwt_identity(),))
+    agent = cur.fetchone()
+    if not agent or livraison["agent_id"] != agent["id"]:
+        return {"error": "Accès refusé à cette livraison"}, 403
+    return None
+
+
+def check_blob_access(cur, sha256):
+    """
+    Admin: tous les fichiers; agent / client: ceux des livraisons (courantes
+    ou archivées) qui leur sont visibles. Retourne une erreur ou None
+    """
+    role = get_jwt().get("role")
+    if role == "admin":
+        return None
+
+    if role == "agent":
+        cur.execute("SELECT id FROM agents WHERE user_id = %s", (get_jwt_identity(),))
+        colonne = "agent_id"
+    elif role == "client":
+        cur.execute("SELECT id FROM clients WHERE user_id = %s", (get_jwt_identity(),))
+        colonne = "client_id"
+    else:
+        return {"error": "Accès refusé à ce fichier"}, 403
+    proprietaire = cur.fetchone()
+
+    if proprietaire:
+        cur.execute(f"""
+            SELECT 1 FROM livraisons
+            WHERE {colonne} = %s AND (photo_blob = %s OR signature_blob = %s)
+            UNION ALL
+            SELECT 1 FROM livraisons_archive
+            WHERE {colonne} = %s AND (photo_blob = %s OR signature_blob = %s)
+            LIMIT 1
+        """, (proprietaire["id"], sha256, sha256) * 2)
+        if cur.fetchone():
+            return None
+    return {"error": "Accès refusé à ce fichier"}, 403
+
+
+def possede_blob(cur, sha256, livraison_id):
+    """
+    L'utilisateur a déjà prouvé qu'il détient le contenu: il l'a envoyé
+    lui-même (envoi par morceaux terminé) ou la livraison le référence déjà.
+    Connaître l'empreinte ne suffit pas.
+    """
+    cur.execute("""
+        SELECT 1 FROM uploads
+        WHERE blob_sha256 = %s AND utilisateur_id = %s AND statut = 'termine'
+        UNION ALL
+        SELECT 1 FROM livraisons
+        WHERE id = %s AND (photo_blob = %s OR signature_blob = %s)
+        LIMIT 1
+    """, (sha256, get_jwt_identity(), livraison_id, sha256, sha256))
+    return cur.fetchone() is not None
+
+
+def attach_to_livraison(cur, upload, sha256):
+    """Rattacher le blob à la livraison (la projection suit par trigger)"""
+    if upload["champ"] == "signature":
+        cur.execute("""
+            UPDATE livraisons SET signature_blob = %s, signature_client = NULL WHERE id = %s
+        """, (sha256, upload["livraison_id"]))
+    else:
+        cur.execute("""
+            UPDATE livraisons SET photo_blob = %s, photo_lieu = NULL WHERE id = %s
+        """, (sha256, upload["livraison_id"]))
+
+
+@blobs_ns.route("/uploads")
+class UploadCreate(Resource):
+    @blobs_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def post(self):
+        """
+        Déclarer un envoi par morceaux pour une livraison.
+        Corps: livraison_id, champ (photo|signature), taille, sha256, content_type.
+        Un envoi en cours pour le même fichier est repris au lieu d'être recréé.
+        """
+        data = request.get_json() or {}
+        livraison_id = data.get("livraison_id")
+        if not livraison_id:
+            return {"error": "livraison_id requis"}, 400
+
+        try:
+            champ, taille, sha256 = validate_new_upload(data)
+        except UploadError as e:
+            return {"error": str(e)}, e.status
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        try:
+            erreur = check_livraison_access(cur, livraison_id)
+            if erreur:
+                return erreur
+
+            # Fichier déjà envoyé par l'utilisateur (nouvel essai après succès,
+            # doublon): rattachement direct. Sinon les octets sont exigés, même
+            # si le contenu est déjà stocké
+            cur.execute("SELECT sha256 FROM blobs WHERE sha256 = %s", (sha256,))
+            if cur.fetchone() and possede_blob(cur, sha256, livraison_id) and get_blob_storage().exists(sha256):
+                cur.execute("""
+                    INSERT INTO uploads (id, livraison_id, champ, taille_totale, sha256_attendu,
+                                         content_type, recu, statut, blob_sha256, utilisateur_id)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, 'termine', %s, %s)
+                    RETURNING *
+                """, (new_upload_id(), livraison_id, champ, taille, sha256,
+                      data.get("content_type"), taille, sha256, get_jwt_identity()))
+                upload = cur.fetchone()
+                attach_to_livraison(cur, upload, sha256)
+                conn.commit()
+                return upload_status(upload), 200
+
+            cur.execute("""
+                SELECT * FROM uploads
+                WHERE livraison_id = %s AND champ = %s AND sha256_attendu = %s AND statut = 'en_cours'
+                ORDER BY created_at DESC
+                LIMIT 1
+            """, (livraison_id, champ, sha256))
+            upload = cur.fetchone()
+            if upload:
+                return upload_status(upload), 200
+
+            cur.execute("""
+                INSERT INTO uploads (id, livraison_id, champ, taille_totale, sha256_attendu,
+                                     content_type, utilisateur_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                RETURNING *
+            """, (new_upload_id(), livraison_id, champ, taille, sha256,
+                  data.get("content_type"), get_jwt_identity()))
+            upload = cur.fetchone()
+            conn.commit()
+
+            return upload_status(upload), 201
+
+        except Exception as e:
+            conn.rollback()
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+        finally:
+            conn.close()
+
+
+@blobs_ns.route("/uploads/<string:upload_id>")
+class UploadChunk(Resource):
+    @blobs_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def get(self, upload_id):
+        """État d'un envoi: position reçue à partir de laquelle reprendre"""
+        conn = get_connection()
+        cur = conn.cursor()
+
+        try:
+            cur.execute("SELECT * FROM uploads WHERE id = %s", (upload_id,))
+            upload = cur.fetchone()
+            if not upload:
+                return {"error": "Envoi non trouvé"}, 404
+
+            erreur = check_livraison_access(cur, upload["livraison_id"])
+            if erreur:
+                return erreur
+
+            return upload_status(upload), 200
+
+        except Exception as e:
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+        finally:
+            conn.close()
+
+    @blobs_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def put(self, upload_id):
+        """
+        Envoyer un morceau (corps brut, en-tête Content-Range: bytes debut-fin/total).
+        Le dernier morceau déclenche la vérification SHA-256 et le rattachement
+        à la livraison; les variantes réduites sont produites en arrière-plan.
+        """
+        plage = parse_content_range(request.headers.get("Content-Range"))
+        if not plage:
+            return {"error": "En-tête Content-Range requis (bytes debut-fin/total)"}, 400
+        debut, fin, total = plage
+        longueur = fin - debut + 1
+        if longueur <= 0:
+            return {"error": "Content-Range invalide"}, 400
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        try:
+            # Verrou de ligne: deux essais simultanés du même morceau ne se croisent pas
+            cur.execute("SELECT * FROM uploads WHERE id = %s FOR UPDATE", (upload_id,))
+            upload = cur.fetchone()
+            if not upload:
+                return {"error": "Envoi non trouvé"}, 404
+
+            erreur = check_livraison_access(cur, upload["livraison_id"])
+            if erreur:
+                return erreur
+
+            if upload["statut"] != "en_cours":
+                return upload_status(upload), 200 if upload["statut"] == "termine" else 410
+            if total is not None and total != upload["taille_totale"]:
+                return {"error": "Taille différente de celle annoncée"}, 400
+
+            try:
+                recu = write_chunk(upload, debut, request.stream, longueur)
+            except UploadError as e:
+                conn.rollback()
+                return {"error": str(e), **upload_status(upload)}, e.status
+
+            upload["recu"] = recu
+            if recu < upload["taille_totale"]:
+                cur.execute("UPDATE uploads SET recu = %s WHERE id = %s", (recu, upload_id))
+                conn.commit()
+                return upload_status(upload), 200
+
+            try:
+                sha256, taille, head = finalize_upload(upload)
+            except UploadError as e:
+                cur.execute("UPDATE uploads SET recu = 0, statut = 'echec' WHERE id = %s", (upload_id,))
+                conn.commit()
+                return {"error": str(e)}, e.status
+
+            content_type = upload["content_type"]
+            if not content_type or content_type == "application/octet-stream":
+                content_type = sniff_content_type(head)
+            register_blob(cur, sha256, taille, content_type)
+            cur.execute("""
+                UPDATE uploads SET recu = %s, statut = 'termine', blob_sha256 = %s
+                WHERE id = %s
+                RETURNING *
+            """, (recu, sha256, upload_id))
+            upload = cur.fetchone()
+            attach_to_livraison(cur, upload, sha256)
+            conn.commit()
+
+            if upload["champ"] == "photo":
+                generate_variants_async(sha256)
+
+            return upload_status(upload), 201
+
+        except Exception as e:
+            conn.rollback()
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+        finally:
+            conn.close()
+
+    @blobs_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def delete(self, upload_id):
+        """Abandonner un envoi en cours"""
+        conn = get_connection()
+        cur = conn.cursor()
+
+        try:
+            cur.execute("SELECT * FROM uploads WHERE id = %s", (upload_id,))
+            upload = cur.fetchone()
+            if not upload:
+                return {"error": "Envoi non trouvé"}, 404
+
+            erreur = check_livraison_access(cur, upload["livraison_id"])
+            if erreur:
+                return erreur
+
+            if upload["statut"] == "en_cours":
+                cur.execute("DELETE FROM uploads WHERE id = %s", (upload_id,))
+                conn.commit()
+                discard_part(upload_id)
+
+            return {"message": "Envoi abandonné"}, 200
+
+        except Exception as e:
+            conn.rollback()
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+        finally:
+            conn.close()
+
+
+@blobs_ns.route("/<string:sha256>")
+class BlobDownload(Resource):
+    @blobs_ns.doc(security="BearerAuth", params={
+        "variante": "medium | thumb (original si absente)",
+        "expires": "Échéance d'une URL signée (à la place du JWT)",
+        "signature": "Signature d'une URL signée",
+    })
+    def get(self, sha256):
+        """Télécharger un fichier (supporte Range et If-None-Match)"""
+        if not is_blob_id(sha256):
+            return {"error": "Référence invalide"}, 400
+
+        variante = request.args.get("variante")
+        if variante and variante not in VARIANTES:
+            return {"error": f"Variante invalide (valeurs possibles: {', '.join(VARIANTES)})"}, 400
+
+        # URL signée (miniatures des listes, chargées par <img src>) ou JWT
+        signee = "signature" in request.args
+        if signee:
+            if not verify_blob_signature(
+                current_app.config["JWT_SECRET_KEY"], sha256, variante,
+                request.args.get("expires"), request.args.get("signature"),
+            ):
+                return {"error": "URL expirée ou signature invalide"}, 403
+        else:
+            verify_jwt_in_request()
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        provisoire = False
+        try:
+            # L'URL signée a été remise par une liste déjà filtrée; avec le JWT,
+            # le fichier doit appartenir à une livraison visible par l'utilisateur
+            if not signee:
+                erreur = check_blob_access(cur, sha256)
+                if erreur:
+                    return erreur
+
+            if variante:
+                # Variante pas encore produite: l'original fait l'affaire
+                cur.execute("""
+                    SELECT variante_sha256 FROM blob_variants
+                    WHERE sha256 = %s AND variante = %s
+                """, (sha256, variante))
+                row = cur.fetchone()
+                if row:
+                    sha256 = row["variante_sha256"]
+                else:
+                    provisoire = True
+
+            cur.execute("SELECT content_type FROM blobs WHERE sha256 = %s", (sha256,))
+            row = cur.fetchone()
+        finally:
+            conn.close()
+
+        storage = get_blob_storage()
+        if not storage.exists(sha256):
+            return {"error": "Fichier non trouvé"}, 404
+
+        # Contenu immuable: le sha256 sert d'ETag et le cache peut être permanent,
+        # sauf pour l'original servi à la place d'une variante à venir
+        return send_file(
+            storage.path_for(sha256),
+            mimetype=row["content_type"] if row else "application/octet-stream",
+            conditional=True,
+            etag=sha256,
+            max_age=60 if provisoire else 31536000,
+        )
@@ -0,0 +1,209 @@
+"""
+Stockage des fichiers (photos, signatures) adressé par contenu
+
+Chaque fichier est identifié par le SHA-256 de son contenu: un même fichier
+envoyé deux fois n'est stocké qu'une fois. Les lignes de livraison ne gardent
+que cette référence (photo_blob, signature_blob).
+"""
+import os
+import re
+import base64
+import binascii
+import hmac
+import time
+import hashlib
+import tempfile
+
+BLOB_STORAGE_DIR = os.getenv(
+    "BLOB_STORAGE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "uploads", "blobs")
+)
+BLOB_MAX_SIZE = int(os.getenv("BLOB_MAX_SIZE", str(20 * 1024 * 1024)))
+# Durée de validité des URL signées (miniatures affichées par <img src>, sans
+# en-tête Authorization). L'échéance est arrondie à ce pas: une même liste
+# rechargée redonne les mêmes URL et le navigateur garde son cache.
+BLOB_URL_TTL = int(os.getenv("BLOB_URL_TTL", "900"))
+
+CHUNK_SIZE = 64 * 1024
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+BASE64_RE = re.compile(r"^[A-Za-z0-9+/=\s]+$")
+
+# Valeurs plus courtes: URL ou chemin saisi par l'ancienne application, gardé tel quel
+INLINE_MIN_SIZE = 256
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+def is_blob_id(value):
+    return bool(value) and bool(SHA256_RE.match(value))
+
+
+def blob_url(sha256):
+    return f"/blobs/{sha256}" if sha256 else None
+
+
+def _blob_signature(secret, sha256, variante, expires):
+    message = f"{sha256}:{variante or ''}:{expires}".encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def signed_blob_url(secret, sha256, variante=None, ttl=BLOB_URL_TTL):
+    """URL de téléchargement valable ttl à 2·ttl secondes, sans JWT"""
+    expires = (int(time.time()) // ttl + 2) * ttl
+    signature = _blob_signature(secret, sha256, variante, expires)
+    variante_param = f"variante={variante}&" if variante else ""
+    return f"{blob_url(sha256)}?{variante_param}expires={expires}&signature={signature}"
+
+
+def verify_blob_signature(secret, sha256, variante, expires, signature):
+    """Signature valide et non échue pour ce fichier et cette variante"""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_blob_signature(secret, sha256, variante, expires), signature or "")
+
+
+def sniff_content_type(head):
+    """Type MIME à partir des premiers octets (formats envoyés par les applications)"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"%PDF"):
+        return "application/pdf"
+    return "application/octet-stream"
+
+
+class LocalBlobStorage:
+    """Backend système de fichiers: <racine>/ab/cd/abcd…"""
+
+    def __init__(self, root=BLOB_STORAGE_DIR):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path_for(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256):
+        return os.path.exists(self.path_for(sha256))
+
+    def put_stream(self, stream, max_size=BLOB_MAX_SIZE):
+        """
+        Écrire un flux par morceaux en calculant son empreinte.
+        Retourne (sha256, taille, premiers octets).
+        """
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_size:
+                        raise BlobTooLarge(f"Fichier trop volumineux (maximum {max_size} octets)")
+                    if len(head) < 16:
+                        head += chunk[:16 - len(head)]
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            sha256 = digest.hexdigest()
+            final_path = self.path_for(sha256)
+            if os.path.exists(final_path):
+                # Déjà stocké: déduplication
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+            return sha256, size, head
+
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def adopt_file(self, path, sha256):
+        """Déplacer un fichier déjà vérifié (même disque) à sa place définitive"""
+        final_path = self.path_for(sha256)
+        if os.path.exists(final_path):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(path, final_path)
+
+    def put_bytes(self, data):
+        from io import BytesIO
+        return self.put_stream(BytesIO(data))
+
+    def open(self, sha256):
+        return open(self.path_for(sha256), "rb")
+
+    def delete(self, sha256):
+        path = self.path_for(sha256)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+_blob_storage = None
+
+
+def get_blob_storage():
+    """Get or create blob storage singleton"""
+    global _blob_storage
+    if _blob_storage is None:
+        _blob_storage = LocalBlobStorage()
+    return _blob_storage
+
+
+def register_blob(cur, sha256, taille, content_type):
+    """Enregistrer les métadonnées du fichier (sans effet s'il existe déjà)"""
+    cur.execute("""
+        INSERT INTO blobs (sha256, taille, content_type)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (sha256) DO NOTHING
+    """, (sha256, taille, content_type))
+
+
+def store_inline_payload(cur, value):
+    """
+    Convertir une valeur envoyée en ligne (base64 ou data URI) en blob.
+    Retourne le sha256, ou None si la valeur n'est pas un contenu encodé
+    (URL, chemin, valeur vide): elle reste alors dans la colonne d'origine.
+    """
+    if not value or not isinstance(value, str):
+        return None
+    if is_blob_id(value):
+        return value
+
+    content_type = None
+    payload = value
+    if value.startswith("data:"):
+        header, _, payload = value.partition(",")
+        if ";base64" not in header:
+            return None
+        content_type = header[5:].split(";")[0] or None
+    elif len(value) < INLINE_MIN_SIZE or not BASE64_RE.match(value[:1024]):
+        return None
+
+    try:
+        data = base64.b64decode(payload, validate=False)
+    except (binascii.Error, ValueError):
+        return None
+    if not data:
+        return None
+
+    sha256, taille, head = get_blob_storage().put_bytes(data)
+    register_blob(cur, sha256, taille, content_type or sniff_content_type(head))
+    return sha256
@@ -0,0 +1,134 @@
+"""
+Envoi des photos de livraison par morceaux
+
+Le client annonce la taille et le SHA-256 du fichier, puis envoie les morceaux
+dans l'ordre (en-tête Content-Range). Les morceaux sont écrits directement dans
+un fichier partiel; la position reçue est enregistrée dans la table uploads,
+ce qui permet de reprendre l'envoi après une coupure au lieu de recommencer.
+"""
+import os
+import re
+import hashlib
+import secrets
+from blobs.storage import get_blob_storage, BLOB_MAX_SIZE, CHUNK_SIZE
+
+UPLOAD_CHUNK_MAX = int(os.getenv("UPLOAD_CHUNK_MAX", str(5 * 1024 * 1024)))
+UPLOAD_CHAMPS = ("photo", "signature")
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def new_upload_id():
+    return secrets.token_hex(16)
+
+
+def parse_content_range(header):
+    """'bytes 0-524287/2000000' -> (0, 524287, 2000000); None si absent ou invalide"""
+    match = CONTENT_RANGE_RE.match((header or "").strip())
+    if not match:
+        return None
+    debut, fin, total = match.groups()
+    return int(debut), int(fin), None if total == "*" else int(total)
+
+
+def part_path(upload_id):
+    storage = get_blob_storage()
+    directory = os.path.join(storage.root, "uploads")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{upload_id}.part")
+
+
+def write_chunk(upload, debut, stream, longueur):
+    """
+    Écrire un morceau à sa position dans le fichier partiel.
+    Un morceau déjà reçu (nouvel essai après une réponse perdue) est réécrit
+    à l'identique; un trou dans la séquence est refusé.
+    Retourne la nouvelle position reçue.
+    """
+    if debut > upload["recu"]:
+        raise UploadError(f"Morceau hors séquence: position attendue {upload['recu']}", 409)
+    if longueur > UPLOAD_CHUNK_MAX:
+        raise UploadError(f"Morceau trop volumineux (maximum {UPLOAD_CHUNK_MAX} octets)", 413)
+    if debut + longueur > upload["taille_totale"]:
+        raise UploadError("Le morceau dépasse la taille annoncée", 416)
+
+    path = part_path(upload["id"])
+    with open(path, "r+b" if os.path.exists(path) else "wb") as part:
+        part.seek(debut)
+        restant = longueur
+        while restant > 0:
+            chunk = stream.read(min(CHUNK_SIZE, restant))
+            if not chunk:
+                break
+            part.write(chunk)
+            restant -= len(chunk)
+        if restant:
+            raise UploadError("Morceau incomplet", 400)
+        part.flush()
+        os.fsync(part.fileno())
+
+    return max(upload["recu"], debut + longueur)
+
+
+def finalize_upload(upload):
+    """
+    Vérifier l'empreinte du fichier assemblé et le déplacer dans le stockage.
+    Retourne (sha256, taille, premiers octets); le fichier partiel est supprimé
+    si l'empreinte ne correspond pas (l'envoi doit alors recommencer).
+    """
+    path = part_path(upload["id"])
+    digest = hashlib.sha256()
+    taille = 0
+    head = b""
+
+    with open(path, "rb") as part:
+        while True:
+            chunk = part.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if not head:
+                head = chunk[:16]
+            taille += len(chunk)
+            digest.update(chunk)
+
+    sha256 = digest.hexdigest()
+    if taille != upload["taille_totale"] or sha256 != upload["sha256_attendu"].strip():
+        os.remove(path)
+        raise UploadError("Empreinte SHA-256 différente de celle annoncée: envoi à recommencer", 422)
+
+    get_blob_storage().adopt_file(path, sha256)
+    return sha256, taille, head
+
+
+def discard_part(upload_id):
+    path = part_path(upload_id)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def validate_new_upload(data):
+    """Contrôler la déclaration d'un envoi; retourne (champ, taille, sha256)"""
+    champ = data.get("champ", "photo")
+    if champ not in UPLOAD_CHAMPS:
+        raise UploadError(f"Champ invalide (valeurs possibles: {', '.join(UPLOAD_CHAMPS)})")
+
+    try:
+        taille = int(data.get("taille"))
+    except (TypeError, ValueError):
+        raise UploadError("Taille du fichier requise")
+    if taille <= 0:
+        raise UploadError("Taille du fichier requise")
+    if taille > BLOB_MAX_SIZE:
+        raise UploadError(f"Fichier trop volumineux (maximum {BLOB_MAX_SIZE} octets)", 413)
+
+    sha256 = (data.get("sha256") or "").lower()
+    if not re.match(r"^[0-9a-f]{64}$", sha256):
+        raise UploadError("Empreinte SHA-256 requise")
+
+    return champ, taille, sha256
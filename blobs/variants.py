@@ -0,0 +1,117 @@
+"""
+Versions réduites des photos de livraison
+
+Générées en arrière-plan après un envoi: 'medium' pour l'affichage détaillé,
+'thumb' pour les listes du tableau de bord. Chaque variante est un blob
+référencé dans blob_variants. Sans Pillow, aucune variante n'est produite et
+les téléchargements renvoient l'original.
+"""
+import os
+from io import BytesIO
+from threading import Thread
+from db import get_connection
+from blobs.storage import get_blob_storage, register_blob
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow optionnel
+    Image = None
+
+# variante -> plus grand côté en pixels
+VARIANTES = {
+    "medium": 1280,
+    "thumb": 256,
+}
+JPEG_QUALITY = 82
+
+IMAGE_TYPES = ("image/jpeg", "image/png", "image/webp")
+# Photos reprises par passage d'entretien (entretien.py)
+VARIANTES_RATTRAPAGE_LOT = int(os.getenv("VARIANTES_RATTRAPAGE_LOT", "100"))
+
+
+def _reduire(original, cote_max):
+    image = original.copy()
+    image.thumbnail((cote_max, cote_max))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return buffer.getvalue(), image.size
+
+
+def generate_variants(sha256):
+    """Produire les variantes manquantes d'une photo (connexion dédiée)"""
+    if Image is None:
+        print(f"[variants] Pillow absent, pas de variantes pour {sha256}")
+        return
+
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("SELECT content_type FROM blobs WHERE sha256 = %s", (sha256,))
+        blob = cur.fetchone()
+        if not blob or blob["content_type"] not in IMAGE_TYPES:
+            return
+
+        cur.execute("SELECT variante FROM blob_variants WHERE sha256 = %s", (sha256,))
+        existantes = {row["variante"] for row in cur.fetchall()}
+        manquantes = [v for v in VARIANTES if v not in existantes]
+        if not manquantes:
+            return
+
+        storage = get_blob_storage()
+        with storage.open(sha256) as f:
+            original = Image.open(f)
+            original.load()
+        # Photos de téléphone: appliquer l'orientation EXIF avant de réduire
+        original = ImageOps.exif_transpose(original)
+
+        for variante in manquantes:
+            data, (largeur, hauteur) = _reduire(original, VARIANTES[variante])
+            variante_sha256, taille, _ = storage.put_bytes(data)
+            register_blob(cur, variante_sha256, taille, "image/jpeg")
+            cur.execute("""
+                INSERT INTO blob_variants (sha256, variante, variante_sha256, largeur, hauteur)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (sha256, variante) DO NOTHING
+            """, (sha256, variante, variante_sha256, largeur, hauteur))
+
+        conn.commit()
+
+    except Exception as e:
+        conn.rollback()
+        print(f"[variants] Erreur pour {sha256}: {str(e)}")
+    finally:
+        conn.close()
+
+
+def rattraper_variantes(conn, lot=VARIANTES_RATTRAPAGE_LOT):
+    """
+    Photos de livraison sans toutes leurs variantes (génération interrompue
+    par l'arrêt du worker, erreur passagère): produites à nouveau, les plus
+    récentes d'abord. Retourne le nombre de photos traitées.
+    """
+    if Image is None:
+        return 0
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT b.sha256
+        FROM blobs b
+        WHERE b.content_type IN %s
+        AND b.created_at < CURRENT_TIMESTAMP - INTERVAL '5 minutes'
+        AND EXISTS (SELECT 1 FROM livraisons l WHERE l.photo_blob = b.sha256)
+        AND (SELECT COUNT(*) FROM blob_variants v WHERE v.sha256 = b.sha256) < %s
+        ORDER BY b.created_at DESC
+        LIMIT %s
+    """, (IMAGE_TYPES, len(VARIANTES), lot))
+    photos = [row["sha256"] for row in cur.fetchall()]
+    conn.commit()
+    for sha256 in photos:
+        generate_variants(sha256)
+    return len(photos)
+
+
+def generate_variants_async(sha256):
+    """Lancer la génération sans bloquer la réponse"""
+    Thread(target=generate_variants, args=(sha256,), daemon=True).start()
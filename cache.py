@@ -0,0 +1,430 @@
+"""
+Cache des résultats calculés (tableaux de bord, KPI, rapports)
+
+Le tableau de bord admin interroge les KPI toutes les quelques secondes et
+par onglet ouvert. Les résultats sont gardés quelques secondes (TTL) et, en
+cas d'absence, un seul calcul est lancé: les requêtes simultanées attendent
+son résultat au lieu de refaire les mêmes requêtes SQL.
+
+Le stockage est interchangeable (RESULT_CACHE_BACKEND):
+  - memory:   dictionnaire LRU propre à chaque worker
+  - sqlite:   fichier local partagé par les workers gunicorn d'une machine (défaut)
+  - postgres: table UNLOGGED partagée par toutes les machines (migration_cache.sql)
+
+Les clés sont versionnées: RESULT_CACHE_VERSION (à incrémenter quand la forme
+d'un résultat change) et la version de chaque étiquette. Les routes
+d'écriture (commandes, livraisons, assignation) incrémentent la version de
+l'étiquette après leur commit: les anciennes entrées ne sont plus lues et
+disparaissent par expiration ou éviction LRU.
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from threading import Lock, Event
+
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "5"))
+# Rapports plus lourds et moins consultés: durée de vie plus longue
+REPORT_CACHE_TTL = float(os.getenv("REPORT_CACHE_TTL", "300"))
+# Pendant le recalcul d'une entrée expirée, l'ancienne valeur reste servie
+RESULT_CACHE_STALE_GRACE = float(os.getenv("RESULT_CACHE_STALE_GRACE", "30"))
+
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "sqlite")
+RESULT_CACHE_VERSION = 1
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1000"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Valeurs sérialisées au-delà de cette taille: compressées (zlib)
+RESULT_CACHE_COMPRESS_MIN = int(os.getenv("RESULT_CACHE_COMPRESS_MIN", "2048"))
+RESULT_CACHE_SQLITE_PATH = os.getenv(
+    "RESULT_CACHE_SQLITE_PATH",
+    os.path.join(tempfile.gettempdir(), "essivi_result_cache.sqlite3")
+)
+
+# Étiquette des résultats qui dépendent des livraisons et des commandes
+CACHE_TAG_DASHBOARD = "dashboard"
+# Étiquette des rapports longs (REPORT_CACHE_TTL) calculés sur les vues et
+# agrégats: invalidés par leur rafraîchissement, pas par chaque écriture
+CACHE_TAG_RAPPORTS = "rapports"
+
+_inflight = {}      # clé -> _Flight (coalescence propre au worker)
+_lock = Lock()
+
+_metrics = {
+    "hits": 0,
+    "misses": 0,
+    "stale": 0,
+    "coalesced": 0,
+    "invalidations": 0,
+    "errors": 0,
+    "backend_errors": 0,
+}
+
+
+class _Flight:
+    """Calcul en cours, partagé par les requêtes qui arrivent pendant ce temps"""
+
+    def __init__(self):
+        self.done = Event()
+        self.value = None
+        self.error = None
+
+
+def _dumps(value):
+    """Sérialiser (JSON) et compresser au-delà de RESULT_CACHE_COMPRESS_MIN"""
+    data = json.dumps(value, separators=(",", ":"), default=str).encode("utf-8")
+    if len(data) >= RESULT_CACHE_COMPRESS_MIN:
+        return zlib.compress(data, 6), True
+    return data, False
+
+
+def _loads(data, compressed):
+    if compressed:
+        data = zlib.decompress(data)
+    return json.loads(bytes(data).decode("utf-8"))
+
+
+class MemoryCacheBackend:
+    """Dictionnaire LRU du worker (perdu au redémarrage du worker)"""
+
+    name = "memory"
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # clé -> (expire_at, valeur)
+        self._tags = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def tag_versions(self, tags):
+        with self._lock:
+            return [self._tags.get(tag, 0) for tag in tags]
+
+    def bump_tags(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._tags[tag] = self._tags.get(tag, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries)}
+
+
+class _SQLCacheBackend:
+    """
+    Stockage en table (SQLite ou Postgres): valeur sérialisée, compressée si
+    grande, éviction LRU sur accessed_at quand la taille totale dépasse
+    max_bytes. Les requêtes sont écrites avec %s et adaptées par _execute.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+
+    def _execute(self, sql, params=(), fetch=False):
+        raise NotImplementedError
+
+    def get(self, key):
+        rows = self._execute(
+            "SELECT expires_at, accessed_at, compressed, value FROM result_cache WHERE key = %s",
+            (key,), fetch=True
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        now = time.time()
+        # Une écriture par seconde au plus pour l'ordre LRU
+        if now - row["accessed_at"] > 1:
+            self._execute("UPDATE result_cache SET accessed_at = %s WHERE key = %s", (now, key))
+        return row["expires_at"], _loads(row["value"], row["compressed"])
+
+    def set(self, key, value, expires_at):
+        data, compressed = _dumps(value)
+        now = time.time()
+        self._execute("""
+            INSERT INTO result_cache (key, expires_at, accessed_at, compressed, size, value)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (key) DO UPDATE SET
+                expires_at = EXCLUDED.expires_at,
+                accessed_at = EXCLUDED.accessed_at,
+                compressed = EXCLUDED.compressed,
+                size = EXCLUDED.size,
+                value = EXCLUDED.value
+        """, (key, expires_at, now, compressed, len(data), self._blob(data)))
+        self._evict(now)
+
+    def _evict(self, now):
+        self._execute(
+            "DELETE FROM result_cache WHERE expires_at < %s",
+            (now - RESULT_CACHE_STALE_GRACE,)
+        )
+        rows = self._execute("SELECT COALESCE(SUM(size), 0) AS total FROM result_cache", fetch=True)
+        excedent = int(rows[0]["total"]) - self.max_bytes
+        if excedent <= 0:
+            return
+        # Moins récemment lues d'abord, jusqu'à repasser sous la limite
+        victimes = self._execute(
+            "SELECT key, size FROM result_cache ORDER BY accessed_at LIMIT 500", fetch=True
+        )
+        keys = []
+        for row in victimes:
+            keys.append(row["key"])
+            excedent -= row["size"]
+            if excedent <= 0:
+                break
+        for key in keys:
+            self._execute("DELETE FROM result_cache WHERE key = %s", (key,))
+
+    def tag_versions(self, tags):
+        if not tags:
+            return []
+        rows = self._execute(
+            f"SELECT tag, version FROM result_cache_tags WHERE tag IN ({', '.join(['%s'] * len(tags))})",
+            tuple(tags), fetch=True
+        )
+        versions = {row["tag"]: row["version"] for row in rows}
+        return [versions.get(tag, 0) for tag in tags]
+
+    def bump_tags(self, tags):
+        for tag in tags:
+            self._execute("""
+                INSERT INTO result_cache_tags (tag, version) VALUES (%s, 1)
+                ON CONFLICT (tag) DO UPDATE SET version = result_cache_tags.version + 1
+            """, (tag,))
+
+    def stats(self):
+        rows = self._execute(
+            "SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM result_cache", fetch=True
+        )
+        return {"entries": rows[0]["entries"], "bytes": int(rows[0]["bytes"])}
+
+    def _blob(self, data):
+        return data
+
+
+class SQLiteCacheBackend(_SQLCacheBackend):
+    """Fichier SQLite (WAL) partagé par les workers d'une même machine"""
+
+    name = "sqlite"
+
+    def __init__(self, path=RESULT_CACHE_SQLITE_PATH, max_bytes=RESULT_CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+        self.path = path
+        self._local = threading.local()
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS result_cache (
+                key TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                compressed INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                value BLOB NOT NULL
+            )
+        """)
+        self._execute("CREATE INDEX IF NOT EXISTS idx_result_cache_accessed ON result_cache(accessed_at)")
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS result_cache_tags (
+                tag TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Une connexion par thread; autocommit, WAL pour les lectures concurrentes
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _execute(self, sql, params=(), fetch=False):
+        cur = self._conn().execute(sql.replace("%s", "?"), params)
+        return cur.fetchall() if fetch else None
+
+
+class PostgresCacheBackend(_SQLCacheBackend):
+    """Table UNLOGGED (migration_cache.sql) partagée par toutes les machines"""
+
+    name = "postgres"
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+        self._local = threading.local()
+
+    def _conn(self):
+        from db import get_connection
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn.closed:
+            # Connexion gardée par thread: un hit ne doit pas coûter une connexion
+            conn = get_connection()
+            conn.autocommit = True
+            self._local.conn = conn
+        return conn
+
+    def _execute(self, sql, params=(), fetch=False):
+        import psycopg2
+
+        try:
+            cur = self._conn().cursor()
+            cur.execute(sql, params)
+            return cur.fetchall() if fetch else None
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Connexion coupée: la prochaine opération en ouvre une nouvelle
+            self._local.conn = None
+            raise
+
+    def _blob(self, data):
+        import psycopg2
+        return psycopg2.Binary(data)
+
+
+_backend = None
+
+
+def get_cache_backend():
+    """Get or create cache backend singleton"""
+    global _backend
+    if _backend is None:
+        try:
+            if RESULT_CACHE_BACKEND == "postgres":
+                _backend = PostgresCacheBackend()
+            elif RESULT_CACHE_BACKEND == "sqlite":
+                _backend = SQLiteCacheBackend()
+            else:
+                _backend = MemoryCacheBackend()
+        except Exception as e:
+            print(f"[cache] Backend {RESULT_CACHE_BACKEND} indisponible ({e}), cache mémoire utilisé")
+            _backend = MemoryCacheBackend()
+    return _backend
+
+
+def _versioned_key(backend, key, tags):
+    versions = backend.tag_versions(tags)
+    suffix = ",".join(f"{tag}={version}" for tag, version in zip(tags, versions))
+    return f"v{RESULT_CACHE_VERSION}:{key}|{suffix}"
+
+
+def cached(key, compute, ttl=None, tags=()):
+    """
+    Valeur en cache pour `key`, ou résultat de compute() (un seul calcul à la
+    fois par clé et par worker). Les exceptions de compute() sont propagées à
+    tous les appelants en attente et rien n'est mis en cache. Une panne du
+    stockage n'empêche pas de répondre: le résultat est alors calculé.
+    """
+    ttl = RESULT_CACHE_TTL if ttl is None else ttl
+    backend = get_cache_backend()
+
+    try:
+        full_key = _versioned_key(backend, key, tags)
+        entry = backend.get(full_key)
+    except Exception as e:
+        print(f"[cache] Lecture impossible ({e})")
+        with _lock:
+            _metrics["backend_errors"] += 1
+        full_key = f"v{RESULT_CACHE_VERSION}:{key}|?"
+        entry = None
+
+    now = time.time()
+
+    with _lock:
+        if entry and entry[0] > now:
+            _metrics["hits"] += 1
+            return entry[1]
+
+        flight = _inflight.get(full_key)
+        if flight:
+            if entry and entry[0] + RESULT_CACHE_STALE_GRACE > now:
+                _metrics["stale"] += 1
+                return entry[1]
+            _metrics["coalesced"] += 1
+            owner = False
+        else:
+            flight = _inflight[full_key] = _Flight()
+            _metrics["misses"] += 1
+            owner = True
+
+    if not owner:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    try:
+        # Même forme qu'une valeur relue du stockage (dates en texte, tuples
+        # en listes...), que la réponse vienne du cache ou non
+        value = json.loads(json.dumps(compute(), default=str))
+    except Exception as e:
+        with _lock:
+            _metrics["errors"] += 1
+            _inflight.pop(full_key, None)
+        flight.error = e
+        flight.done.set()
+        raise
+
+    # Invalidé pendant le calcul: la clé porte l'ancienne version et ne sera plus lue
+    try:
+        backend.set(full_key, value, time.time() + ttl)
+    except Exception as e:
+        print(f"[cache] Écriture impossible ({e})")
+        with _lock:
+            _metrics["backend_errors"] += 1
+
+    with _lock:
+        _inflight.pop(full_key, None)
+
+    flight.value = value
+    flight.done.set()
+    return value
+
+
+def invalidate(*tags):
+    """Invalider les entrées portant l'une des étiquettes (à appeler après commit)"""
+    try:
+        get_cache_backend().bump_tags(tags)
+    except Exception as e:
+        print(f"[cache] Invalidation impossible ({e})")
+        with _lock:
+            _metrics["backend_errors"] += 1
+        return
+    with _lock:
+        _metrics["invalidations"] += 1
+
+
+def cache_metrics():
+    backend = get_cache_backend()
+    try:
+        stockage = backend.stats()
+    except Exception as e:
+        stockage = {"error": str(e)}
+
+    with _lock:
+        total = _metrics["hits"] + _metrics["stale"] + _metrics["misses"] + _metrics["coalesced"]
+        return {
+            **_metrics,
+            "inflight": len(_inflight),
+            "hit_ratio": round((_metrics["hits"] + _metrics["stale"] + _metrics["coalesced"]) / total, 3) if total else 0,
+            "ttl_seconds": RESULT_CACHE_TTL,
+            "backend": backend.name,
+            "storage": stockage,
+            # Compteurs propres à chaque worker gunicorn
+            "pid": os.getpid(),
+        }
@@ -1,7 +1,12 @@
 from flask_restx import Namespace, Resource, fields
 from flask import request
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from db import get_connection
+from db import get_connection, like_pattern
+from livraisons.events import record_agent_position, invalidate_timeline
+from vues import view_refreshed_at, REFRESH_HEADER
+from cartographie.spatial_index import index as spatial_index, ENTITES as NEARBY_ENTITES
+from geo import haversine_m, plus_proches
+import time
 import traceback
 from datetime import datetime
 from decimal import Decimal
@@ -151,7 +156,13 @@ class LocaliserAgent(Resource):
             if not result:
                 return {"error": "Agent non trouvé"}, 404
             
+            livraison_ids = record_agent_position(cur, agent_id, data.get("latitude"), data.get("longitude"))
             conn.commit()
+            invalidate_timeline(*livraison_ids)
+            spatial_index.position(
+                "agent", agent_id, result["latitude"], result["longitude"],
+                last_location_update=result["last_location_update"]
+            )
             
             return {
                 "message": "Position mise à jour",
@@ -196,8 +207,9 @@ class ClientsGeo(Resource):
             params = []
             
             if zone:
+                # Servi par l'index trigramme idx_clients_adresse_trgm
                 query += " AND adresse ILIKE %s"
-                params.append(f"%{zone}%")
+                params.append(like_pattern(zone))
             
             query += " ORDER BY nom_point_vente"
             
@@ -281,7 +293,7 @@ class CouvertureZones(Resource):
     @carto_ns.doc(security="BearerAuth")
     @jwt_required()
     def get(self):
-        """Récupérer les zones couvertes par les agents"""
+        """Récupérer les zones couvertes par les agents (vue matérialisée, voir vues.py)"""
         conn = get_connection()
         cur = conn.cursor()
         
@@ -290,22 +302,27 @@ class CouvertureZones(Resource):
                 SELECT
                     a.id as agent_id,
                     a.nom,
-                    COUNT(DISTINCT l.client_id) as clients_desservis,
-                    MIN(l.latitude_gps) as lat_min,
-                    MAX(l.latitude_gps) as lat_max,
-                    MIN(l.longitude_gps) as lon_min,
-                    MAX(l.longitude_gps) as lon_max
+                    COUNT(DISTINCT NULLIF(m.client_id, 0)) as clients_desservis,
+                    MIN(m.lat_min) as lat_min,
+                    MAX(m.lat_max) as lat_max,
+                    MIN(m.lon_min) as lon_min,
+                    MAX(m.lon_max) as lon_max
                 FROM agents a
-                LEFT JOIN livraisons l ON a.id = l.agent_id
-                    AND DATE(l.date_livraison) >= CURRENT_DATE - INTERVAL '30 days'
+                LEFT JOIN mv_livraisons_agent_client_jour m ON a.id = m.agent_id
+                    AND m.jour_livraison >= CURRENT_DATE - 30
                 WHERE a.actif = TRUE
                 GROUP BY a.id, a.nom
                 ORDER BY clients_desservis DESC
             """)
             
             zones = cur.fetchall()
+            refreshed_at = view_refreshed_at(cur, "mv_livraisons_agent_client_jour")
             
-            return {"zones": zones}, 200
+            return (
+                {"zones": convert_decimal(zones), "refreshed_at": refreshed_at},
+                200,
+                {REFRESH_HEADER: refreshed_at or ""},
+            )
             
         except Exception as e:
             return {"error": f"Erreur serveur: {str(e)}"}, 500
@@ -386,6 +403,7 @@ class LocaliserClient(Resource):
                 return {"error": "Client non trouvé"}, 404
             
             conn.commit()
+            spatial_index.position("client", client_id, result["latitude"], result["longitude"])
             
             return {
                 "message": "Position mise à jour",
@@ -406,25 +424,56 @@ class LocaliserClient(Resource):
         return {}, 200
 
 
+# 2 km selon cahier des charges
+PROXIMITE_SEUIL_KM = 2.0
+PROXIMITE_CLIENTS_MAX = 500
+
+
 @carto_ns.route("/proximite")
 class ProximiteAgentClient(Resource):
-    @carto_ns.doc(security="BearerAuth")
+    @carto_ns.doc(
+        security="BearerAuth",
+        params={
+            "agent_id": "Agent",
+            "client_id": "Client",
+            "client_ids": f"Plusieurs clients séparés par des virgules (max {PROXIMITE_CLIENTS_MAX}), à la place de client_id",
+            "k": "Avec client_ids: seulement les k clients les plus proches",
+        },
+    )
     @jwt_required()
     def get(self):
         """Calculer la proximité agent-client (pour validation de livraison)"""
+        agent_id = request.args.get("agent_id", type=int)
+        client_id = request.args.get("client_id", type=int)
+        try:
+            client_ids = [int(v) for v in request.args.get("client_ids", "").split(",") if v.strip()]
+        except ValueError:
+            return {"error": "client_ids doit être une liste d'identifiants séparés par des virgules"}, 400
+        if not agent_id or not (client_id or client_ids):
+            return {"error": "agent_id et client_id (ou client_ids) sont requis"}, 400
+        if len(client_ids) > PROXIMITE_CLIENTS_MAX:
+            return {"error": f"Au plus {PROXIMITE_CLIENTS_MAX} clients"}, 400
+        k = request.args.get("k", type=int)
+        if k is not None and k < 1:
+            return {"error": "k doit être un entier positif"}, 400
+
         conn = get_connection()
         cur = conn.cursor()
         
         try:
-            agent_id = request.args.get("agent_id", type=int, required=True)
-            client_id = request.args.get("client_id", type=int, required=True)
-            
             # Récupérer les coordonnées
             cur.execute("""
                 SELECT latitude, longitude FROM agents WHERE id = %s
             """, (agent_id,))
             agent = cur.fetchone()
             
+            if client_ids:
+                if not agent:
+                    return {"error": "Agent non trouvé"}, 404
+                if agent["latitude"] is None or agent["longitude"] is None:
+                    return {"error": "Coordonnées GPS de l'agent manquantes"}, 400
+                return proximite_clients(cur, agent, client_ids, k), 200
+            
             cur.execute("""
                 SELECT latitude, longitude FROM clients WHERE id = %s
             """, (client_id,))
@@ -433,23 +482,148 @@ class ProximiteAgentClient(Resource):
             if not agent or not client:
                 return {"error": "Agent ou client non trouvé"}, 404
             
-            # Calcul simplifié de distance (en km)
-            # Formule approximée: sqrt((lat2-lat1)² + (lon2-lon1)²) * 111
-            lat1, lon1 = agent["latitude"], agent["longitude"]
-            lat2, lon2 = client["latitude"], client["longitude"]
+            if None in (agent["latitude"], agent["longitude"], client["latitude"], client["longitude"]):
+                return {"error": "Coordonnées GPS manquantes"}, 400
             
-            distance = ((lat2 - lat1)**2 + (lon2 - lon1)**2)**0.5 * 111
+            distance = haversine_m(
+                agent["latitude"], agent["longitude"],
+                client["latitude"], client["longitude"]
+            ) / 1000
             
-            # 2 km selon cahier des charges
-            can_deliver = distance <= 2.0
+            can_deliver = distance <= PROXIMITE_SEUIL_KM
             
             return {
                 "distance_km": round(distance, 3),
                 "peut_livrer": can_deliver,
-                "seuil_km": 2.0
+                "seuil_km": PROXIMITE_SEUIL_KM
             }, 200
             
         except Exception as e:
             return {"error": f"Erreur serveur: {str(e)}"}, 500
         finally:
             conn.close()
+
+
+def proximite_clients(cur, agent, client_ids, k=None):
+    """
+    Distances d'un agent à plusieurs clients, triées (geo.plus_proches: une
+    ligne de matrice, sélection partielle si k est fourni)
+    """
+    cur.execute("""
+        SELECT id, latitude, longitude FROM clients WHERE id = ANY(%s)
+    """, (client_ids,))
+    clients = cur.fetchall()
+    places = [c for c in clients if c["latitude"] is not None and c["longitude"] is not None]
+
+    resultats = []
+    if places:
+        indices, distances = plus_proches(
+            [(agent["latitude"], agent["longitude"])],
+            [(c["latitude"], c["longitude"]) for c in places],
+            k=k or len(places),
+        )
+        for j, metres in zip(indices[0], distances[0]):
+            distance = float(metres) / 1000
+            resultats.append({
+                "client_id": places[j]["id"],
+                "distance_km": round(distance, 3),
+                "peut_livrer": distance <= PROXIMITE_SEUIL_KM,
+            })
+
+    trouves = {c["id"] for c in clients}
+    return {
+        "seuil_km": PROXIMITE_SEUIL_KM,
+        "clients": resultats,
+        "sans_coordonnees": sorted(trouves - {c["id"] for c in places}),
+        "introuvables": sorted(set(client_ids) - trouves),
+    }
+
+
+NEARBY_RAYON_MAX_KM = 50.0
+NEARBY_LIMITE_MAX = 500
+
+
+def _coordonnee(nom, minimum, maximum):
+    valeur = request.args.get(nom, type=float)
+    if valeur is not None and not (minimum <= valeur <= maximum):
+        raise ValueError(nom)
+    return valeur
+
+
+@carto_ns.route("/nearby")
+class Nearby(Resource):
+    @carto_ns.doc(
+        security="BearerAuth",
+        params={
+            "lat": "Latitude du point de recherche",
+            "lon": "Longitude du point de recherche",
+            "entite": "client, agent (défaut: les deux)",
+            "rayon_km": f"Points à moins de rayon_km (max {NEARBY_RAYON_MAX_KM:g}); borne des k plus proches",
+            "k": "Les k points les plus proches",
+            "bbox": "sud,ouest,nord,est: points du rectangle (triés par distance si lat/lon fournis)",
+            "limite": f"Nombre de résultats (défaut: 100, max: {NEARBY_LIMITE_MAX})",
+        },
+    )
+    @jwt_required()
+    def get(self):
+        """Clients et agents proches d'un point, servis par l'index spatial en mémoire (admin, agent)"""
+        if get_jwt().get("role") not in ("admin", "agent"):
+            return {"error": "Accès réservé aux administrateurs et agents"}, 403
+
+        try:
+            lat = _coordonnee("lat", -90, 90)
+            lon = _coordonnee("lon", -180, 180)
+            rayon_km = request.args.get("rayon_km", type=float)
+            k = request.args.get("k", type=int)
+            limite = max(1, min(request.args.get("limite", 100, type=int), NEARBY_LIMITE_MAX))
+            bbox = request.args.get("bbox")
+            if bbox:
+                sud, ouest, nord, est = (float(v) for v in bbox.split(","))
+                if not (-90 <= sud <= nord <= 90 and -180 <= ouest <= est <= 180):
+                    raise ValueError("bbox")
+        except ValueError:
+            return {"error": "Paramètres invalides (lat, lon, rayon_km, k, bbox=sud,ouest,nord,est)"}, 400
+
+        entite = request.args.get("entite")
+        if entite and entite not in NEARBY_ENTITES:
+            return {"error": f"Entité invalide (valeurs: {', '.join(NEARBY_ENTITES)})"}, 400
+        entites = (entite,) if entite else NEARBY_ENTITES
+
+        if (lat is None) != (lon is None):
+            return {"error": "lat et lon vont ensemble"}, 400
+        if not bbox and lat is None:
+            return {"error": "lat et lon, ou bbox, sont requis"}, 400
+        if rayon_km is not None and not (0 < rayon_km <= NEARBY_RAYON_MAX_KM):
+            return {"error": f"rayon_km doit être compris entre 0 et {NEARBY_RAYON_MAX_KM:g}"}, 400
+        if not bbox and rayon_km is None and k is None:
+            return {"error": "Préciser rayon_km, k ou bbox"}, 400
+
+        try:
+            spatial_index.pret()
+        except Exception as e:
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+
+        debut = time.perf_counter()
+        if bbox:
+            mode = "bbox"
+            resultats = spatial_index.rectangle(entites, sud, ouest, nord, est, limite, lat, lon)
+        elif k is not None:
+            mode = "k"
+            resultats = spatial_index.plus_proches(entites, lat, lon, max(1, min(k, limite)), rayon_km)
+        else:
+            mode = "rayon"
+            resultats = spatial_index.rayon(entites, lat, lon, rayon_km, limite)
+        duree_us = round((time.perf_counter() - debut) * 1e6, 1)
+
+        return (
+            {
+                "mode": mode,
+                "entites": list(entites),
+                "total": len(resultats),
+                "resultats": resultats,
+                "index": spatial_index.stats(),
+                "duree_us": duree_us,
+            },
+            200,
+            {"Server-Timing": f"index;dur={duree_us / 1000:.3f}"},
+        )
@@ -0,0 +1,469 @@
+"""
+Index spatial en mémoire des points de vente et des agents (/cartographie/nearby)
+
+Chaque worker garde les positions des clients et la dernière position des
+agents actifs dans une grille régulière (cellules de SPATIAL_INDEX_CELL_DEG
+degrés, ~1,1 km par défaut): dictionnaire cellule -> identifiants. Une
+recherche par rayon, rectangle ou k plus proches ne lit que les cellules
+concernées, sans requête SQL: quelques dizaines de microsecondes.
+
+Mise à jour incrémentale, par un thread du worker (les recherches ne lisent
+jamais la base, sauf le chargement initial):
+  - les routes d'écriture du worker appliquent la position directement
+    (position()) ou marquent la ligne à relire (invalider(), qui réveille
+    le thread);
+  - les écritures des autres workers sont relues toutes les
+    SPATIAL_INDEX_SYNC secondes (lignes dont updated_at a changé, tenu par
+    trigger sur clients et agents), avec une marge pour les transactions
+    longues;
+  - rechargement complet toutes les SPATIAL_INDEX_RELOAD secondes
+    (suppressions faites ailleurs).
+"""
+import os
+import math
+import time
+import heapq
+import threading
+from datetime import datetime, timedelta
+from db import pooled_connection
+from geo import haversine_m, RAYON_TERRE_M
+
+SPATIAL_INDEX_CELL_DEG = float(os.getenv("SPATIAL_INDEX_CELL_DEG", "0.01"))
+SPATIAL_INDEX_SYNC = float(os.getenv("SPATIAL_INDEX_SYNC", "5"))
+SPATIAL_INDEX_RELOAD = float(os.getenv("SPATIAL_INDEX_RELOAD", "600"))
+# updated_at vaut le début de la transaction: relire un peu avant le filigrane
+SPATIAL_INDEX_MARGE = timedelta(seconds=60)
+
+ENTITES = ("client", "agent")
+RAYON_TERRE_KM = RAYON_TERRE_M / 1000
+KM_PAR_DEGRE = math.pi * RAYON_TERRE_KM / 180
+
+CLIENTS_SQL = """
+    SELECT id, nom_point_vente, responsable, telephone, adresse,
+           latitude::float8 AS latitude, longitude::float8 AS longitude, updated_at
+    FROM clients
+"""
+
+AGENTS_SQL = """
+    SELECT id, nom, telephone, tricycle, capacite_tricycle, actif,
+           latitude::float8 AS latitude, longitude::float8 AS longitude,
+           last_location_update, updated_at
+    FROM agents
+"""
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Distance orthodromique (haversine) en km"""
+    return haversine_m(lat1, lon1, lat2, lon2) / 1000
+
+
+def _km(h):
+    """Terme haversine -> distance en km"""
+    return 2 * RAYON_TERRE_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+def _terme(km):
+    """Distance en km -> terme haversine (comparaisons sans asin ni racine)"""
+    return math.sin(min(km / (2 * RAYON_TERRE_KM), math.pi / 2)) ** 2
+
+
+class Grille:
+    """
+    Points rangés par cellule. Chaque point garde sa latitude, sa longitude
+    et son cosinus en radians: une distance ne coûte que deux sinus, et les
+    candidats sont comparés sur le terme haversine.
+    """
+
+    def __init__(self, pas=SPATIAL_INDEX_CELL_DEG):
+        self.pas = pas
+        self.points = {}    # identifiant -> (lat, lon, cellule, infos, lat rad, lon rad, cos lat)
+        self.cellules = {}  # cellule -> identifiants
+
+    def __len__(self):
+        return len(self.points)
+
+    def cellule(self, lat, lon):
+        return (math.floor(lat / self.pas), math.floor(lon / self.pas))
+
+    def placer(self, ident, lat, lon, infos):
+        self.retirer(ident)
+        c = self.cellule(lat, lon)
+        phi = math.radians(lat)
+        self.points[ident] = (lat, lon, c, infos, phi, math.radians(lon), math.cos(phi))
+        self.cellules.setdefault(c, set()).add(ident)
+
+    def deplacer(self, ident, lat, lon, **infos):
+        """Nouvelle position d'un point connu (infos complétées); False s'il est absent"""
+        point = self.points.get(ident)
+        if point is None:
+            return False
+        self.placer(ident, lat, lon, {**point[3], **infos})
+        return True
+
+    def retirer(self, ident):
+        point = self.points.pop(ident, None)
+        if point is None:
+            return
+        membres = self.cellules[point[2]]
+        membres.discard(ident)
+        if not membres:
+            del self.cellules[point[2]]
+
+    def _dans_cellules(self, i0, i1, j0, j1):
+        """Identifiants des cellules [i0, i1] × [j0, j1]; tous les points si la plage est plus grande"""
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.points):
+            return self.points.keys()
+        idents = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                membres = self.cellules.get((i, j))
+                if membres:
+                    idents.extend(membres)
+        return idents
+
+    def _mesure(self, lat, lon):
+        """Fonction identifiant -> terme haversine depuis (lat, lon)"""
+        phi = math.radians(lat)
+        lam = math.radians(lon)
+        cos_phi = math.cos(phi)
+        points = self.points
+        sin = math.sin
+
+        def terme(ident):
+            p = points[ident]
+            return sin((p[4] - phi) / 2) ** 2 + cos_phi * p[6] * sin((p[5] - lam) / 2) ** 2
+        return terme
+
+    def rayon(self, lat, lon, km):
+        """[(distance, identifiant)] à moins de km, triés par distance"""
+        dlat = km / KM_PAR_DEGRE
+        dlon = km / (KM_PAR_DEGRE * max(math.cos(math.radians(min(abs(lat) + dlat, 89.9))), 1e-6))
+        i0, j0 = self.cellule(lat - dlat, lon - dlon)
+        i1, j1 = self.cellule(lat + dlat, lon + dlon)
+
+        terme = self._mesure(lat, lon)
+        seuil = _terme(km)
+        resultats = []
+        for ident in self._dans_cellules(i0, i1, j0, j1):
+            h = terme(ident)
+            if h <= seuil:
+                resultats.append((h, ident))
+        resultats.sort()
+        return [(_km(h), ident) for h, ident in resultats]
+
+    def rectangle(self, sud, ouest, nord, est):
+        """Identifiants dans le rectangle (sans passage de l'antiméridien)"""
+        i0, j0 = self.cellule(sud, ouest)
+        i1, j1 = self.cellule(nord, est)
+        return [
+            ident for ident in self._dans_cellules(i0, i1, j0, j1)
+            if sud <= self.points[ident][0] <= nord and ouest <= self.points[ident][1] <= est
+        ]
+
+    def plus_proches(self, lat, lon, k, km_max=None, filtre=None):
+        """
+        [(distance, identifiant)] des k points les plus proches, triés; seuls
+        les points dont filtre(identifiant, infos) est vrai sont retenus.
+        Parcours des couronnes de cellules autour du point jusqu'à ce
+        qu'aucune cellule non visitée ne puisse contenir un point plus proche.
+        """
+        if k <= 0 or not self.points:
+            return []
+
+        ci, cj = self.cellule(lat, lon)
+        terme = self._mesure(lat, lon)
+        seuil = _terme(km_max) if km_max is not None else 1.0
+        tas = []  # k meilleurs: (-terme, identifiant)
+
+        def garder(ident):
+            h = terme(ident)
+            if h > seuil or (filtre is not None and not filtre(ident, self.points[ident][3])):
+                return
+            if len(tas) < k:
+                heapq.heappush(tas, (-h, ident))
+            elif -tas[0][0] > h:
+                heapq.heapreplace(tas, (-h, ident))
+
+        r = 0
+        while True:
+            # Couronne plus grande que l'index: finir par un parcours complet
+            if (2 * r + 1) ** 2 > len(self.points):
+                tas = []
+                for ident in self.points:
+                    garder(ident)
+                break
+
+            if r == 0:
+                couronne = [(ci, cj)]
+            else:
+                couronne = [(ci + di, cj + dj) for di in (-r, r) for dj in range(-r, r + 1)]
+                couronne += [(ci + di, cj + dj) for dj in (-r, r) for di in range(-r + 1, r)]
+            for c in couronne:
+                for ident in self.cellules.get(c, ()):
+                    garder(ident)
+
+            # Distance minimale d'un point situé au-delà de la couronne r
+            lat_max = min(abs(lat) + (r + 1) * self.pas, 89.9)
+            borne = _terme(r * self.pas * KM_PAR_DEGRE * math.cos(math.radians(lat_max)))
+            if borne > seuil:
+                break
+            if len(tas) == k and -tas[0][0] <= borne:
+                break
+            r += 1
+
+        return [(_km(h), ident) for h, ident in sorted((-h, ident) for h, ident in tas)]
+
+
+class IndexSpatial:
+    """Grilles des clients et des agents du worker, synchronisées avec la base"""
+
+    def __init__(self):
+        self.grilles = {entite: Grille() for entite in ENTITES}
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._marques = {entite: set() for entite in ENTITES}
+        self._filigranes = {entite: None for entite in ENTITES}
+        self.charge_a = None
+        self.synchronise_a = None
+        self._reveil = threading.Event()
+        self._thread = None
+
+    # ----- Écritures du worker -----
+
+    def position(self, entite, ident, lat, lon, **infos):
+        """Position reçue par une route du worker: appliquée sans relecture"""
+        if lat is None or lon is None:
+            self.invalider(entite, ident)
+            return
+        with self._lock:
+            if self.grilles[entite].deplacer(ident, float(lat), float(lon), **infos):
+                return
+        self.invalider(entite, ident)
+
+    def invalider(self, entite, ident):
+        """Ligne créée, modifiée ou supprimée: relue par le thread de synchronisation"""
+        with self._lock:
+            self._marques[entite].add(ident)
+        self._reveil.set()
+
+    # ----- Synchronisation -----
+
+    @staticmethod
+    def _point(entite, row):
+        """Ligne SQL -> (latitude, longitude, infos), None si elle sort de l'index"""
+        if row["latitude"] is None or row["longitude"] is None:
+            return None
+        if entite == "agent":
+            if not row["actif"]:
+                return None
+            infos = {
+                "nom": row["nom"],
+                "telephone": row["telephone"],
+                "tricycle": row["tricycle"],
+                "capacite_tricycle": row["capacite_tricycle"],
+                "last_location_update": row["last_location_update"],
+            }
+        else:
+            infos = {
+                "nom_point_vente": row["nom_point_vente"],
+                "responsable": row["responsable"],
+                "telephone": row["telephone"],
+                "adresse": row["adresse"],
+            }
+        return row["latitude"], row["longitude"], infos
+
+    def _lire(self, cur, entite, depuis=None, idents=()):
+        sql = CLIENTS_SQL if entite == "client" else AGENTS_SQL
+        if depuis is None and not idents:
+            cur.execute(sql)
+        else:
+            cur.execute(sql + " WHERE updated_at >= %s OR id = ANY(%s)", (depuis, list(idents)))
+        return cur.fetchall()
+
+    def _filigrane(self, entite, rows):
+        dates = [row["updated_at"] for row in rows if row["updated_at"]]
+        if dates:
+            courant = self._filigranes[entite]
+            self._filigranes[entite] = max(dates) if courant is None else max(courant, max(dates))
+
+    def recharger(self, conn):
+        """Reconstruire les grilles à partir des tables"""
+        with self._lock:
+            for entite in ENTITES:
+                self._marques[entite].clear()
+        cur = conn.cursor()
+        grilles = {}
+        for entite in ENTITES:
+            rows = self._lire(cur, entite)
+            grille = Grille()
+            for row in rows:
+                point = self._point(entite, row)
+                if point:
+                    grille.placer(row["id"], *point)
+            grilles[entite] = (grille, rows)
+
+        with self._lock:
+            for entite, (grille, rows) in grilles.items():
+                self.grilles[entite] = grille
+                self._filigranes[entite] = None
+                self._filigrane(entite, rows)
+            self.charge_a = self.synchronise_a = time.time()
+
+    def appliquer_modifications(self, conn):
+        """Relire les lignes marquées et celles modifiées depuis le filigrane"""
+        with self._lock:
+            marques = {entite: set(self._marques[entite]) for entite in ENTITES}
+            for entite in ENTITES:
+                self._marques[entite].clear()
+        try:
+            self._relire(conn, marques)
+        except Exception:
+            # Relues à la prochaine synchronisation
+            with self._lock:
+                for entite in ENTITES:
+                    self._marques[entite] |= marques[entite]
+            raise
+        with self._lock:
+            self.synchronise_a = time.time()
+
+    def _relire(self, conn, marques):
+        cur = conn.cursor()
+        for entite in ENTITES:
+            filigrane = self._filigranes[entite]
+            if filigrane is None:
+                # Table vide au chargement: tout relire
+                rows = self._lire(cur, entite)
+            else:
+                rows = self._lire(cur, entite, filigrane - SPATIAL_INDEX_MARGE, marques[entite])
+            with self._lock:
+                grille = self.grilles[entite]
+                for row in rows:
+                    point = self._point(entite, row)
+                    if point:
+                        grille.placer(row["id"], *point)
+                    else:
+                        grille.retirer(row["id"])
+                # Marquées mais absentes: supprimées
+                for ident in marques[entite] - {row["id"] for row in rows}:
+                    grille.retirer(ident)
+                self._filigrane(entite, rows)
+
+    def synchroniser(self):
+        """
+        Recharger ou relire les modifications si nécessaire (un seul thread à
+        la fois). Une fois l'index chargé, une erreur de lecture est journalisée
+        et les recherches continuent sur l'état courant.
+        """
+        maintenant = time.time()
+        with self._lock:
+            recharger = self.charge_a is None or maintenant - self.charge_a >= SPATIAL_INDEX_RELOAD
+            relire = (
+                recharger
+                or maintenant - self.synchronise_a >= SPATIAL_INDEX_SYNC
+                or any(self._marques.values())
+            )
+        if not relire:
+            return
+
+        # Index déjà chargé: les autres threads utilisent l'état courant
+        if not self._sync_lock.acquire(blocking=self.charge_a is None):
+            return
+        try:
+            if recharger and self.charge_a is not None and time.time() - self.charge_a < SPATIAL_INDEX_RELOAD:
+                return  # chargé par un autre thread pendant l'attente
+            with pooled_connection() as conn:
+                if self.charge_a is None or time.time() - self.charge_a >= SPATIAL_INDEX_RELOAD:
+                    self.recharger(conn)
+                else:
+                    self.appliquer_modifications(conn)
+        except Exception as e:
+            if self.charge_a is None:
+                raise
+            print(f"[spatial_index] Synchronisation impossible: {e}")
+        finally:
+            self._sync_lock.release()
+
+    def _boucle(self):
+        while True:
+            self._reveil.wait(SPATIAL_INDEX_SYNC)
+            self._reveil.clear()
+            try:
+                self.synchroniser()
+            except Exception as e:
+                print(f"[spatial_index] Chargement impossible: {e}")
+
+    def demarrer(self):
+        """Lancer le thread de synchronisation du worker (une seule fois)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._boucle, name="spatial_index", daemon=True)
+                self._thread.start()
+
+    def pret(self):
+        """
+        À appeler avant une recherche: charge l'index au premier appel
+        (bloquant, lève l'erreur de lecture) et lance le thread de
+        synchronisation; ensuite, ne fait rien.
+        """
+        if self.charge_a is None:
+            self.synchroniser()
+        if self._thread is None:
+            self.demarrer()
+
+    # ----- Recherches -----
+
+    def _resultats(self, couples):
+        """
+        [(distance ou None, entité, identifiant)] -> points avec leurs infos
+        (dates gardées en datetime dans l'index, sérialisées ici)
+        """
+        resultats = []
+        for d, entite, ident in couples:
+            lat, lon, _, infos = self.grilles[entite].points[ident][:4]
+            resultat = {"entite": entite, "id": ident, "latitude": lat, "longitude": lon}
+            if d is not None:
+                resultat["distance_km"] = round(d, 3)
+            for cle, valeur in infos.items():
+                resultat[cle] = valeur.isoformat() if isinstance(valeur, datetime) else valeur
+            resultats.append(resultat)
+        return resultats
+
+    def rayon(self, entites, lat, lon, km, limite):
+        with self._lock:
+            couples = [(d, entite, ident) for entite in entites for d, ident in self.grilles[entite].rayon(lat, lon, km)]
+            couples.sort(key=lambda c: c[0])
+            return self._resultats(couples[:limite])
+
+    def plus_proches(self, entites, lat, lon, k, km_max=None, filtre=None):
+        with self._lock:
+            couples = [
+                (d, entite, ident)
+                for entite in entites
+                for d, ident in self.grilles[entite].plus_proches(lat, lon, k, km_max, filtre)
+            ]
+            couples.sort(key=lambda c: c[0])
+            return self._resultats(couples[:k])
+
+    def rectangle(self, entites, sud, ouest, nord, est, limite, lat=None, lon=None):
+        """Points du rectangle, triés par distance au point (lat, lon) s'il est fourni"""
+        with self._lock:
+            couples = []
+            for entite in entites:
+                points = self.grilles[entite].points
+                for ident in self.grilles[entite].rectangle(sud, ouest, nord, est):
+                    d = distance_km(lat, lon, points[ident][0], points[ident][1]) if lat is not None else None
+                    couples.append((d, entite, ident))
+            if lat is not None:
+                couples.sort(key=lambda c: c[0])
+            return self._resultats(couples[:limite])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self.grilles["client"]),
+                "agents": len(self.grilles["agent"]),
+                "synchronise_a": datetime.fromtimestamp(self.synchronise_a).isoformat() if self.synchronise_a else None,
+            }
+
+
+index = IndexSpatial()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Vérifier que la projection livraisons_read correspond à la source
+(livraisons + agents + clients + commandes)
+
+Usage:
+    python check_livraisons_read_model.py [--repair]
+"""
+import sys
+import argparse
+from db import get_connection
+
+
+def check(repair=False):
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        # Lignes différentes, manquantes ou en trop dans la projection
+        cur.execute("""
+            SELECT DISTINCT id FROM (
+                (SELECT * FROM livraisons_read_source EXCEPT SELECT * FROM livraisons_read)
+                UNION ALL
+                (SELECT * FROM livraisons_read EXCEPT SELECT * FROM livraisons_read_source)
+            ) AS diff
+            ORDER BY id
+        """)
+        ids = [row["id"] for row in cur.fetchall()]
+
+        cur.execute("SELECT COUNT(*) AS n FROM livraisons_read")
+        total = cur.fetchone()["n"]
+
+        if not ids:
+            print(f"✓ Projection cohérente ({total} livraisons)")
+            return 0
+
+        print(f"✗ {len(ids)} livraison(s) divergente(s) sur {total}")
+        print(f"   IDs: {ids[:50]}{' …' if len(ids) > 50 else ''}")
+
+        if repair:
+            for livraison_id in ids:
+                cur.execute("SELECT livraisons_read_refresh(%s)", (livraison_id,))
+            conn.commit()
+            print(f"✓ {len(ids)} livraison(s) recalculée(s)")
+            return 0
+
+        return 1
+
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Erreur: {e}")
+        return 2
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vérifier la projection livraisons_read")
+    parser.add_argument("--repair", action="store_true", help="Recalculer les lignes divergentes")
+    args = parser.parse_args()
+
+    sys.exit(check(args.repair))
@@ -3,7 +3,10 @@ from flask import request
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from werkzeug.security import generate_password_hash
 from werkzeug.exceptions import HTTPException
-from db import get_connection
+from db import get_connection, like_pattern
+from previsions import PREVISION_FENETRE_MAX
+from cartographie.spatial_index import index as spatial_index
+from datetime import date, datetime, timedelta
 import psycopg2
 
 clients_ns = Namespace(
@@ -177,6 +180,7 @@ class ClientsList(Resource):
 
             client_id = cur.fetchone()["id"]
             conn.commit()
+            spatial_index.invalider("client", client_id)
 
             return {
                 "id": client_id,
@@ -192,6 +196,81 @@ class ClientsList(Resource):
         finally:
             conn.close()
 
+CLIENTS_SEARCH_DOCUMENT = "clients_search_document(nom_point_vente, responsable, telephone, adresse)"
+
+# Les deux conditions utilisent l'index idx_clients_search_trgm: sous-chaîne
+# exacte d'abord, puis similarité par mot (repris par bench_recherche.py)
+CLIENTS_SEARCH_SQL = f"""
+    SELECT
+        c.id,
+        c.nom_point_vente,
+        c.responsable,
+        c.telephone,
+        c.adresse,
+        c.latitude,
+        c.longitude,
+        {CLIENTS_SEARCH_DOCUMENT} LIKE %(like)s AS exact,
+        word_similarity(%(q)s, {CLIENTS_SEARCH_DOCUMENT}) AS score
+    FROM clients c
+    WHERE {CLIENTS_SEARCH_DOCUMENT} LIKE %(like)s
+    OR %(q)s <%% {CLIENTS_SEARCH_DOCUMENT}
+    ORDER BY exact DESC, score DESC, c.nom_point_vente
+    LIMIT %(limit)s
+"""
+# Seuil plus permissif que le défaut (0.6) pour tolérer les fautes de frappe
+CLIENTS_SEARCH_SEUIL = "0.4"
+
+
+@clients_ns.route("/search")
+class ClientsSearch(Resource):
+    @clients_ns.doc(
+        security="BearerAuth",
+        params={
+            "q": "Texte recherché (nom, responsable, téléphone ou adresse)",
+            "limit": "Nombre maximum de résultats (défaut 20)",
+        }
+    )
+    @jwt_required()
+    def get(self):
+        """Rechercher des clients (correspondance approximative, résultats classés)"""
+        q = (request.args.get("q") or "").strip().lower()
+        limit = max(1, min(request.args.get("limit", default=20, type=int), 100))
+
+        if len(q) < 2:
+            clients_ns.abort(400, "Le paramètre 'q' doit contenir au moins 2 caractères")
+
+        like = like_pattern(q)
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        try:
+            cur.execute(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", (CLIENTS_SEARCH_SEUIL,)
+            )
+            cur.execute(CLIENTS_SEARCH_SQL, {"q": q, "like": like, "limit": limit})
+            rows = cur.fetchall()
+
+            return {
+                "query": q,
+                "results": [{
+                    "id": row["id"],
+                    "nom_point_vente": row["nom_point_vente"],
+                    "responsable": row["responsable"],
+                    "telephone": row["telephone"],
+                    "adresse": row["adresse"],
+                    "latitude": float(row["latitude"]) if row["latitude"] else None,
+                    "longitude": float(row["longitude"]) if row["longitude"] else None,
+                    "score": round(float(row["score"]), 3),
+                } for row in rows],
+            }
+
+        except Exception as e:
+            clients_ns.abort(500, f"Erreur serveur: {str(e)}")
+        finally:
+            conn.close()
+
+
 @clients_ns.route("/<int:client_id>")
 class ClientDetail(Resource):
     @clients_ns.doc(security="BearerAuth")
@@ -327,6 +406,7 @@ class ClientDetail(Resource):
                 )
 
             conn.commit()
+            spatial_index.invalider("client", client_id)
 
             return {"message": "Client mis à jour avec succès"}
 
@@ -359,6 +439,7 @@ class ClientDetail(Resource):
             cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
 
             conn.commit()
+            spatial_index.invalider("client", client_id)
 
             return {"message": "Client supprimé avec succès"}
 
@@ -572,4 +653,126 @@ class ClientMonthlyStats(Resource):
         except Exception as e:
             clients_ns.abort(500, f"Erreur: {str(e)}")
         finally:
-            conn.close()
\ No newline at end of file
+            conn.close()
+
+
+def _prevision(row):
+    return {
+        "nb_commandes": row["nb_commandes"],
+        "derniere_commande": row["derniere_commande"].isoformat(),
+        "intervalle_jours": float(row["intervalle_jours"]),
+        "ecart_jours": float(row["ecart_jours"]),
+        "quantite_prevue": float(row["quantite_prevue"]) if row["quantite_prevue"] is not None else None,
+        "montant_prevu": float(row["montant_prevu"]) if row["montant_prevu"] is not None else None,
+        "prochaine_commande": row["prochaine_commande"].isoformat(),
+        "computed_at": row["computed_at"].isoformat(),
+    }
+
+
+@clients_ns.route("/<int:client_id>/forecast")
+class ClientForecast(Resource):
+    @clients_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def get(self, client_id):
+        """Date et quantité attendues de la prochaine commande du client (voir previsions.py)"""
+        conn = get_connection()
+        cur = conn.cursor()
+
+        try:
+            cur.execute("SELECT id FROM clients WHERE id = %s", (client_id,))
+            if not cur.fetchone():
+                return {"error": "Client non trouvé"}, 404
+
+            cur.execute("SELECT * FROM clients_previsions WHERE client_id = %s", (client_id,))
+            row = cur.fetchone()
+            if not row:
+                # Moins de deux jours de commande sur l'historique
+                return {"client_id": client_id, "prevision": None}, 200
+
+            prevision = _prevision(row)
+            prevision["en_retard"] = row["prochaine_commande"] < date.today()
+            return {"client_id": client_id, "prevision": prevision}, 200
+
+        except Exception as e:
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+        finally:
+            conn.close()
+
+
+@clients_ns.route("/forecast/tomorrow")
+class ClientsLikelyTomorrow(Resource):
+    @clients_ns.doc(
+        security="BearerAuth",
+        params={
+            "date": "Jour visé, AAAA-MM-JJ (défaut: demain)",
+            "limite": "Nombre de clients (défaut: 100, max: 1000)",
+        },
+    )
+    @jwt_required()
+    def get(self):
+        """Clients susceptibles de commander demain, pour préparer les tournées (admin, agent)"""
+        if get_jwt().get("role") not in ("admin", "agent"):
+            return {"error": "Accès réservé aux administrateurs et agents"}, 403
+
+        try:
+            jour = (
+                datetime.strptime(request.args["date"], "%Y-%m-%d").date()
+                if request.args.get("date") else date.today() + timedelta(days=1)
+            )
+            limite = max(1, min(int(request.args.get("limite", 100)), 1000))
+        except ValueError:
+            return {"error": "Paramètres invalides (date AAAA-MM-JJ, limite entière)"}, 400
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        try:
+            # Prochaine commande attendue à ± écart lissé du jour visé, sans
+            # commande passée depuis le calcul de la prévision
+            cur.execute("""
+                SELECT
+                    p.*,
+                    c.nom_point_vente,
+                    c.telephone,
+                    c.adresse,
+                    c.latitude,
+                    c.longitude,
+                    p.prochaine_commande - %(jour)s::date AS decalage_jours
+                FROM clients_previsions p
+                JOIN clients c ON c.id = p.client_id
+                WHERE p.prochaine_commande BETWEEN %(jour)s::date - %(fenetre)s AND %(jour)s::date + %(fenetre)s
+                AND ABS(p.prochaine_commande - %(jour)s::date) <= LEAST(GREATEST(CEIL(p.ecart_jours), 1), %(fenetre)s)
+                AND NOT EXISTS (
+                    SELECT 1 FROM commandes cmd
+                    WHERE cmd.client_id = p.client_id
+                    AND cmd.statut IS DISTINCT FROM 'annulee'
+                    AND DATE(COALESCE(cmd.date_commande, cmd.created_at)) > p.derniere_commande
+                )
+                ORDER BY ABS(p.prochaine_commande - %(jour)s::date), p.quantite_prevue DESC NULLS LAST
+                LIMIT %(limite)s
+            """, {"jour": jour, "fenetre": PREVISION_FENETRE_MAX, "limite": limite})
+
+            clients = []
+            for row in cur.fetchall():
+                clients.append({
+                    "client_id": row["client_id"],
+                    "nom_point_vente": row["nom_point_vente"],
+                    "telephone": row["telephone"],
+                    "adresse": row["adresse"],
+                    "latitude": float(row["latitude"]) if row["latitude"] is not None else None,
+                    "longitude": float(row["longitude"]) if row["longitude"] is not None else None,
+                    "decalage_jours": row["decalage_jours"],
+                    **_prevision(row),
+                })
+
+            return {
+                "date": jour.isoformat(),
+                "nombre": len(clients),
+                "quantite_prevue_totale": round(sum(c["quantite_prevue"] or 0 for c in clients), 2),
+                "clients": clients,
+            }, 200
+
+        except Exception as e:
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+        finally:
+            conn.close()
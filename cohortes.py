@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Cohortes de clients et rétention hebdomadaire (clients_cohortes)
+
+Chaque client a un bitmap des semaines où il a commandé depuis son
+inscription (voir migration_cohortes.sql, tenu à jour par trigger). La
+matrice semaine d'inscription × semaines écoulées compte, pour chaque
+cohorte, les clients dont le bit k est à 1: quelques milliers de lignes
+courtes au lieu d'un parcours de commandes.
+
+Ce script reconstruit les bitmaps à partir des commandes (archive comprise).
+
+Usage:
+    python cohortes.py --rebuild
+"""
+import argparse
+from datetime import date, timedelta
+from db import get_connection, like_pattern
+from archivage import commandes_source
+from cache import invalidate, CACHE_TAG_RAPPORTS
+
+COHORTES_SEMAINES_DEFAUT = 12
+COHORTES_SEMAINES_MAX = 104
+COHORTES_NOMBRE_DEFAUT = 26
+
+REBUILD_SQL = """
+    WITH semaines AS (
+        SELECT DISTINCT cmd.client_id,
+            (DATE_TRUNC('week', COALESCE(cmd.date_commande, cmd.created_at))::date
+             - DATE_TRUNC('week', c.created_at)::date) / 7 AS k
+        FROM {commandes} cmd
+        JOIN clients c ON c.id = cmd.client_id
+        WHERE cmd.statut IS DISTINCT FROM 'annulee'
+    ),
+    bits AS (
+        SELECT s.client_id,
+               string_agg(CASE WHEN s2.k IS NULL THEN '0' ELSE '1' END, '' ORDER BY g.k)::varbit AS semaines
+        FROM (SELECT client_id, MAX(k) AS kmax FROM semaines WHERE k >= 0 GROUP BY client_id) s
+        CROSS JOIN LATERAL generate_series(0, s.kmax) g(k)
+        LEFT JOIN semaines s2 ON s2.client_id = s.client_id AND s2.k = g.k
+        GROUP BY s.client_id
+    ),
+    premier_agent AS (
+        SELECT DISTINCT ON (client_id) client_id, agent_id
+        FROM {commandes}
+        WHERE agent_id IS NOT NULL AND statut IS DISTINCT FROM 'annulee'
+        ORDER BY client_id, COALESCE(date_commande, created_at), id
+    )
+    INSERT INTO clients_cohortes (client_id, semaine_inscription, agent_id, semaines)
+    SELECT c.id,
+           DATE_TRUNC('week', COALESCE(c.created_at, CURRENT_TIMESTAMP))::date,
+           pa.agent_id,
+           COALESCE(b.semaines, B'')
+    FROM clients c
+    LEFT JOIN bits b ON b.client_id = c.id
+    LEFT JOIN premier_agent pa ON pa.client_id = c.id
+"""
+
+
+def lundi(jour):
+    return jour - timedelta(days=jour.weekday())
+
+
+def cohort_matrix(cur, debut=None, fin=None, semaines=COHORTES_SEMAINES_DEFAUT, zone=None, agent_id=None):
+    """
+    Matrice de rétention des cohortes inscrites entre `debut` et `fin`
+    (semaines des 26 dernières par défaut). Pour chaque cohorte: taille,
+    clients actifs et taux pour k = 0..semaines-1; None pour les semaines
+    pas encore écoulées.
+    """
+    courante = lundi(date.today())
+    fin = lundi(fin or courante)
+    debut = lundi(debut or courante - timedelta(weeks=COHORTES_NOMBRE_DEFAUT - 1))
+
+    filters = ["cc.semaine_inscription BETWEEN %s AND %s"]
+    params = [debut, fin]
+    jointure = ""
+    if agent_id:
+        filters.append("cc.agent_id = %s")
+        params.append(agent_id)
+    if zone:
+        # Même filtre que /cartographie/clients/geo (index trigramme sur l'adresse)
+        jointure = "JOIN clients c ON c.id = cc.client_id"
+        filters.append("c.adresse ILIKE %s")
+        params.append(like_pattern(zone))
+    where = " AND ".join(filters)
+
+    cur.execute(f"""
+        SELECT cc.semaine_inscription, COUNT(*) AS taille
+        FROM clients_cohortes cc {jointure}
+        WHERE {where}
+        GROUP BY cc.semaine_inscription
+        ORDER BY cc.semaine_inscription
+    """, params)
+    tailles = {row["semaine_inscription"]: row["taille"] for row in cur.fetchall()}
+
+    cur.execute(f"""
+        SELECT cc.semaine_inscription, g.k, COUNT(*) AS actifs
+        FROM clients_cohortes cc {jointure}
+        CROSS JOIN LATERAL generate_series(0, LEAST(length(cc.semaines), %s) - 1) g(k)
+        WHERE {where} AND get_bit(cc.semaines, g.k) = 1
+        GROUP BY cc.semaine_inscription, g.k
+    """, [semaines] + params)
+    actifs = {(row["semaine_inscription"], row["k"]): row["actifs"] for row in cur.fetchall()}
+
+    cohortes = []
+    for semaine, taille in tailles.items():
+        ecoulees = (courante - semaine).days // 7 + 1
+        ligne_actifs = []
+        ligne_taux = []
+        for k in range(semaines):
+            if k >= ecoulees:
+                ligne_actifs.append(None)
+                ligne_taux.append(None)
+                continue
+            n = actifs.get((semaine, k), 0)
+            ligne_actifs.append(n)
+            ligne_taux.append(round(n / taille, 4) if taille else None)
+        cohortes.append({
+            "semaine": semaine.isoformat(),
+            "taille": taille,
+            "actifs": ligne_actifs,
+            "taux": ligne_taux,
+        })
+
+    return {
+        "debut": debut.isoformat(),
+        "fin": fin.isoformat(),
+        "semaines": semaines,
+        "zone": zone,
+        "agent_id": agent_id,
+        "cohortes": cohortes,
+    }
+
+
+def rebuild():
+    """Reconstruire les bitmaps de tous les clients"""
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        # Aucune commande ni client ajouté pendant le calcul
+        cur.execute("LOCK TABLE commandes, clients IN SHARE ROW EXCLUSIVE MODE")
+        commandes = commandes_source(cur)
+        cur.execute("DELETE FROM clients_cohortes")
+        cur.execute(REBUILD_SQL.format(commandes=commandes))
+        lignes = cur.rowcount
+        conn.commit()
+        print(f"✓ Cohortes reconstruites: {lignes} clients")
+        invalidate(CACHE_TAG_RAPPORTS)
+        return lignes
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Erreur: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cohortes de clients (rétention hebdomadaire)")
+    parser.add_argument("--rebuild", action="store_true", help="Reconstruire les bitmaps à partir des commandes")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild()
+    else:
+        parser.print_help()
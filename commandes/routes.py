@@ -1,12 +1,20 @@
 from flask_restx import Namespace, Resource, fields
 from flask import request
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from db import get_connection
-from datetime import datetime
+from db import get_connection, pooled_connection
+from cache import invalidate, CACHE_TAG_DASHBOARD
+from cartographie.spatial_index import index as spatial_index
+from datetime import datetime, timedelta
 from decimal import Decimal
-import math
+from geo import haversine_m
+import os
+import time
 from notifications import get_notification_service
 from notifications_admin import add_admin_notification
+from livraisons.events import (
+    record_livraison_event, record_commande_event, event_for_statut, invalidate_timeline,
+    EVENT_CREEE, EVENT_AGENT_ASSIGNE, EVENT_ARRIVEE, EVENT_LIVREE, EVENT_ANNULEE,
+)
 
 
 def convert_decimal(obj):
@@ -23,25 +31,6 @@ def convert_decimal(obj):
     return obj
 
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """
-    Calculate the great circle distance between two points
-    on the earth (specified in decimal degrees)
-    Returns distance in meters
-    """
-    # Convert decimal degrees to radians
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-
-    # Haversine formula
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-
-    # Radius of earth in meters
-    r = 6371000
-    return c * r
-
 commandes_ns = Namespace(
     "commandes",
     path="/commandes",
@@ -329,8 +318,11 @@ class CommandesList(Resource):
             
             livraison = cur.fetchone()
             livraison_id = livraison["id"]
+            record_livraison_event(cur, livraison_id, EVENT_CREEE)
 
             conn.commit()
+            invalidate(CACHE_TAG_DASHBOARD)
+            invalidate_timeline(livraison_id)
 
             # Envoyer notification à l'admin (nouvelle commande)
             try:
@@ -441,6 +433,130 @@ class CommandeAgentLocation(Resource):
             conn.close()
 
 
+# Candidats à l'assignation: agents actifs dont la position date de moins de N minutes
+CANDIDATS_FRAICHEUR_MINUTES = int(os.getenv("CANDIDATS_FRAICHEUR_MINUTES", "30"))
+CANDIDATS_K_MAX = 20
+
+
+@commandes_ns.route("/<int:commande_id>/candidates")
+class CommandeCandidats(Resource):
+    @commandes_ns.doc(
+        security="BearerAuth",
+        params={
+            "k": f"Nombre d'agents (défaut: 5, max: {CANDIDATS_K_MAX})",
+            "fraicheur_minutes": f"Âge maximal de la position (défaut: {CANDIDATS_FRAICHEUR_MINUTES})",
+            "rayon_km": "Distance maximale (optionnel)",
+        },
+    )
+    @jwt_required()
+    def get(self, commande_id):
+        """Agents actifs les plus proches d'une commande, avec leur charge du jour (admin)"""
+        if get_jwt().get("role") != "admin":
+            return {"error": "Accès réservé aux administrateurs"}, 403
+
+        k = max(1, min(request.args.get("k", 5, type=int), CANDIDATS_K_MAX))
+        fraicheur = max(1, request.args.get("fraicheur_minutes", CANDIDATS_FRAICHEUR_MINUTES, type=int))
+        rayon_km = request.args.get("rayon_km", type=float)
+        debut = time.perf_counter()
+
+        try:
+            spatial_index.pret()
+
+            with pooled_connection() as conn:
+                cur = conn.cursor()
+                # Position de la commande (GPS de la commande, sinon point de vente;
+                # 0,0 = position non fournie) et quantité commandée
+                cur.execute("""
+                    SELECT
+                        c.id, c.statut, c.agent_id,
+                        CASE WHEN c.latitude IS NOT NULL AND c.longitude IS NOT NULL
+                             AND NOT (c.latitude = 0 AND c.longitude = 0) THEN 'commande' ELSE 'client' END AS source,
+                        CASE WHEN c.latitude IS NOT NULL AND c.longitude IS NOT NULL
+                             AND NOT (c.latitude = 0 AND c.longitude = 0) THEN c.latitude ELSE cl.latitude END AS latitude,
+                        CASE WHEN c.latitude IS NOT NULL AND c.longitude IS NOT NULL
+                             AND NOT (c.latitude = 0 AND c.longitude = 0) THEN c.longitude ELSE cl.longitude END AS longitude,
+                        (SELECT SUM(d.quantite) FROM commande_details d WHERE d.commande_id = c.id) AS quantite,
+                        LOCALTIMESTAMP AS maintenant
+                    FROM commandes c
+                    LEFT JOIN clients cl ON cl.id = c.client_id
+                    WHERE c.id = %s
+                """, (commande_id,))
+                commande = cur.fetchone()
+                if not commande:
+                    return {"error": "Commande non trouvée"}, 404
+                if commande["latitude"] is None or commande["longitude"] is None:
+                    return {"error": "Position de la commande et du client inconnue"}, 400
+
+                # last_location_update est à l'heure de la base, comme maintenant
+                limite = commande["maintenant"] - timedelta(minutes=fraicheur)
+
+                def position_recente(ident, infos):
+                    return infos["last_location_update"] is not None and infos["last_location_update"] >= limite
+
+                proches = spatial_index.plus_proches(
+                    ("agent",), float(commande["latitude"]), float(commande["longitude"]),
+                    k, rayon_km, position_recente
+                )
+
+                charges = {}
+                if proches:
+                    # Charge du jour: livraisons en cours (index partiel idx_livraisons_agent_en_cours)
+                    cur.execute("""
+                        SELECT agent_id, COUNT(*) AS livraisons_ouvertes, COALESCE(SUM(quantite), 0) AS quantite_ouverte
+                        FROM livraisons
+                        WHERE agent_id = ANY(%s) AND statut = 'en_cours'
+                        AND COALESCE(date_livraison, created_at::date) = CURRENT_DATE
+                        GROUP BY agent_id
+                    """, ([agent["id"] for agent in proches],))
+                    charges = {row["agent_id"]: row for row in cur.fetchall()}
+
+            quantite = int(commande["quantite"]) if commande["quantite"] is not None else None
+            candidats = []
+            for agent in proches:
+                charge = charges.get(agent["id"])
+                quantite_ouverte = int(charge["quantite_ouverte"]) if charge else 0
+                capacite = agent["capacite_tricycle"]
+                restante = capacite - quantite_ouverte if capacite is not None else None
+                candidats.append({
+                    "agent_id": agent["id"],
+                    "nom": agent["nom"],
+                    "telephone": agent["telephone"],
+                    "tricycle": agent["tricycle"],
+                    "latitude": agent["latitude"],
+                    "longitude": agent["longitude"],
+                    "distance_km": agent["distance_km"],
+                    "last_location_update": agent["last_location_update"],
+                    "livraisons_ouvertes": charge["livraisons_ouvertes"] if charge else 0,
+                    "quantite_ouverte": quantite_ouverte,
+                    "capacite_tricycle": capacite,
+                    "capacite_restante": restante,
+                    "peut_charger": restante >= quantite if restante is not None and quantite is not None else None,
+                    "assigne": agent["id"] == commande["agent_id"],
+                })
+
+            duree_ms = round((time.perf_counter() - debut) * 1000, 2)
+            return (
+                {
+                    "commande_id": commande_id,
+                    "statut": commande["statut"],
+                    "position": {
+                        "latitude": float(commande["latitude"]),
+                        "longitude": float(commande["longitude"]),
+                        "source": commande["source"],
+                    },
+                    "quantite": quantite,
+                    "fraicheur_minutes": fraicheur,
+                    "candidats": candidats,
+                    "duree_ms": duree_ms,
+                },
+                200,
+                {"Server-Timing": f"candidats;dur={duree_ms}"},
+            )
+
+        except Exception as e:
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+
+
 @commandes_ns.route("/<int:commande_id>/cancel")
 class AnnulerCommande(Resource):
     @commandes_ns.doc(security="BearerAuth")
@@ -489,7 +605,10 @@ class AnnulerCommande(Resource):
             """, (commande_id,))
 
             result = cur.fetchone()
+            livraison_ids = record_commande_event(cur, commande_id, EVENT_ANNULEE, details="annulee_par_client")
             conn.commit()
+            invalidate(CACHE_TAG_DASHBOARD)
+            invalidate_timeline(*livraison_ids)
 
             return {
                 "message": "Commande annulée avec succès",
@@ -560,7 +679,7 @@ class ValiderCommande(Resource):
                 return {"error": "Coordonnées GPS manquantes pour la validation"}, 400
 
             # Calculer la distance
-            distance = haversine_distance(
+            distance = haversine_m(
                 commande["agent_lat"], commande["agent_lon"],
                 commande["client_lat"], commande["client_lon"]
             )
@@ -581,7 +700,13 @@ class ValiderCommande(Resource):
             """, (commande_id,))
 
             result = cur.fetchone()
+            # La validation se fait sur place (< 2 m): elle vaut aussi arrivée
+            record_commande_event(cur, commande_id, EVENT_ARRIVEE, agent_id=agent_id,
+                                  details=f"distance_m={distance:.1f}")
+            livraison_ids = record_commande_event(cur, commande_id, EVENT_LIVREE, agent_id=agent_id)
             conn.commit()
+            invalidate(CACHE_TAG_DASHBOARD)
+            invalidate_timeline(*livraison_ids)
 
             return {
                 "message": "Commande validée et marquée comme livrée",
@@ -635,6 +760,7 @@ class SupprimerCommande(Resource):
             cur.execute("DELETE FROM commandes WHERE id = %s", (commande_id,))
 
             conn.commit()
+            invalidate(CACHE_TAG_DASHBOARD)
 
             return {
                 "message": "Commande supprimée avec succès",
@@ -786,7 +912,16 @@ class CommandeDetail(Resource):
             if not result:
                 return {"error": "Commande non trouvée"}, 404
 
+            livraison_ids = []
+            if new_statut == "en_cours" and agent_id:
+                livraison_ids = record_commande_event(cur, commande_id, EVENT_AGENT_ASSIGNE, agent_id=agent_id)
+            elif new_statut != old_statut:
+                livraison_ids = record_commande_event(cur, commande_id, event_for_statut(new_statut),
+                                                      details=f"commande_{new_statut}")
+
             conn.commit()
+            invalidate(CACHE_TAG_DASHBOARD)
+            invalidate_timeline(*livraison_ids)
 
             # Récupérer les informations du client
             cur.execute("""
@@ -0,0 +1,237 @@
+"""
+Vue d'ensemble du dashboard admin (/dashboard/overview)
+
+Le dashboard chargeait ses sections par six appels séparés. Elles sont ici
+calculées en parallèle, chacune sur une connexion du pool
+(db.pooled_connection), avec le même cache que les endpoints d'origine.
+Chaque section a son propre délai (SECTION_TIMEOUTS) et son repli: une
+section en retard ou en erreur renvoie la dernière valeur calculée par le
+worker (ou null), est marquée dans la réponse sans faire échouer la page, et
+la durée de chaque section est renvoyée.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from datetime import datetime
+from flask_restx import Namespace, Resource
+from flask import request
+from flask_jwt_extended import jwt_required, get_jwt
+from db import pooled_connection
+from cache import cached, CACHE_TAG_DASHBOARD, CACHE_TAG_RAPPORTS, REPORT_CACHE_TTL
+from rapports.routes import compute_dashboard_stats, compute_tendances_mensuelles, compute_statistiques_par_statut
+from statistiques.routes import compute_kpi_dashboard
+from agents.routes import compute_active_locations
+from notifications_admin import notification_stats
+
+dashboard_ns = Namespace(
+    "dashboard",
+    path="/dashboard",
+    description="Vue d'ensemble du dashboard admin"
+)
+
+DASHBOARD_WORKERS = int(os.getenv("DASHBOARD_WORKERS", "6"))
+# Délai d'une section (secondes): au-delà elle est renvoyée en retard
+DASHBOARD_SECTION_TIMEOUT = float(os.getenv("DASHBOARD_SECTION_TIMEOUT", "3"))
+DASHBOARD_TIMEOUT_MAX = 30.0
+
+# Délai propre à chaque section, selon ce qu'elle lit
+SECTION_TIMEOUTS = {
+    "dashboard": DASHBOARD_SECTION_TIMEOUT,
+    "kpi": DASHBOARD_SECTION_TIMEOUT,
+    "tendances_mensuelles": 2 * DASHBOARD_SECTION_TIMEOUT,     # douze mois d'historique
+    "statistiques_par_statut": DASHBOARD_SECTION_TIMEOUT / 2,  # agrégat journalier
+    "agents_positions": DASHBOARD_SECTION_TIMEOUT / 2,         # index partiel, dernières heures
+    "notifications": 0.5,                                      # en mémoire
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Repli: dernière valeur calculée de chaque section dans ce worker -> (valeur, date)
+_dernieres = {}
+_dernieres_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix="dashboard")
+        return _executor
+
+
+def _sur_connexion(compute, timeout):
+    """compute(conn) sur une connexion du pool; les requêtes sont annulées après le délai"""
+    with pooled_connection() as conn:
+        # SET LOCAL: annulé par le rollback au retour dans le pool
+        conn.cursor().execute("SET LOCAL statement_timeout = %s", (int(timeout * 1000),))
+        return compute(conn)
+
+
+def _section_dashboard(today, timeout):
+    return cached(
+        f"rapports:dashboard:{today.isoformat()}",
+        lambda: _sur_connexion(lambda conn: compute_dashboard_stats(today, conn), timeout),
+        tags=(CACHE_TAG_DASHBOARD,),
+    )
+
+
+def _section_kpi(today, timeout):
+    return cached(
+        "statistiques:kpi",
+        lambda: _sur_connexion(compute_kpi_dashboard, timeout),
+        tags=(CACHE_TAG_DASHBOARD,),
+    )
+
+
+def _section_tendances(today, timeout):
+    return cached(
+        "rapports:tendances-mensuelles",
+        lambda: _sur_connexion(compute_tendances_mensuelles, timeout),
+        ttl=REPORT_CACHE_TTL,
+        tags=(CACHE_TAG_RAPPORTS,),
+    )
+
+
+def _section_statuts(today, timeout):
+    statuts, refreshed_at = _sur_connexion(
+        lambda conn: compute_statistiques_par_statut(conn=conn), timeout
+    )
+    return {"data": statuts, "refreshed_at": refreshed_at}
+
+
+def _section_positions(today, timeout):
+    return _sur_connexion(compute_active_locations, timeout)
+
+
+def _section_notifications(today, timeout):
+    # En mémoire dans le worker: pas de connexion
+    return notification_stats()
+
+
+# Nom de section -> calcul; les noms suivent les endpoints d'origine
+SECTIONS = {
+    "dashboard": _section_dashboard,                    # /rapports/dashboard
+    "kpi": _section_kpi,                                # /statistiques/dashboard/kpi
+    "tendances_mensuelles": _section_tendances,         # /rapports/tendances-mensuelles
+    "statistiques_par_statut": _section_statuts,        # /rapports/statistiques-par-statut
+    "agents_positions": _section_positions,             # /agents/active-locations
+    "notifications": _section_notifications,            # /notifications/admin/stats
+}
+
+
+def _mesurer(section, today, timeout):
+    """(valeur, durée en ms, erreur) d'une section; une valeur calculée devient son repli"""
+    debut = time.perf_counter()
+    try:
+        valeur, erreur = SECTIONS[section](today, timeout), None
+    except Exception as e:
+        valeur, erreur = None, str(e)
+    else:
+        with _dernieres_lock:
+            _dernieres[section] = (valeur, datetime.now())
+    return valeur, int((time.perf_counter() - debut) * 1000), erreur
+
+
+def _repli(section, etat):
+    """Dernière valeur connue de la section (ou None), sa date dans l'état"""
+    with _dernieres_lock:
+        derniere = _dernieres.get(section)
+    if derniere is None:
+        return None
+    etat["repli_du"] = derniere[1].isoformat()
+    return derniere[0]
+
+
+def compute_overview(sections, timeouts):
+    """
+    Calculer les sections en parallèle; chacune est attendue au plus son
+    délai (timeouts[section], compté depuis le lancement). Retourne
+    (sections, état de chaque section, durée totale en ms). Une section en
+    retard continue en arrière-plan: son résultat alimente le cache et le
+    repli pour l'appel suivant.
+    """
+    today = datetime.now().date()
+    executor = _get_executor()
+    debut = time.perf_counter()
+
+    futures = {
+        section: executor.submit(_mesurer, section, today, timeouts[section])
+        for section in sections
+    }
+
+    valeurs = {}
+    etats = {}
+    for section, future in futures.items():
+        reste = max(0.0, debut + timeouts[section] - time.perf_counter())
+        try:
+            valeur, duree_ms, erreur = future.result(timeout=reste)
+        except FuturesTimeout:
+            etats[section] = {
+                "statut": "en_retard",
+                "delai_s": timeouts[section],
+                "duree_ms": int((time.perf_counter() - debut) * 1000),
+            }
+            valeurs[section] = _repli(section, etats[section])
+            continue
+
+        if erreur:
+            etats[section] = {"statut": "erreur", "erreur": erreur, "duree_ms": duree_ms}
+            valeurs[section] = _repli(section, etats[section])
+        else:
+            etats[section] = {"statut": "ok", "duree_ms": duree_ms}
+            valeurs[section] = valeur
+
+    return valeurs, etats, int((time.perf_counter() - debut) * 1000)
+
+
+@dashboard_ns.route("/overview")
+class DashboardOverview(Resource):
+    @dashboard_ns.doc(
+        security="BearerAuth",
+        params={
+            "sections": f"Sections à calculer, séparées par des virgules (défaut: {', '.join(SECTIONS)})",
+            "timeout": "Délai en secondes appliqué à toutes les sections (défaut: délai propre à chaque section)",
+        },
+    )
+    @jwt_required()
+    def get(self):
+        """Toutes les sections du dashboard admin en un appel (résultats partiels si une section est en retard)"""
+        if get_jwt().get("role") != "admin":
+            return {"error": "Accès réservé aux administrateurs"}, 403
+
+        demandees = request.args.get("sections")
+        sections = [s.strip() for s in demandees.split(",") if s.strip()] if demandees else list(SECTIONS)
+        inconnues = [s for s in sections if s not in SECTIONS]
+        if inconnues:
+            return {
+                "error": f"Section inconnue: {', '.join(inconnues)} (valeurs possibles: {', '.join(SECTIONS)})"
+            }, 400
+
+        timeouts = dict(SECTION_TIMEOUTS)
+        if request.args.get("timeout"):
+            try:
+                timeout = float(request.args["timeout"])
+            except ValueError:
+                return {"error": "timeout doit être un nombre de secondes"}, 400
+            timeouts = dict.fromkeys(SECTIONS, max(0.1, min(timeout, DASHBOARD_TIMEOUT_MAX)))
+
+        try:
+            valeurs, etats, duree_ms = compute_overview(list(dict.fromkeys(sections)), timeouts)
+        except Exception as e:
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+
+        # Durées aussi dans Server-Timing (onglet réseau du navigateur)
+        server_timing = ", ".join(f"{section};dur={etat['duree_ms']}" for section, etat in etats.items())
+        return (
+            {
+                "sections": valeurs,
+                "etat": etats,
+                "complet": all(etat["statut"] == "ok" for etat in etats.values()),
+                "duree_ms": duree_ms,
+                "generated_at": datetime.now().isoformat(),
+            },
+            200,
+            {"Server-Timing": server_timing},
+        )
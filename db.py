@@ -1,26 +1,20 @@
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager
+import threading
 import os
 from dotenv import load_dotenv
 
 # Charger les variables d'environnement
 load_dotenv()
 
-def get_connection():
-    """
-    Créer une connexion à la base de données PostgreSQL
-    Utilise les variables d'environnement pour la configuration
-    Supporte:
-      - Production: DATABASE_URL (Supabase) ou variables individuelles
-      - Développement: DATABASE_URL ou variables locales
-    """
+def _connection_params():
+    """Arguments de connexion: DATABASE_URL ou variables individuelles"""
     # Si DATABASE_URL est disponible, l'utiliser (Supabase/production)
     database_url = os.getenv('DATABASE_URL')
     if database_url:
-        return psycopg2.connect(
-            database_url,
-            cursor_factory=RealDictCursor
-        )
+        return (database_url,), {"cursor_factory": RealDictCursor}
     
     # Sinon, utiliser les variables individuelles (développement local)
     db_host = os.getenv('DB_HOST', 'localhost')
@@ -30,12 +24,81 @@ def get_connection():
     db_password = os.getenv('DB_PASSWORD', 'root')
     db_sslmode = os.getenv('DB_SSLMODE', 'prefer')
     
-    return psycopg2.connect(
-        host=db_host,
-        port=int(db_port),
-        database=db_name,
-        user=db_user,
-        password=db_password,
-        sslmode=db_sslmode,
-        cursor_factory=RealDictCursor
-    )
+    return (), {
+        "host": db_host,
+        "port": int(db_port),
+        "database": db_name,
+        "user": db_user,
+        "password": db_password,
+        "sslmode": db_sslmode,
+        "cursor_factory": RealDictCursor,
+    }
+
+
+def get_connection():
+    """
+    Créer une connexion à la base de données PostgreSQL
+    Utilise les variables d'environnement pour la configuration
+    Supporte:
+      - Production: DATABASE_URL (Supabase) ou variables individuelles
+      - Développement: DATABASE_URL ou variables locales
+    """
+    args, kwargs = _connection_params()
+    return psycopg2.connect(*args, **kwargs)
+
+
+def like_pattern(texte):
+    """
+    Motif LIKE / ILIKE « contient texte »: les jokers saisis (%, _) et le
+    caractère d'échappement (\\, échappé en premier) sont pris littéralement
+    """
+    echappe = texte.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{echappe}%"
+
+
+# Pool par worker, pour les traitements qui ouvrent plusieurs connexions en
+# parallèle (exports par tranches, vue d'ensemble du dashboard). Les routes gardent get_connection().
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "8"))
+# Attente maximale d'une connexion libre (secondes)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool lève une erreur quand il est épuisé: le sémaphore fait attendre
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            args, kwargs = _connection_params()
+            _pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, *args, **kwargs)
+        return _pool
+
+
+@contextmanager
+def pooled_connection():
+    """Emprunter une connexion du pool; rendue propre (rollback, session par défaut)"""
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise psycopg2.pool.PoolError("Aucune connexion libre dans le pool")
+    try:
+        pool = get_pool()
+        conn = pool.getconn()
+    except Exception:
+        _pool_slots.release()
+        raise
+
+    try:
+        yield conn
+    finally:
+        close = bool(conn.closed)
+        if not close:
+            try:
+                conn.rollback()
+                conn.set_session(isolation_level="DEFAULT", readonly="DEFAULT")
+            except Exception:
+                close = True
+        pool.putconn(conn, close=close)
+        _pool_slots.release()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Entretien des fichiers du service web
+
+Les fichiers d'export (EXPORT_DIR) et les blobs (BLOB_STORAGE_DIR) sont sur
+le disque du service web: les crons Render tournent dans leurs propres
+conteneurs et ne le voient pas. L'entretien tourne donc dans le service web:
+chaque worker gunicorn lance un thread (demarrer_entretien, appelé par
+app.py) qui fait un passage toutes les ENTRETIEN_INTERVAL secondes. Un verrou consultatif PostgreSQL garantit
+qu'un seul worker fait le passage à la fois.
+
+Tâches: exports expirés, envois par morceaux abandonnés, blobs que plus rien
+ne référence (après BLOB_ORPHELIN_JOURS), variantes de photos manquantes.
+
+Usage (passage unique, sur la machine du service web):
+    python entretien.py
+"""
+import os
+import random
+import threading
+import time
+from db import get_connection
+
+# Secondes entre deux passages (0 = pas de thread d'entretien)
+ENTRETIEN_INTERVAL = int(os.getenv("ENTRETIEN_INTERVAL", "3600"))
+ENTRETIEN_VERROU = "essivi.entretien"
+UPLOAD_RETENTION_DAYS = int(os.getenv("UPLOAD_RETENTION_DAYS", "7"))
+# Délai avant de supprimer un blob non référencé: POST /blobs renvoie une
+# référence que le client passe ensuite à POST/PUT /livraisons
+BLOB_ORPHELIN_JOURS = int(os.getenv("BLOB_ORPHELIN_JOURS", "2"))
+BLOB_ORPHELIN_LOT = 500
+
+# Blobs que rien n'utilise plus (index de migration_blobs_entretien.sql)
+BLOB_ORPHELINS_SQL = """
+    SELECT b.sha256 FROM blobs b
+    WHERE b.created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+    AND NOT EXISTS (SELECT 1 FROM livraisons l WHERE l.photo_blob = b.sha256)
+    AND NOT EXISTS (SELECT 1 FROM livraisons l WHERE l.signature_blob = b.sha256)
+    AND NOT EXISTS (SELECT 1 FROM livraisons_archive l WHERE l.photo_blob = b.sha256)
+    AND NOT EXISTS (SELECT 1 FROM livraisons_archive l WHERE l.signature_blob = b.sha256)
+    AND NOT EXISTS (SELECT 1 FROM uploads u WHERE u.blob_sha256 = b.sha256)
+    AND NOT EXISTS (SELECT 1 FROM blob_variants v WHERE v.variante_sha256 = b.sha256)
+    LIMIT %s
+"""
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def purger_exports(conn):
+    """Fichiers d'export expirés (EXPORT_ARTIFACT_TTL)"""
+    from rapports.jobs import purge_expired
+
+    return purge_expired(conn)
+
+
+def purger_uploads(conn):
+    """Envois par morceaux abandonnés: ligne et fichier partiel"""
+    from blobs.uploads import discard_part
+
+    cur = conn.cursor()
+    cur.execute("""
+        DELETE FROM uploads
+        WHERE statut <> 'termine' AND updated_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+        RETURNING id
+    """, (UPLOAD_RETENTION_DAYS,))
+    ids = [row["id"] for row in cur.fetchall()]
+    conn.commit()
+    for upload_id in ids:
+        discard_part(upload_id)
+    return len(ids)
+
+
+def purger_blobs_orphelins(conn):
+    """
+    Blobs que plus aucune livraison, envoi ni variante ne référence. La
+    suppression d'un original supprime ses lignes blob_variants: ses
+    variantes deviennent orphelines et partent au tour suivant de la boucle.
+    """
+    from blobs.storage import get_blob_storage
+
+    storage = get_blob_storage()
+    cur = conn.cursor()
+    total = 0
+    while True:
+        cur.execute(BLOB_ORPHELINS_SQL, (BLOB_ORPHELIN_JOURS, BLOB_ORPHELIN_LOT))
+        orphelins = [row["sha256"] for row in cur.fetchall()]
+        if not orphelins:
+            conn.commit()
+            return total
+        # Une livraison qui référence le blob entre-temps fait échouer le lot
+        # (clé étrangère): il sera repris au passage suivant
+        cur.execute("DELETE FROM blobs WHERE sha256 = ANY(%s)", (orphelins,))
+        conn.commit()
+
+        # Même contenu renvoyé entre-temps (POST /blobs l'a ré-enregistré): fichier gardé
+        cur.execute("SELECT sha256 FROM blobs WHERE sha256 = ANY(%s)", (orphelins,))
+        revenus = {row["sha256"] for row in cur.fetchall()}
+        conn.commit()
+        for sha256 in orphelins:
+            if sha256 not in revenus:
+                storage.delete(sha256)
+        total += len(orphelins)
+
+
+def rattraper_variantes(conn):
+    """Variantes de photos manquantes (génération en arrière-plan interrompue)"""
+    from blobs.variants import rattraper_variantes as rattraper
+
+    return rattraper(conn)
+
+
+# (nom, tâche(conn) -> nombre d'éléments traités), dans l'ordre d'exécution
+TACHES = (
+    ("exports", purger_exports),
+    ("uploads", purger_uploads),
+    ("blobs_orphelins", purger_blobs_orphelins),
+    ("variantes", rattraper_variantes),
+)
+
+
+def entretenir():
+    """
+    Un passage de toutes les tâches. Retourne {tâche: nombre} (None pour une
+    tâche en erreur), ou None si un autre worker fait déjà le passage.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        # Verrou de session: relâché à la fermeture de la connexion
+        cur.execute("SELECT pg_try_advisory_lock(hashtext(%s)) AS verrou", (ENTRETIEN_VERROU,))
+        verrou = cur.fetchone()["verrou"]
+        conn.commit()
+        if not verrou:
+            return None
+
+        resultats = {}
+        for nom, tache in TACHES:
+            try:
+                resultats[nom] = tache(conn)
+            except Exception as e:
+                conn.rollback()
+                print(f"[entretien] {nom}: {e}")
+                resultats[nom] = None
+        return resultats
+    finally:
+        conn.close()
+
+
+def _boucle():
+    # Décalage aléatoire: les workers démarrés ensemble ne se disputent pas le verrou
+    time.sleep(random.uniform(0.5, 1.0) * ENTRETIEN_INTERVAL)
+    while True:
+        try:
+            resultats = entretenir()
+            if resultats:
+                print(f"[entretien] {resultats}")
+        except Exception as e:
+            print(f"[entretien] Passage impossible: {e}")
+        time.sleep(ENTRETIEN_INTERVAL)
+
+
+def demarrer_entretien():
+    """Lancer le thread d'entretien du worker (une seule fois)"""
+    global _thread
+    if ENTRETIEN_INTERVAL <= 0:
+        return
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_boucle, name="entretien", daemon=True)
+            _thread.start()
+
+
+if __name__ == "__main__":
+    resultats = entretenir()
+    if resultats is None:
+        print("… Entretien déjà en cours sur un autre worker")
+    else:
+        print(f"✓ Entretien: {resultats}")
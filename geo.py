@@ -0,0 +1,169 @@
+"""
+Distances géographiques (haversine) partagées par les routes et les traitements
+
+Une seule définition de la distance pour toute l'application: grand cercle
+sur une sphère de RAYON_TERRE_M mètres (même formule que le SQL de
+livraisons/events.py). Les matrices de distances (un agent × plusieurs
+clients pour /cartographie/proximite) sont calculées en une passe numpy sur
+des tableaux de coordonnées; les grandes matrices sont découpées en blocs de
+lignes pour borner la mémoire. Sans numpy, les mêmes fonctions tournent en Python pur
+(listes de listes), beaucoup plus lentement.
+
+Coordonnées en degrés décimaux; distances en mètres. Un point sans
+coordonnées (None ou nan) donne une distance nan (None en Python pur).
+
+Voir bench_geo.py pour le débit à 100, 1 000 et 10 000 points.
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:  # numpy optionnel: repli en Python pur
+    np = None
+
+RAYON_TERRE_M = 6371000.0
+# Lignes par bloc: bloc × colonnes valeurs float64 en mémoire de travail
+GEO_BLOC = 1024
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Distance en mètres entre deux points"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAYON_TERRE_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _point_valide(p):
+    return p is not None and p[0] is not None and p[1] is not None
+
+
+# ===== Python pur =====
+
+def _matrice_py(a, b):
+    b_rad = [
+        (math.radians(float(p[0])), math.radians(float(p[1]))) if _point_valide(p) else None
+        for p in b
+    ]
+    b_cos = [math.cos(p[0]) if p else None for p in b_rad]
+    lignes = []
+    for p in a:
+        if not _point_valide(p):
+            lignes.append([None] * len(b_rad))
+            continue
+        phi, lam = math.radians(float(p[0])), math.radians(float(p[1]))
+        cos_phi = math.cos(phi)
+        ligne = []
+        for q, cos_q in zip(b_rad, b_cos):
+            if q is None:
+                ligne.append(None)
+                continue
+            h = math.sin((q[0] - phi) / 2) ** 2 + cos_phi * cos_q * math.sin((q[1] - lam) / 2) ** 2
+            ligne.append(2 * RAYON_TERRE_M * math.asin(min(1.0, math.sqrt(h))))
+        lignes.append(ligne)
+    return lignes
+
+
+# ===== numpy =====
+
+def _radians(points):
+    """Séquence de (lat, lon) ou tableau (n, 2) -> (phi, lambda, cos phi), nan pour les points manquants"""
+    if isinstance(points, np.ndarray):
+        coords = points.astype(np.float64, copy=False).reshape(-1, 2)
+    else:
+        coords = np.array(
+            [(p[0], p[1]) if _point_valide(p) else (np.nan, np.nan) for p in points],
+            dtype=np.float64,
+        ).reshape(-1, 2)
+    phi = np.radians(coords[:, 0])
+    lam = np.radians(coords[:, 1])
+    return phi, lam, np.cos(phi)
+
+
+def _termes(phi_a, lam_a, cos_a, phi_b, lam_b, cos_b):
+    """Terme haversine de toutes les paires (lignes a × colonnes b)"""
+    h = np.sin((phi_b[None, :] - phi_a[:, None]) * 0.5)
+    h *= h
+    s = np.sin((lam_b[None, :] - lam_a[:, None]) * 0.5)
+    s *= s
+    s *= cos_a[:, None]
+    s *= cos_b[None, :]
+    h += s
+    return h
+
+
+def _metres(h, out=None):
+    """Terme haversine -> mètres (en place si out est h)"""
+    np.clip(h, 0.0, 1.0, out=h)
+    np.sqrt(h, out=h)
+    np.arcsin(h, out=h)
+    h *= 2 * RAYON_TERRE_M
+    if out is not None and out is not h:
+        out[...] = h
+        return out
+    return h
+
+
+def matrice_distances(a, b=None, dtype=None, bloc=GEO_BLOC):
+    """
+    Matrice des distances (mètres) entre les points de a (lignes) et de b
+    (colonnes); b = a par défaut. a et b: séquences de (lat, lon) ou
+    tableaux (n, 2). Retourne un tableau numpy (float64, ou dtype pour
+    réduire la mémoire), ou une liste de listes sans numpy.
+    """
+    if b is None:
+        b = a
+    if np is None:
+        return _matrice_py(a, b)
+
+    phi_a, lam_a, cos_a = _radians(a)
+    phi_b, lam_b, cos_b = _radians(b)
+    resultat = np.empty((len(phi_a), len(phi_b)), dtype=dtype or np.float64)
+    for debut in range(0, len(phi_a), bloc):
+        fin = min(debut + bloc, len(phi_a))
+        h = _termes(phi_a[debut:fin], lam_a[debut:fin], cos_a[debut:fin], phi_b, lam_b, cos_b)
+        _metres(h, out=resultat[debut:fin])
+    return resultat
+
+
+def plus_proches(a, b, k=1, bloc=GEO_BLOC):
+    """
+    Pour chaque point de a, les k points de b les plus proches, sans garder
+    la matrice complète (calcul par blocs de lignes). Retourne (indices,
+    distances en mètres), chacun de forme (len(a), k) et triés par distance
+    croissante; listes de listes sans numpy. Les points de b sans
+    coordonnées ne sont jamais retenus (distance inf, indice -1 s'il en
+    manque). b vide ou k <= 0: aucune colonne.
+    """
+    k = max(0, min(k, len(b)))
+    if np is None:
+        indices, valeurs = [], []
+        for ligne in _matrice_py(a, b):
+            ordre = sorted((d, j) for j, d in enumerate(ligne) if d is not None)[:k]
+            ordre += [(math.inf, -1)] * (k - len(ordre))
+            indices.append([j for _, j in ordre])
+            valeurs.append([d for d, _ in ordre])
+        return indices, valeurs
+
+    phi_a, lam_a, cos_a = _radians(a)
+    indices = np.empty((len(phi_a), k), dtype=np.int64)
+    valeurs = np.empty((len(phi_a), k), dtype=np.float64)
+    if k == 0:
+        return indices, valeurs
+    phi_b, lam_b, cos_b = _radians(b)
+    for debut in range(0, len(phi_a), bloc):
+        fin = min(debut + bloc, len(phi_a))
+        h = _termes(phi_a[debut:fin], lam_a[debut:fin], cos_a[debut:fin], phi_b, lam_b, cos_b)
+        h[np.isnan(h)] = np.inf
+        # Sélection partielle sur le terme (monotone en distance), puis tri des k retenus
+        if k < h.shape[1]:
+            choix = np.argpartition(h, k - 1, axis=1)[:, :k]
+        else:
+            choix = np.broadcast_to(np.arange(h.shape[1]), (fin - debut, h.shape[1]))
+        retenus = np.take_along_axis(h, choix, axis=1)
+        ordre = np.argsort(retenus, axis=1)
+        choix = np.take_along_axis(choix, ordre, axis=1)
+        retenus = np.take_along_axis(retenus, ordre, axis=1)
+        manquants = np.isinf(retenus)
+        indices[debut:fin] = np.where(manquants, -1, choix)
+        valeurs[debut:fin] = np.where(manquants, np.inf, _metres(np.where(manquants, 0.0, retenus)))
+    return indices, valeurs
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Classements agents / clients par période (leaderboard_scores)
+
+Le trigger de migration_leaderboards.sql ajoute chaque livraison à ses six
+lignes de classement (jour, semaine, mois × agent, client): une mise à jour
+ne déplace qu'une entrée dans les index de score. Le top k se lit en
+parcourant l'index dans l'ordre (k lignes), sans agréger ni trier.
+
+Les périodes sont calendaires, sur la date de livraison (à défaut la date de
+création, comme l'agrégat journalier): le jour, la semaine commençant le
+lundi, le mois.
+
+Usage:
+    python leaderboards.py --backfill
+    python leaderboards.py --rebuild [--jours 35]
+"""
+import argparse
+from datetime import date, timedelta
+from db import get_connection
+from archivage import livraisons_source
+
+PERIODES = ("jour", "semaine", "mois")
+ENTITES = ("agent", "client")
+
+# Scores indexés (idx_leaderboard_*): seuls ceux-ci servent au classement
+CLASSEMENTS = ("montant", "terminees")
+
+LEADERBOARD_LIMITE_MAX = 100
+REBUILD_DAYS = 35
+
+LEADERBOARD_SELECT = """
+    SELECT p.periode, p.debut, e.entite, e.entite_id,
+           COUNT(*), COUNT(*) FILTER (WHERE l.statut = 'terminee'),
+           COALESCE(SUM(l.quantite), 0), COALESCE(SUM(l.montant_percu), 0),
+           COUNT(l.montant_percu)
+    FROM {source} l
+    CROSS JOIN LATERAL (SELECT COALESCE(l.date_livraison, l.created_at::DATE) AS jour) j
+    CROSS JOIN LATERAL (VALUES
+        ('jour', j.jour),
+        ('semaine', DATE_TRUNC('week', j.jour)::DATE),
+        ('mois', DATE_TRUNC('month', j.jour)::DATE)
+    ) p(periode, debut)
+    CROSS JOIN LATERAL (VALUES ('agent', l.agent_id), ('client', l.client_id)) e(entite, entite_id)
+    WHERE j.jour IS NOT NULL AND e.entite_id IS NOT NULL AND {where}
+    GROUP BY 1, 2, 3, 4
+"""
+
+LEADERBOARD_COLUMNS = "periode, debut, entite, entite_id, nb_livraisons, terminees, quantite, montant, nb_montants"
+
+
+def debut_periode(periode, jour=None):
+    """Premier jour de la période contenant `jour` (aujourd'hui par défaut)"""
+    jour = jour or date.today()
+    if periode == "semaine":
+        return jour - timedelta(days=jour.weekday())
+    if periode == "mois":
+        return jour.replace(day=1)
+    return jour
+
+
+def top(cur, periode, entite, classement="montant", limite=10, jour=None):
+    """
+    Les `limite` premiers de la période, dans l'ordre du classement.
+    Lignes: entite_id, rang, nb_livraisons, terminees, quantite, montant, nb_montants.
+    """
+    if classement not in CLASSEMENTS:
+        raise ValueError(f"Classement invalide: {classement}")
+
+    cur.execute(f"""
+        SELECT entite_id, nb_livraisons, terminees, quantite, montant, nb_montants
+        FROM leaderboard_scores
+        WHERE periode = %s AND debut = %s AND entite = %s
+        ORDER BY {classement} DESC, entite_id
+        LIMIT %s
+    """, (periode, debut_periode(periode, jour), entite, limite))
+
+    return [{**row, "rang": rang} for rang, row in enumerate(cur.fetchall(), start=1)]
+
+
+def _lock_livraisons(cur):
+    # Même verrou que rollups.py: aucun delta du trigger pendant le calcul
+    cur.execute("LOCK TABLE livraisons IN SHARE ROW EXCLUSIVE MODE")
+
+
+def backfill():
+    """Reconstruire tous les classements (archive comprise)"""
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        _lock_livraisons(cur)
+        source = livraisons_source(cur)
+        cur.execute("DELETE FROM leaderboard_scores")
+        cur.execute(f"""
+            INSERT INTO leaderboard_scores ({LEADERBOARD_COLUMNS})
+            {LEADERBOARD_SELECT.format(source=source, where="TRUE")}
+        """)
+        lignes = cur.rowcount
+        conn.commit()
+        print(f"✓ Classements reconstruits: {lignes} lignes")
+        return lignes
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Erreur: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+def rebuild(jours=REBUILD_DAYS):
+    """
+    Recalculer les classements des périodes touchant les derniers jours
+    (semaines et mois entiers, pour ne pas laisser une période à moitié comptée)
+    """
+    jour = date.today() - timedelta(days=jours)
+    bornes = [debut_periode(periode, jour) for periode in PERIODES]
+    plancher = min(bornes)
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        _lock_livraisons(cur)
+        # L'archivage se fait sur created_at: marge pour les livraisons tardives
+        source = livraisons_source(cur, plancher, marge_jours=7)
+        cur.execute("""
+            DELETE FROM leaderboard_scores
+            WHERE debut >= CASE periode WHEN 'jour' THEN %s WHEN 'semaine' THEN %s ELSE %s END
+        """, bornes)
+        supprimees = cur.rowcount
+        where = (
+            "j.jour >= %s "
+            "AND p.debut >= CASE p.periode WHEN 'jour' THEN %s WHEN 'semaine' THEN %s ELSE %s END"
+        )
+        cur.execute(f"""
+            INSERT INTO leaderboard_scores ({LEADERBOARD_COLUMNS})
+            {LEADERBOARD_SELECT.format(source=source, where=where)}
+        """, [plancher] + bornes)
+        lignes = cur.rowcount
+        conn.commit()
+        print(f"✓ Classements depuis {plancher}: {supprimees} lignes remplacées par {lignes}")
+        return lignes
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Erreur: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classements agents / clients par période")
+    parser.add_argument("--backfill", action="store_true", help="Reconstruire tous les classements")
+    parser.add_argument("--rebuild", action="store_true", help="Recalculer les dernières périodes")
+    parser.add_argument("--jours", type=int, default=REBUILD_DAYS)
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill()
+    elif args.rebuild:
+        rebuild(args.jours)
+    else:
+        parser.print_help()
@@ -0,0 +1,165 @@
+"""
+Journal des événements de livraison (livraison_events)
+
+Les routes qui font avancer une livraison enregistrent un événement dans la
+même transaction que leur mise à jour. L'historique de suivi
+(/livraisons/<id>/tracking-history) est construit à partir de ce journal.
+
+Le cache des timelines est propre au worker: chaque entrée porte la version
+de la livraison (dernier événement, statut) et n'est servie que si la
+version lue en base est la même, ce qui la rend juste sur tous les workers.
+Les routes appellent en plus invalidate_timeline() après leur commit pour
+libérer l'entrée du worker courant.
+"""
+import os
+import time
+from threading import Lock
+
+# Distance (en mètres) à partir de laquelle l'agent est considéré arrivé
+ARRIVEE_RAYON_M = float(os.getenv("LIVRAISON_ARRIVEE_RAYON_M", "50"))
+
+# Durée de vie des timelines en cache (l'écran de suivi du client interroge en boucle)
+TIMELINE_CACHE_TTL = int(os.getenv("TIMELINE_CACHE_TTL", "10"))
+
+EVENT_CREEE = "creee"
+EVENT_AGENT_ASSIGNE = "agent_assigne"
+EVENT_EN_ROUTE = "en_route"
+EVENT_ARRIVEE = "arrivee"
+EVENT_LIVREE = "livree"
+EVENT_PROBLEME = "probleme"
+EVENT_ANNULEE = "annulee"
+EVENT_STATUT_MODIFIE = "statut_modifie"
+
+# Statut de livraison / commande -> type d'événement
+STATUT_EVENTS = {
+    "livree": EVENT_LIVREE,
+    "terminee": EVENT_LIVREE,
+    "probleme": EVENT_PROBLEME,
+    "annulee": EVENT_ANNULEE,
+}
+
+_timeline_cache = {}
+_timeline_lock = Lock()
+
+
+def event_for_statut(statut):
+    return STATUT_EVENTS.get(statut, EVENT_STATUT_MODIFIE)
+
+
+def record_livraison_event(cur, livraison_id, type_evenement, statut=None, agent_id=None,
+                           latitude=None, longitude=None, details=None):
+    """Ajouter un événement au journal d'une livraison"""
+    cur.execute("""
+        INSERT INTO livraison_events (
+            livraison_id, commande_id, type_evenement, statut, agent_id,
+            latitude, longitude, details
+        )
+        SELECT id, commande_id, %s, COALESCE(%s, statut), COALESCE(%s, agent_id), %s, %s, %s
+        FROM livraisons
+        WHERE id = %s
+    """, (type_evenement, statut, agent_id, latitude, longitude, details, livraison_id))
+
+
+def record_commande_event(cur, commande_id, type_evenement, statut=None, agent_id=None, details=None):
+    """
+    Ajouter un événement à toutes les livraisons d'une commande.
+    Retourne les livraisons concernées (timelines à invalider après commit).
+    """
+    cur.execute("""
+        INSERT INTO livraison_events (
+            livraison_id, commande_id, type_evenement, statut, agent_id, details
+        )
+        SELECT id, commande_id, %s, COALESCE(%s, statut), COALESCE(%s, agent_id), %s
+        FROM livraisons
+        WHERE commande_id = %s
+        RETURNING livraison_id
+    """, (type_evenement, statut, agent_id, details, commande_id))
+    return [row["livraison_id"] for row in cur.fetchall()]
+
+
+def record_agent_position(cur, agent_id, latitude, longitude):
+    """
+    Détecter le départ et l'arrivée à partir d'une nouvelle position de l'agent.
+    Premier point reçu après l'assignation: en_route. Point à moins de
+    ARRIVEE_RAYON_M de l'adresse de livraison: arrivee. Chaque événement
+    n'est enregistré qu'une fois par livraison.
+    Retourne les livraisons concernées (timelines à invalider après commit).
+    """
+    if latitude is None or longitude is None:
+        return []
+
+    params = {
+        "agent_id": agent_id,
+        "lat": latitude,
+        "lon": longitude,
+        "rayon": ARRIVEE_RAYON_M,
+        "en_route": EVENT_EN_ROUTE,
+        "arrivee": EVENT_ARRIVEE,
+    }
+
+    cur.execute("""
+        WITH actives AS (
+            SELECT
+                l.id, l.commande_id, l.statut,
+                CASE
+                    WHEN l.latitude_gps IS NULL OR l.longitude_gps IS NULL
+                        OR (l.latitude_gps = 0 AND l.longitude_gps = 0) THEN NULL
+                    ELSE 6371000 * 2 * ASIN(SQRT(
+                        POWER(SIN(RADIANS(l.latitude_gps - %(lat)s) / 2), 2)
+                        + COS(RADIANS(%(lat)s)) * COS(RADIANS(l.latitude_gps))
+                        * POWER(SIN(RADIANS(l.longitude_gps - %(lon)s) / 2), 2)
+                    ))
+                END AS distance
+            FROM livraisons l
+            WHERE l.agent_id = %(agent_id)s AND l.statut = 'en_cours'
+        ),
+        nouveaux AS (
+            SELECT a.id, a.commande_id, a.statut, %(en_route)s AS type_evenement, a.distance
+            FROM actives a
+            WHERE NOT EXISTS (
+                SELECT 1 FROM livraison_events e
+                WHERE e.livraison_id = a.id AND e.type_evenement IN (%(en_route)s, %(arrivee)s)
+            )
+            UNION ALL
+            SELECT a.id, a.commande_id, a.statut, %(arrivee)s, a.distance
+            FROM actives a
+            WHERE a.distance <= %(rayon)s
+            AND NOT EXISTS (
+                SELECT 1 FROM livraison_events e
+                WHERE e.livraison_id = a.id AND e.type_evenement = %(arrivee)s
+            )
+        )
+        INSERT INTO livraison_events (
+            livraison_id, commande_id, type_evenement, statut, agent_id, latitude, longitude, details
+        )
+        SELECT id, commande_id, type_evenement, statut, %(agent_id)s, %(lat)s, %(lon)s,
+               CASE WHEN distance IS NULL THEN NULL ELSE 'distance_m=' || ROUND(distance::numeric, 1) END
+        FROM nouveaux
+        RETURNING livraison_id
+    """, params)
+    return [row["livraison_id"] for row in cur.fetchall()]
+
+
+def invalidate_timeline(*livraison_ids):
+    """À appeler après le commit: un appel avant laisserait un lecteur remettre l'ancienne version"""
+    with _timeline_lock:
+        for livraison_id in livraison_ids:
+            _timeline_cache.pop(livraison_id, None)
+
+
+def get_cached_timeline(livraison_id, version):
+    """Timeline en cache pour cette version (None si absente, expirée ou d'une autre version)"""
+    with _timeline_lock:
+        entry = _timeline_cache.get(livraison_id)
+        if entry and entry[0] > time.monotonic() and entry[1] == version:
+            return entry[2]
+        _timeline_cache.pop(livraison_id, None)
+        return None
+
+
+def set_cached_timeline(livraison_id, version, timeline):
+    with _timeline_lock:
+        # Borne simple: les livraisons suivies à un instant donné sont peu nombreuses
+        if len(_timeline_cache) > 5000:
+            _timeline_cache.clear()
+        _timeline_cache[livraison_id] = (time.monotonic() + TIMELINE_CACHE_TTL, version, timeline)
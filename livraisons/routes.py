@@ -1,10 +1,16 @@
 from flask_restx import Namespace, Resource, fields
-from flask import request
+from flask import request, make_response, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from db import get_connection
+from cache import invalidate, CACHE_TAG_DASHBOARD
 from datetime import datetime
 from decimal import Decimal
 from notifications import get_notification_service
+from blobs.storage import store_inline_payload, is_blob_id, signed_blob_url
+from livraisons.events import (
+    record_livraison_event, event_for_statut, get_cached_timeline, set_cached_timeline, invalidate_timeline,
+    EVENT_CREEE, EVENT_AGENT_ASSIGNE, EVENT_EN_ROUTE, EVENT_ARRIVEE, EVENT_LIVREE,
+)
 import traceback
 from threading import Thread
 
@@ -23,6 +29,45 @@ def convert_decimal(obj):
     return obj
 
 
+class BlobReferenceInvalide(Exception):
+    pass
+
+
+def _blob_existant(cur, champ, valeur):
+    """Référence de blob envoyée par le client: format SHA-256 et blob enregistré"""
+    if not valeur:
+        return None
+    if not isinstance(valeur, str) or not is_blob_id(valeur):
+        raise BlobReferenceInvalide(f"{champ} invalide (SHA-256 hexadécimal attendu)")
+    cur.execute("SELECT 1 FROM blobs WHERE sha256 = %s", (valeur,))
+    if not cur.fetchone():
+        raise BlobReferenceInvalide(f"{champ} inconnu: envoyer le fichier par POST /blobs d'abord")
+    return valeur
+
+
+def split_payloads(cur, data):
+    """
+    Photo et signature: référence de blob (photo_blob / signature_blob, ou
+    contenu base64 converti en blob) ou, à défaut, valeur courte gardée en ligne.
+    Retourne (photo_blob, photo_lieu, signature_blob, signature_client).
+    Lève BlobReferenceInvalide si une référence fournie n'existe pas.
+    """
+    photo_blob = (
+        _blob_existant(cur, "photo_blob", data.get("photo_blob"))
+        or store_inline_payload(cur, data.get("photo_lieu"))
+    )
+    signature_blob = (
+        _blob_existant(cur, "signature_blob", data.get("signature_blob"))
+        or store_inline_payload(cur, data.get("signature_client"))
+    )
+    return (
+        photo_blob,
+        None if photo_blob else data.get("photo_lieu"),
+        signature_blob,
+        None if signature_blob else data.get("signature_client"),
+    )
+
+
 def send_notifications_async(client_info, agent_info, livraison_info):
     """Send notifications in a background thread to avoid blocking the response"""
     try:
@@ -109,6 +154,8 @@ create_livraison_model = livraisons_ns.model("CreateLivraison", {
     "adresse_livraison": fields.String(required=True),
     "photo_lieu": fields.String(),
     "signature_client": fields.String(),
+    "photo_blob": fields.String(description="Référence renvoyée par POST /blobs"),
+    "signature_blob": fields.String(description="Référence renvoyée par POST /blobs"),
     "statut": fields.String(),
 })
 
@@ -140,6 +187,8 @@ class LivraisonsList(Resource):
             print(f"[LivraisonsList GET] Params: agent_id={agent_id}, client_id={client_id}, statut={statut}, page={page}, per_page={per_page}")
             
             # Construire la requête dynamiquement
+            # livraisons_read: projection dénormalisée (agent, client, commande)
+            # maintenue par triggers, voir migration_livraisons_read.sql
             query = """
                 SELECT
                     l.id,
@@ -157,19 +206,16 @@ class LivraisonsList(Resource):
                     l.heure_livraison,
                     l.statut,
                     l.created_at,
-                    a.nom as agent_nom,
-                    a.telephone as agent_telephone,
-                    a.tricycle,
-                    c.nom_point_vente,
-                    c.responsable,
-                    c.telephone as client_telephone,
-                    cmd.latitude as order_latitude,
-                    cmd.longitude as order_longitude,
-                    cmd.montant_total
-                FROM livraisons l
-                LEFT JOIN agents a ON l.agent_id = a.id
-                LEFT JOIN clients c ON l.client_id = c.id
-                LEFT JOIN commandes cmd ON l.commande_id = cmd.id
+                    l.agent_nom,
+                    l.agent_telephone,
+                    l.tricycle,
+                    l.nom_point_vente,
+                    l.responsable,
+                    l.client_telephone,
+                    l.order_latitude,
+                    l.order_longitude,
+                    l.montant_total
+                FROM livraisons_read l
                 WHERE 1=1
             """
             
@@ -198,7 +244,7 @@ class LivraisonsList(Resource):
                 params.append(montant_max)
             
             # Compter le total
-            count_query = "SELECT COUNT(*) as total FROM livraisons l WHERE 1=1"
+            count_query = "SELECT COUNT(*) as total FROM livraisons_read l WHERE 1=1"
             count_params = []
             
             if agent_id:
@@ -249,6 +295,15 @@ class LivraisonsList(Resource):
             
             print(f"[LivraisonsList GET] Found {len(livraisons)} livraisons")
             
+            # Miniature: URL signée, affichable directement dans une balise <img>
+            secret = current_app.config["JWT_SECRET_KEY"]
+            for livraison in livraisons:
+                photo = livraison["photo_lieu"] or ""
+                sha256 = photo[len("/blobs/"):] if photo.startswith("/blobs/") else None
+                livraison["photo_miniature"] = (
+                    signed_blob_url(secret, sha256, "thumb") if is_blob_id(sha256) else None
+                )
+            
             # Convert and return
             converted_livraisons = convert_decimal(livraisons) if livraisons else []
             
@@ -291,15 +346,16 @@ class LivraisonsList(Resource):
                 return {"error": "Vous n'êtes pas un agent"}, 403
             
             agent_id = agent["id"] if agent else data.get("agent_id")
+            photo_blob, photo_lieu, signature_blob, signature_client = split_payloads(cur, data)
             
             cur.execute("""
                 INSERT INTO livraisons (
                     commande_id, agent_id, client_id, quantite, montant_percu,
                     latitude_gps, longitude_gps, adresse_livraison,
-                    photo_lieu, signature_client, date_livraison, heure_livraison,
-                    statut, created_at
+                    photo_lieu, signature_client, photo_blob, signature_blob,
+                    date_livraison, heure_livraison, statut, created_at
                 )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 RETURNING id, created_at
             """, (
                 data.get("commande_id"),
@@ -310,8 +366,10 @@ class LivraisonsList(Resource):
                 data.get("latitude_gps"),
                 data.get("longitude_gps"),
                 data.get("adresse_livraison"),
-                data.get("photo_lieu"),
-                data.get("signature_client"),
+                photo_lieu,
+                signature_client,
+                photo_blob,
+                signature_blob,
                 datetime.now().date(),
                 datetime.now().time(),
                 "en_cours",
@@ -319,7 +377,12 @@ class LivraisonsList(Resource):
             ))
             
             result = cur.fetchone()
+            record_livraison_event(cur, result["id"], EVENT_CREEE)
+            if agent_id:
+                record_livraison_event(cur, result["id"], EVENT_AGENT_ASSIGNE, agent_id=agent_id)
             conn.commit()
+            invalidate(CACHE_TAG_DASHBOARD)
+            invalidate_timeline(result["id"])
             
             return {
                 "message": "Livraison créée avec succès",
@@ -327,6 +390,9 @@ class LivraisonsList(Resource):
                 "created_at": result["created_at"].isoformat()
             }, 201
             
+        except BlobReferenceInvalide as e:
+            conn.rollback()
+            return {"error": str(e)}, 400
         except Exception as e:
             conn.rollback()
             return {"error": f"Erreur serveur: {str(e)}"}, 500
@@ -362,16 +428,14 @@ class LivraisonDetail(Resource):
                     l.heure_livraison,
                     l.statut,
                     l.created_at,
-                    a.nom as agent_nom,
-                    a.telephone as agent_telephone,
-                    a.tricycle,
-                    c.nom_point_vente,
-                    c.responsable,
-                    c.telephone as client_telephone,
-                    c.adresse
-                FROM livraisons l
-                LEFT JOIN agents a ON l.agent_id = a.id
-                LEFT JOIN clients c ON l.client_id = c.id
+                    l.agent_nom,
+                    l.agent_telephone,
+                    l.tricycle,
+                    l.nom_point_vente,
+                    l.responsable,
+                    l.client_telephone,
+                    l.client_adresse as adresse
+                FROM livraisons_read l
                 WHERE l.id = %s
             """, (livraison_id,))
 
@@ -405,6 +469,9 @@ class LivraisonDetail(Resource):
             if not livraison_actuelle:
                 return {"error": "Livraison non trouvée"}, 404
 
+            photo_blob, photo_lieu, signature_blob, signature_client = split_payloads(cur, data)
+
+            # Un nouveau blob remplace l'éventuelle valeur en ligne
             cur.execute("""
                 UPDATE livraisons
                 SET
@@ -413,8 +480,10 @@ class LivraisonDetail(Resource):
                     latitude_gps = COALESCE(%s, latitude_gps),
                     longitude_gps = COALESCE(%s, longitude_gps),
                     adresse_livraison = COALESCE(%s, adresse_livraison),
-                    photo_lieu = COALESCE(%s, photo_lieu),
-                    signature_client = COALESCE(%s, signature_client),
+                    photo_blob = COALESCE(%s, photo_blob),
+                    photo_lieu = CASE WHEN %s IS NOT NULL THEN NULL ELSE COALESCE(%s, photo_lieu) END,
+                    signature_blob = COALESCE(%s, signature_blob),
+                    signature_client = CASE WHEN %s IS NOT NULL THEN NULL ELSE COALESCE(%s, signature_client) END,
                     statut = COALESCE(%s, statut),
                     updated_at = CURRENT_TIMESTAMP
                 WHERE id = %s
@@ -425,8 +494,12 @@ class LivraisonDetail(Resource):
                 data.get("latitude_gps"),
                 data.get("longitude_gps"),
                 data.get("adresse_livraison"),
-                data.get("photo_lieu"),
-                data.get("signature_client"),
+                photo_blob,
+                photo_blob,
+                photo_lieu,
+                signature_blob,
+                signature_blob,
+                signature_client,
                 data.get("statut"),
                 livraison_id
             ))
@@ -436,6 +509,9 @@ class LivraisonDetail(Resource):
             if not result:
                 return {"error": "Livraison non trouvée"}, 404
 
+            if data.get("statut") and data.get("statut") != livraison_actuelle["statut"]:
+                record_livraison_event(cur, livraison_id, event_for_statut(data.get("statut")))
+
             # Si le statut de la livraison passe à "livree", mettre à jour le statut de la commande à "livree"
             if data.get("statut") == "livree" and livraison_actuelle["statut"] != "livree":
                 cur.execute("""
@@ -445,6 +521,8 @@ class LivraisonDetail(Resource):
                 """, (livraison_actuelle["commande_id"],))
 
             conn.commit()
+            invalidate(CACHE_TAG_DASHBOARD)
+            invalidate_timeline(livraison_id)
 
             return {
                 "message": "Livraison modifiée avec succès",
@@ -452,6 +530,9 @@ class LivraisonDetail(Resource):
                 "updated_at": result["updated_at"].isoformat()
             }, 200
 
+        except BlobReferenceInvalide as e:
+            conn.rollback()
+            return {"error": str(e)}, 400
         except Exception as e:
             conn.rollback()
             return {"error": f"Erreur serveur: {str(e)}"}, 500
@@ -474,6 +555,8 @@ class LivraisonDetail(Resource):
                 return {"error": "Livraison non trouvée"}, 404
             
             conn.commit()
+            invalidate(CACHE_TAG_DASHBOARD)
+            invalidate_timeline(livraison_id)
             
             return {"message": "Livraison supprimée avec succès"}, 200
             
@@ -537,6 +620,7 @@ class AssignAgent(Resource):
             """, (agent_id, livraison_id))
 
             result = cur.fetchone()
+            record_livraison_event(cur, livraison_id, EVENT_AGENT_ASSIGNE, agent_id=agent_id)
 
             # Mettre à jour le statut et l'agent de la commande associée à "en_cours"
             cur.execute("""
@@ -546,6 +630,8 @@ class AssignAgent(Resource):
             """, (agent_id, result["commande_id"]))
 
             conn.commit()
+            invalidate(CACHE_TAG_DASHBOARD)
+            invalidate_timeline(livraison_id)
             
             # Prepare notification data for async sending
             client_info = None
@@ -731,6 +817,65 @@ class NotificationsHistory(Resource):
         return {}, 200
 
 
+# Étapes affichées par l'écran de suivi et événement qui valide chacune
+TRACKING_STEPS = [
+    ("1", "Commande reçue", EVENT_CREEE,
+     "La commande a été enregistrée dans le système", "La commande a été enregistrée dans le système"),
+    ("2", "Agent assigné", EVENT_AGENT_ASSIGNE,
+     "Un livreur a été assigné à la commande", "En attente d'assignation"),
+    ("3", "En route", EVENT_EN_ROUTE,
+     "Le livreur est en route vers la destination", "Le livreur partira bientôt"),
+    ("4", "Arrivée sur place", EVENT_ARRIVEE,
+     "Le livreur est arrivé chez le client", "Le livreur arrivera bientôt"),
+    ("5", "Livraison effectuée", EVENT_LIVREE,
+     "La livraison a été confirmée par le client", "En attente de confirmation"),
+]
+
+
+def build_tracking_timeline(livraison, events):
+    """Construire la timeline de suivi à partir du journal des événements"""
+    # Heure du dernier événement de chaque type
+    times = {}
+    for event in events:
+        times[event["type_evenement"]] = event["created_at"]
+
+    # Une étape est franchie si son événement existe ou si une étape suivante l'est
+    reached = -1
+    for index, step in enumerate(TRACKING_STEPS):
+        if step[2] in times:
+            reached = index
+
+    tracking_steps = []
+    for index, (step_id, title, event_type, done_text, pending_text) in enumerate(TRACKING_STEPS):
+        completed = index <= reached
+        event_time = times.get(event_type)
+        tracking_steps.append({
+            "id": step_id,
+            "title": title,
+            "description": done_text if completed else pending_text,
+            "time": event_time.strftime("%H:%M") if event_time and completed else None,
+            "completed": completed,
+            "current": index == reached + 1,
+        })
+
+    return {
+        "tracking_steps": tracking_steps,
+        "current_status": livraison["statut"],
+        "agent_name": livraison["agent_nom"],
+        "client_name": livraison["nom_point_vente"],
+        "events": [{
+            "type": event["type_evenement"],
+            "statut": event["statut"],
+            "agent_id": event["agent_id"],
+            "latitude": event["latitude"],
+            "longitude": event["longitude"],
+            "details": event["details"],
+            "created_at": event["created_at"],
+        } for event in events],
+        "last_event_id": events[-1]["id"] if events else 0,
+    }
+
+
 @livraisons_ns.route("/<int:livraison_id>/tracking-history")
 class TrackingHistory(Resource):
     @livraisons_ns.doc(security="BearerAuth")
@@ -739,99 +884,50 @@ class TrackingHistory(Resource):
         """Récupérer l'historique de suivi d'une livraison"""
         conn = get_connection()
         cur = conn.cursor()
-        
+
         try:
-            # Récupérer la livraison et ses informations d'état
+            # Version validée en base: le cache d'un autre worker ne peut pas servir une timeline périmée
             cur.execute("""
-                SELECT
-                    l.id,
-                    l.statut,
-                    l.date_livraison,
-                    l.heure_livraison,
-                    l.created_at,
-                    l.updated_at,
-                    a.nom as agent_nom,
-                    c.nom_point_vente as client_name
-                FROM livraisons l
-                LEFT JOIN agents a ON l.agent_id = a.id
-                LEFT JOIN clients c ON l.client_id = c.id
+                SELECT l.id, l.statut, l.agent_nom, l.nom_point_vente,
+                       (SELECT MAX(e.id) FROM livraison_events e WHERE e.livraison_id = l.id) AS last_event_id
+                FROM livraisons_read l
                 WHERE l.id = %s
             """, (livraison_id,))
-            
+
             livraison = cur.fetchone()
-            
+
             if not livraison:
                 return {"error": "Livraison non trouvée"}, 404
-            
-            # Construire l'historique de suivi basé sur l'état actuel
-            tracking_steps = []
-            
-            # Étape 1: Commande reçue
-            tracking_steps.append({
-                "id": "1",
-                "title": "Commande reçue",
-                "description": "La commande a été enregistrée dans le système",
-                "time": livraison["created_at"].strftime("%H:%M") if livraison["created_at"] else None,
-                "completed": True,
-                "current": False
-            })
-            
-            # Étape 2: Agent assigné
-            is_pending = livraison["statut"] in ["en_attente", "pending"]
-            is_in_progress = livraison["statut"] in ["en_cours", "assigned"]
-            is_completed = livraison["statut"] in ["livree", "completed"]
-            
-            tracking_steps.append({
-                "id": "2",
-                "title": "Agent assigné",
-                "description": "En attente d'assignation" if is_pending else "Un livreur a été assigné à la commande",
-                "time": None if is_pending else (livraison["updated_at"].strftime("%H:%M") if livraison["updated_at"] else None),
-                "completed": not is_pending,
-                "current": is_pending
-            })
-            
-            # Étape 3: En route
-            tracking_steps.append({
-                "id": "3",
-                "title": "En route",
-                "description": "Le livreur est en route vers la destination" if is_in_progress or is_completed else "Le livreur partira bientôt",
-                "time": None if not (is_in_progress or is_completed) else (livraison["heure_livraison"].strftime("%H:%M") if livraison["heure_livraison"] else None),
-                "completed": is_in_progress or is_completed,
-                "current": is_in_progress and not is_completed
-            })
-            
-            # Étape 4: Arrivée sur place
-            tracking_steps.append({
-                "id": "4",
-                "title": "Arrivée sur place",
-                "description": "Le livreur est arrivé chez le client" if is_completed else "Le livreur arrivera bientôt",
-                "time": None if not is_completed else (livraison["updated_at"].strftime("%H:%M") if livraison["updated_at"] else None),
-                "completed": is_completed,
-                "current": False
-            })
-            
-            # Étape 5: Livraison effectuée
-            tracking_steps.append({
-                "id": "5",
-                "title": "Livraison effectuée",
-                "description": "La livraison a été confirmée par le client" if is_completed else "En attente de confirmation",
-                "time": None if not is_completed else (livraison["updated_at"].strftime("%H:%M") if livraison["updated_at"] else None),
-                "completed": is_completed,
-                "current": False
-            })
-            
-            return convert_decimal({
-                "tracking_steps": tracking_steps,
-                "current_status": livraison["statut"],
-                "agent_name": livraison["agent_nom"],
-                "client_name": livraison["client_name"]
-            }), 200
-            
+
+            version = (livraison["last_event_id"], livraison["statut"], livraison["agent_nom"], livraison["nom_point_vente"])
+            timeline = get_cached_timeline(livraison_id, version)
+
+            if timeline is None:
+                cur.execute("""
+                    SELECT id, type_evenement, statut, agent_id, latitude, longitude, details, created_at
+                    FROM livraison_events
+                    WHERE livraison_id = %s
+                    ORDER BY created_at, id
+                """, (livraison_id,))
+
+                timeline = convert_decimal(build_tracking_timeline(livraison, cur.fetchall()))
+                set_cached_timeline(livraison_id, version, timeline)
+
         except Exception as e:
             return {"error": f"Erreur serveur: {str(e)}"}, 500
         finally:
             conn.close()
 
+        # L'application de suivi renvoie l'ETag reçu: 304 tant que rien n'a changé
+        etag = f'"{livraison_id}-{timeline["last_event_id"]}-{timeline["current_status"]}"'
+        if request.headers.get("If-None-Match") == etag:
+            response = make_response("", 304)
+        else:
+            response = make_response(timeline, 200)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
     def options(self, livraison_id):
         """Gérer les requêtes OPTIONS pour CORS"""
         return {}, 200
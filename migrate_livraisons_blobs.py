@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Reprise des photos et signatures stockées en ligne (base64) dans livraisons
+Chaque contenu est déplacé vers le stockage de blobs et remplacé par sa référence.
+À lancer une fois après migration_blobs.sql.
+
+Usage:
+    python migrate_livraisons_blobs.py [--batch 200]
+"""
+import argparse
+from db import get_connection
+from blobs.storage import store_inline_payload
+
+
+def migrer_table(conn, table, batch_size):
+    cur = conn.cursor()
+    migrees = 0
+    dernier_id = 0
+
+    while True:
+        cur.execute(f"""
+            SELECT id, photo_lieu, signature_client
+            FROM {table}
+            WHERE id > %s
+            AND ((photo_lieu IS NOT NULL AND photo_blob IS NULL)
+                 OR (signature_client IS NOT NULL AND signature_blob IS NULL))
+            ORDER BY id
+            LIMIT %s
+        """, (dernier_id, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            return migrees
+
+        for row in rows:
+            photo_blob = store_inline_payload(cur, row["photo_lieu"])
+            signature_blob = store_inline_payload(cur, row["signature_client"])
+            if photo_blob or signature_blob:
+                cur.execute(f"""
+                    UPDATE {table}
+                    SET photo_blob = COALESCE(%s, photo_blob),
+                        photo_lieu = CASE WHEN %s IS NOT NULL THEN NULL ELSE photo_lieu END,
+                        signature_blob = COALESCE(%s, signature_blob),
+                        signature_client = CASE WHEN %s IS NOT NULL THEN NULL ELSE signature_client END
+                    WHERE id = %s
+                """, (photo_blob, photo_blob, signature_blob, signature_blob, row["id"]))
+                migrees += 1
+            dernier_id = row["id"]
+
+        conn.commit()
+        print(f"   … {table}: {migrees} livraisons migrées (id <= {dernier_id})")
+
+
+def main(batch_size):
+    conn = get_connection()
+    try:
+        for table in ("livraisons", "livraisons_archive"):
+            migrees = migrer_table(conn, table, batch_size)
+            print(f"✓ {table}: {migrees} livraisons migrées vers le stockage de blobs")
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Erreur: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Déplacer photos et signatures en ligne vers le stockage de blobs")
+    parser.add_argument("--batch", type=int, default=200)
+    args = parser.parse_args()
+
+    main(args.batch)
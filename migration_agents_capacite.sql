@@ -0,0 +1,14 @@
+-- Migration: Capacité des tricycles et charge des agents (/commandes/<id>/candidates)
+-- capacite_tricycle: quantité transportable en une tournée, dans l'unité de
+-- livraisons.quantite (NULL = non renseignée). La charge d'un agent est la
+-- quantité de ses livraisons en cours du jour, lue par un index partiel.
+
+ALTER TABLE agents ADD COLUMN IF NOT EXISTS capacite_tricycle INTEGER
+    CHECK (capacite_tricycle IS NULL OR capacite_tricycle >= 0);
+
+COMMENT ON COLUMN agents.capacite_tricycle IS 'Quantité transportable par le tricycle en une tournée';
+
+CREATE INDEX IF NOT EXISTS idx_livraisons_agent_en_cours ON livraisons(agent_id, date_livraison)
+    WHERE statut = 'en_cours';
+
+-- Fin migration
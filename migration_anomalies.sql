@@ -0,0 +1,40 @@
+-- Migration: Livraisons signalées par l'analyse des anomalies (anomalies.py)
+-- Une ligne par (livraison, règle). Règles:
+--   montant_zscore_agent / quantite_zscore_agent: écart à la moyenne de l'agent
+--     (|z| > ANOMALIE_Z), score = z
+--   montant_iqr_client / quantite_iqr_client: hors des bornes Q1 - k·IQR,
+--     Q3 + k·IQR du client, score = distance aux bornes en IQR
+--   ecart_commande: montant perçu sur la commande (toutes ses livraisons)
+--     différent de commandes.montant_total, une fois aucune livraison en
+--     cours, score = écart relatif
+--   Les scores sont bornés à ±9999999.999 (précision de la colonne)
+-- Une nouvelle analyse remplace les anomalies 'nouvelle' de la période; les
+-- anomalies vérifiées ou ignorées sont gardées.
+
+CREATE TABLE IF NOT EXISTS livraisons_anomalies (
+    id SERIAL PRIMARY KEY,
+    livraison_id INTEGER NOT NULL,
+    jour DATE NOT NULL,                 -- date de livraison (création à défaut)
+    agent_id INTEGER,
+    client_id INTEGER,
+    commande_id INTEGER,
+    regle VARCHAR(30) NOT NULL CHECK (regle IN (
+        'montant_zscore_agent', 'quantite_zscore_agent',
+        'montant_iqr_client', 'quantite_iqr_client',
+        'ecart_commande'
+    )),
+    valeur NUMERIC(14,2),               -- valeur observée
+    reference NUMERIC(14,2),            -- moyenne, médiane ou montant de la commande
+    score NUMERIC(10,3) NOT NULL,
+    statut VARCHAR(20) NOT NULL DEFAULT 'nouvelle' CHECK (statut IN ('nouvelle', 'verifiee', 'ignoree')),
+    detected_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (livraison_id, regle)
+);
+
+CREATE INDEX IF NOT EXISTS idx_livraisons_anomalies_jour ON livraisons_anomalies(jour, regle);
+CREATE INDEX IF NOT EXISTS idx_livraisons_anomalies_agent ON livraisons_anomalies(agent_id, jour);
+CREATE INDEX IF NOT EXISTS idx_livraisons_anomalies_statut ON livraisons_anomalies(statut) WHERE statut = 'nouvelle';
+
+COMMENT ON TABLE livraisons_anomalies IS 'Livraisons aux montants ou quantités atypiques (anomalies.py)';
+
+-- Fin migration
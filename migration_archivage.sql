@@ -0,0 +1,48 @@
+-- Migration: Tables d'archive pour les livraisons et commandes anciennes
+-- Les lignes plus anciennes que l'horizon configuré (ARCHIVE_HORIZON_DAYS)
+-- sont déplacées ici par archivage.py. Les tables chaudes restent petites et
+-- les rapports font l'union avec l'archive quand la période remonte assez loin.
+
+-- Mêmes colonnes, dans le même ordre, que les tables chaudes (INSERT ... SELECT *)
+-- Pas de clés étrangères: les lignes archivées ne doivent jamais bloquer
+-- la suppression d'un agent ou d'un client.
+CREATE TABLE IF NOT EXISTS livraisons_archive (LIKE livraisons INCLUDING DEFAULTS);
+CREATE TABLE IF NOT EXISTS commandes_archive (LIKE commandes INCLUDING DEFAULTS);
+CREATE TABLE IF NOT EXISTS commande_details_archive (LIKE commande_details INCLUDING DEFAULTS);
+CREATE TABLE IF NOT EXISTS paiements_archive (LIKE paiements INCLUDING DEFAULTS);
+
+ALTER TABLE livraisons_archive DROP CONSTRAINT IF EXISTS livraisons_archive_pkey;
+ALTER TABLE livraisons_archive ADD CONSTRAINT livraisons_archive_pkey PRIMARY KEY (id);
+ALTER TABLE commandes_archive DROP CONSTRAINT IF EXISTS commandes_archive_pkey;
+ALTER TABLE commandes_archive ADD CONSTRAINT commandes_archive_pkey PRIMARY KEY (id);
+
+-- Les rapports filtrent l'archive par date de création, agent et client
+CREATE INDEX IF NOT EXISTS idx_livraisons_archive_created_at ON livraisons_archive(created_at);
+CREATE INDEX IF NOT EXISTS idx_livraisons_archive_agent_id ON livraisons_archive(agent_id);
+CREATE INDEX IF NOT EXISTS idx_livraisons_archive_client_id ON livraisons_archive(client_id);
+CREATE INDEX IF NOT EXISTS idx_commandes_archive_created_at ON commandes_archive(created_at);
+CREATE INDEX IF NOT EXISTS idx_commandes_archive_client_id ON commandes_archive(client_id);
+CREATE INDEX IF NOT EXISTS idx_commande_details_archive_commande_id ON commande_details_archive(commande_id);
+CREATE INDEX IF NOT EXISTS idx_paiements_archive_commande_id ON paiements_archive(commande_id);
+
+-- Index utilisé par le job pour trouver les lignes à archiver
+CREATE INDEX IF NOT EXISTS idx_livraisons_created_at ON livraisons(created_at);
+CREATE INDEX IF NOT EXISTS idx_commandes_created_at ON commandes(created_at);
+
+-- Historique des passages du job. La date de coupure la plus récente indique
+-- aux rapports à partir de quand l'archive doit être incluse.
+CREATE TABLE IF NOT EXISTS archive_runs (
+    id SERIAL PRIMARY KEY,
+    cutoff DATE NOT NULL,
+    statut VARCHAR(20) NOT NULL DEFAULT 'en_cours' CHECK (statut IN ('en_cours', 'terminee', 'interrompu')),
+    livraisons_archivees INTEGER DEFAULT 0,
+    commandes_archivees INTEGER DEFAULT 0,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+COMMENT ON TABLE livraisons_archive IS 'Livraisons terminées plus anciennes que l''horizon d''archivage';
+COMMENT ON TABLE commandes_archive IS 'Commandes clôturées plus anciennes que l''horizon d''archivage';
+COMMENT ON TABLE archive_runs IS 'Historique des passages du job d''archivage';
+
+-- Fin migration
@@ -0,0 +1,84 @@
+-- Migration: Photos et signatures stockées hors de la table livraisons
+-- Les fichiers sont stockés par blobs/storage.py (adressés par leur SHA-256);
+-- les livraisons ne gardent qu'une référence. Les listes renvoient une URL
+-- /blobs/<sha256> au lieu du contenu.
+-- Après la migration: python migrate_livraisons_blobs.py (reprise de l'existant)
+
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    taille BIGINT NOT NULL,
+    content_type VARCHAR(100) NOT NULL DEFAULT 'application/octet-stream',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE livraisons ADD COLUMN IF NOT EXISTS photo_blob CHAR(64) REFERENCES blobs(sha256);
+ALTER TABLE livraisons ADD COLUMN IF NOT EXISTS signature_blob CHAR(64) REFERENCES blobs(sha256);
+
+-- Les tables d'archive gardent les mêmes colonnes que les tables chaudes
+ALTER TABLE livraisons_archive ADD COLUMN IF NOT EXISTS photo_blob CHAR(64);
+ALTER TABLE livraisons_archive ADD COLUMN IF NOT EXISTS signature_blob CHAR(64);
+
+-- La projection de lecture (migration_livraisons_read.sql) lit photo_lieu et
+-- signature_client: la supprimer avant de changer leur type, puis la recréer
+DROP TABLE IF EXISTS livraisons_read;
+DROP VIEW IF EXISTS livraisons_read_source;
+
+-- L'ancienne application envoie des signatures en base64: plus de limite à 255
+ALTER TABLE livraisons ALTER COLUMN photo_lieu TYPE TEXT;
+ALTER TABLE livraisons ALTER COLUMN signature_client TYPE TEXT;
+ALTER TABLE livraisons_archive ALTER COLUMN photo_lieu TYPE TEXT;
+ALTER TABLE livraisons_archive ALTER COLUMN signature_client TYPE TEXT;
+
+-- ===========================================
+-- Projection de lecture: URL à la place du contenu
+-- ===========================================
+CREATE VIEW livraisons_read_source AS
+SELECT
+    l.id,
+    l.commande_id,
+    l.agent_id,
+    l.client_id,
+    l.quantite,
+    l.montant_percu,
+    l.latitude_gps,
+    l.longitude_gps,
+    l.adresse_livraison,
+    CASE WHEN l.photo_blob IS NOT NULL THEN '/blobs/' || l.photo_blob ELSE l.photo_lieu END as photo_lieu,
+    CASE WHEN l.signature_blob IS NOT NULL THEN '/blobs/' || l.signature_blob ELSE l.signature_client END as signature_client,
+    l.date_livraison,
+    l.heure_livraison,
+    l.statut,
+    l.created_at,
+    l.updated_at,
+    a.nom as agent_nom,
+    a.telephone as agent_telephone,
+    a.tricycle,
+    c.nom_point_vente,
+    c.responsable,
+    c.telephone as client_telephone,
+    c.adresse as client_adresse,
+    cmd.latitude as order_latitude,
+    cmd.longitude as order_longitude,
+    cmd.montant_total
+FROM livraisons l
+LEFT JOIN agents a ON l.agent_id = a.id
+LEFT JOIN clients c ON l.client_id = c.id
+LEFT JOIN commandes cmd ON l.commande_id = cmd.id;
+
+CREATE TABLE livraisons_read AS
+SELECT * FROM livraisons_read_source WITH NO DATA;
+
+ALTER TABLE livraisons_read ADD CONSTRAINT livraisons_read_pkey PRIMARY KEY (id);
+
+CREATE INDEX IF NOT EXISTS idx_livraisons_read_created_at ON livraisons_read(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_livraisons_read_agent_id ON livraisons_read(agent_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_livraisons_read_client_id ON livraisons_read(client_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_livraisons_read_statut ON livraisons_read(statut, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_livraisons_read_date_livraison ON livraisons_read(date_livraison);
+CREATE INDEX IF NOT EXISTS idx_livraisons_read_commande_id ON livraisons_read(commande_id);
+
+INSERT INTO livraisons_read SELECT * FROM livraisons_read_source;
+
+COMMENT ON TABLE blobs IS 'Fichiers (photos, signatures) stockés hors base, identifiés par SHA-256';
+
+-- Fin migration
@@ -0,0 +1,14 @@
+-- Migration: Purge des blobs que plus rien ne référence (entretien.py)
+-- Le passage d'entretien du service web cherche, pour chaque blob, une
+-- livraison (chaude ou archivée), un envoi ou une variante qui l'utilise:
+-- index partiels sur les colonnes de référence.
+
+CREATE INDEX IF NOT EXISTS idx_livraisons_photo_blob ON livraisons(photo_blob) WHERE photo_blob IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_livraisons_signature_blob ON livraisons(signature_blob) WHERE signature_blob IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_livraisons_archive_photo_blob ON livraisons_archive(photo_blob) WHERE photo_blob IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_livraisons_archive_signature_blob ON livraisons_archive(signature_blob) WHERE signature_blob IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_uploads_blob ON uploads(blob_sha256) WHERE blob_sha256 IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_blob_variants_variante ON blob_variants(variante_sha256);
+CREATE INDEX IF NOT EXISTS idx_blobs_created_at ON blobs(created_at);
+
+-- Fin migration
@@ -0,0 +1,24 @@
+-- Migration: Cache des résultats partagé (RESULT_CACHE_BACKEND=postgres)
+-- Tables UNLOGGED: pas de WAL, contenu perdu après un crash du serveur,
+-- ce qui est sans conséquence pour un cache (voir cache.py).
+
+CREATE UNLOGGED TABLE IF NOT EXISTS result_cache (
+    key TEXT PRIMARY KEY,
+    expires_at DOUBLE PRECISION NOT NULL,
+    accessed_at DOUBLE PRECISION NOT NULL,
+    compressed BOOLEAN NOT NULL DEFAULT FALSE,
+    size INTEGER NOT NULL,
+    value BYTEA NOT NULL
+);
+
+-- Éviction LRU
+CREATE INDEX IF NOT EXISTS idx_result_cache_accessed ON result_cache(accessed_at);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS result_cache_tags (
+    tag TEXT PRIMARY KEY,
+    version BIGINT NOT NULL
+);
+
+COMMENT ON TABLE result_cache IS 'Cache des résultats calculés (rapports, KPI), clés versionnées';
+
+-- Fin migration
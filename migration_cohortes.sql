@@ -0,0 +1,98 @@
+-- Migration: Cohortes de clients (rétention hebdomadaire, voir cohortes.py)
+-- Une ligne par client: semaine d'inscription (lundi de clients.created_at),
+-- agent de la première commande et un bitmap des semaines avec commande:
+-- le bit k vaut 1 si le client a commandé k semaines après son inscription.
+-- Deux ans d'activité (104 bits) tiennent en 13 octets par client. La matrice
+-- cohorte × semaine se calcule en sommant les bits, avec n'importe quel
+-- filtre sur les clients (zone, agent).
+-- Tenu à jour par trigger sur commandes et clients; commandes annulées
+-- ignorées. Après la migration: python cohortes.py --rebuild
+
+CREATE TABLE IF NOT EXISTS clients_cohortes (
+    client_id INTEGER PRIMARY KEY REFERENCES clients(id) ON DELETE CASCADE,
+    semaine_inscription DATE NOT NULL,
+    agent_id INTEGER,                       -- agent de la première commande
+    semaines VARBIT NOT NULL DEFAULT B'',   -- bit k: commande en semaine k après l'inscription
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_clients_cohortes_semaine ON clients_cohortes(semaine_inscription);
+CREATE INDEX IF NOT EXISTS idx_clients_cohortes_agent ON clients_cohortes(agent_id, semaine_inscription);
+
+-- Marquer la semaine d'une commande dans le bitmap du client
+CREATE OR REPLACE FUNCTION cohorte_marquer(p_client_id INTEGER, p_date TIMESTAMP, p_agent_id INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    debut DATE;
+    bits VARBIT;
+    k INTEGER;
+BEGIN
+    IF p_client_id IS NULL OR p_date IS NULL THEN
+        RETURN;
+    END IF;
+
+    SELECT semaine_inscription, semaines INTO debut, bits
+    FROM clients_cohortes WHERE client_id = p_client_id FOR UPDATE;
+    IF NOT FOUND THEN
+        INSERT INTO clients_cohortes (client_id, semaine_inscription)
+        SELECT id, DATE_TRUNC('week', COALESCE(created_at, CURRENT_TIMESTAMP))::DATE
+        FROM clients WHERE id = p_client_id
+        ON CONFLICT (client_id) DO NOTHING;
+
+        SELECT semaine_inscription, semaines INTO debut, bits
+        FROM clients_cohortes WHERE client_id = p_client_id FOR UPDATE;
+        IF NOT FOUND THEN
+            RETURN;
+        END IF;
+    END IF;
+
+    k := (DATE_TRUNC('week', p_date)::DATE - debut) / 7;
+    -- Commande antérieure à l'inscription (client importé): hors cohorte
+    IF k < 0 THEN
+        RETURN;
+    END IF;
+
+    IF length(bits) <= k THEN
+        bits := bits || repeat('0', k + 1 - length(bits))::VARBIT;
+    END IF;
+
+    UPDATE clients_cohortes
+    SET semaines = set_bit(bits, k, 1),
+        agent_id = COALESCE(agent_id, p_agent_id),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE client_id = p_client_id
+    AND (get_bit(bits, k) = 0 OR length(semaines) <> length(bits) OR (agent_id IS NULL AND p_agent_id IS NOT NULL));
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION cohorte_on_commande()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.statut IS DISTINCT FROM 'annulee' THEN
+        PERFORM cohorte_marquer(NEW.client_id, COALESCE(NEW.date_commande, NEW.created_at), NEW.agent_id);
+    END IF;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION cohorte_on_client()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO clients_cohortes (client_id, semaine_inscription)
+    VALUES (NEW.id, DATE_TRUNC('week', COALESCE(NEW.created_at, CURRENT_TIMESTAMP))::DATE)
+    ON CONFLICT (client_id) DO NOTHING;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS cohorte_commande ON commandes;
+CREATE TRIGGER cohorte_commande AFTER INSERT OR UPDATE OF client_id, agent_id, statut, date_commande ON commandes
+FOR EACH ROW EXECUTE FUNCTION cohorte_on_commande();
+
+DROP TRIGGER IF EXISTS cohorte_client ON clients;
+CREATE TRIGGER cohorte_client AFTER INSERT ON clients
+FOR EACH ROW EXECUTE FUNCTION cohorte_on_client();
+
+COMMENT ON TABLE clients_cohortes IS 'Semaines avec commande de chaque client depuis son inscription (bitmap), tenu par trigger';
+
+-- Fin migration
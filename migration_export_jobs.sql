@@ -0,0 +1,37 @@
+-- Migration: Exports de rapports en arrière-plan (/rapports/exports)
+-- Les fichiers sont produits par le pool de rapports/jobs.py dans EXPORT_DIR;
+-- cette table garde l'état des tâches, visible de tous les workers.
+-- params_hash n'est renseigné que pour les périodes closes: une demande
+-- identique réutilise alors le fichier tant qu'il n'a pas expiré.
+
+CREATE TABLE IF NOT EXISTS export_jobs (
+    id VARCHAR(32) PRIMARY KEY,
+    format VARCHAR(10) NOT NULL CHECK (format IN ('csv', 'xlsx')),
+    report_type VARCHAR(30) NOT NULL,
+    start_date DATE,
+    end_date DATE,
+    params_hash CHAR(64),
+    statut VARCHAR(20) NOT NULL DEFAULT 'en_attente'
+        CHECK (statut IN ('en_attente', 'en_cours', 'termine', 'echec', 'expire')),
+    fichier TEXT,
+    taille BIGINT,
+    lignes BIGINT,
+    erreur TEXT,
+    utilisateur_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    expires_at TIMESTAMP
+);
+
+-- Recherche d'un fichier réutilisable
+CREATE INDEX IF NOT EXISTS idx_export_jobs_params ON export_jobs(params_hash, created_at DESC)
+    WHERE params_hash IS NOT NULL AND statut IN ('en_attente', 'en_cours', 'termine');
+-- Purge des fichiers expirés
+CREATE INDEX IF NOT EXISTS idx_export_jobs_expires ON export_jobs(expires_at) WHERE statut = 'termine';
+-- Métriques (débit de la dernière heure)
+CREATE INDEX IF NOT EXISTS idx_export_jobs_finished ON export_jobs(finished_at);
+
+COMMENT ON TABLE export_jobs IS 'Exports CSV/Excel produits en arrière-plan et leurs fichiers';
+
+-- Fin migration
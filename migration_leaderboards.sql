@@ -0,0 +1,116 @@
+-- Migration: Classements des agents et des clients par période
+-- Une ligne par (période, début de période, entité) avec les scores cumulés.
+-- Tenue à jour par trigger à chaque écriture sur livraisons: une livraison
+-- modifie au plus six lignes (jour, semaine, mois × agent, client). Les index
+-- sur les scores donnent le top k par un simple parcours d'index (k lignes
+-- lues), sans re-trier l'agrégat.
+-- Périodes calendaires sur la date de livraison, à défaut la date de création
+-- (axe des autres blocs du tableau de bord): jour, semaine (lundi), mois.
+-- Après la migration: python leaderboards.py --backfill
+
+CREATE TABLE IF NOT EXISTS leaderboard_scores (
+    periode VARCHAR(10) NOT NULL CHECK (periode IN ('jour', 'semaine', 'mois')),
+    debut DATE NOT NULL,
+    entite VARCHAR(10) NOT NULL CHECK (entite IN ('agent', 'client')),
+    entite_id INTEGER NOT NULL,
+    nb_livraisons INTEGER NOT NULL DEFAULT 0,
+    terminees INTEGER NOT NULL DEFAULT 0,
+    quantite BIGINT NOT NULL DEFAULT 0,
+    montant NUMERIC(14,2) NOT NULL DEFAULT 0,
+    nb_montants INTEGER NOT NULL DEFAULT 0,  -- pour la moyenne (montants renseignés)
+    PRIMARY KEY (periode, debut, entite, entite_id)
+);
+
+-- Top k: parcours de l'index dans l'ordre du score
+CREATE INDEX IF NOT EXISTS idx_leaderboard_montant
+    ON leaderboard_scores(periode, debut, entite, montant DESC, entite_id);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_terminees
+    ON leaderboard_scores(periode, debut, entite, terminees DESC, entite_id);
+
+-- Ajouter (signe = 1) ou retirer (signe = -1) une livraison des classements
+CREATE OR REPLACE FUNCTION leaderboard_apply(l livraisons, signe INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    cle RECORD;
+    jour DATE := COALESCE(l.date_livraison, l.created_at::DATE);
+BEGIN
+    IF jour IS NULL THEN
+        RETURN;
+    END IF;
+
+    FOR cle IN
+        SELECT p.periode, p.debut, e.entite, e.entite_id
+        FROM (VALUES
+            ('jour', jour),
+            ('semaine', DATE_TRUNC('week', jour)::DATE),
+            ('mois', DATE_TRUNC('month', jour)::DATE)
+        ) p(periode, debut)
+        CROSS JOIN (VALUES ('agent', l.agent_id), ('client', l.client_id)) e(entite, entite_id)
+        WHERE e.entite_id IS NOT NULL
+    LOOP
+        INSERT INTO leaderboard_scores (
+            periode, debut, entite, entite_id, nb_livraisons, terminees, quantite, montant, nb_montants
+        )
+        VALUES (
+            cle.periode, cle.debut, cle.entite, cle.entite_id,
+            signe,
+            CASE WHEN l.statut = 'terminee' THEN signe ELSE 0 END,
+            signe * COALESCE(l.quantite, 0),
+            signe * COALESCE(l.montant_percu, 0),
+            CASE WHEN l.montant_percu IS NOT NULL THEN signe ELSE 0 END
+        )
+        ON CONFLICT (periode, debut, entite, entite_id)
+        DO UPDATE SET
+            nb_livraisons = leaderboard_scores.nb_livraisons + EXCLUDED.nb_livraisons,
+            terminees = leaderboard_scores.terminees + EXCLUDED.terminees,
+            quantite = leaderboard_scores.quantite + EXCLUDED.quantite,
+            montant = leaderboard_scores.montant + EXCLUDED.montant,
+            nb_montants = leaderboard_scores.nb_montants + EXCLUDED.nb_montants;
+
+        IF signe < 0 THEN
+            DELETE FROM leaderboard_scores s
+            WHERE s.periode = cle.periode AND s.debut = cle.debut
+            AND s.entite = cle.entite AND s.entite_id = cle.entite_id
+            AND s.nb_livraisons = 0;
+        END IF;
+    END LOOP;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION leaderboard_on_livraison()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        -- Déplacement vers l'archive: la livraison reste comptée
+        IF COALESCE(current_setting('essivi.archivage', true), '') <> 'on' THEN
+            PERFORM leaderboard_apply(OLD, -1);
+        END IF;
+        RETURN OLD;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        PERFORM leaderboard_apply(OLD, -1);
+    END IF;
+    PERFORM leaderboard_apply(NEW, 1);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS leaderboard_insert_delete ON livraisons;
+CREATE TRIGGER leaderboard_insert_delete AFTER INSERT OR DELETE ON livraisons
+FOR EACH ROW EXECUTE FUNCTION leaderboard_on_livraison();
+
+DROP TRIGGER IF EXISTS leaderboard_update ON livraisons;
+CREATE TRIGGER leaderboard_update AFTER UPDATE ON livraisons
+FOR EACH ROW
+WHEN (OLD.date_livraison IS DISTINCT FROM NEW.date_livraison
+      OR OLD.created_at IS DISTINCT FROM NEW.created_at
+      OR OLD.agent_id IS DISTINCT FROM NEW.agent_id
+      OR OLD.client_id IS DISTINCT FROM NEW.client_id
+      OR OLD.statut IS DISTINCT FROM NEW.statut
+      OR OLD.quantite IS DISTINCT FROM NEW.quantite
+      OR OLD.montant_percu IS DISTINCT FROM NEW.montant_percu)
+EXECUTE FUNCTION leaderboard_on_livraison();
+
+COMMENT ON TABLE leaderboard_scores IS 'Classements agents / clients par jour, semaine et mois, tenus par trigger';
+
+-- Fin migration
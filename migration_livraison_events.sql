@@ -0,0 +1,50 @@
+-- Migration: Journal des événements de livraison
+-- Table en ajout seul, alimentée par les routes (livraisons/events.py).
+-- Pas de clé étrangère: l'historique reste lisible après suppression ou
+-- archivage de la livraison.
+
+CREATE TABLE IF NOT EXISTS livraison_events (
+    id BIGSERIAL PRIMARY KEY,
+    livraison_id INTEGER NOT NULL,
+    commande_id INTEGER,
+    type_evenement VARCHAR(30) NOT NULL,
+    statut VARCHAR(20),
+    agent_id INTEGER,
+    latitude DECIMAL(9,6),
+    longitude DECIMAL(9,6),
+    details TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Historique d'une livraison: lecture d'une plage de l'index
+CREATE INDEX IF NOT EXISTS idx_livraison_events_livraison ON livraison_events(livraison_id, created_at, id);
+
+-- Reprise de l'existant: on ne connaît que la création et l'état courant
+INSERT INTO livraison_events (livraison_id, commande_id, type_evenement, statut, agent_id, created_at)
+SELECT l.id, l.commande_id, 'creee', 'en_cours', NULL, l.created_at
+FROM livraisons l
+WHERE NOT EXISTS (SELECT 1 FROM livraison_events e WHERE e.livraison_id = l.id);
+
+INSERT INTO livraison_events (livraison_id, commande_id, type_evenement, statut, agent_id, created_at)
+SELECT l.id, l.commande_id, 'agent_assigne', l.statut, l.agent_id, COALESCE(l.updated_at, l.created_at)
+FROM livraisons l
+WHERE l.agent_id IS NOT NULL
+AND NOT EXISTS (
+    SELECT 1 FROM livraison_events e
+    WHERE e.livraison_id = l.id AND e.type_evenement = 'agent_assigne'
+);
+
+INSERT INTO livraison_events (livraison_id, commande_id, type_evenement, statut, agent_id, created_at)
+SELECT l.id, l.commande_id,
+       CASE WHEN l.statut = 'probleme' THEN 'probleme' ELSE 'livree' END,
+       l.statut, l.agent_id, COALESCE(l.updated_at, l.created_at)
+FROM livraisons l
+WHERE l.statut IN ('livree', 'terminee', 'probleme')
+AND NOT EXISTS (
+    SELECT 1 FROM livraison_events e
+    WHERE e.livraison_id = l.id AND e.type_evenement IN ('livree', 'probleme')
+);
+
+COMMENT ON TABLE livraison_events IS 'Journal (ajout seul) des étapes de chaque livraison';
+
+-- Fin migration
@@ -0,0 +1,145 @@
+-- Migration: Modèle de lecture dénormalisé pour les livraisons
+-- La liste et le détail (/livraisons/, /livraisons/<id>) lisent une seule
+-- table au lieu de joindre livraisons, agents, clients et commandes à chaque
+-- requête. Les triggers ci-dessous maintiennent la projection à jour;
+-- check_livraisons_read_model.py la compare à la source.
+
+-- Définition unique de la projection: utilisée par les triggers, le
+-- remplissage initial et l'outil de vérification
+CREATE OR REPLACE VIEW livraisons_read_source AS
+SELECT
+    l.id,
+    l.commande_id,
+    l.agent_id,
+    l.client_id,
+    l.quantite,
+    l.montant_percu,
+    l.latitude_gps,
+    l.longitude_gps,
+    l.adresse_livraison,
+    l.photo_lieu,
+    l.signature_client,
+    l.date_livraison,
+    l.heure_livraison,
+    l.statut,
+    l.created_at,
+    l.updated_at,
+    a.nom as agent_nom,
+    a.telephone as agent_telephone,
+    a.tricycle,
+    c.nom_point_vente,
+    c.responsable,
+    c.telephone as client_telephone,
+    c.adresse as client_adresse,
+    cmd.latitude as order_latitude,
+    cmd.longitude as order_longitude,
+    cmd.montant_total
+FROM livraisons l
+LEFT JOIN agents a ON l.agent_id = a.id
+LEFT JOIN clients c ON l.client_id = c.id
+LEFT JOIN commandes cmd ON l.commande_id = cmd.id;
+
+CREATE TABLE IF NOT EXISTS livraisons_read AS
+SELECT * FROM livraisons_read_source WITH NO DATA;
+
+ALTER TABLE livraisons_read DROP CONSTRAINT IF EXISTS livraisons_read_pkey;
+ALTER TABLE livraisons_read ADD CONSTRAINT livraisons_read_pkey PRIMARY KEY (id);
+
+-- Index des filtres et du tri de /livraisons/
+CREATE INDEX IF NOT EXISTS idx_livraisons_read_created_at ON livraisons_read(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_livraisons_read_agent_id ON livraisons_read(agent_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_livraisons_read_client_id ON livraisons_read(client_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_livraisons_read_statut ON livraisons_read(statut, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_livraisons_read_date_livraison ON livraisons_read(date_livraison);
+CREATE INDEX IF NOT EXISTS idx_livraisons_read_commande_id ON livraisons_read(commande_id);
+
+-- Recalculer la projection d'une livraison
+CREATE OR REPLACE FUNCTION livraisons_read_refresh(p_id INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    DELETE FROM livraisons_read WHERE id = p_id;
+    INSERT INTO livraisons_read SELECT * FROM livraisons_read_source WHERE id = p_id;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION livraisons_read_on_livraison()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM livraisons_read WHERE id = OLD.id;
+        RETURN OLD;
+    END IF;
+    PERFORM livraisons_read_refresh(NEW.id);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION livraisons_read_on_agent()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE livraisons_read
+    SET agent_nom = NEW.nom, agent_telephone = NEW.telephone, tricycle = NEW.tricycle
+    WHERE agent_id = NEW.id;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION livraisons_read_on_client()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE livraisons_read
+    SET nom_point_vente = NEW.nom_point_vente, responsable = NEW.responsable,
+        client_telephone = NEW.telephone, client_adresse = NEW.adresse
+    WHERE client_id = NEW.id;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION livraisons_read_on_commande()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE livraisons_read
+    SET order_latitude = NEW.latitude, order_longitude = NEW.longitude,
+        montant_total = NEW.montant_total
+    WHERE commande_id = NEW.id;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS livraisons_read_sync ON livraisons;
+CREATE TRIGGER livraisons_read_sync AFTER INSERT OR UPDATE OR DELETE ON livraisons
+FOR EACH ROW EXECUTE FUNCTION livraisons_read_on_livraison();
+
+-- Les mises à jour de position GPS des agents (fréquentes) ne touchent pas la projection
+DROP TRIGGER IF EXISTS livraisons_read_sync ON agents;
+CREATE TRIGGER livraisons_read_sync AFTER UPDATE ON agents
+FOR EACH ROW
+WHEN (OLD.nom IS DISTINCT FROM NEW.nom
+      OR OLD.telephone IS DISTINCT FROM NEW.telephone
+      OR OLD.tricycle IS DISTINCT FROM NEW.tricycle)
+EXECUTE FUNCTION livraisons_read_on_agent();
+
+DROP TRIGGER IF EXISTS livraisons_read_sync ON clients;
+CREATE TRIGGER livraisons_read_sync AFTER UPDATE ON clients
+FOR EACH ROW
+WHEN (OLD.nom_point_vente IS DISTINCT FROM NEW.nom_point_vente
+      OR OLD.responsable IS DISTINCT FROM NEW.responsable
+      OR OLD.telephone IS DISTINCT FROM NEW.telephone
+      OR OLD.adresse IS DISTINCT FROM NEW.adresse)
+EXECUTE FUNCTION livraisons_read_on_client();
+
+DROP TRIGGER IF EXISTS livraisons_read_sync ON commandes;
+CREATE TRIGGER livraisons_read_sync AFTER UPDATE ON commandes
+FOR EACH ROW
+WHEN (OLD.latitude IS DISTINCT FROM NEW.latitude
+      OR OLD.longitude IS DISTINCT FROM NEW.longitude
+      OR OLD.montant_total IS DISTINCT FROM NEW.montant_total)
+EXECUTE FUNCTION livraisons_read_on_commande();
+
+-- Remplissage initial
+TRUNCATE livraisons_read;
+INSERT INTO livraisons_read SELECT * FROM livraisons_read_source;
+
+COMMENT ON TABLE livraisons_read IS 'Projection dénormalisée de livraisons (+ agent, client, commande) pour les lectures';
+
+-- Fin migration
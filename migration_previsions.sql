@@ -0,0 +1,22 @@
+-- Migration: Prévision de la prochaine commande de chaque client (previsions.py)
+-- Lissage exponentiel des intervalles entre commandes et des quantités
+-- commandées (commande_details), recalculé chaque nuit pour tous les clients
+-- ayant au moins deux jours de commande sur l'historique.
+
+CREATE TABLE IF NOT EXISTS clients_previsions (
+    client_id INTEGER PRIMARY KEY REFERENCES clients(id) ON DELETE CASCADE,
+    nb_commandes INTEGER NOT NULL,          -- jours de commande pris en compte
+    derniere_commande DATE NOT NULL,
+    intervalle_jours NUMERIC(8,2) NOT NULL, -- intervalle lissé entre deux commandes
+    ecart_jours NUMERIC(8,2) NOT NULL,      -- écart absolu moyen lissé (incertitude)
+    quantite_prevue NUMERIC(10,2),
+    montant_prevu NUMERIC(12,2),
+    prochaine_commande DATE NOT NULL,
+    computed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_clients_previsions_prochaine ON clients_previsions(prochaine_commande);
+
+COMMENT ON TABLE clients_previsions IS 'Date et quantité attendues de la prochaine commande de chaque client';
+
+-- Fin migration
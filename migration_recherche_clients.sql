@@ -0,0 +1,27 @@
+-- Migration: Recherche approximative des clients (index trigrammes)
+-- Sert /clients/search?q= et le filtre `zone` de /cartographie/clients/geo
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Texte recherché pour un client. La fonction doit être IMMUTABLE pour être
+-- indexée: concat_ws() ne l'est pas, d'où les COALESCE explicites.
+CREATE OR REPLACE FUNCTION clients_search_document(
+    nom_point_vente TEXT, responsable TEXT, telephone TEXT, adresse TEXT
+)
+RETURNS TEXT AS $$
+    SELECT lower(
+        COALESCE(nom_point_vente, '') || ' ' ||
+        COALESCE(responsable, '') || ' ' ||
+        COALESCE(telephone, '') || ' ' ||
+        COALESCE(adresse, '')
+    )
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- L'expression doit être identique à celle utilisée dans clients/routes.py
+CREATE INDEX IF NOT EXISTS idx_clients_search_trgm ON clients
+USING GIN (clients_search_document(nom_point_vente, responsable, telephone, adresse) gin_trgm_ops);
+
+-- ILIKE '%zone%' sur l'adresse passe par cet index au lieu d'un parcours séquentiel
+CREATE INDEX IF NOT EXISTS idx_clients_adresse_trgm ON clients USING GIN (adresse gin_trgm_ops);
+
+-- Fin migration
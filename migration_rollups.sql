@@ -0,0 +1,101 @@
+-- Migration: Agrégat journalier des livraisons
+-- Une ligne par (jour de création, date de livraison, agent, client, statut)
+-- avec nombre, quantité et montant. Tenu à jour par trigger à chaque
+-- insertion / modification / suppression; les tableaux de bord et rapports
+-- le lisent au lieu de réagréger livraisons.
+-- Les déplacements vers l'archive (essivi.archivage = 'on') ne retirent rien:
+-- l'agrégat couvre aussi l'historique archivé.
+-- Après la migration: python rollups.py --backfill
+
+CREATE TABLE IF NOT EXISTS livraisons_rollup_daily (
+    jour DATE NOT NULL,                    -- DATE(created_at)
+    jour_livraison DATE,                   -- date_livraison
+    agent_id INTEGER NOT NULL DEFAULT 0,   -- 0 = sans agent
+    client_id INTEGER NOT NULL DEFAULT 0,  -- 0 = sans client
+    statut VARCHAR(20) NOT NULL,
+    nb_livraisons INTEGER NOT NULL DEFAULT 0,
+    quantite BIGINT NOT NULL DEFAULT 0,
+    montant NUMERIC(14,2) NOT NULL DEFAULT 0
+);
+
+-- Clé de l'agrégat (date_livraison peut être NULL)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_livraisons_rollup_daily_cle ON livraisons_rollup_daily (
+    jour, (COALESCE(jour_livraison, DATE '1970-01-01')), agent_id, client_id, statut
+);
+CREATE INDEX IF NOT EXISTS idx_livraisons_rollup_daily_livraison ON livraisons_rollup_daily(jour_livraison);
+CREATE INDEX IF NOT EXISTS idx_livraisons_rollup_daily_agent ON livraisons_rollup_daily(agent_id, jour);
+CREATE INDEX IF NOT EXISTS idx_livraisons_rollup_daily_client ON livraisons_rollup_daily(client_id, jour);
+
+-- Ajouter (signe = 1) ou retirer (signe = -1) une livraison de l'agrégat
+CREATE OR REPLACE FUNCTION livraisons_rollup_apply(l livraisons, signe INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO livraisons_rollup_daily (
+        jour, jour_livraison, agent_id, client_id, statut, nb_livraisons, quantite, montant
+    )
+    VALUES (
+        DATE(COALESCE(l.created_at, CURRENT_TIMESTAMP)),
+        l.date_livraison,
+        COALESCE(l.agent_id, 0),
+        COALESCE(l.client_id, 0),
+        COALESCE(l.statut, 'inconnu'),
+        signe,
+        signe * COALESCE(l.quantite, 0),
+        signe * COALESCE(l.montant_percu, 0)
+    )
+    ON CONFLICT (jour, (COALESCE(jour_livraison, DATE '1970-01-01')), agent_id, client_id, statut)
+    DO UPDATE SET
+        nb_livraisons = livraisons_rollup_daily.nb_livraisons + EXCLUDED.nb_livraisons,
+        quantite = livraisons_rollup_daily.quantite + EXCLUDED.quantite,
+        montant = livraisons_rollup_daily.montant + EXCLUDED.montant;
+
+    IF signe < 0 THEN
+        DELETE FROM livraisons_rollup_daily r
+        WHERE r.jour = DATE(COALESCE(l.created_at, CURRENT_TIMESTAMP))
+        AND r.jour_livraison IS NOT DISTINCT FROM l.date_livraison
+        AND r.agent_id = COALESCE(l.agent_id, 0)
+        AND r.client_id = COALESCE(l.client_id, 0)
+        AND r.statut = COALESCE(l.statut, 'inconnu')
+        AND r.nb_livraisons = 0;
+    END IF;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION livraisons_rollup_on_livraison()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        -- Déplacement vers l'archive: la livraison reste comptée
+        IF COALESCE(current_setting('essivi.archivage', true), '') <> 'on' THEN
+            PERFORM livraisons_rollup_apply(OLD, -1);
+        END IF;
+        RETURN OLD;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        PERFORM livraisons_rollup_apply(OLD, -1);
+    END IF;
+    PERFORM livraisons_rollup_apply(NEW, 1);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS livraisons_rollup_insert_delete ON livraisons;
+CREATE TRIGGER livraisons_rollup_insert_delete AFTER INSERT OR DELETE ON livraisons
+FOR EACH ROW EXECUTE FUNCTION livraisons_rollup_on_livraison();
+
+-- Seules les colonnes agrégées déclenchent une mise à jour
+DROP TRIGGER IF EXISTS livraisons_rollup_update ON livraisons;
+CREATE TRIGGER livraisons_rollup_update AFTER UPDATE ON livraisons
+FOR EACH ROW
+WHEN (OLD.created_at IS DISTINCT FROM NEW.created_at
+      OR OLD.date_livraison IS DISTINCT FROM NEW.date_livraison
+      OR OLD.agent_id IS DISTINCT FROM NEW.agent_id
+      OR OLD.client_id IS DISTINCT FROM NEW.client_id
+      OR OLD.statut IS DISTINCT FROM NEW.statut
+      OR OLD.quantite IS DISTINCT FROM NEW.quantite
+      OR OLD.montant_percu IS DISTINCT FROM NEW.montant_percu)
+EXECUTE FUNCTION livraisons_rollup_on_livraison();
+
+COMMENT ON TABLE livraisons_rollup_daily IS 'Agrégat journalier des livraisons (jour, agent, client, statut), tenu par trigger';
+
+-- Fin migration
@@ -0,0 +1,119 @@
+-- Migration: Histogrammes journaliers des livraisons (percentiles approchés)
+-- Pour chaque (date de livraison, agent, mesure), le nombre de livraisons par
+-- classe de valeur. Classes géométriques de raison 1.08: un percentile lu
+-- dans l'histogramme est à ±4 % de la valeur exacte. Les histogrammes
+-- s'additionnent: n'importe quelle période se calcule en sommant les jours
+-- (voir sketches.py). Tenus à jour par trigger, comme livraisons_rollup_daily;
+-- les déplacements vers l'archive ne retirent rien.
+-- Mesures: montant (montant_percu), quantite, duree (minutes entre la
+-- création et la livraison effective).
+-- Après la migration: python sketches.py --backfill
+
+CREATE TABLE IF NOT EXISTS livraisons_sketch_daily (
+    jour_livraison DATE NOT NULL,
+    agent_id INTEGER NOT NULL DEFAULT 0,   -- 0 = sans agent
+    metrique VARCHAR(20) NOT NULL CHECK (metrique IN ('montant', 'quantite', 'duree')),
+    classe SMALLINT NOT NULL,              -- 0 = valeur nulle ou négative
+    n INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (jour_livraison, agent_id, metrique, classe)
+);
+
+CREATE INDEX IF NOT EXISTS idx_livraisons_sketch_daily_metrique ON livraisons_sketch_daily(metrique, jour_livraison);
+
+-- Classe d'une valeur: 1 + floor(log_1.08(v)), valeurs < 1 dans la classe 1,
+-- plafonnée à 255 (au-delà de 1.08^254 ≈ 3e8)
+CREATE OR REPLACE FUNCTION sketch_classe(v NUMERIC)
+RETURNS SMALLINT AS $$
+    SELECT CASE
+        WHEN v IS NULL THEN NULL
+        WHEN v <= 0 THEN 0
+        ELSE LEAST(255, 1 + FLOOR(LN(GREATEST(v, 1)) / LN(1.08)))::SMALLINT
+    END
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Durée de livraison en minutes (NULL si la livraison n'est pas terminée)
+CREATE OR REPLACE FUNCTION livraisons_duree_minutes(
+    statut VARCHAR, created_at TIMESTAMP, date_livraison DATE, heure_livraison TIME
+)
+RETURNS NUMERIC AS $$
+    SELECT CASE
+        WHEN statut IN ('terminee', 'livree')
+             AND created_at IS NOT NULL AND date_livraison IS NOT NULL AND heure_livraison IS NOT NULL
+             AND date_livraison + heure_livraison >= created_at
+        THEN (EXTRACT(EPOCH FROM (date_livraison + heure_livraison) - created_at) / 60)::NUMERIC
+    END
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Ajouter (signe = 1) ou retirer (signe = -1) une livraison des histogrammes
+CREATE OR REPLACE FUNCTION livraisons_sketch_apply(l livraisons, signe INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    m RECORD;
+BEGIN
+    IF l.date_livraison IS NULL THEN
+        RETURN;
+    END IF;
+
+    FOR m IN
+        SELECT metrique, sketch_classe(valeur) AS classe
+        FROM (VALUES
+            ('montant', l.montant_percu::NUMERIC),
+            ('quantite', l.quantite::NUMERIC),
+            ('duree', livraisons_duree_minutes(l.statut, l.created_at, l.date_livraison, l.heure_livraison))
+        ) v(metrique, valeur)
+        WHERE valeur IS NOT NULL
+    LOOP
+        INSERT INTO livraisons_sketch_daily (jour_livraison, agent_id, metrique, classe, n)
+        VALUES (l.date_livraison, COALESCE(l.agent_id, 0), m.metrique, m.classe, signe)
+        ON CONFLICT (jour_livraison, agent_id, metrique, classe)
+        DO UPDATE SET n = livraisons_sketch_daily.n + EXCLUDED.n;
+
+        IF signe < 0 THEN
+            DELETE FROM livraisons_sketch_daily s
+            WHERE s.jour_livraison = l.date_livraison
+            AND s.agent_id = COALESCE(l.agent_id, 0)
+            AND s.metrique = m.metrique
+            AND s.classe = m.classe
+            AND s.n = 0;
+        END IF;
+    END LOOP;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION livraisons_sketch_on_livraison()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        -- Déplacement vers l'archive: la livraison reste comptée
+        IF COALESCE(current_setting('essivi.archivage', true), '') <> 'on' THEN
+            PERFORM livraisons_sketch_apply(OLD, -1);
+        END IF;
+        RETURN OLD;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        PERFORM livraisons_sketch_apply(OLD, -1);
+    END IF;
+    PERFORM livraisons_sketch_apply(NEW, 1);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS livraisons_sketch_insert_delete ON livraisons;
+CREATE TRIGGER livraisons_sketch_insert_delete AFTER INSERT OR DELETE ON livraisons
+FOR EACH ROW EXECUTE FUNCTION livraisons_sketch_on_livraison();
+
+DROP TRIGGER IF EXISTS livraisons_sketch_update ON livraisons;
+CREATE TRIGGER livraisons_sketch_update AFTER UPDATE ON livraisons
+FOR EACH ROW
+WHEN (OLD.created_at IS DISTINCT FROM NEW.created_at
+      OR OLD.date_livraison IS DISTINCT FROM NEW.date_livraison
+      OR OLD.heure_livraison IS DISTINCT FROM NEW.heure_livraison
+      OR OLD.agent_id IS DISTINCT FROM NEW.agent_id
+      OR OLD.statut IS DISTINCT FROM NEW.statut
+      OR OLD.quantite IS DISTINCT FROM NEW.quantite
+      OR OLD.montant_percu IS DISTINCT FROM NEW.montant_percu)
+EXECUTE FUNCTION livraisons_sketch_on_livraison();
+
+COMMENT ON TABLE livraisons_sketch_daily IS 'Histogrammes journaliers (montant, quantité, durée) par agent, tenus par trigger';
+
+-- Fin migration
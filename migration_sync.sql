@@ -0,0 +1,124 @@
+-- Migration: Synchronisation différentielle (/sync) pour les applications mobiles
+-- Les applications envoient le watermark reçu lors de la synchronisation
+-- précédente et ne récupèrent que les lignes modifiées depuis, via updated_at.
+
+-- ===========================================
+-- updated_at sur toutes les tables synchronisées
+-- ===========================================
+ALTER TABLE livraisons ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE commandes ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE produits ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE stocks ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE notifications ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+-- Les tables d'archive gardent les mêmes colonnes que les tables chaudes
+ALTER TABLE livraisons_archive ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE commandes_archive ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+DROP TRIGGER IF EXISTS update_livraisons_updated_at ON livraisons;
+CREATE TRIGGER update_livraisons_updated_at BEFORE UPDATE ON livraisons
+FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+DROP TRIGGER IF EXISTS update_commandes_updated_at ON commandes;
+CREATE TRIGGER update_commandes_updated_at BEFORE UPDATE ON commandes
+FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+DROP TRIGGER IF EXISTS update_produits_updated_at ON produits;
+CREATE TRIGGER update_produits_updated_at BEFORE UPDATE ON produits
+FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+DROP TRIGGER IF EXISTS update_stocks_updated_at ON stocks;
+CREATE TRIGGER update_stocks_updated_at BEFORE UPDATE ON stocks
+FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+DROP TRIGGER IF EXISTS update_notifications_updated_at ON notifications;
+CREATE TRIGGER update_notifications_updated_at BEFORE UPDATE ON notifications
+FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Index utilisés par /sync (filtre du rôle + updated_at)
+CREATE INDEX IF NOT EXISTS idx_livraisons_updated_at ON livraisons(updated_at);
+CREATE INDEX IF NOT EXISTS idx_livraisons_agent_updated_at ON livraisons(agent_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_livraisons_client_updated_at ON livraisons(client_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_commandes_updated_at ON commandes(updated_at);
+CREATE INDEX IF NOT EXISTS idx_commandes_agent_updated_at ON commandes(agent_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_commandes_client_updated_at ON commandes(client_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_notifications_utilisateur_updated_at ON notifications(utilisateur_id, updated_at);
+
+-- ===========================================
+-- Tombstones: lignes supprimées (ou sorties du périmètre d'un agent)
+-- ===========================================
+CREATE TABLE IF NOT EXISTS sync_tombstones (
+    id BIGSERIAL PRIMARY KEY,
+    table_name VARCHAR(30) NOT NULL,
+    row_id INTEGER NOT NULL,
+    agent_id INTEGER,
+    client_id INTEGER,
+    utilisateur_id INTEGER,
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_deleted_at ON sync_tombstones(deleted_at);
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_agent ON sync_tombstones(agent_id, deleted_at);
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_client ON sync_tombstones(client_id, deleted_at);
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_utilisateur ON sync_tombstones(utilisateur_id, deleted_at);
+
+-- Les lignes déplacées par archivage.py ne sont pas des suppressions:
+-- le job positionne essivi.archivage = 'on' pour sa transaction.
+CREATE OR REPLACE FUNCTION sync_record_tombstone()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF COALESCE(current_setting('essivi.archivage', true), '') = 'on' THEN
+        RETURN OLD;
+    END IF;
+
+    IF TG_TABLE_NAME = 'livraisons' THEN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO sync_tombstones (table_name, row_id, agent_id, client_id)
+            VALUES ('livraisons', OLD.id, OLD.agent_id, OLD.client_id);
+        ELSIF OLD.agent_id IS NOT NULL AND OLD.agent_id IS DISTINCT FROM NEW.agent_id THEN
+            -- Livraison réassignée: elle disparaît de la liste de l'ancien agent
+            INSERT INTO sync_tombstones (table_name, row_id, agent_id)
+            VALUES ('livraisons', OLD.id, OLD.agent_id);
+        END IF;
+    ELSIF TG_TABLE_NAME = 'commandes' THEN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO sync_tombstones (table_name, row_id, agent_id, client_id)
+            VALUES ('commandes', OLD.id, OLD.agent_id, OLD.client_id);
+        ELSIF OLD.agent_id IS NOT NULL AND OLD.agent_id IS DISTINCT FROM NEW.agent_id THEN
+            INSERT INTO sync_tombstones (table_name, row_id, agent_id)
+            VALUES ('commandes', OLD.id, OLD.agent_id);
+        END IF;
+    ELSIF TG_TABLE_NAME = 'notifications' THEN
+        INSERT INTO sync_tombstones (table_name, row_id, utilisateur_id)
+        VALUES ('notifications', OLD.id, OLD.utilisateur_id);
+    ELSIF TG_TABLE_NAME = 'produits' THEN
+        INSERT INTO sync_tombstones (table_name, row_id)
+        VALUES ('produits', OLD.id);
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS sync_tombstone_livraisons ON livraisons;
+CREATE TRIGGER sync_tombstone_livraisons AFTER DELETE OR UPDATE OF agent_id ON livraisons
+FOR EACH ROW EXECUTE FUNCTION sync_record_tombstone();
+
+DROP TRIGGER IF EXISTS sync_tombstone_commandes ON commandes;
+CREATE TRIGGER sync_tombstone_commandes AFTER DELETE OR UPDATE OF agent_id ON commandes
+FOR EACH ROW EXECUTE FUNCTION sync_record_tombstone();
+
+DROP TRIGGER IF EXISTS sync_tombstone_notifications ON notifications;
+CREATE TRIGGER sync_tombstone_notifications AFTER DELETE ON notifications
+FOR EACH ROW EXECUTE FUNCTION sync_record_tombstone();
+
+DROP TRIGGER IF EXISTS sync_tombstone_produits ON produits;
+CREATE TRIGGER sync_tombstone_produits AFTER DELETE ON produits
+FOR EACH ROW EXECUTE FUNCTION sync_record_tombstone();
+
+COMMENT ON TABLE sync_tombstones IS 'Suppressions à propager aux applications mobiles via /sync';
+
+-- Fin migration
@@ -0,0 +1,42 @@
+-- Migration: Envoi des photos de livraison par morceaux (reprise possible)
+-- Les morceaux sont assemblés sur disque (blobs/uploads.py); la position
+-- reçue est gardée ici pour reprendre l'envoi après une coupure réseau.
+-- Les variantes réduites (medium, thumb) sont elles-mêmes des blobs.
+
+CREATE TABLE IF NOT EXISTS uploads (
+    id VARCHAR(32) PRIMARY KEY,
+    livraison_id INTEGER NOT NULL REFERENCES livraisons(id) ON DELETE CASCADE,
+    champ VARCHAR(20) NOT NULL DEFAULT 'photo' CHECK (champ IN ('photo', 'signature')),
+    taille_totale BIGINT NOT NULL CHECK (taille_totale > 0),
+    sha256_attendu CHAR(64) NOT NULL,
+    content_type VARCHAR(100),
+    recu BIGINT NOT NULL DEFAULT 0,
+    statut VARCHAR(20) NOT NULL DEFAULT 'en_cours' CHECK (statut IN ('en_cours', 'termine', 'echec')),
+    blob_sha256 CHAR(64) REFERENCES blobs(sha256),
+    utilisateur_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_uploads_livraison ON uploads(livraison_id);
+-- Purge des envois abandonnés
+CREATE INDEX IF NOT EXISTS idx_uploads_en_cours ON uploads(updated_at) WHERE statut = 'en_cours';
+
+DROP TRIGGER IF EXISTS update_uploads_updated_at ON uploads;
+CREATE TRIGGER update_uploads_updated_at BEFORE UPDATE ON uploads
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+CREATE TABLE IF NOT EXISTS blob_variants (
+    sha256 CHAR(64) NOT NULL REFERENCES blobs(sha256) ON DELETE CASCADE,
+    variante VARCHAR(20) NOT NULL CHECK (variante IN ('medium', 'thumb')),
+    variante_sha256 CHAR(64) NOT NULL REFERENCES blobs(sha256),
+    largeur INTEGER,
+    hauteur INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sha256, variante)
+);
+
+COMMENT ON TABLE uploads IS 'Envois de fichiers par morceaux, rattachés à une livraison';
+COMMENT ON TABLE blob_variants IS 'Versions réduites des photos (medium, thumb)';
+
+-- Fin migration
@@ -0,0 +1,66 @@
+-- Migration: Vues matérialisées des rapports de performance et de couverture
+-- Les rapports de performance par jour de livraison et de couverture des zones
+-- lisent ces vues au lieu d'agréger toutes les livraisons à chaque appel. Grain journalier:
+-- les filtres de période restent possibles (et paramétrés).
+-- Rafraîchies par vues.py (cron et POST /rapports/vues); la date du dernier
+-- rafraîchissement est gardée dans mv_refresh_log et renvoyée avec les rapports.
+-- À appliquer après migration_archivage.sql (l'archive est incluse) et
+-- migration_rollups.sql.
+
+-- Par jour de création, agent et statut: /rapports/performance-agents et
+-- /rapports/statistiques-par-statut lisent l'agrégat livraisons_rollup_daily
+-- (migration_rollups.sql), tenu à jour par trigger. La vue qui le doublait est
+-- retirée des bases où elle a été créée.
+DROP MATERIALIZED VIEW IF EXISTS mv_livraisons_agent_statut_jour;
+
+-- Par jour de livraison, agent et client: /statistiques/performance/agents,
+-- /cartographie/zones/couverture
+DROP MATERIALIZED VIEW IF EXISTS mv_livraisons_agent_client_jour;
+CREATE MATERIALIZED VIEW mv_livraisons_agent_client_jour AS
+SELECT
+    l.date_livraison AS jour_livraison,
+    l.agent_id,
+    COALESCE(l.client_id, 0) AS client_id,
+    COUNT(*) AS nb_livraisons,
+    COALESCE(SUM(l.quantite), 0) AS quantite,
+    COALESCE(SUM(l.montant_percu), 0) AS montant,
+    -- Pour la moyenne: AVG ignore les montants absents
+    COUNT(l.montant_percu) AS nb_montants,
+    MIN(l.latitude_gps) AS lat_min,
+    MAX(l.latitude_gps) AS lat_max,
+    MIN(l.longitude_gps) AS lon_min,
+    MAX(l.longitude_gps) AS lon_max
+FROM (
+    SELECT date_livraison, agent_id, client_id, quantite, montant_percu, latitude_gps, longitude_gps
+    FROM livraisons
+    UNION ALL
+    SELECT date_livraison, agent_id, client_id, quantite, montant_percu, latitude_gps, longitude_gps
+    FROM livraisons_archive
+) l
+WHERE l.date_livraison IS NOT NULL AND l.agent_id IS NOT NULL
+GROUP BY 1, 2, 3
+WITH DATA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_agent_client_jour_pk
+    ON mv_livraisons_agent_client_jour(jour_livraison, agent_id, client_id);
+CREATE INDEX IF NOT EXISTS idx_mv_agent_client_jour_agent
+    ON mv_livraisons_agent_client_jour(agent_id, jour_livraison);
+
+-- Dernier rafraîchissement de chaque vue
+CREATE TABLE IF NOT EXISTS mv_refresh_log (
+    vue VARCHAR(100) PRIMARY KEY,
+    refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    duree_ms INTEGER,
+    concurrent BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+INSERT INTO mv_refresh_log (vue, refreshed_at)
+VALUES
+    ('mv_livraisons_agent_client_jour', CURRENT_TIMESTAMP)
+ON CONFLICT (vue) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at, duree_ms = NULL, concurrent = FALSE;
+DELETE FROM mv_refresh_log WHERE vue = 'mv_livraisons_agent_statut_jour';
+
+COMMENT ON MATERIALIZED VIEW mv_livraisons_agent_client_jour IS 'Livraisons par jour de livraison, agent et client (vues.py)';
+COMMENT ON TABLE mv_refresh_log IS 'Date du dernier rafraîchissement des vues matérialisées';
+
+-- Fin migration
@@ -281,6 +281,23 @@ def clear_notifications():
     except Exception as e:
         return {"error": f"Server error: {str(e)}"}, 500
 
+def notification_stats():
+    """Compteurs des notifications admin du worker courant"""
+    total = len(active_admin_notifications)
+    unread = len([n for n in active_admin_notifications if not n.get("read")])
+    
+    # Compter par type
+    by_type = {}
+    for notif in active_admin_notifications:
+        notif_type = notif.get("type", "unknown")
+        by_type[notif_type] = by_type.get(notif_type, 0) + 1
+    
+    return {
+        "total": total,
+        "unread": unread,
+        "by_type": by_type
+    }
+
 @notifications_bp.route("/admin/stats", methods=['GET'])
 @jwt_required()
 def get_notification_stats():
@@ -294,20 +311,7 @@ def get_notification_stats():
         if user_role != "admin":
             return {"error": "Unauthorized"}, 403
         
-        total = len(active_admin_notifications)
-        unread = len([n for n in active_admin_notifications if not n.get("read")])
-        
-        # Compter par type
-        by_type = {}
-        for notif in active_admin_notifications:
-            notif_type = notif.get("type", "unknown")
-            by_type[notif_type] = by_type.get(notif_type, 0) + 1
-        
-        return {
-            "total": total,
-            "unread": unread,
-            "by_type": by_type
-        }, 200
+        return notification_stats(), 200
         
     except Exception as e:
         return {"error": f"Server error: {str(e)}"}, 500
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Prévision de la prochaine commande de chaque client (clients_previsions)
+
+L'historique des commandes (une ligne par client et par jour de commande,
+quantités de commande_details) est chargé en une requête puis rangé dans
+une matrice clients × dernières commandes (PREVISION_HISTORIQUE colonnes,
+alignée à droite). Le lissage exponentiel des intervalles et des quantités
+avance colonne par colonne, calculé pour tous les clients à la fois:
+  s = α·x + (1 - α)·s
+Prochaine commande = dernière commande + intervalle lissé; l'écart absolu
+moyen lissé donne la fenêtre d'incertitude.
+
+Usage:
+    python previsions.py [--jours 365]
+"""
+import time
+import argparse
+from datetime import date, timedelta
+import numpy as np
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+from db import get_connection
+from archivage import commandes_source, commande_details_source
+
+PREVISION_JOURS = 365
+# Dernières commandes prises en compte par client
+PREVISION_HISTORIQUE = 24
+PREVISION_ALPHA = 0.3
+# Liste du lendemain: fenêtre de ± écart lissé, bornée (jours)
+PREVISION_FENETRE_MAX = 7
+
+LOAD_SQL = """
+    SELECT cmd.client_id,
+           DATE(COALESCE(cmd.date_commande, cmd.created_at)) AS jour,
+           COALESCE(SUM(d.quantite), 0)::float8,
+           COALESCE(SUM(cmd.montant_total), 0)::float8
+    FROM {commandes} cmd
+    LEFT JOIN (
+        SELECT commande_id, SUM(quantite) AS quantite
+        FROM {details}
+        GROUP BY commande_id
+    ) d ON d.commande_id = cmd.id
+    WHERE cmd.statut IS DISTINCT FROM 'annulee'
+    AND COALESCE(cmd.date_commande, cmd.created_at) >= %s
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+
+
+def matrice_historique(clients, jours, valeurs, historique=PREVISION_HISTORIQUE):
+    """
+    Lignes triées par (client, jour) -> matrices clients × historique,
+    alignées à droite (dernière commande dans la dernière colonne, nan avant
+    la première). Retourne (identifiants clients, jours, [matrices des valeurs], effectifs).
+    """
+    ids, debuts, effectifs = np.unique(clients, return_index=True, return_counts=True)
+    rang = np.arange(len(clients)) - np.repeat(debuts, effectifs)
+    depuis_fin = np.repeat(effectifs, effectifs) - 1 - rang
+    garde = depuis_fin < historique
+
+    lignes = np.repeat(np.arange(len(ids)), effectifs)[garde]
+    colonnes = historique - 1 - depuis_fin[garde]
+
+    m_jours = np.full((len(ids), historique), np.nan)
+    m_jours[lignes, colonnes] = jours[garde]
+    matrices = []
+    for v in valeurs:
+        m = np.full((len(ids), historique), np.nan)
+        m[lignes, colonnes] = v[garde]
+        matrices.append(m)
+    return ids, m_jours, matrices, np.minimum(effectifs, historique)
+
+
+def lissage(matrice, alpha=PREVISION_ALPHA):
+    """
+    Lissage exponentiel de chaque ligne (nan ignorés, initialisé sur la
+    première valeur). Retourne (niveau final, écart absolu moyen lissé).
+    """
+    niveau = np.full(matrice.shape[0], np.nan)
+    ecart = np.zeros(matrice.shape[0])
+    for j in range(matrice.shape[1]):
+        x = matrice[:, j]
+        present = ~np.isnan(x)
+        premier = present & np.isnan(niveau)
+        suivant = present & ~premier
+        # Erreur de prévision avant mise à jour du niveau
+        ecart = np.where(suivant, alpha * np.abs(x - niveau) + (1 - alpha) * ecart, ecart)
+        niveau = np.where(premier, x, niveau)
+        niveau = np.where(suivant, alpha * x + (1 - alpha) * niveau, niveau)
+    return niveau, ecart
+
+
+def prevoir(clients, jours, quantites, montants, historique=PREVISION_HISTORIQUE, alpha=PREVISION_ALPHA):
+    """
+    Prévisions de tous les clients. jours: numéros de jour (ordinaux).
+    Retourne un dict de tableaux (client_id, nb_commandes, derniere,
+    intervalle, ecart, quantite, montant, prochaine), clients avec au moins
+    deux jours de commande.
+    """
+    ids, m_jours, (m_quantites, m_montants), effectifs = matrice_historique(
+        clients, jours, (quantites, montants), historique
+    )
+    intervalles = np.diff(m_jours, axis=1)
+    intervalle, ecart = lissage(intervalles, alpha)
+    quantite, _ = lissage(m_quantites, alpha)
+    montant, _ = lissage(m_montants, alpha)
+
+    derniere = m_jours[:, -1]
+    garde = effectifs >= 2
+    return {
+        "client_id": ids[garde],
+        "nb_commandes": effectifs[garde],
+        "derniere": derniere[garde].astype(np.int64),
+        "intervalle": intervalle[garde],
+        "ecart": ecart[garde],
+        "quantite": quantite[garde],
+        "montant": montant[garde],
+        "prochaine": (derniere[garde] + np.maximum(np.rint(intervalle[garde]), 1)).astype(np.int64),
+    }
+
+
+def calculer(jours=PREVISION_JOURS):
+    """Recalculer les prévisions de tous les clients"""
+    depuis = date.today() - timedelta(days=jours)
+    conn = get_connection()
+    # Curseur à tuples: pas de dict par ligne au chargement
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+
+    try:
+        t0 = time.perf_counter()
+        commandes = commandes_source(cur, depuis)
+        # Commandes archivées: leurs lignes sont dans commande_details_archive
+        details = commande_details_source(cur, depuis)
+        cur.execute(LOAD_SQL.format(commandes=commandes, details=details), (depuis,))
+        rows = cur.fetchall()
+        n = len(rows)
+
+        clients = np.fromiter((r[0] for r in rows), dtype=np.int64, count=n)
+        ordinaux = np.fromiter((r[1].toordinal() for r in rows), dtype=np.float64, count=n)
+        quantites = np.fromiter((r[2] for r in rows), dtype=np.float64, count=n)
+        montants = np.fromiter((r[3] for r in rows), dtype=np.float64, count=n)
+        t1 = time.perf_counter()
+
+        p = prevoir(clients, ordinaux, quantites, montants)
+        t2 = time.perf_counter()
+
+        cur.execute("DELETE FROM clients_previsions")
+        execute_values(cur, """
+            INSERT INTO clients_previsions (
+                client_id, nb_commandes, derniere_commande, intervalle_jours, ecart_jours,
+                quantite_prevue, montant_prevu, prochaine_commande
+            )
+            VALUES %s
+        """, [
+            (
+                int(p["client_id"][i]),
+                int(p["nb_commandes"][i]),
+                date.fromordinal(int(p["derniere"][i])),
+                round(float(p["intervalle"][i]), 2),
+                round(float(p["ecart"][i]), 2),
+                round(float(p["quantite"][i]), 2),
+                round(float(p["montant"][i]), 2),
+                date.fromordinal(int(p["prochaine"][i])),
+            )
+            for i in range(len(p["client_id"]))
+        ], page_size=1000)
+        conn.commit()
+        t3 = time.perf_counter()
+
+        print(
+            f"✓ {len(p['client_id'])} prévisions ({n} jours de commande depuis {depuis}; "
+            f"chargement {t1 - t0:.2f} s, calcul {t2 - t1:.2f} s, écriture {t3 - t2:.2f} s)"
+        )
+        return len(p["client_id"])
+
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Erreur: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prévoir la prochaine commande de chaque client")
+    parser.add_argument("--jours", type=int, default=PREVISION_JOURS, help="Historique pris en compte")
+    args = parser.parse_args()
+
+    calculer(args.jours)
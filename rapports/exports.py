@@ -0,0 +1,484 @@
+"""
+Exports des rapports (CSV, Excel)
+
+Les lignes ne passent jamais par Python sous forme de dictionnaires: le CSV
+est produit par Postgres (COPY ... TO STDOUT) et transmis au client par
+morceaux au fur et à mesure. L'Excel est écrit en mode write-only d'openpyxl
+à partir d'un curseur serveur, dans un fichier temporaire. Dans les deux cas
+la mémoire utilisée ne dépend pas du nombre de lignes exportées.
+
+Excel, 200 000 lignes de livraisons (bench_exports.py --synthetique 200000,
+sans lxml): ~6 000 lignes/s, pic RSS 32 Mo, contre 763 Mo pour l'ancien
+classeur construit cellule par cellule. openpyxl sérialise avec lxml
+lorsqu'il est installé, ce qui augmente nettement le débit.
+"""
+import os
+import queue
+import tempfile
+import threading
+from contextlib import ExitStack
+from itertools import chain, islice
+import psycopg2.extensions
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle, Font, PatternFill, Alignment, Border, Side
+from openpyxl.utils import get_column_letter
+from db import get_connection, pooled_connection, DB_POOL_MAX
+from archivage import livraisons_source, commandes_source
+
+EXPORT_TYPES = ("livraisons", "agents")
+
+UTF8_BOM = "\ufeff".encode("utf-8")  # pour qu'Excel détecte l'UTF-8
+CSV_CHUNK_SIZE = 64 * 1024
+# Morceaux en attente d'envoi: au-delà, COPY attend le client
+CSV_QUEUE_SIZE = 16
+
+# Excel: lignes lues par aller-retour du curseur serveur, lignes servant à
+# calculer la largeur des colonnes
+XLSX_ITERSIZE = 2000
+XLSX_SAMPLE_ROWS = 500
+XLSX_HEADER_STYLE = "entete_rapport"
+EXPORT_TMP_DIR = os.getenv("EXPORT_TMP_DIR", tempfile.gettempdir())
+
+# Export par tranches: nombre maximal de connexions en parallèle par export
+EXPORT_MAX_SHARDS = int(os.getenv("EXPORT_MAX_SHARDS", "8"))
+# Les agrégats (type agents) ne se découpent pas
+SHARDABLE_TYPES = ("livraisons",)
+
+# Colonnes exportées: (expression SQL, en-tête)
+EXPORT_COLUMNS = {
+    "livraisons": [
+        ("l.id", "ID"),
+        ("l.commande_id", "Commande"),
+        ("u.nom", "Agent"),
+        ("c.nom_point_vente", "Client"),
+        ("l.adresse_livraison", "Adresse"),
+        ("l.statut", "Statut"),
+        ("l.montant_percu", "Montant"),
+        ("l.date_livraison", "Date"),
+        ("l.heure_livraison", "Heure"),
+    ],
+    "agents": [
+        ("a.id", "ID Agent"),
+        ("u.nom", "Nom"),
+        ("a.telephone", "Téléphone"),
+        ("a.tricycle", "Tricycle"),
+        ("COUNT(*)", "Total Livraisons"),
+        ("SUM(CASE WHEN l.statut = 'terminee' THEN 1 ELSE 0 END)", "Complétées"),
+        ("COALESCE(SUM(l.montant_percu), 0)", "Montant"),
+    ],
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def _export_filters(start_date, end_date):
+    filters = ["1=1"]
+    params = []
+    if start_date and end_date:
+        filters.append("DATE(l.created_at) BETWEEN %s AND %s")
+        params.extend([start_date, end_date])
+    return filters, params
+
+
+def build_export_query(cur, report_type, start_date=None, end_date=None, tranche=None):
+    """
+    Requête d'export pour un type de rapport.
+    tranche: (condition SQL, paramètres) ajoutée au WHERE (export par tranches).
+    Retourne (sql, params, en-têtes); les colonnes portent le nom de l'en-tête.
+    """
+    if report_type not in EXPORT_TYPES:
+        raise ExportError(f"Type de rapport invalide (valeurs possibles: {', '.join(EXPORT_TYPES)})")
+
+    filters, params = _export_filters(start_date, end_date)
+    if tranche:
+        filters.append(tranche[0])
+        params.extend(tranche[1])
+    where_clause = " AND ".join(filters)
+
+    livraisons = livraisons_source(cur, start_date if end_date else None)
+    commandes = commandes_source(cur, start_date if end_date else None)
+
+    columns = EXPORT_COLUMNS[report_type]
+    select = ",\n            ".join(f'{expr} AS "{header}"' for expr, header in columns)
+
+    if report_type == "livraisons":
+        sql = f"""
+            SELECT
+            {select}
+            FROM {livraisons} l
+            JOIN agents ag ON l.agent_id = ag.id
+            JOIN users u ON ag.user_id = u.id
+            JOIN {commandes} cmd ON l.commande_id = cmd.id
+            JOIN clients c ON cmd.client_id = c.id
+            WHERE {where_clause}
+            ORDER BY l.created_at DESC
+        """
+    else:
+        sql = f"""
+            SELECT
+            {select}
+            FROM {livraisons} l
+            JOIN agents a ON l.agent_id = a.id
+            JOIN users u ON a.user_id = u.id
+            WHERE {where_clause}
+            GROUP BY a.id, u.nom, a.telephone, a.tricycle
+            ORDER BY COUNT(*) DESC
+        """
+
+    return sql, params, [header for _, header in columns]
+
+
+_FIN = object()
+
+
+class _ExportCancelled(Exception):
+    pass
+
+
+def _put(chunks, cancelled, item):
+    """Déposer un morceau; abandonner si le client est parti entre-temps"""
+    while True:
+        if cancelled.is_set():
+            raise _ExportCancelled()
+        try:
+            chunks.put(item, timeout=1)
+            return
+        except queue.Full:
+            continue
+
+
+class _ChunkWriter:
+    """Fichier pour copy_expert: regroupe les lignes en morceaux de CSV_CHUNK_SIZE"""
+
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= CSV_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        chunk = bytes(self.buffer)
+        self.buffer.clear()
+        # Client parti: lever une exception interrompt COPY
+        _put(self.chunks, self.cancelled, chunk)
+
+
+def stream_csv(sql, params):
+    """
+    Lancer COPY (sql) TO STDOUT sur une connexion dédiée et retourner un
+    générateur de morceaux (BOM UTF-8 en tête). Le premier morceau est
+    attendu avant de retourner: une erreur SQL est levée ici et peut encore
+    produire une réponse 500.
+    """
+    chunks = queue.Queue(maxsize=CSV_QUEUE_SIZE)
+    cancelled = threading.Event()
+
+    def produce():
+        conn = None
+        try:
+            conn = get_connection()
+            cur = conn.cursor()
+            # COPY n'accepte pas de paramètres liés: requête complétée par mogrify
+            query = cur.mogrify(sql, params).decode("utf-8")
+            writer = _ChunkWriter(chunks, cancelled)
+            cur.copy_expert(
+                f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true, ENCODING 'UTF8')",
+                writer,
+                size=CSV_CHUNK_SIZE,
+            )
+            writer.flush()
+            _put(chunks, cancelled, _FIN)
+        except _ExportCancelled:
+            pass
+        except Exception as e:
+            try:
+                _put(chunks, cancelled, e)
+            except _ExportCancelled:
+                pass
+        finally:
+            if conn:
+                conn.close()
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    premier = chunks.get()
+    if isinstance(premier, Exception):
+        raise premier
+
+    def generate():
+        try:
+            yield UTF8_BOM
+            item = premier
+            while item is not _FIN:
+                if isinstance(item, Exception):
+                    # En-têtes déjà envoyés: la réponse est interrompue
+                    print(f"[exports] Export CSV interrompu: {item}")
+                    raise item
+                yield item
+                item = chunks.get()
+        finally:
+            cancelled.set()
+
+    return generate()
+
+
+def export_csv(sql, params, path):
+    """
+    Écrire le CSV (COPY ... TO STDOUT, BOM UTF-8 en tête) dans un fichier.
+    Retourne le nombre de lignes exportées.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        query = cur.mogrify(sql, params).decode("utf-8")
+        with open(path, "wb") as f:
+            f.write(UTF8_BOM)
+            cur.copy_expert(
+                f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true, ENCODING 'UTF8')",
+                f,
+                size=CSV_CHUNK_SIZE,
+            )
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+def shard_ranges(cur, start_date, end_date, shards):
+    """
+    Découper les livraisons de la période en tranches de created_at de même
+    nombre de lignes (quantiles: l'activité n'est pas régulière dans le
+    temps), de la plus récente à la plus ancienne (ordre du rapport).
+    Retourne la liste des tranches à passer à build_export_query.
+    """
+    if shards <= 1:
+        return [None]
+
+    livraisons = livraisons_source(cur, start_date if end_date else None)
+    filters, params = _export_filters(start_date, end_date)
+    cur.execute(f"""
+        SELECT
+            MIN(l.created_at) AS debut,
+            percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY l.created_at) AS coupures
+        FROM {livraisons} l
+        WHERE {" AND ".join(filters)}
+    """, [[i / shards for i in range(1, shards)]] + params)
+    row = cur.fetchone()
+    # Beaucoup de lignes à la même date: coupures confondues, moins de tranches
+    coupures = sorted({c for c in row["coupures"] or [] if c is not None and c > row["debut"]})
+    if not coupures:
+        return [None]
+
+    # created_at NULL sort en tête de ORDER BY created_at DESC: première tranche
+    tranches = [("(l.created_at >= %s OR l.created_at IS NULL)", [coupures[-1]])]
+    for i in range(len(coupures) - 1, 0, -1):
+        tranches.append(("l.created_at >= %s AND l.created_at < %s", [coupures[i - 1], coupures[i]]))
+    tranches.append(("l.created_at < %s", [coupures[0]]))
+    return tranches
+
+
+# Les exports par tranches prennent leurs connexions un à la fois: deux
+# exports ne restent pas bloqués chacun avec une partie du pool
+_shards_start_lock = threading.Lock()
+
+
+class ShardedCsvExport:
+    """
+    Export CSV découpé en tranches lues en parallèle, chacune sur sa
+    connexion du pool. Toutes les tranches importent le même instantané
+    (pg_export_snapshot): le résultat est celui d'une seule requête.
+    Chaque tranche est copiée dans un fichier temporaire; chunks() les
+    restitue dans l'ordre dès qu'elles sont prêtes.
+    """
+
+    def __init__(self, report_type, start_date, end_date, shards):
+        self.report_type = report_type
+        self.start_date = start_date
+        self.end_date = end_date
+        # Une connexion par tranche, plus celle qui exporte l'instantané
+        self.shards = max(1, min(shards, EXPORT_MAX_SHARDS, DB_POOL_MAX - 1))
+        self._stack = ExitStack()
+        self._tranches = []
+        # Lignes des tranches déjà restituées par chunks()
+        self.lignes = 0
+
+    def start(self):
+        try:
+            with _shards_start_lock:
+                origine = self._stack.enter_context(pooled_connection())
+                origine.set_session(isolation_level="REPEATABLE READ", readonly=True)
+                cur = origine.cursor()
+                cur.execute("SELECT pg_export_snapshot() AS snapshot")
+                snapshot = cur.fetchone()["snapshot"]
+
+                requetes = [
+                    build_export_query(cur, self.report_type, self.start_date, self.end_date, tranche)[:2]
+                    for tranche in shard_ranges(cur, self.start_date, self.end_date, self.shards)
+                ]
+                conns = [self._stack.enter_context(pooled_connection()) for _ in requetes]
+
+            for conn in conns:
+                conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+                conn.cursor().execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+            # Instantané importé partout: la transaction d'origine peut se terminer
+            origine.commit()
+
+            for i, (conn, (sql, params)) in enumerate(zip(conns, requetes)):
+                fd, path = tempfile.mkstemp(suffix=".csv", dir=EXPORT_TMP_DIR)
+                os.close(fd)
+                tranche = {"conn": conn, "path": path, "done": threading.Event(), "error": None, "rows": 0}
+                self._tranches.append(tranche)
+                threading.Thread(
+                    target=self._copy, args=(tranche, sql, params, i == 0), daemon=True
+                ).start()
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    @staticmethod
+    def _copy(tranche, sql, params, header):
+        try:
+            cur = tranche["conn"].cursor()
+            query = cur.mogrify(sql, params).decode("utf-8")
+            with open(tranche["path"], "wb") as f:
+                cur.copy_expert(
+                    f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER {'true' if header else 'false'}, ENCODING 'UTF8')",
+                    f,
+                    size=CSV_CHUNK_SIZE,
+                )
+            tranche["rows"] = cur.rowcount
+        except Exception as e:
+            tranche["error"] = e
+        finally:
+            tranche["done"].set()
+
+    def chunks(self):
+        """Morceaux du CSV complet (BOM UTF-8 en tête), tranche après tranche"""
+        try:
+            yield UTF8_BOM
+            for tranche in self._tranches:
+                tranche["done"].wait()
+                if tranche["error"]:
+                    print(f"[exports] Export CSV par tranches interrompu: {tranche['error']}")
+                    raise tranche["error"]
+                with open(tranche["path"], "rb") as f:
+                    while True:
+                        chunk = f.read(CSV_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        yield chunk
+                self.lignes += tranche["rows"]
+        finally:
+            self.close()
+
+    def close(self):
+        """Annuler les copies en cours, rendre les connexions, supprimer les fichiers"""
+        for tranche in self._tranches:
+            if not tranche["done"].is_set():
+                try:
+                    tranche["conn"].cancel()
+                except Exception:
+                    pass
+        for tranche in self._tranches:
+            tranche["done"].wait()
+            if os.path.exists(tranche["path"]):
+                os.remove(tranche["path"])
+        self._tranches = []
+        self._stack.close()
+
+
+def export_csv_sharded(report_type, start_date, end_date, shards, path):
+    """Comme export_csv, en tranches parallèles. Retourne le nombre de lignes"""
+    export = ShardedCsvExport(report_type, start_date, end_date, shards).start()
+    with open(path, "wb") as f:
+        for chunk in export.chunks():
+            f.write(chunk)
+    return export.lignes
+
+
+def _header_style():
+    thin = Side(style="thin")
+    style = NamedStyle(name=XLSX_HEADER_STYLE)
+    style.fill = PatternFill(start_color="1f2937", end_color="1f2937", fill_type="solid")
+    style.font = Font(bold=True, color="FFFFFF", size=12)
+    style.alignment = Alignment(horizontal="center", vertical="center")
+    style.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    return style
+
+
+def _column_widths(headers, sample):
+    """Largeur de chaque colonne d'après l'en-tête et un échantillon de lignes"""
+    widths = []
+    for i, header in enumerate(headers):
+        longest = max([len(header)] + [len(str(row[i])) for row in sample if row[i] is not None])
+        widths.append(min(max(longest + 2, 8), 60))
+    return widths
+
+
+def write_xlsx(rows, headers, path, title="Rapports"):
+    """
+    Écrire un classeur en mode write-only (les lignes ne restent pas en
+    mémoire). rows: itérable de tuples dans l'ordre des en-têtes.
+    Retourne le nombre de lignes écrites.
+    """
+    rows = iter(rows)
+    sample = list(islice(rows, XLSX_SAMPLE_ROWS))
+
+    wb = Workbook(write_only=True)
+    wb.add_named_style(_header_style())
+    ws = wb.create_sheet(title)
+
+    # En mode write-only, les largeurs doivent précéder la première ligne
+    for i, width in enumerate(_column_widths(headers, sample), 1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    entete = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.style = XLSX_HEADER_STYLE
+        entete.append(cell)
+    ws.append(entete)
+
+    count = 0
+    for row in chain(sample, rows):
+        ws.append(row)
+        count += 1
+
+    wb.save(path)
+    return count
+
+
+def export_xlsx(sql, params, headers, title="Rapports", path=None):
+    """
+    Exécuter la requête d'export avec un curseur serveur et écrire le classeur
+    dans path, ou dans un fichier temporaire (à supprimer par l'appelant).
+    Retourne (chemin, nombre de lignes).
+    """
+    temporaire = path is None
+    if temporaire:
+        fd, path = tempfile.mkstemp(suffix=".xlsx", dir=EXPORT_TMP_DIR)
+        os.close(fd)
+    conn = get_connection()
+
+    try:
+        # Curseur nommé: Postgres envoie les lignes par paquets de XLSX_ITERSIZE
+        cur = conn.cursor(name="export_xlsx", cursor_factory=psycopg2.extensions.cursor)
+        cur.itersize = XLSX_ITERSIZE
+        cur.execute(sql, params)
+        lignes = write_xlsx(cur, headers, path, title)
+        return path, lignes
+    except BaseException:
+        if temporaire and os.path.exists(path):
+            os.remove(path)
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,343 @@
+"""
+Exports de rapports en arrière-plan (/rapports/exports)
+
+Un POST enregistre la tâche dans export_jobs et la confie au pool de threads
+du worker: la requête HTTP rend la main tout de suite et le fichier est
+écrit dans EXPORT_DIR, puis téléchargé par GET. Sur une période close (date
+de fin passée) les données ne bougent plus: une demande aux paramètres
+identiques réutilise la tâche en cours ou le fichier déjà produit tant qu'il
+n'a pas expiré (EXPORT_ARTIFACT_TTL).
+"""
+import os
+import json
+import hashlib
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from db import get_connection
+from rapports.exports import (
+    EXPORT_TYPES, SHARDABLE_TYPES, ExportError, build_export_query, export_csv, export_csv_sharded,
+    export_xlsx,
+)
+
+EXPORT_DIR = os.getenv(
+    "EXPORT_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "uploads", "exports")
+)
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+# Durée de vie d'un fichier produit (secondes)
+EXPORT_ARTIFACT_TTL = int(os.getenv("EXPORT_ARTIFACT_TTL", str(24 * 3600)))
+# Tâche restée en attente ou en cours plus longtemps: worker arrêté, en échec
+EXPORT_JOB_TIMEOUT = int(os.getenv("EXPORT_JOB_TIMEOUT", "1800"))
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Compteurs propres au worker courant
+_lock = threading.Lock()
+_metrics = {
+    "submitted": 0,
+    "reused": 0,
+    "completed": 0,
+    "failed": 0,
+    "rows": 0,
+    "bytes": 0,
+    "seconds": 0.0,
+}
+_queued = 0
+_running = 0
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+        return _executor
+
+
+def _parse_date(value, nom):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise ExportError(f"{nom} invalide (format attendu: AAAA-MM-JJ)")
+
+
+def parse_export_request(data):
+    """Valider le corps d'un POST /rapports/exports -> (format, type, début, fin)"""
+    fmt = data.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"Format invalide (valeurs possibles: {', '.join(EXPORT_FORMATS)})")
+    report_type = data.get("type", "livraisons")
+    if report_type not in EXPORT_TYPES:
+        raise ExportError(f"Type de rapport invalide (valeurs possibles: {', '.join(EXPORT_TYPES)})")
+
+    start_date = _parse_date(data.get("start_date"), "start_date")
+    end_date = _parse_date(data.get("end_date"), "end_date")
+    # Comme les exports directs: la période ne filtre que si les deux bornes sont là
+    if not (start_date and end_date):
+        start_date = end_date = None
+    elif start_date > end_date:
+        raise ExportError("start_date postérieure à end_date")
+    return fmt, report_type, start_date, end_date
+
+
+def params_hash(fmt, report_type, start_date, end_date):
+    """Identifiant des paramètres si la période est close, None sinon"""
+    if not end_date or end_date >= date.today():
+        return None
+    cle = json.dumps([fmt, report_type, start_date.isoformat(), end_date.isoformat()])
+    return hashlib.sha256(cle.encode("utf-8")).hexdigest()
+
+
+def artifact_path(job):
+    return os.path.join(EXPORT_DIR, job["id"] + EXPORT_FORMATS[job["format"]][1])
+
+
+def artifact_name(job):
+    periode = ""
+    if job["start_date"] and job["end_date"]:
+        periode = f"_{job['start_date']:%Y%m%d}_{job['end_date']:%Y%m%d}"
+    return f"rapport_{job['report_type']}{periode}{EXPORT_FORMATS[job['format']][1]}"
+
+
+def job_status(job):
+    return {
+        "job_id": job["id"],
+        "format": job["format"],
+        "type": job["report_type"],
+        "start_date": job["start_date"].isoformat() if job["start_date"] else None,
+        "end_date": job["end_date"].isoformat() if job["end_date"] else None,
+        "statut": job["statut"],
+        "lignes": job["lignes"],
+        "taille": job["taille"],
+        "erreur": job["erreur"],
+        "created_at": job["created_at"].isoformat() if job["created_at"] else None,
+        "finished_at": job["finished_at"].isoformat() if job["finished_at"] else None,
+        "expires_at": job["expires_at"].isoformat() if job["expires_at"] else None,
+        "url": f"/rapports/exports/{job['id']}/fichier" if job["statut"] == "termine" else None,
+    }
+
+
+def _find_reusable(cur, cle):
+    cur.execute("""
+        SELECT * FROM export_jobs
+        WHERE params_hash = %s
+        AND ((statut = 'termine' AND expires_at > CURRENT_TIMESTAMP)
+             OR (statut IN ('en_attente', 'en_cours')
+                 AND COALESCE(started_at, created_at) > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'))
+        ORDER BY created_at DESC
+    """, (cle, EXPORT_JOB_TIMEOUT))
+    for job in cur.fetchall():
+        # Fichier absent (disque d'une autre instance, purge manuelle): ignoré
+        if job["statut"] != "termine" or os.path.exists(artifact_path(job)):
+            return job
+    return None
+
+
+def create_job(cur, fmt, report_type, start_date, end_date, utilisateur_id):
+    """
+    Enregistrer une tâche (ou retrouver une tâche réutilisable).
+    Retourne (tâche, réutilisée). L'appelant valide puis appelle submit_job
+    si la tâche est nouvelle.
+    """
+    cle = params_hash(fmt, report_type, start_date, end_date)
+    if cle:
+        # Deux demandes identiques simultanées (même sur deux workers): une seule tâche
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (cle,))
+        job = _find_reusable(cur, cle)
+        if job:
+            with _lock:
+                _metrics["reused"] += 1
+            return job, True
+
+    cur.execute("""
+        INSERT INTO export_jobs (id, format, report_type, start_date, end_date, params_hash, utilisateur_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        RETURNING *
+    """, (secrets.token_hex(16), fmt, report_type, start_date, end_date, cle, utilisateur_id))
+    return cur.fetchone(), False
+
+
+def expire_stale(cur, job):
+    """
+    Tâche abandonnée par un worker arrêté: passée en échec. Le délai court
+    depuis le démarrage (une tâche longtemps en attente dans la file garde
+    tout EXPORT_JOB_TIMEOUT pour s'exécuter)
+    """
+    if job["statut"] not in ("en_attente", "en_cours"):
+        return job
+    cur.execute("""
+        UPDATE export_jobs
+        SET statut = 'echec', erreur = 'Interrompue (worker arrêté)', finished_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND statut IN ('en_attente', 'en_cours')
+        AND COALESCE(started_at, created_at) < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+        RETURNING *
+    """, (job["id"], EXPORT_JOB_TIMEOUT))
+    return cur.fetchone() or job
+
+
+def submit_job(job_id, shards=1):
+    """shards > 1: CSV lu en tranches parallèles (même résultat, voir ShardedCsvExport)"""
+    global _queued
+    with _lock:
+        _metrics["submitted"] += 1
+        _queued += 1
+    _get_executor().submit(_run_job, job_id, shards)
+
+
+def _run_job(job_id, shards=1):
+    global _queued, _running
+    with _lock:
+        _queued -= 1
+        _running += 1
+
+    debut = time.perf_counter()
+    tmp_path = None
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            UPDATE export_jobs SET statut = 'en_cours', started_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND statut = 'en_attente'
+            RETURNING *
+        """, (job_id,))
+        job = cur.fetchone()
+        conn.commit()
+        if not job:
+            return
+
+        sql, params, headers = build_export_query(cur, job["report_type"], job["start_date"], job["end_date"])
+        conn.commit()
+
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        path = artifact_path(job)
+        # Écrit à côté puis renommé: un fichier visible est toujours complet
+        tmp_path = path + ".part"
+        if job["format"] == "csv" and shards > 1 and job["report_type"] in SHARDABLE_TYPES:
+            lignes = export_csv_sharded(job["report_type"], job["start_date"], job["end_date"], shards, tmp_path)
+        elif job["format"] == "csv":
+            lignes = export_csv(sql, params, tmp_path)
+        else:
+            _, lignes = export_xlsx(sql, params, headers, path=tmp_path)
+        os.replace(tmp_path, path)
+        tmp_path = None
+        taille = os.path.getsize(path)
+
+        # Déjà passée en échec par expire_stale (trop longue): le fichier n'est plus attendu
+        cur.execute("""
+            UPDATE export_jobs
+            SET statut = 'termine', fichier = %s, taille = %s, lignes = %s,
+                finished_at = CURRENT_TIMESTAMP,
+                expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+            WHERE id = %s AND statut = 'en_cours'
+        """, (path, taille, lignes, EXPORT_ARTIFACT_TTL, job_id))
+        termine = cur.rowcount
+        conn.commit()
+        if not termine:
+            os.remove(path)
+            print(f"[exports] Tâche {job_id} expirée avant la fin: fichier supprimé")
+            return
+
+        with _lock:
+            _metrics["completed"] += 1
+            _metrics["rows"] += lignes
+            _metrics["bytes"] += taille
+            _metrics["seconds"] += time.perf_counter() - debut
+
+    except Exception as e:
+        conn.rollback()
+        print(f"[exports] Tâche {job_id} en échec: {e}")
+        with _lock:
+            _metrics["failed"] += 1
+        try:
+            cur.execute("""
+                UPDATE export_jobs SET statut = 'echec', erreur = %s, finished_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND statut = 'en_cours'
+            """, (str(e)[:500], job_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn.close()
+        with _lock:
+            _running -= 1
+
+
+def purge_expired(conn):
+    """Supprimer les fichiers expirés; retourne le nombre de fichiers purgés"""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('public.export_jobs') AS t")
+    if not cur.fetchone()["t"]:
+        return 0
+    cur.execute("""
+        UPDATE export_jobs SET statut = 'expire', fichier = NULL
+        WHERE statut = 'termine' AND expires_at < CURRENT_TIMESTAMP
+        RETURNING id, format
+    """)
+    jobs = cur.fetchall()
+    conn.commit()
+    for job in jobs:
+        path = artifact_path(job)
+        if os.path.exists(path):
+            os.remove(path)
+    return len(jobs)
+
+
+def export_metrics():
+    """Débit et file d'attente: worker courant et ensemble des workers (base)"""
+    with _lock:
+        local = {
+            **_metrics,
+            "queued": _queued,
+            "running": _running,
+            "workers": EXPORT_WORKERS,
+            "rows_per_second": round(_metrics["rows"] / _metrics["seconds"], 1) if _metrics["seconds"] else 0,
+            "pid": os.getpid(),
+        }
+
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT statut, COUNT(*) AS nombre FROM export_jobs GROUP BY statut")
+        par_statut = {row["statut"]: row["nombre"] for row in cur.fetchall()}
+        cur.execute("""
+            SELECT
+                COUNT(*) AS jobs,
+                COALESCE(SUM(lignes), 0)::bigint AS lignes,
+                COALESCE(SUM(taille), 0)::bigint AS octets,
+                COALESCE(SUM(EXTRACT(EPOCH FROM finished_at - started_at)), 0)::float AS secondes,
+                COALESCE(AVG(EXTRACT(EPOCH FROM started_at - created_at)), 0)::float AS attente_moyenne
+            FROM export_jobs
+            WHERE statut IN ('termine', 'expire') AND finished_at > CURRENT_TIMESTAMP - INTERVAL '1 hour'
+        """)
+        heure = cur.fetchone()
+    finally:
+        conn.close()
+
+    return {
+        "worker": local,
+        "queue_depth": par_statut.get("en_attente", 0),
+        "running": par_statut.get("en_cours", 0),
+        "par_statut": par_statut,
+        "derniere_heure": {
+            "jobs": heure["jobs"],
+            "lignes": heure["lignes"],
+            "octets": heure["octets"],
+            "lignes_par_seconde": round(heure["lignes"] / heure["secondes"], 1) if heure["secondes"] else 0,
+            "attente_moyenne_s": round(heure["attente_moyenne"], 2),
+        },
+        "ttl_seconds": EXPORT_ARTIFACT_TTL,
+    }
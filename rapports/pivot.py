@@ -0,0 +1,285 @@
+"""
+Rapport pivot (/rapports/pivot) sur l'agrégat journalier des livraisons
+
+Les dimensions, mesures et filtres demandés sont compilés en une seule
+requête GROUP BY sur livraisons_rollup_daily (voir rollups.py); les noms
+d'agent et de client ne sont joints que s'ils sont demandés. Le résultat est
+renvoyé par colonnes: un nouveau widget n'a pas besoin d'un nouveau SQL.
+
+L'agrégat ne porte pas de produit: avec la dimension produit, la requête lit
+les livraisons et les lignes de leur commande (livraisons.commande_id ->
+commande_details), avec les mêmes colonnes que l'agrégat; quantité et
+montant sont alors ceux des lignes de commande.
+"""
+import os
+from datetime import datetime
+from decimal import Decimal
+from db import like_pattern
+from archivage import livraisons_source, commande_details_source
+
+# Colonne de jour selon l'axe de date choisi
+AXES = {
+    "creation": "r.jour",
+    "livraison": "r.jour_livraison",
+}
+
+# Grains de date: une seule par requête
+DIMENSIONS_DATE = {
+    "jour": "{axe}",
+    "semaine": "DATE_TRUNC('week', {axe})::date",
+    "mois": "DATE_TRUNC('month', {axe})::date",
+}
+
+# Zone: cellule de la grille (en degrés, ~1,1 km par défaut) où se trouve
+# le client, repérée par son centre
+PIVOT_ZONE_DEG = float(os.getenv("PIVOT_ZONE_DEG", "0.01"))
+_ZONE = "ROUND((FLOOR(c.{axe} / {pas}) + 0.5) * {pas}, 6)::float8"
+
+# Dimensions: (colonnes (alias, expression), jointure nécessaire)
+DIMENSIONS = {
+    "agent": ([("agent_id", "NULLIF(r.agent_id, 0)"), ("agent", "a.nom")], "agents"),
+    "client": ([("client_id", "NULLIF(r.client_id, 0)"), ("client", "c.nom_point_vente")], "clients"),
+    "statut": ([("statut", "r.statut")], None),
+    "produit": ([("produit_id", "r.produit_id"), ("produit", "p.nom")], "produits"),
+    "zone": (
+        [
+            ("zone_latitude", _ZONE.format(axe="latitude", pas=PIVOT_ZONE_DEG)),
+            ("zone_longitude", _ZONE.format(axe="longitude", pas=PIVOT_ZONE_DEG)),
+        ],
+        "clients",
+    ),
+}
+
+MESURES = {
+    "nombre": "SUM(r.nb_livraisons)::bigint",
+    "quantite": "SUM(r.quantite)::bigint",
+    "montant": "COALESCE(SUM(r.montant), 0)",
+    "collecte": "COALESCE(SUM(r.montant) FILTER (WHERE r.statut = 'terminee'), 0)",
+}
+
+JOINTURES = {
+    "agents": "LEFT JOIN agents a ON a.id = r.agent_id",
+    "clients": "LEFT JOIN clients c ON c.id = r.client_id",
+    "produits": "LEFT JOIN produits p ON p.id = r.produit_id",
+}
+
+# Même forme que livraisons_rollup_daily, une ligne par livraison et produit
+# (les livraisons sans commande n'y figurent pas)
+PAR_PRODUIT = """(
+        SELECT
+            DATE(l.created_at) AS jour,
+            l.date_livraison AS jour_livraison,
+            COALESCE(l.agent_id, 0) AS agent_id,
+            COALESCE(l.client_id, 0) AS client_id,
+            COALESCE(l.statut, 'inconnu') AS statut,
+            d.produit_id,
+            1 AS nb_livraisons,
+            d.quantite,
+            d.montant_ligne AS montant
+        FROM {livraisons} l
+        JOIN {details} d ON d.commande_id = l.commande_id
+    )"""
+
+PIVOT_LIMITE_DEFAUT = 1000
+PIVOT_LIMITE_MAX = 10000
+
+
+class PivotError(Exception):
+    pass
+
+
+def _liste(valeur):
+    if not valeur:
+        return []
+    return [v.strip() for v in valeur.split(",") if v.strip()]
+
+
+def _entiers(valeur, nom):
+    try:
+        return [int(v) for v in _liste(valeur)]
+    except ValueError:
+        raise PivotError(f"{nom}: liste d'identifiants attendue (ex. 1,2,3)")
+
+
+def _date(valeur, nom):
+    if not valeur:
+        return None
+    try:
+        return datetime.strptime(valeur, "%Y-%m-%d").date()
+    except ValueError:
+        raise PivotError(f"{nom} invalide (format attendu: AAAA-MM-JJ)")
+
+
+def parse_pivot_args(args):
+    """Lire et valider les paramètres de la requête -> dict normalisé"""
+    dimensions = _liste(args.get("dimensions"))
+    mesures = _liste(args.get("mesures")) or ["nombre", "montant"]
+
+    for dimension in dimensions:
+        if dimension not in DIMENSIONS_DATE and dimension not in DIMENSIONS:
+            raise PivotError(
+                f"Dimension invalide: {dimension} "
+                f"(valeurs possibles: {', '.join(list(DIMENSIONS_DATE) + list(DIMENSIONS))})"
+            )
+    if len(dimensions) != len(set(dimensions)):
+        raise PivotError("Dimension répétée")
+    if len([d for d in dimensions if d in DIMENSIONS_DATE]) > 1:
+        raise PivotError("Une seule dimension de date (jour, semaine ou mois)")
+
+    for mesure in mesures:
+        if mesure not in MESURES:
+            raise PivotError(f"Mesure invalide: {mesure} (valeurs possibles: {', '.join(MESURES)})")
+
+    axe = args.get("axe", "creation")
+    if axe not in AXES:
+        raise PivotError(f"Axe invalide (valeurs possibles: {', '.join(AXES)})")
+
+    try:
+        limite = int(args.get("limite", PIVOT_LIMITE_DEFAUT))
+    except ValueError:
+        raise PivotError("limite doit être un entier")
+
+    return {
+        "dimensions": dimensions,
+        "mesures": list(dict.fromkeys(mesures)),
+        "axe": axe,
+        "start_date": _date(args.get("start_date"), "start_date"),
+        "end_date": _date(args.get("end_date"), "end_date"),
+        "agent_id": _entiers(args.get("agent_id"), "agent_id"),
+        "client_id": _entiers(args.get("client_id"), "client_id"),
+        "statut": _liste(args.get("statut")),
+        "zone": (args.get("zone") or "").strip() or None,
+        "limite": max(1, min(limite, PIVOT_LIMITE_MAX)),
+    }
+
+
+def cache_key(spec):
+    """Clé de cache stable pour une demande normalisée"""
+    parties = [
+        ",".join(spec["dimensions"]),
+        ",".join(spec["mesures"]),
+        spec["axe"],
+        str(spec["start_date"]),
+        str(spec["end_date"]),
+        ",".join(map(str, spec["agent_id"])),
+        ",".join(map(str, spec["client_id"])),
+        ",".join(spec["statut"]),
+        spec["zone"] or "",
+        str(spec["limite"]),
+    ]
+    return "rapports:pivot:" + "|".join(parties)
+
+
+def compile_pivot(spec, livraisons="livraisons", details="commande_details"):
+    """
+    Demande normalisée -> (sql, params, colonnes). livraisons et details:
+    sources lues avec la dimension produit (archive comprise si besoin)
+    """
+    axe = AXES[spec["axe"]]
+    select = []
+    group_by = []
+    colonnes = []
+    jointures = []
+
+    for dimension in spec["dimensions"]:
+        if dimension in DIMENSIONS_DATE:
+            expr = DIMENSIONS_DATE[dimension].format(axe=axe)
+            select.append(f"{expr} AS {dimension}")
+            group_by.append(expr)
+            colonnes.append(dimension)
+            continue
+        champs, jointure = DIMENSIONS[dimension]
+        for alias, expr in champs:
+            select.append(f"{expr} AS {alias}")
+            group_by.append(expr)
+            colonnes.append(alias)
+        if jointure and jointure not in jointures:
+            jointures.append(jointure)
+
+    for mesure in spec["mesures"]:
+        select.append(f"{MESURES[mesure]} AS {mesure}")
+        colonnes.append(mesure)
+
+    filters = ["1=1"]
+    params = []
+    if spec["start_date"]:
+        filters.append(f"{axe} >= %s")
+        params.append(spec["start_date"])
+    if spec["end_date"]:
+        filters.append(f"{axe} <= %s")
+        params.append(spec["end_date"])
+    if spec["agent_id"]:
+        filters.append("r.agent_id = ANY(%s)")
+        params.append(spec["agent_id"])
+    if spec["client_id"]:
+        filters.append("r.client_id = ANY(%s)")
+        params.append(spec["client_id"])
+    if spec["statut"]:
+        filters.append("r.statut = ANY(%s)")
+        params.append(spec["statut"])
+    if spec["zone"]:
+        # Même filtre que /cartographie/clients/geo (index trigramme sur l'adresse)
+        if "clients" not in jointures:
+            jointures.append("clients")
+        filters.append("c.adresse ILIKE %s")
+        params.append(like_pattern(spec["zone"]))
+
+    if "produit" in spec["dimensions"]:
+        base = PAR_PRODUIT.format(livraisons=livraisons, details=details) + " r"
+    else:
+        base = "livraisons_rollup_daily r"
+    from_clause = "\n        ".join([base] + [JOINTURES[j] for j in jointures])
+
+    group_clause = f"GROUP BY {', '.join(group_by)}" if group_by else ""
+    # Dates dans l'ordre, puis les plus gros volumes d'abord
+    premiere_mesure = spec["mesures"][0]
+    order = [str(i + 1) for i, c in enumerate(colonnes) if c in DIMENSIONS_DATE]
+    order.append(f"{premiere_mesure} DESC NULLS LAST")
+
+    sql = f"""
+        SELECT {', '.join(select)}
+        FROM {from_clause}
+        WHERE {' AND '.join(filters)}
+        {group_clause}
+        ORDER BY {', '.join(order)}
+        LIMIT %s
+    """
+    # Une ligne de plus pour savoir si le résultat est tronqué
+    params.append(spec["limite"] + 1)
+    return sql, params, colonnes
+
+
+def _valeur(v):
+    if isinstance(v, Decimal):
+        return float(v)
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    return v
+
+
+def run_pivot(cur, spec):
+    """Exécuter le pivot et retourner le résultat par colonnes"""
+    if "produit" in spec["dimensions"]:
+        # Axe livraison: une livraison peut être livrée après sa création
+        marge = 7 if spec["axe"] == "livraison" else 0
+        sql, params, colonnes = compile_pivot(
+            spec,
+            livraisons_source(cur, spec["start_date"], marge_jours=marge),
+            commande_details_source(cur, spec["start_date"], marge_jours=marge),
+        )
+    else:
+        sql, params, colonnes = compile_pivot(spec)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    tronque = len(rows) > spec["limite"]
+    rows = rows[:spec["limite"]]
+
+    return {
+        "dimensions": spec["dimensions"],
+        "mesures": spec["mesures"],
+        "axe": spec["axe"],
+        "colonnes": colonnes,
+        "valeurs": {colonne: [_valeur(row[colonne]) for row in rows] for colonne in colonnes},
+        "lignes": len(rows),
+        "tronque": tronque,
+    }
@@ -1,13 +1,23 @@
 from flask_restx import Resource, Namespace, fields as api_fields
-from flask import request, send_file
+from flask import request, send_file, Response
 from datetime import datetime, timedelta
 from db import get_connection
-from flask_jwt_extended import jwt_required
-import csv
-from io import BytesIO, StringIO
+from archivage import livraisons_source, commandes_source
+from cache import cached, invalidate, CACHE_TAG_DASHBOARD, CACHE_TAG_RAPPORTS, REPORT_CACHE_TTL
+from rapports.pivot import parse_pivot_args, run_pivot, cache_key as pivot_cache_key, PivotError
+from anomalies import REGLES as ANOMALIE_REGLES
+from cohortes import cohort_matrix, COHORTES_SEMAINES_DEFAUT, COHORTES_SEMAINES_MAX
+from vues import VUES, refresh_views, views_status, REFRESH_HEADER
+from rapports.exports import (
+    build_export_query, stream_csv, export_xlsx, ExportError, ShardedCsvExport, SHARDABLE_TYPES,
+)
+from rapports.jobs import (
+    EXPORT_FORMATS, parse_export_request, create_job, submit_job, job_status, expire_stale,
+    artifact_path, artifact_name, export_metrics,
+)
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
+import os
 import json
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 
 rapports_ns = Namespace("rapports", description="Endpoints pour les rapports et exports")
 
@@ -42,137 +52,147 @@ agent_performance_model = rapports_ns.model("AgentPerformance", {
 })
 
 
+def compute_dashboard_stats(today, conn=None):
+    """Stats du dashboard pour une journée (résultat mis en cache par DashboardStats)"""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    cur = conn.cursor()
+    
+    try:
+        # Livraisons aujourd'hui (agrégat journalier, voir rollups.py)
+        cur.execute("""
+            SELECT
+                COALESCE(SUM(nb_livraisons), 0) as total,
+                COALESCE(SUM(nb_livraisons) FILTER (WHERE statut = 'terminee'), 0) as terminees,
+                COALESCE(SUM(nb_livraisons) FILTER (WHERE statut = 'en_cours'), 0) as en_cours,
+                COALESCE(SUM(montant), 0) as montant_total
+            FROM livraisons_rollup_daily
+            WHERE jour = %s
+        """, [today])
+        
+        livraisons = cur.fetchone()
+        
+        # Agents actifs aujourd'hui (avec position récente)
+        cur.execute("""
+            SELECT COUNT(*) as count
+            FROM agents a
+            WHERE a.actif = TRUE
+            AND a.last_location_update > CURRENT_TIMESTAMP - INTERVAL '2 hours'
+        """)
+        
+        agents = cur.fetchone()
+        
+        # Quantité livrée aujourd'hui
+        cur.execute("""
+            SELECT
+                COALESCE(SUM(r.quantite), 0)::bigint as total_quantity,
+                COALESCE(SUM(r.nb_livraisons), 0) as delivery_count
+            FROM livraisons_rollup_daily r
+            WHERE r.jour = %s
+            AND r.statut = 'terminee'
+        """, [today])
+        
+        quantity = cur.fetchone()
+        
+        # Top agents aujourd'hui: parcours de l'index du classement (leaderboards.py)
+        cur.execute("""
+            SELECT
+                a.id,
+                u.nom,
+                a.telephone,
+                a.tricycle,
+                s.nb_livraisons as livraisons,
+                s.terminees,
+                s.montant,
+                COALESCE(CONCAT(a.latitude, ', ', a.longitude), 'Position inconnue') as derniere_position
+            FROM leaderboard_scores s
+            JOIN agents a ON s.entite_id = a.id
+            JOIN users u ON a.user_id = u.id
+            WHERE s.periode = 'jour' AND s.debut = %s AND s.entite = 'agent'
+            ORDER BY s.terminees DESC, s.entite_id
+            LIMIT 5
+        """, [today])
+        
+        top_agents = cur.fetchall()
+        
+        # Recent deliveries (dernières 5) avec client info
+        cur.execute("""
+            SELECT
+                l.id,
+                l.statut,
+                l.montant_percu,
+                l.adresse_livraison,
+                l.quantite,
+                u.nom as agent_nom,
+                l.created_at as heure_livraison,
+                c.nom_point_vente as nom_client
+            FROM livraisons l
+            JOIN agents a ON l.agent_id = a.id
+            JOIN users u ON a.user_id = u.id
+            LEFT JOIN clients c ON l.client_id = c.id
+            WHERE DATE(l.created_at) = %s
+            ORDER BY l.created_at DESC
+            LIMIT 5
+        """, [today])
+        
+        recent_deliveries = cur.fetchall()
+        
+        return {
+            "stats": {
+                "livraisons_today": livraisons['total'] or 0,
+                "livraisons_completed": livraisons['terminees'] or 0,
+                "livraisons_in_progress": livraisons['en_cours'] or 0,
+                "agents_active": agents['count'] or 0,
+                "quantity_delivered": quantity['total_quantity'] or 0,
+                "revenue_today": float(livraisons['montant_total'] or 0),
+            },
+            "top_agents": [
+                {
+                    "id": f"AG-{agent['id']:03d}",
+                    "nom": agent['nom'],
+                    "telephone": agent['telephone'],
+                    "numero_tricycle": agent['tricycle'] or "N/A",
+                    "nombre_livraisons_completees": agent['terminees'] or 0,
+                    "statut": "active" if agent['terminees'] and agent['terminees'] > 0 else "inactive",
+                    "derniere_position": agent['derniere_position'],
+                }
+                for agent in top_agents
+            ],
+            "recent_deliveries": [
+                {
+                    "id": f"LIV-{d['id']:03d}",
+                    "nom_client": d['nom_client'] or "Client inconnu",
+                    "agent_nom": d['agent_nom'],
+                    "quantite": d['quantite'] or 0,
+                    "montant": float(d['montant_percu'] or 0),
+                    "heure_livraison": d['heure_livraison'].strftime("%H:%M") if d['heure_livraison'] else "N/A",
+                    "statut": d['statut'],
+                    "adresse_client": d['adresse_livraison'] or "Adresse inconnue",
+                }
+                for d in recent_deliveries
+            ],
+        }
+    finally:
+        if own_conn:
+            conn.close()
+
+
 @rapports_ns.route("/dashboard")
 class DashboardStats(Resource):
     @rapports_ns.doc(security="BearerAuth")
     @jwt_required()
     def get(self):
         """Récupérer les stats du dashboard (aujourd'hui)"""
-        conn = get_connection()
-        cur = conn.cursor()
-        
+        today = datetime.now().date()
         try:
-            today = datetime.now().date()
-            
-            # Livraisons aujourd'hui
-            cur.execute("""
-                SELECT
-                    COUNT(*) as total,
-                    SUM(CASE WHEN statut = 'terminee' THEN 1 ELSE 0 END) as terminees,
-                    SUM(CASE WHEN statut = 'en_cours' THEN 1 ELSE 0 END) as en_cours,
-                    COALESCE(SUM(montant_percu), 0) as montant_total
-                FROM livraisons l
-                WHERE DATE(l.created_at) = %s
-            """, [today])
-            
-            livraisons = cur.fetchone()
-            
-            # Agents actifs aujourd'hui (avec position récente)
-            cur.execute("""
-                SELECT COUNT(*) as count
-                FROM agents a
-                WHERE a.actif = TRUE
-                AND a.last_location_update > CURRENT_TIMESTAMP - INTERVAL '2 hours'
-            """)
-            
-            agents = cur.fetchone()
-            
-            # Quantité livrée aujourd'hui
-            cur.execute("""
-                SELECT
-                    COALESCE(SUM(l.quantite), 0) as total_quantity,
-                    COUNT(DISTINCT l.id) as delivery_count
-                FROM livraisons l
-                WHERE DATE(l.created_at) = %s
-                AND l.statut = 'terminee'
-            """, [today])
-            
-            quantity = cur.fetchone()
-            
-            # Top agents aujourd'hui
-            cur.execute("""
-                SELECT
-                    a.id,
-                    u.nom,
-                    a.telephone,
-                    a.tricycle,
-                    COUNT(*) as livraisons,
-                    SUM(CASE WHEN l.statut = 'terminee' THEN 1 ELSE 0 END) as terminees,
-                    COALESCE(SUM(l.montant_percu), 0) as montant,
-                    COALESCE(CONCAT(a.latitude, ', ', a.longitude), 'Position inconnue') as derniere_position
-                FROM livraisons l
-                JOIN agents a ON l.agent_id = a.id
-                JOIN users u ON a.user_id = u.id
-                WHERE DATE(l.created_at) = %s
-                GROUP BY a.id, u.id, u.nom, a.telephone, a.tricycle, a.latitude, a.longitude
-                ORDER BY terminees DESC
-                LIMIT 5
-            """, [today])
-            
-            top_agents = cur.fetchall()
-            
-            # Recent deliveries (dernières 5) avec client info
-            cur.execute("""
-                SELECT
-                    l.id,
-                    l.statut,
-                    l.montant_percu,
-                    l.adresse_livraison,
-                    l.quantite,
-                    u.nom as agent_nom,
-                    l.created_at as heure_livraison,
-                    c.nom_point_vente as nom_client
-                FROM livraisons l
-                JOIN agents a ON l.agent_id = a.id
-                JOIN users u ON a.user_id = u.id
-                LEFT JOIN clients c ON l.client_id = c.id
-                WHERE DATE(l.created_at) = %s
-                ORDER BY l.created_at DESC
-                LIMIT 5
-            """, [today])
-            
-            recent_deliveries = cur.fetchall()
-            
-            return {
-                "stats": {
-                    "livraisons_today": livraisons['total'] or 0,
-                    "livraisons_completed": livraisons['terminees'] or 0,
-                    "livraisons_in_progress": livraisons['en_cours'] or 0,
-                    "agents_active": agents['count'] or 0,
-                    "quantity_delivered": quantity['total_quantity'] or 0,
-                    "revenue_today": float(livraisons['montant_total'] or 0),
-                },
-                "top_agents": [
-                    {
-                        "id": f"AG-{agent['id']:03d}",
-                        "nom": agent['nom'],
-                        "telephone": agent['telephone'],
-                        "numero_tricycle": agent['tricycle'] or "N/A",
-                        "nombre_livraisons_completees": agent['terminees'] or 0,
-                        "statut": "active" if agent['terminees'] and agent['terminees'] > 0 else "inactive",
-                        "derniere_position": agent['derniere_position'],
-                    }
-                    for agent in top_agents
-                ],
-                "recent_deliveries": [
-                    {
-                        "id": f"LIV-{d['id']:03d}",
-                        "nom_client": d['nom_client'] or "Client inconnu",
-                        "agent_nom": d['agent_nom'],
-                        "quantite": d['quantite'] or 0,
-                        "montant": float(d['montant_percu'] or 0),
-                        "heure_livraison": d['heure_livraison'].strftime("%H:%M") if d['heure_livraison'] else "N/A",
-                        "statut": d['statut'],
-                        "adresse_client": d['adresse_livraison'] or "Adresse inconnue",
-                    }
-                    for d in recent_deliveries
-                ],
-            }
-        
+            return cached(
+                f"rapports:dashboard:{today.isoformat()}",
+                lambda: compute_dashboard_stats(today),
+                tags=(CACHE_TAG_DASHBOARD,),
+            )
         except Exception as e:
             rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
-        finally:
-            conn.close()
 
 
 @rapports_ns.route("/resume")
@@ -190,32 +210,39 @@ class RapportResume(Resource):
             end_date = request.args.get('end_date')
             
             date_filter = ""
+            rollup_filter = ""
+            date_params = []
             if start_date and end_date:
-                date_filter = f"AND DATE(l.created_at) BETWEEN '{start_date}' AND '{end_date}'"
+                date_filter = "AND DATE(l.created_at) BETWEEN %s AND %s"
+                rollup_filter = "AND jour BETWEEN %s AND %s"
+                date_params = [start_date, end_date]
             
-            # KPI Livraisons
+            # Inclure l'archive seulement si la période remonte avant la coupure
+            commandes = commandes_source(cur, start_date if end_date else None)
+            
+            # KPI Livraisons (l'agrégat journalier couvre aussi l'archive)
             cur.execute(f"""
                 SELECT
-                    COUNT(*) as total,
-                    SUM(CASE WHEN statut = 'terminee' THEN 1 ELSE 0 END) as terminees,
-                    SUM(CASE WHEN statut = 'en_cours' THEN 1 ELSE 0 END) as en_cours,
-                    SUM(CASE WHEN statut = 'en_attente' THEN 1 ELSE 0 END) as en_attente,
-                    SUM(CASE WHEN statut = 'probleme' THEN 1 ELSE 0 END) as problemes,
-                    COALESCE(SUM(montant_percu), 0) as montant_total,
-                    COALESCE(SUM(montant_percu), 0) as montant_collecte
-                FROM livraisons l
-                WHERE 1=1 {date_filter}
-            """)
+                    COALESCE(SUM(nb_livraisons), 0) as total,
+                    COALESCE(SUM(nb_livraisons) FILTER (WHERE statut = 'terminee'), 0) as terminees,
+                    COALESCE(SUM(nb_livraisons) FILTER (WHERE statut = 'en_cours'), 0) as en_cours,
+                    COALESCE(SUM(nb_livraisons) FILTER (WHERE statut = 'en_attente'), 0) as en_attente,
+                    COALESCE(SUM(nb_livraisons) FILTER (WHERE statut = 'probleme'), 0) as problemes,
+                    COALESCE(SUM(montant), 0) as montant_total,
+                    COALESCE(SUM(montant), 0) as montant_collecte
+                FROM livraisons_rollup_daily
+                WHERE 1=1 {rollup_filter}
+            """, date_params)
             
             livraisons_data = cur.fetchone()
             
             # Nombre de clients uniques
             cur.execute(f"""
                 SELECT COUNT(DISTINCT c.id) as total_clients
-                FROM commandes cmd
+                FROM {commandes} cmd
                 JOIN clients c ON cmd.client_id = c.id
                 WHERE 1=1 {date_filter.replace('l.', 'cmd.')}
-            """)
+            """, date_params)
             clients_data = cur.fetchone()
             
             # Nombre d'agents actifs
@@ -247,48 +274,124 @@ class RapportResume(Resource):
             conn.close()
 
 
+def compute_tendances_mensuelles(conn=None):
+    """Tendances des 12 derniers mois (résultat mis en cache par TendancesMensuelles)"""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("""
+            SELECT
+                TO_CHAR(DATE_TRUNC('month', r.jour), 'Mon') as month_name,
+                TO_CHAR(DATE_TRUNC('month', r.jour), 'MM') as month_num,
+                TO_CHAR(DATE_TRUNC('month', r.jour), 'YYYY') as year,
+                SUM(r.nb_livraisons) as livraisons,
+                COALESCE(SUM(r.montant), 0) as montant,
+                COALESCE(SUM(r.montant) FILTER (WHERE r.statut = 'terminee'), 0) as collecte
+            FROM livraisons_rollup_daily r
+            WHERE r.jour >= CURRENT_DATE - INTERVAL '12 months'
+            GROUP BY DATE_TRUNC('month', r.jour)
+            ORDER BY year DESC, month_num DESC
+        """)
+        
+        rows = cur.fetchall()
+        result = []
+        
+        for row in rows:
+            result.append({
+                "month": f"{row['month_name']} {row['year']}",
+                "livraisons": row['livraisons'] or 0,
+                "montant": float(row['montant'] or 0),
+                "collecte": float(row['collecte'] or 0),
+            })
+        
+        # Retourner dans l'ordre chronologique (ancien au nouveau)
+        return list(reversed(result))
+    finally:
+        if own_conn:
+            conn.close()
+
+
 @rapports_ns.route("/tendances-mensuelles")
 class TendancesMensuelles(Resource):
     @rapports_ns.doc(security="BearerAuth")
     @jwt_required()
     def get(self):
         """Récupérer les tendances mensuelles (derniers 12 mois)"""
-        conn = get_connection()
-        cur = conn.cursor()
-        
         try:
-            cur.execute("""
-                SELECT
-                    TO_CHAR(DATE_TRUNC('month', l.created_at), 'Mon') as month_name,
-                    TO_CHAR(DATE_TRUNC('month', l.created_at), 'MM') as month_num,
-                    TO_CHAR(DATE_TRUNC('month', l.created_at), 'YYYY') as year,
-                    COUNT(*) as livraisons,
-                    COALESCE(SUM(montant_percu), 0) as montant,
-                    COALESCE(SUM(CASE WHEN statut = 'terminee' THEN montant_percu ELSE 0 END), 0) as collecte
-                FROM livraisons l
-                WHERE l.created_at > CURRENT_DATE - INTERVAL '12 months'
-                GROUP BY DATE_TRUNC('month', l.created_at)
-                ORDER BY year DESC, month_num DESC
-            """)
-            
-            rows = cur.fetchall()
-            result = []
-            
-            for row in rows:
-                result.append({
-                    "month": f"{row['month_name']} {row['year']}",
-                    "livraisons": row['livraisons'] or 0,
-                    "montant": float(row['montant'] or 0),
-                    "collecte": float(row['collecte'] or 0),
-                })
-            
-            # Retourner dans l'ordre chronologique (ancien au nouveau)
-            return list(reversed(result))
-        
+            return cached(
+                "rapports:tendances-mensuelles",
+                compute_tendances_mensuelles,
+                ttl=REPORT_CACHE_TTL,
+                tags=(CACHE_TAG_RAPPORTS,),
+            )
         except Exception as e:
             rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
-        finally:
-            conn.close()
+
+
+def compute_performance_agents(start_date, end_date):
+    """
+    Performance par agent (résultat mis en cache par PerformanceAgents).
+    Lue dans l'agrégat journalier livraisons_rollup_daily, à jour à la
+    lecture: la date renvoyée est celle du calcul.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    
+    try:
+        date_filter = ""
+        date_params = []
+        if start_date and end_date:
+            date_filter = "AND m.jour BETWEEN %s AND %s"
+            date_params = [start_date, end_date]
+        
+        cur.execute(f"""
+            SELECT
+                a.id,
+                u.nom,
+                a.telephone,
+                a.tricycle,
+                SUM(m.nb_livraisons)::bigint as total_livraisons,
+                COALESCE(SUM(m.nb_livraisons) FILTER (WHERE m.statut = 'terminee'), 0)::bigint as livraisons_completees,
+                COALESCE(SUM(m.nb_livraisons) FILTER (WHERE m.statut = 'en_cours'), 0)::bigint as livraisons_en_cours,
+                COALESCE(SUM(m.montant), 0) as montant_total,
+                COALESCE(SUM(m.montant) FILTER (WHERE m.statut = 'terminee'), 0) as montant_collecte
+            FROM livraisons_rollup_daily m
+            JOIN agents a ON m.agent_id = a.id
+            JOIN users u ON a.user_id = u.id
+            WHERE 1=1 {date_filter}
+            GROUP BY a.id, u.nom, a.telephone, a.tricycle
+            ORDER BY livraisons_completees DESC
+        """, date_params)
+        
+        rows = cur.fetchall()
+        result = []
+        
+        for row in rows:
+            total = row['total_livraisons'] or 0
+            completed = row['livraisons_completees'] or 0
+            
+            result.append({
+                "id": row['id'],
+                "nom": row['nom'],
+                "telephone": row['telephone'],
+                "tricycle": row['tricycle'],
+                "total_livraisons": total,
+                "livraisons_completees": completed,
+                "livraisons_en_cours": row['livraisons_en_cours'] or 0,
+                "montant_total": float(row['montant_total'] or 0),
+                "montant_collecte": float(row['montant_collecte'] or 0),
+                "taux_completion": round((completed / total * 100) if total > 0 else 0, 1),
+            })
+        
+        return {
+            "data": result,
+            "refreshed_at": datetime.now().isoformat(),
+        }
+    finally:
+        conn.close()
 
 
 @rapports_ns.route("/performance-agents")
@@ -296,60 +399,287 @@ class PerformanceAgents(Resource):
     @rapports_ns.doc(security="BearerAuth")
     @jwt_required()
     def get(self):
-        """Récupérer la performance de chaque agent"""
+        """Récupérer la performance de chaque agent (date de la vue: en-tête X-Data-Refreshed-At)"""
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        
+        try:
+            resultat = cached(
+                f"rapports:performance-agents-vue:{start_date}:{end_date}",
+                lambda: compute_performance_agents(start_date, end_date),
+                ttl=REPORT_CACHE_TTL,
+                tags=(CACHE_TAG_RAPPORTS,),
+            )
+            return resultat["data"], 200, {REFRESH_HEADER: resultat["refreshed_at"] or ""}
+        except Exception as e:
+            rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
+
+
+def compute_pivot(spec):
+    """Pivot sur l'agrégat journalier ou par produit (résultat mis en cache par Pivot)"""
+    conn = get_connection()
+    cur = conn.cursor()
+    
+    try:
+        return run_pivot(cur, spec)
+    finally:
+        conn.close()
+
+
+@rapports_ns.route("/pivot")
+class Pivot(Resource):
+    @rapports_ns.doc(security="BearerAuth", params={
+        "dimensions": "jour|semaine|mois, agent, client, statut, produit, zone (séparées par des virgules)",
+        "mesures": "nombre, quantite, montant, collecte (défaut: nombre,montant)",
+        "axe": "creation (défaut) ou livraison: date utilisée pour les dimensions et filtres de date",
+        "start_date": "AAAA-MM-JJ",
+        "end_date": "AAAA-MM-JJ",
+        "agent_id": "Filtre, identifiants séparés par des virgules",
+        "client_id": "Filtre, identifiants séparés par des virgules",
+        "statut": "Filtre, statuts séparés par des virgules",
+        "zone": "Filtre sur l'adresse du client",
+        "limite": "Nombre maximal de lignes (1000 par défaut)",
+    })
+    @jwt_required()
+    def get(self):
+        """Rapport pivot: dimensions, mesures et filtres libres, résultat par colonnes"""
+        try:
+            spec = parse_pivot_args(request.args)
+        except PivotError as e:
+            return {"error": str(e)}, 400
+        
+        try:
+            return cached(
+                pivot_cache_key(spec),
+                lambda: compute_pivot(spec),
+                ttl=REPORT_CACHE_TTL,
+                tags=(CACHE_TAG_RAPPORTS,),
+            )
+        except Exception as e:
+            rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
+
+
+@rapports_ns.route("/vues")
+class VuesMaterialisees(Resource):
+    @rapports_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def get(self):
+        """Date du dernier rafraîchissement des vues matérialisées"""
+        try:
+            return views_status(), 200
+        except Exception as e:
+            rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
+    
+    @rapports_ns.doc(security="BearerAuth", params={"vue": "Vue à rafraîchir (toutes par défaut)"})
+    @jwt_required()
+    def post(self):
+        """Rafraîchir les vues matérialisées maintenant (admin)"""
+        if get_jwt().get("role") != "admin":
+            return {"error": "Accès réservé aux administrateurs"}, 403
+        
+        vue = request.args.get("vue")
+        if vue and vue not in VUES:
+            return {"error": f"Vue invalide (valeurs possibles: {', '.join(VUES)})"}, 400
+        
+        try:
+            resultats = refresh_views((vue,) if vue else VUES)
+            # Rapports en cache calculés sur l'ancienne version
+            invalidate(CACHE_TAG_RAPPORTS)
+            return resultats, 200
+        except Exception as e:
+            rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
+
+
+def compute_cohortes(debut, fin, semaines, zone, agent_id):
+    """Matrice de rétention des cohortes (résultat mis en cache par Cohortes)"""
+    conn = get_connection()
+    cur = conn.cursor()
+    
+    try:
+        return cohort_matrix(cur, debut, fin, semaines, zone, agent_id)
+    finally:
+        conn.close()
+
+
+@rapports_ns.route("/cohortes")
+class Cohortes(Resource):
+    @rapports_ns.doc(security="BearerAuth", params={
+        "start_date": "Première semaine d'inscription, AAAA-MM-JJ (défaut: 25 semaines avant la semaine courante)",
+        "end_date": "Dernière semaine d'inscription, AAAA-MM-JJ (défaut: semaine courante)",
+        "semaines": f"Semaines suivies après l'inscription (défaut: {COHORTES_SEMAINES_DEFAUT}, max: {COHORTES_SEMAINES_MAX})",
+        "zone": "Texte recherché dans l'adresse du client",
+        "agent_id": "Agent de la première commande du client",
+    })
+    @jwt_required()
+    def get(self):
+        """Rétention hebdomadaire des clients par semaine d'inscription"""
+        try:
+            debut = datetime.strptime(request.args['start_date'], "%Y-%m-%d").date() if request.args.get('start_date') else None
+            fin = datetime.strptime(request.args['end_date'], "%Y-%m-%d").date() if request.args.get('end_date') else None
+            semaines = int(request.args.get('semaines', COHORTES_SEMAINES_DEFAUT))
+            agent_id = int(request.args['agent_id']) if request.args.get('agent_id') else None
+        except ValueError:
+            return {"error": "Paramètres invalides (dates AAAA-MM-JJ, semaines et agent_id entiers)"}, 400
+        semaines = max(1, min(semaines, COHORTES_SEMAINES_MAX))
+        zone = (request.args.get('zone') or '').strip() or None
+        
+        try:
+            return cached(
+                f"rapports:cohortes:{debut}:{fin}:{semaines}:{zone or ''}:{agent_id or ''}",
+                lambda: compute_cohortes(debut, fin, semaines, zone, agent_id),
+                ttl=REPORT_CACHE_TTL,
+                tags=(CACHE_TAG_RAPPORTS,),
+            )
+        except Exception as e:
+            rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
+
+
+ANOMALIE_STATUTS = ("nouvelle", "verifiee", "ignoree")
+
+
+@rapports_ns.route("/anomalies")
+class Anomalies(Resource):
+    @rapports_ns.doc(security="BearerAuth", params={
+        "start_date": "AAAA-MM-JJ (jour de livraison)",
+        "end_date": "AAAA-MM-JJ",
+        "regle": f"Une des règles: {', '.join(ANOMALIE_REGLES)}",
+        "agent_id": "Identifiant de l'agent",
+        "client_id": "Identifiant du client",
+        "statut": f"{' | '.join(ANOMALIE_STATUTS)}",
+        "page": "Page (défaut: 1)",
+        "per_page": "Lignes par page (défaut: 50)",
+    })
+    @jwt_required()
+    def get(self):
+        """Livraisons signalées par l'analyse des anomalies (admin, voir anomalies.py)"""
+        if get_jwt().get("role") != "admin":
+            return {"error": "Accès réservé aux administrateurs"}, 403
+        
+        regle = request.args.get('regle')
+        statut = request.args.get('statut')
+        if regle and regle not in ANOMALIE_REGLES:
+            return {"error": f"Règle invalide (valeurs possibles: {', '.join(ANOMALIE_REGLES)})"}, 400
+        if statut and statut not in ANOMALIE_STATUTS:
+            return {"error": f"Statut invalide (valeurs possibles: {', '.join(ANOMALIE_STATUTS)})"}, 400
+        
         conn = get_connection()
         cur = conn.cursor()
         
         try:
             start_date = request.args.get('start_date')
             end_date = request.args.get('end_date')
+            page = max(1, int(request.args.get('page', 1)))
+            per_page = max(1, min(int(request.args.get('per_page', 50)), 500))
             
-            date_filter = ""
-            if start_date and end_date:
-                date_filter = f"AND DATE(l.created_at) BETWEEN '{start_date}' AND '{end_date}'"
+            filters = ["1=1"]
+            params = []
+            if start_date:
+                filters.append("a.jour >= %s")
+                params.append(start_date)
+            if end_date:
+                filters.append("a.jour <= %s")
+                params.append(end_date)
+            if regle:
+                filters.append("a.regle = %s")
+                params.append(regle)
+            if statut:
+                filters.append("a.statut = %s")
+                params.append(statut)
+            if request.args.get('agent_id'):
+                filters.append("a.agent_id = %s")
+                params.append(int(request.args['agent_id']))
+            if request.args.get('client_id'):
+                filters.append("a.client_id = %s")
+                params.append(int(request.args['client_id']))
+            where_clause = " AND ".join(filters)
+            
+            cur.execute(f"""
+                SELECT a.regle, COUNT(*) as nombre
+                FROM livraisons_anomalies a
+                WHERE {where_clause}
+                GROUP BY a.regle
+            """, params)
+            par_regle = {row['regle']: row['nombre'] for row in cur.fetchall()}
+            total = sum(par_regle.values())
             
             cur.execute(f"""
                 SELECT
-                    a.id,
-                    u.nom,
-                    a.telephone,
-                    a.tricycle,
-                    COUNT(*) as total_livraisons,
-                    SUM(CASE WHEN l.statut = 'terminee' THEN 1 ELSE 0 END) as livraisons_completees,
-                    SUM(CASE WHEN l.statut = 'en_cours' THEN 1 ELSE 0 END) as livraisons_en_cours,
-                    COALESCE(SUM(l.montant_percu), 0) as montant_total,
-                    COALESCE(SUM(CASE WHEN l.statut = 'terminee' THEN l.montant_percu ELSE 0 END), 0) as montant_collecte
-                FROM livraisons l
-                JOIN agents a ON l.agent_id = a.id
-                JOIN users u ON a.user_id = u.id
-                WHERE 1=1 {date_filter}
-                GROUP BY a.id, u.nom, a.telephone, a.tricycle
-                ORDER BY livraisons_completees DESC
-            """)
+                    a.id, a.livraison_id, a.jour, a.agent_id, a.client_id, a.commande_id,
+                    a.regle, a.valeur, a.reference, a.score, a.statut, a.detected_at,
+                    ag.nom as agent_nom,
+                    c.nom_point_vente as client_nom
+                FROM livraisons_anomalies a
+                LEFT JOIN agents ag ON ag.id = a.agent_id
+                LEFT JOIN clients c ON c.id = a.client_id
+                WHERE {where_clause}
+                ORDER BY a.jour DESC, ABS(a.score) DESC
+                LIMIT %s OFFSET %s
+            """, params + [per_page, (page - 1) * per_page])
             
-            rows = cur.fetchall()
             result = []
-            
-            for row in rows:
-                total = row['total_livraisons'] or 0
-                completed = row['livraisons_completees'] or 0
-                
+            for row in cur.fetchall():
                 result.append({
                     "id": row['id'],
-                    "nom": row['nom'],
-                    "telephone": row['telephone'],
-                    "tricycle": row['tricycle'],
-                    "total_livraisons": total,
-                    "livraisons_completees": completed,
-                    "livraisons_en_cours": row['livraisons_en_cours'] or 0,
-                    "montant_total": float(row['montant_total'] or 0),
-                    "montant_collecte": float(row['montant_collecte'] or 0),
-                    "taux_completion": round((completed / total * 100) if total > 0 else 0, 1),
+                    "livraison_id": row['livraison_id'],
+                    "commande_id": row['commande_id'],
+                    "jour": row['jour'].isoformat(),
+                    "agent_id": row['agent_id'],
+                    "agent": row['agent_nom'],
+                    "client_id": row['client_id'],
+                    "client": row['client_nom'],
+                    "regle": row['regle'],
+                    "valeur": float(row['valeur']) if row['valeur'] is not None else None,
+                    "reference": float(row['reference']) if row['reference'] is not None else None,
+                    "score": float(row['score']),
+                    "statut": row['statut'],
+                    "detected_at": row['detected_at'].isoformat(),
                 })
             
-            return result
+            return {
+                "total": total,
+                "par_regle": par_regle,
+                "page": page,
+                "per_page": per_page,
+                "pages": (total + per_page - 1) // per_page,
+                "data": result
+            }
+        
+        except ValueError:
+            return {"error": "page, per_page, agent_id et client_id doivent être des entiers"}, 400
+        except Exception as e:
+            rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
+        finally:
+            conn.close()
+
+
+@rapports_ns.route("/anomalies/<int:anomalie_id>")
+class AnomalieStatut(Resource):
+    @rapports_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def put(self, anomalie_id):
+        """Marquer une anomalie vérifiée ou ignorée (admin); gardée par les analyses suivantes"""
+        if get_jwt().get("role") != "admin":
+            return {"error": "Accès réservé aux administrateurs"}, 403
+        
+        statut = (request.get_json() or {}).get("statut")
+        if statut not in ANOMALIE_STATUTS:
+            return {"error": f"Statut invalide (valeurs possibles: {', '.join(ANOMALIE_STATUTS)})"}, 400
+        
+        conn = get_connection()
+        cur = conn.cursor()
         
+        try:
+            cur.execute(
+                "UPDATE livraisons_anomalies SET statut = %s WHERE id = %s RETURNING id, statut",
+                (statut, anomalie_id)
+            )
+            row = cur.fetchone()
+            if not row:
+                return {"error": "Anomalie introuvable"}, 404
+            conn.commit()
+            return row, 200
         except Exception as e:
+            conn.rollback()
             rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
         finally:
             conn.close()
@@ -390,10 +720,13 @@ class DetailsLivraisons(Resource):
             where_clause = " AND ".join(filters)
             offset = (page - 1) * per_page
             
+            livraisons = livraisons_source(cur, start_date if end_date else None)
+            commandes = commandes_source(cur, start_date if end_date else None)
+            
             # Récupérer le total
             cur.execute(f"""
                 SELECT COUNT(*) as total
-                FROM livraisons l
+                FROM {livraisons} l
                 WHERE {where_clause}
             """, params)
             
@@ -413,10 +746,10 @@ class DetailsLivraisons(Resource):
                     u.nom as agent_nom,
                     ag.telephone as agent_telephone,
                     c.nom_point_vente as client_nom
-                FROM livraisons l
+                FROM {livraisons} l
                 JOIN agents ag ON l.agent_id = ag.id
                 JOIN users u ON ag.user_id = u.id
-                JOIN commandes cmd ON l.commande_id = cmd.id
+                JOIN {commandes} cmd ON l.commande_id = cmd.id
                 JOIN clients c ON cmd.client_id = c.id
                 WHERE {where_clause}
                 ORDER BY l.created_at DESC
@@ -459,120 +792,96 @@ class ExportCSV(Resource):
     @rapports_ns.doc(security="BearerAuth")
     @jwt_required()
     def get(self):
-        """Exporter les livraisons en CSV"""
+        """
+        Exporter les livraisons en CSV (flux COPY, mémoire constante).
+        shards > 1: lecture en tranches parallèles (type livraisons).
+        """
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        report_type = request.args.get('type', 'livraisons')
+        shards = request.args.get('shards', 1, type=int)
+        
         conn = get_connection()
         cur = conn.cursor()
         
         try:
-            start_date = request.args.get('start_date')
-            end_date = request.args.get('end_date')
-            report_type = request.args.get('type', 'livraisons')
-            
-            filters = ["1=1"]
-            params = []
-            
-            if start_date and end_date:
-                filters.append(f"DATE(l.created_at) BETWEEN %s AND %s")
-                params.extend([start_date, end_date])
-            
-            where_clause = " AND ".join(filters)
-            
-            if report_type == 'livraisons':
-                cur.execute(f"""
-                    SELECT
-                        l.id,
-                        l.commande_id,
-                        u.nom as agent_nom,
-                        c.nom_point_vente as client_nom,
-                        l.adresse_livraison,
-                        l.statut,
-                        l.montant_percu,
-                        l.date_livraison,
-                        l.heure_livraison
-                    FROM livraisons l
-                    JOIN agents ag ON l.agent_id = ag.id
-                    JOIN users u ON ag.user_id = u.id
-                    JOIN commandes cmd ON l.commande_id = cmd.id
-                    JOIN clients c ON cmd.client_id = c.id
-                    WHERE {where_clause}
-                    ORDER BY l.created_at DESC
-                """, params)
-                
-                rows = cur.fetchall()
-                
-                # Créer CSV
-                output = StringIO()
-                fieldnames = ['ID', 'Commande', 'Agent', 'Client', 'Adresse', 'Statut', 'Montant', 'Date', 'Heure']
-                writer = csv.DictWriter(output, fieldnames=fieldnames)
-                writer.writeheader()
-                
-                for row in rows:
-                    writer.writerow({
-                        'ID': row['id'],
-                        'Commande': row['commande_id'],
-                        'Agent': row['agent_nom'],
-                        'Client': row['client_nom'],
-                        'Adresse': row['adresse_livraison'],
-                        'Statut': row['statut'],
-                        'Montant': row['montant_percu'],
-                        'Date': row['date_livraison'],
-                        'Heure': row['heure_livraison'],
-                    })
-            
-            elif report_type == 'agents':
-                cur.execute(f"""
-                    SELECT
-                        a.id,
-                        u.nom,
-                        a.telephone,
-                        a.tricycle,
-                        COUNT(*) as total_livraisons,
-                        SUM(CASE WHEN l.statut = 'terminee' THEN 1 ELSE 0 END) as livraisons_completees,
-                        COALESCE(SUM(l.montant_percu), 0) as montant_total
-                    FROM livraisons l
-                    JOIN agents a ON l.agent_id = a.id
-                    JOIN users u ON a.user_id = u.id
-                    WHERE {where_clause}
-                    GROUP BY a.id, u.nom, a.telephone, a.tricycle
-                    ORDER BY total_livraisons DESC
-                """, params)
-                
-                rows = cur.fetchall()
-                
-                output = StringIO()
-                fieldnames = ['ID Agent', 'Nom', 'Téléphone', 'Tricycle', 'Total Livraisons', 'Complétées', 'Montant']
-                writer = csv.DictWriter(output, fieldnames=fieldnames)
-                writer.writeheader()
-                
-                for row in rows:
-                    writer.writerow({
-                        'ID Agent': row['id'],
-                        'Nom': row['nom'],
-                        'Téléphone': row['telephone'],
-                        'Tricycle': row['tricycle'],
-                        'Total Livraisons': row['total_livraisons'],
-                        'Complétées': row['livraisons_completees'],
-                        'Montant': row['montant_total'],
-                    })
-            
-            # Retourner le fichier CSV
-            mem = BytesIO()
-            mem.write(output.getvalue().encode('utf-8-sig'))  # UTF-8 with BOM pour Excel
-            mem.seek(0)
-            
-            filename = f"rapport_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            
-            return send_file(
-                mem,
-                mimetype="text/csv",
-                as_attachment=True,
-                download_name=filename
-            )
-        
+            sql, params, _ = build_export_query(cur, report_type, start_date, end_date)
+        except ExportError as e:
+            return {"error": str(e)}, 400
         except Exception as e:
             rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
         finally:
             conn.close()
+        
+        export = None
+        try:
+            if shards > 1 and report_type in SHARDABLE_TYPES:
+                export = ShardedCsvExport(report_type, start_date, end_date, shards).start()
+                chunks = export.chunks()
+            else:
+                chunks = stream_csv(sql, params)
+        except Exception as e:
+            rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
+        
+        filename = f"rapport_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        
+        response = Response(
+            chunks,
+            mimetype="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+        if export:
+            # Réponse fermée avant le premier morceau: connexions rendues quand même
+            response.call_on_close(export.close)
+        return response
+
+
+STATUS_COLORS = {
+    'terminee': '#22c55e',
+    'en_cours': '#3b82f6',
+    'en_attente': '#f59e0b',
+    'probleme': '#ef4444',
+}
+
+
+def compute_statistiques_par_statut(start_date=None, end_date=None, conn=None):
+    """Livraisons par statut (agrégat journalier) -> (lignes, date du calcul)"""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    cur = conn.cursor()
+    
+    try:
+        date_filter = ""
+        date_params = []
+        if start_date and end_date:
+            date_filter = "AND m.jour BETWEEN %s AND %s"
+            date_params = [start_date, end_date]
+        
+        cur.execute(f"""
+            SELECT
+                m.statut,
+                SUM(m.nb_livraisons)::bigint as nombre,
+                COALESCE(SUM(m.montant), 0) as montant
+            FROM livraisons_rollup_daily m
+            WHERE 1=1 {date_filter}
+            GROUP BY m.statut
+            ORDER BY nombre DESC
+        """, date_params)
+        
+        result = []
+        for row in cur.fetchall():
+            result.append({
+                "statut": row['statut'],
+                "nombre": row['nombre'],
+                "montant": float(row['montant']),
+                "color": STATUS_COLORS.get(row['statut'], '#9ca3af'),
+            })
+        
+        return result, datetime.now().isoformat()
+    finally:
+        if own_conn:
+            conn.close()
 
 
 @rapports_ns.route("/statistiques-par-statut")
@@ -580,214 +889,174 @@ class StatistiquesParStatut(Resource):
     @rapports_ns.doc(security="BearerAuth")
     @jwt_required()
     def get(self):
-        """Récupérer les statistiques par statut de livraison"""
+        """Récupérer les statistiques par statut de livraison (date de la vue: en-tête X-Data-Refreshed-At)"""
+        try:
+            result, refreshed_at = compute_statistiques_par_statut(
+                request.args.get('start_date'), request.args.get('end_date')
+            )
+            return result, 200, {REFRESH_HEADER: refreshed_at or ""}
+        except Exception as e:
+            rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
+
+
+@rapports_ns.route("/export/excel")
+class ExportExcel(Resource):
+    @rapports_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def get(self):
+        """Exporter les livraisons en Excel (write-only, mémoire plafonnée)"""
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        report_type = request.args.get('type', 'livraisons')
+        
         conn = get_connection()
         cur = conn.cursor()
         
         try:
-            start_date = request.args.get('start_date')
-            end_date = request.args.get('end_date')
-            
-            date_filter = ""
-            if start_date and end_date:
-                date_filter = f"AND DATE(l.created_at) BETWEEN '{start_date}' AND '{end_date}'"
-            
-            cur.execute(f"""
-                SELECT
-                    l.statut,
-                    COUNT(*) as nombre,
-                    COALESCE(SUM(l.montant_percu), 0) as montant
-                FROM livraisons l
-                WHERE 1=1 {date_filter}
-                GROUP BY l.statut
-                ORDER BY nombre DESC
-            """)
-            
-            rows = cur.fetchall()
-            
-            status_colors = {
-                'terminee': '#22c55e',
-                'en_cours': '#3b82f6',
-                'en_attente': '#f59e0b',
-                'probleme': '#ef4444',
-            }
-            
-            result = []
-            for row in rows:
-                result.append({
-                    "statut": row['statut'],
-                    "nombre": row['nombre'],
-                    "montant": float(row['montant']),
-                    "color": status_colors.get(row['statut'], '#9ca3af'),
-                })
-            
-            return result
-        
+            sql, params, headers = build_export_query(cur, report_type, start_date, end_date)
+        except ExportError as e:
+            return {"error": str(e)}, 400
         except Exception as e:
             rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
         finally:
             conn.close()
+        
+        try:
+            path, _ = export_xlsx(sql, params, headers)
+        except Exception as e:
+            rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
+        
+        # Le fichier reste lisible après suppression de son nom (envoyé puis fermé)
+        fichier = open(path, "rb")
+        os.remove(path)
+        
+        filename = f"rapport_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        
+        return send_file(
+            fichier,
+            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            as_attachment=True,
+            download_name=filename
+        )
 
 
-@rapports_ns.route("/export/excel")
-class ExportExcel(Resource):
+@rapports_ns.route("/exports")
+class ExportJobs(Resource):
     @rapports_ns.doc(security="BearerAuth")
     @jwt_required()
-    def get(self):
-        """Exporter les livraisons en Excel"""
+    def post(self):
+        """
+        Lancer un export en arrière-plan.
+        Corps: format (csv|xlsx), type, start_date, end_date, shards (CSV en tranches parallèles).
+        Une demande identique sur une période close réutilise l'export existant.
+        """
+        try:
+            data = request.get_json() or {}
+            fmt, report_type, start_date, end_date = parse_export_request(data)
+            shards = int(data.get("shards") or 1)
+        except (ExportError, TypeError, ValueError) as e:
+            return {"error": str(e)}, 400
+        
         conn = get_connection()
         cur = conn.cursor()
         
         try:
-            start_date = request.args.get('start_date')
-            end_date = request.args.get('end_date')
-            report_type = request.args.get('type', 'livraisons')
-            
-            filters = ["1=1"]
-            params = []
-            
-            if start_date and end_date:
-                filters.append(f"DATE(l.created_at) BETWEEN %s AND %s")
-                params.extend([start_date, end_date])
-            
-            where_clause = " AND ".join(filters)
-            
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Rapports"
-            
-            # Define header style
-            header_fill = PatternFill(start_color="1f2937", end_color="1f2937", fill_type="solid")
-            header_font = Font(bold=True, color="FFFFFF", size=12)
-            header_alignment = Alignment(horizontal="center", vertical="center")
-            border = Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
-            
-            if report_type == 'livraisons':
-                cur.execute(f"""
-                    SELECT
-                        l.id,
-                        l.commande_id,
-                        u.nom as agent_nom,
-                        c.nom_point_vente as client_nom,
-                        l.adresse_livraison,
-                        l.statut,
-                        l.montant_percu,
-                        l.date_livraison,
-                        l.heure_livraison
-                    FROM livraisons l
-                    JOIN agents ag ON l.agent_id = ag.id
-                    JOIN users u ON ag.user_id = u.id
-                    JOIN commandes cmd ON l.commande_id = cmd.id
-                    JOIN clients c ON cmd.client_id = c.id
-                    WHERE {where_clause}
-                    ORDER BY l.created_at DESC
-                """, params)
-                
-                rows = cur.fetchall()
-                
-                # Add headers
-                headers = ['ID', 'Commande', 'Agent', 'Client', 'Adresse', 'Statut', 'Montant', 'Date', 'Heure']
-                for col_num, header in enumerate(headers, 1):
-                    cell = ws.cell(row=1, column=col_num)
-                    cell.value = header
-                    cell.fill = header_fill
-                    cell.font = header_font
-                    cell.alignment = header_alignment
-                    cell.border = border
-                
-                # Add data
-                for row_num, row in enumerate(rows, 2):
-                    ws.cell(row=row_num, column=1).value = row['id']
-                    ws.cell(row=row_num, column=2).value = row['commande_id']
-                    ws.cell(row=row_num, column=3).value = row['agent_nom']
-                    ws.cell(row=row_num, column=4).value = row['client_nom']
-                    ws.cell(row=row_num, column=5).value = row['adresse_livraison']
-                    ws.cell(row=row_num, column=6).value = row['statut']
-                    ws.cell(row=row_num, column=7).value = float(row['montant_percu'] or 0)
-                    ws.cell(row=row_num, column=8).value = row['date_livraison']
-                    ws.cell(row=row_num, column=9).value = row['heure_livraison']
-                    
-                    for col_num in range(1, 10):
-                        ws.cell(row=row_num, column=col_num).border = border
-                
-                # Auto-adjust column widths
-                ws.column_dimensions['A'].width = 8
-                ws.column_dimensions['B'].width = 12
-                ws.column_dimensions['C'].width = 15
-                ws.column_dimensions['D'].width = 18
-                ws.column_dimensions['E'].width = 25
-                ws.column_dimensions['F'].width = 12
-                ws.column_dimensions['G'].width = 12
-                ws.column_dimensions['H'].width = 12
-                ws.column_dimensions['I'].width = 12
+            job, reutilise = create_job(cur, fmt, report_type, start_date, end_date, get_jwt_identity())
+            conn.commit()
+            if not reutilise:
+                submit_job(job["id"], shards)
             
-            elif report_type == 'agents':
-                cur.execute(f"""
-                    SELECT
-                        a.id,
-                        u.nom,
-                        a.telephone,
-                        a.tricycle,
-                        COUNT(*) as total_livraisons,
-                        SUM(CASE WHEN l.statut = 'terminee' THEN 1 ELSE 0 END) as livraisons_completees,
-                        COALESCE(SUM(l.montant_percu), 0) as montant_total
-                    FROM livraisons l
-                    JOIN agents a ON l.agent_id = a.id
-                    JOIN users u ON a.user_id = u.id
-                    WHERE {where_clause}
-                    GROUP BY a.id, u.nom, a.telephone, a.tricycle
-                    ORDER BY total_livraisons DESC
-                """, params)
-                
-                rows = cur.fetchall()
-                
-                # Add headers
-                headers = ['ID Agent', 'Nom', 'Téléphone', 'Tricycle', 'Total Livraisons', 'Complétées', 'Montant']
-                for col_num, header in enumerate(headers, 1):
-                    cell = ws.cell(row=1, column=col_num)
-                    cell.value = header
-                    cell.fill = header_fill
-                    cell.font = header_font
-                    cell.alignment = header_alignment
-                    cell.border = border
-                
-                # Add data
-                for row_num, row in enumerate(rows, 2):
-                    ws.cell(row=row_num, column=1).value = row['id']
-                    ws.cell(row=row_num, column=2).value = row['nom']
-                    ws.cell(row=row_num, column=3).value = row['telephone']
-                    ws.cell(row=row_num, column=4).value = row['tricycle']
-                    ws.cell(row=row_num, column=5).value = row['total_livraisons']
-                    ws.cell(row=row_num, column=6).value = row['livraisons_completees']
-                    ws.cell(row=row_num, column=7).value = float(row['montant_total'])
-                    
-                    for col_num in range(1, 8):
-                        ws.cell(row=row_num, column=col_num).border = border
-                
-                # Auto-adjust column widths
-                for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G']:
-                    ws.column_dimensions[col].width = 15
-            
-            # Save to bytes
-            output = BytesIO()
-            wb.save(output)
-            output.seek(0)
-            
-            filename = f"rapport_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            
-            return send_file(
-                output,
-                mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                as_attachment=True,
-                download_name=filename
+            return (
+                {**job_status(job), "reutilise": reutilise},
+                200 if job["statut"] == "termine" else 202,
+                {"Location": f"/rapports/exports/{job['id']}"},
             )
         
         except Exception as e:
-            rapports_ns.abort(500, f"Erreur serveur: {str(e)}")
+            conn.rollback()
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
         finally:
             conn.close()
+
+
+@rapports_ns.route("/exports/metrics")
+class ExportJobsMetrics(Resource):
+    @rapports_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def get(self):
+        """Débit des exports et profondeur de la file d'attente (admin)"""
+        if get_jwt().get("role") != "admin":
+            return {"error": "Accès réservé aux administrateurs"}, 403
+        try:
+            return export_metrics(), 200
+        except Exception as e:
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+
+
+def _get_export_job(cur, job_id):
+    cur.execute("""
+        SELECT *, expires_at < CURRENT_TIMESTAMP AS perime FROM export_jobs WHERE id = %s
+    """, (job_id,))
+    job = cur.fetchone()
+    return expire_stale(cur, job) if job else None
+
+
+@rapports_ns.route("/exports/<string:job_id>")
+class ExportJob(Resource):
+    @rapports_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def get(self, job_id):
+        """État d'un export (en_attente, en_cours, termine, echec, expire)"""
+        conn = get_connection()
+        cur = conn.cursor()
+        
+        try:
+            job = _get_export_job(cur, job_id)
+            conn.commit()
+            if not job:
+                return {"error": "Export non trouvé"}, 404
+            return job_status(job), 200
+        
+        except Exception as e:
+            conn.rollback()
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+        finally:
+            conn.close()
+
+
+@rapports_ns.route("/exports/<string:job_id>/fichier")
+class ExportJobFile(Resource):
+    @rapports_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def get(self, job_id):
+        """Télécharger le fichier d'un export terminé"""
+        conn = get_connection()
+        cur = conn.cursor()
+        
+        try:
+            job = _get_export_job(cur, job_id)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+        finally:
+            conn.close()
+        
+        if not job:
+            return {"error": "Export non trouvé"}, 404
+        if job["statut"] in ("en_attente", "en_cours"):
+            return {**job_status(job), "error": "Export pas encore terminé"}, 409
+        if job["statut"] == "echec":
+            return {**job_status(job), "error": "Export en échec"}, 500
+        
+        path = artifact_path(job)
+        if job["statut"] == "expire" or job.get("perime") or not os.path.exists(path):
+            return {"error": "Export expiré, à relancer"}, 410
+        
+        return send_file(
+            path,
+            mimetype=EXPORT_FORMATS[job["format"]][0],
+            as_attachment=True,
+            download_name=artifact_name(job),
+            conditional=True,
+        )
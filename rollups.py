@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Agrégat journalier des livraisons (livraisons_rollup_daily)
+
+Le trigger de migration_rollups.sql le tient à jour; ce script sert à le
+construire la première fois et à vérifier qu'il n'a pas dérivé.
+
+Usage:
+    python rollups.py --backfill
+    python rollups.py --reconcile [--jours 35] [--repair]
+"""
+import sys
+import argparse
+from datetime import date, timedelta
+from db import get_connection
+from archivage import livraisons_source
+from cache import invalidate, CACHE_TAG_RAPPORTS
+
+RECONCILE_DAYS = 35
+
+# Agrégation de référence, {source} = livraisons ou livraisons + archive
+ROLLUP_SELECT = """
+    SELECT
+        DATE(l.created_at) AS jour,
+        l.date_livraison AS jour_livraison,
+        COALESCE(l.agent_id, 0) AS agent_id,
+        COALESCE(l.client_id, 0) AS client_id,
+        COALESCE(l.statut, 'inconnu') AS statut,
+        COUNT(*) AS nb_livraisons,
+        COALESCE(SUM(l.quantite), 0) AS quantite,
+        COALESCE(SUM(l.montant_percu), 0) AS montant
+    FROM {source} l
+    WHERE {where}
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+ROLLUP_COLUMNS = "jour, jour_livraison, agent_id, client_id, statut, nb_livraisons, quantite, montant"
+
+
+def _lock_livraisons(cur):
+    # Lectures autorisées, écritures (et archivage) en attente: aucun delta
+    # du trigger ne peut se glisser entre le calcul et l'écriture
+    cur.execute("LOCK TABLE livraisons IN SHARE ROW EXCLUSIVE MODE")
+
+
+def backfill():
+    """Reconstruire tout l'agrégat à partir des livraisons (archive comprise)"""
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        _lock_livraisons(cur)
+        source = livraisons_source(cur)
+        cur.execute("DELETE FROM livraisons_rollup_daily")
+        cur.execute(f"""
+            INSERT INTO livraisons_rollup_daily ({ROLLUP_COLUMNS})
+            {ROLLUP_SELECT.format(source=source, where="TRUE")}
+        """)
+        lignes = cur.rowcount
+        conn.commit()
+        print(f"✓ Agrégat reconstruit: {lignes} lignes")
+        invalidate(CACHE_TAG_RAPPORTS)
+        return 0
+
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Erreur: {e}")
+        return 2
+    finally:
+        conn.close()
+
+
+def reconcile(jours=RECONCILE_DAYS, repair=False):
+    """Comparer l'agrégat aux livraisons sur les derniers jours"""
+    debut = date.today() - timedelta(days=jours)
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        if repair:
+            _lock_livraisons(cur)
+        source = livraisons_source(cur, debut)
+
+        cur.execute(f"""
+            WITH attendu AS (
+                {ROLLUP_SELECT.format(source=source, where="DATE(l.created_at) >= %(debut)s")}
+            ),
+            actuel AS (
+                SELECT {ROLLUP_COLUMNS} FROM livraisons_rollup_daily WHERE jour >= %(debut)s
+            )
+            SELECT
+                COALESCE(a.jour, r.jour) AS jour,
+                COALESCE(a.agent_id, r.agent_id) AS agent_id,
+                COALESCE(a.client_id, r.client_id) AS client_id,
+                COALESCE(a.statut, r.statut) AS statut,
+                a.nb_livraisons AS attendu, r.nb_livraisons AS actuel
+            FROM attendu a
+            FULL OUTER JOIN actuel r
+                ON r.jour = a.jour
+                AND r.jour_livraison IS NOT DISTINCT FROM a.jour_livraison
+                AND r.agent_id = a.agent_id
+                AND r.client_id = a.client_id
+                AND r.statut = a.statut
+            WHERE a.nb_livraisons IS DISTINCT FROM r.nb_livraisons
+            OR a.quantite IS DISTINCT FROM r.quantite
+            OR a.montant IS DISTINCT FROM r.montant
+            ORDER BY 1
+        """, {"debut": debut})
+        ecarts = cur.fetchall()
+
+        if not ecarts:
+            print(f"✓ Agrégat cohérent depuis le {debut.isoformat()}")
+            conn.rollback()
+            return 0
+
+        jours_faux = sorted({row["jour"] for row in ecarts})
+        print(f"✗ {len(ecarts)} ligne(s) divergente(s) sur {len(jours_faux)} jour(s)")
+        for row in ecarts[:20]:
+            print(f"   {row['jour']} agent={row['agent_id']} client={row['client_id']} "
+                  f"statut={row['statut']}: attendu={row['attendu']} actuel={row['actuel']}")
+
+        if not repair:
+            conn.rollback()
+            return 1
+
+        cur.execute("DELETE FROM livraisons_rollup_daily WHERE jour = ANY(%s)", (jours_faux,))
+        cur.execute(f"""
+            INSERT INTO livraisons_rollup_daily ({ROLLUP_COLUMNS})
+            {ROLLUP_SELECT.format(source=source, where="DATE(l.created_at) = ANY(%s)")}
+        """, (jours_faux,))
+        conn.commit()
+        print(f"✓ {len(jours_faux)} jour(s) recalculé(s)")
+        invalidate(CACHE_TAG_RAPPORTS)
+        return 0
+
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Erreur: {e}")
+        return 2
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agrégat journalier des livraisons")
+    parser.add_argument("--backfill", action="store_true", help="Reconstruire tout l'agrégat")
+    parser.add_argument("--reconcile", action="store_true", help="Comparer l'agrégat aux livraisons")
+    parser.add_argument("--jours", type=int, default=RECONCILE_DAYS)
+    parser.add_argument("--repair", action="store_true", help="Recalculer les jours divergents")
+    args = parser.parse_args()
+
+    if args.backfill:
+        sys.exit(backfill())
+    if args.reconcile:
+        sys.exit(reconcile(args.jours, args.repair))
+    parser.print_help()
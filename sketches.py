@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Histogrammes journaliers des livraisons (livraisons_sketch_daily)
+
+Chaque mesure (montant, quantite, duree en minutes) est comptée par classe
+géométrique de raison SKETCH_RAISON: la classe c >= 1 couvre
+[raison^(c-1), raison^c[. Les histogrammes de plusieurs jours ou agents
+s'additionnent classe par classe; un percentile se lit ensuite dans
+l'histogramme fusionné, à ±4 % près, quelle que soit la période.
+
+Le trigger de migration_sketches.sql les tient à jour; ce script sert à les
+construire la première fois et à recalculer les derniers jours.
+
+Usage:
+    python sketches.py --backfill
+    python sketches.py --rebuild [--jours 35]
+"""
+import argparse
+from datetime import date, timedelta
+from db import get_connection
+from archivage import livraisons_source
+
+# Doit rester identique à sketch_classe() (migration_sketches.sql)
+SKETCH_RAISON = 1.08
+SKETCH_CLASSES = 256
+
+METRIQUES = ("montant", "quantite", "duree")
+REBUILD_DAYS = 35
+
+SKETCH_SELECT = """
+    SELECT l.date_livraison, COALESCE(l.agent_id, 0), v.metrique, sketch_classe(v.valeur), COUNT(*)
+    FROM {source} l
+    CROSS JOIN LATERAL (VALUES
+        ('montant', l.montant_percu::NUMERIC),
+        ('quantite', l.quantite::NUMERIC),
+        ('duree', livraisons_duree_minutes(l.statut, l.created_at, l.date_livraison, l.heure_livraison))
+    ) v(metrique, valeur)
+    WHERE l.date_livraison IS NOT NULL AND v.valeur IS NOT NULL AND {where}
+    GROUP BY 1, 2, 3, 4
+"""
+
+
+def valeur_classe(classe):
+    """Valeur représentative d'une classe (erreur relative <= (raison-1)/(raison+1))"""
+    if classe <= 0:
+        return 0.0
+    return 2 * SKETCH_RAISON ** classe / (SKETCH_RAISON + 1)
+
+
+def bornes_classe(classe):
+    if classe <= 0:
+        return (None, 0.0)
+    return (SKETCH_RAISON ** (classe - 1), SKETCH_RAISON ** classe)
+
+
+def quantiles(histogramme, qs):
+    """
+    Percentiles d'un histogramme {classe: n}.
+    Retourne {q: valeur} (None si l'histogramme est vide).
+    """
+    classes = sorted((c, n) for c, n in histogramme.items() if n > 0)
+    total = sum(n for _, n in classes)
+    if not total:
+        return {q: None for q in qs}
+
+    resultat = {}
+    for q in qs:
+        # Rang de la valeur cherchée (0 = plus petite)
+        rang = q * (total - 1)
+        cumul = 0
+        for classe, n in classes:
+            cumul += n
+            if cumul > rang:
+                resultat[q] = round(valeur_classe(classe), 2)
+                break
+    return resultat
+
+
+def resume(histogramme):
+    """Nombre, médiane, p90, p99 et écart interquartile d'un histogramme"""
+    q = quantiles(histogramme, (0.25, 0.5, 0.75, 0.9, 0.99))
+    return {
+        "n": sum(histogramme.values()),
+        "p50": q[0.5],
+        "p90": q[0.9],
+        "p99": q[0.99],
+        "iqr": round(q[0.75] - q[0.25], 2) if q[0.5] is not None else None,
+    }
+
+
+def histogramme_compact(histogramme):
+    """[[borne basse, borne haute, n], ...] par classe non vide, dans l'ordre"""
+    return [
+        [round(bas, 2) if bas is not None else None, round(haut, 2), n]
+        for classe, n in sorted(histogramme.items()) if n > 0
+        for bas, haut in [bornes_classe(classe)]
+    ]
+
+
+def fetch_histograms(cur, date_debut, date_fin, metriques=METRIQUES, par_agent=False):
+    """
+    Histogrammes fusionnés sur la période (dates de livraison incluses).
+    Retourne {metrique: {classe: n}} ou {(agent_id, metrique): {classe: n}}.
+    """
+    cle = "agent_id, " if par_agent else ""
+    cur.execute(f"""
+        SELECT {cle}metrique, classe, SUM(n)::bigint AS n
+        FROM livraisons_sketch_daily
+        WHERE jour_livraison BETWEEN %s AND %s AND metrique = ANY(%s)
+        GROUP BY {cle}metrique, classe
+    """, (date_debut, date_fin, list(metriques)))
+
+    histogrammes = {}
+    for row in cur.fetchall():
+        groupe = (row["agent_id"], row["metrique"]) if par_agent else row["metrique"]
+        histogrammes.setdefault(groupe, {})[row["classe"]] = row["n"]
+    return histogrammes
+
+
+def _lock_livraisons(cur):
+    # Même verrou que rollups.py: aucun delta du trigger pendant le calcul
+    cur.execute("LOCK TABLE livraisons IN SHARE ROW EXCLUSIVE MODE")
+
+
+def backfill():
+    """Reconstruire tous les histogrammes (archive comprise)"""
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        _lock_livraisons(cur)
+        source = livraisons_source(cur)
+        cur.execute("DELETE FROM livraisons_sketch_daily")
+        cur.execute(f"""
+            INSERT INTO livraisons_sketch_daily (jour_livraison, agent_id, metrique, classe, n)
+            {SKETCH_SELECT.format(source=source, where="TRUE")}
+        """)
+        lignes = cur.rowcount
+        conn.commit()
+        print(f"✓ Histogrammes reconstruits: {lignes} lignes")
+        return lignes
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Erreur: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+def rebuild(jours=REBUILD_DAYS):
+    """Recalculer les histogrammes des derniers jours de livraison"""
+    debut = date.today() - timedelta(days=jours)
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        _lock_livraisons(cur)
+        # L'archivage se fait sur created_at: marge pour les livraisons tardives
+        source = livraisons_source(cur, debut, marge_jours=7)
+        cur.execute("DELETE FROM livraisons_sketch_daily WHERE jour_livraison >= %s", (debut,))
+        supprimees = cur.rowcount
+        cur.execute(f"""
+            INSERT INTO livraisons_sketch_daily (jour_livraison, agent_id, metrique, classe, n)
+            {SKETCH_SELECT.format(source=source, where="l.date_livraison >= %s")}
+        """, (debut,))
+        lignes = cur.rowcount
+        conn.commit()
+        print(f"✓ Histogrammes depuis {debut}: {supprimees} lignes remplacées par {lignes}")
+        return lignes
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Erreur: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Histogrammes journaliers des livraisons")
+    parser.add_argument("--backfill", action="store_true", help="Reconstruire tous les histogrammes")
+    parser.add_argument("--rebuild", action="store_true", help="Recalculer les derniers jours")
+    parser.add_argument("--jours", type=int, default=REBUILD_DAYS)
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill()
+    elif args.rebuild:
+        rebuild(args.jours)
+    else:
+        parser.print_help()
@@ -1,7 +1,12 @@
 from flask_restx import Namespace, Resource, fields
 from flask import request
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import jwt_required, get_jwt
 from db import get_connection
+from archivage import livraisons_source
+from cache import cached, cache_metrics, CACHE_TAG_DASHBOARD
+from vues import view_refreshed_at, REFRESH_HEADER
+from sketches import METRIQUES, fetch_histograms, resume, histogramme_compact
+import leaderboards
 from datetime import datetime, timedelta
 from decimal import Decimal
 
@@ -26,91 +31,111 @@ stats_ns = Namespace(
 )
 
 
+def compute_kpi_dashboard(conn=None):
+    """KPI du dashboard (résultat mis en cache par KPIDashboard)"""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    cur = conn.cursor()
+    
+    try:
+        # Statistiques du jour (agrégat journalier, voir rollups.py)
+        cur.execute("""
+            SELECT
+                SUM(nb_livraisons) as livraisons_jour,
+                SUM(quantite)::bigint as quantite_jour,
+                SUM(montant) as montant_jour,
+                COUNT(DISTINCT NULLIF(agent_id, 0)) as agents_actifs
+            FROM livraisons_rollup_daily
+            WHERE jour_livraison = CURRENT_DATE
+        """)
+        jour = cur.fetchone()
+        
+        # Statistiques hebdomadaires
+        cur.execute("""
+            SELECT
+                SUM(nb_livraisons) as livraisons_semaine,
+                SUM(quantite)::bigint as quantite_semaine,
+                SUM(montant) as montant_semaine
+            FROM livraisons_rollup_daily
+            WHERE jour_livraison >= CURRENT_DATE - INTERVAL '7 days'
+        """)
+        semaine = cur.fetchone()
+        
+        # Statistiques mensuelles
+        cur.execute("""
+            SELECT
+                SUM(nb_livraisons) as livraisons_mois,
+                SUM(quantite)::bigint as quantite_mois,
+                SUM(montant) as montant_mois
+            FROM livraisons_rollup_daily
+            WHERE jour_livraison >= DATE_TRUNC('month', CURRENT_DATE)
+            AND jour_livraison < DATE_TRUNC('month', CURRENT_DATE) + INTERVAL '1 month'
+        """)
+        mois = cur.fetchone()
+        
+        # Agents actifs en tournée
+        cur.execute("""
+            SELECT COUNT(DISTINCT NULLIF(agent_id, 0)) as agents_en_tournee
+            FROM livraisons_rollup_daily
+            WHERE jour_livraison = CURRENT_DATE AND statut = 'en_cours'
+        """)
+        agents = cur.fetchone()
+        
+        # Commandes en attente
+        cur.execute("""
+            SELECT COUNT(*) as commandes_en_attente
+            FROM commandes
+            WHERE statut = 'en_attente'
+        """)
+        commandes = cur.fetchone()
+        
+        return {
+            "jour": {
+                "livraisons": jour["livraisons_jour"] or 0,
+                "quantite": jour["quantite_jour"] or 0,
+                "montant": float(jour["montant_jour"] or 0),
+                "agents_actifs": jour["agents_actifs"] or 0
+            },
+            "semaine": {
+                "livraisons": semaine["livraisons_semaine"] or 0,
+                "quantite": semaine["quantite_semaine"] or 0,
+                "montant": float(semaine["montant_semaine"] or 0)
+            },
+            "mois": {
+                "livraisons": mois["livraisons_mois"] or 0,
+                "quantite": mois["quantite_mois"] or 0,
+                "montant": float(mois["montant_mois"] or 0)
+            },
+            "agents_en_tournee": agents["agents_en_tournee"] or 0,
+            "commandes_en_attente": commandes["commandes_en_attente"] or 0
+        }
+    finally:
+        if own_conn:
+            conn.close()
+
+
 @stats_ns.route("/dashboard/kpi")
 class KPIDashboard(Resource):
     @stats_ns.doc(security="BearerAuth")
     @jwt_required()
     def get(self):
         """Récupérer tous les KPI pour le dashboard"""
-        conn = get_connection()
-        cur = conn.cursor()
-        
         try:
-            # Statistiques du jour
-            cur.execute("""
-                SELECT
-                    COUNT(*) as livraisons_jour,
-                    SUM(quantite) as quantite_jour,
-                    SUM(montant_percu) as montant_jour,
-                    COUNT(DISTINCT agent_id) as agents_actifs
-                FROM livraisons
-                WHERE DATE(date_livraison) = CURRENT_DATE
-            """)
-            jour = cur.fetchone()
-            
-            # Statistiques hebdomadaires
-            cur.execute("""
-                SELECT
-                    COUNT(*) as livraisons_semaine,
-                    SUM(quantite) as quantite_semaine,
-                    SUM(montant_percu) as montant_semaine
-                FROM livraisons
-                WHERE DATE(date_livraison) >= CURRENT_DATE - INTERVAL '7 days'
-            """)
-            semaine = cur.fetchone()
-            
-            # Statistiques mensuelles
-            cur.execute("""
-                SELECT
-                    COUNT(*) as livraisons_mois,
-                    SUM(quantite) as quantite_mois,
-                    SUM(montant_percu) as montant_mois
-                FROM livraisons
-                WHERE DATE_TRUNC('month', date_livraison) = DATE_TRUNC('month', CURRENT_DATE)
-            """)
-            mois = cur.fetchone()
-            
-            # Agents actifs en tournée
-            cur.execute("""
-                SELECT COUNT(DISTINCT agent_id) as agents_en_tournee
-                FROM livraisons
-                WHERE DATE(date_livraison) = CURRENT_DATE AND statut = 'en_cours'
-            """)
-            agents = cur.fetchone()
-            
-            # Commandes en attente
-            cur.execute("""
-                SELECT COUNT(*) as commandes_en_attente
-                FROM commandes
-                WHERE statut = 'en_attente'
-            """)
-            commandes = cur.fetchone()
-            
-            return {
-                "jour": {
-                    "livraisons": jour["livraisons_jour"] or 0,
-                    "quantite": jour["quantite_jour"] or 0,
-                    "montant": float(jour["montant_jour"] or 0),
-                    "agents_actifs": jour["agents_actifs"] or 0
-                },
-                "semaine": {
-                    "livraisons": semaine["livraisons_semaine"] or 0,
-                    "quantite": semaine["quantite_semaine"] or 0,
-                    "montant": float(semaine["montant_semaine"] or 0)
-                },
-                "mois": {
-                    "livraisons": mois["livraisons_mois"] or 0,
-                    "quantite": mois["quantite_mois"] or 0,
-                    "montant": float(mois["montant_mois"] or 0)
-                },
-                "agents_en_tournee": agents["agents_en_tournee"] or 0,
-                "commandes_en_attente": commandes["commandes_en_attente"] or 0
-            }, 200
-            
+            return cached("statistiques:kpi", compute_kpi_dashboard, tags=(CACHE_TAG_DASHBOARD,)), 200
         except Exception as e:
             return {"error": f"Erreur serveur: {str(e)}"}, 500
-        finally:
-            conn.close()
+
+
+@stats_ns.route("/cache")
+class CacheMetrics(Resource):
+    @stats_ns.doc(security="BearerAuth")
+    @jwt_required()
+    def get(self):
+        """Compteurs du cache des résultats (hits, misses, stale) du worker courant"""
+        if get_jwt().get("role") != "admin":
+            return {"error": "Accès réservé aux administrateurs"}, 403
+        return cache_metrics(), 200
 
 
 @stats_ns.route("/performance/agents")
@@ -118,19 +143,23 @@ class PerformanceAgents(Resource):
     @stats_ns.doc(security="BearerAuth")
     @jwt_required()
     def get(self):
-        """Récupérer la performance de chaque agent"""
+        """Récupérer la performance de chaque agent (vue matérialisée, voir vues.py)"""
         conn = get_connection()
         cur = conn.cursor()
         
         try:
             periode = request.args.get("periode", "mois")  # jour, semaine, mois
             
+            # Filtres sans valeur interpolée: plan réutilisable d'un appel à l'autre
             if periode == "jour":
-                date_filter = "DATE(l.date_livraison) = CURRENT_DATE"
+                date_filter = "m.jour_livraison = CURRENT_DATE"
             elif periode == "semaine":
-                date_filter = "DATE(l.date_livraison) >= CURRENT_DATE - INTERVAL '7 days'"
+                date_filter = "m.jour_livraison >= CURRENT_DATE - 7"
             else:
-                date_filter = "DATE_TRUNC('month', l.date_livraison) = DATE_TRUNC('month', CURRENT_DATE)"
+                date_filter = (
+                    "m.jour_livraison >= DATE_TRUNC('month', CURRENT_DATE)::date "
+                    "AND m.jour_livraison < (DATE_TRUNC('month', CURRENT_DATE) + INTERVAL '1 month')::date"
+                )
             
             query = f"""
                 SELECT
@@ -138,14 +167,14 @@ class PerformanceAgents(Resource):
                     a.nom,
                     a.telephone,
                     a.tricycle,
-                    COUNT(l.id) as nombre_livraisons,
-                    SUM(l.quantite) as quantite_totale,
-                    SUM(l.montant_percu) as montant_total,
-                    AVG(l.montant_percu) as montant_moyen,
-                    COUNT(DISTINCT l.client_id) as clients_servis,
-                    ROUND(AVG(l.montant_percu)::numeric, 2) as moyenne_par_livraison
+                    COALESCE(SUM(m.nb_livraisons), 0)::bigint as nombre_livraisons,
+                    SUM(m.quantite)::bigint as quantite_totale,
+                    SUM(m.montant) as montant_total,
+                    SUM(m.montant) / NULLIF(SUM(m.nb_montants), 0) as montant_moyen,
+                    COUNT(DISTINCT NULLIF(m.client_id, 0)) as clients_servis,
+                    ROUND(SUM(m.montant) / NULLIF(SUM(m.nb_montants), 0), 2) as moyenne_par_livraison
                 FROM agents a
-                LEFT JOIN livraisons l ON a.id = l.agent_id AND {date_filter}
+                LEFT JOIN mv_livraisons_agent_client_jour m ON a.id = m.agent_id AND {date_filter}
                 WHERE a.actif = TRUE
                 GROUP BY a.id, a.nom, a.telephone, a.tricycle
                 ORDER BY nombre_livraisons DESC
@@ -153,8 +182,13 @@ class PerformanceAgents(Resource):
             
             cur.execute(query)
             agents = cur.fetchall()
+            refreshed_at = view_refreshed_at(cur, "mv_livraisons_agent_client_jour")
             
-            return {"agents": convert_decimal(agents)}, 200
+            return (
+                {"agents": convert_decimal(agents), "refreshed_at": refreshed_at},
+                200,
+                {REFRESH_HEADER: refreshed_at or ""},
+            )
             
         except Exception as e:
             return {"error": f"Erreur serveur: {str(e)}"}, 500
@@ -173,6 +207,9 @@ class ChiffreAffairesEvolution(Resource):
         
         try:
             jours = request.args.get("jours", default=30, type=int)
+            livraisons = livraisons_source(
+                cur, datetime.now().date() - timedelta(days=jours), marge_jours=7
+            )
             
             cur.execute(f"""
                 SELECT
@@ -180,7 +217,7 @@ class ChiffreAffairesEvolution(Resource):
                     COUNT(*) as nombre_livraisons,
                     SUM(quantite) as quantite,
                     SUM(montant_percu) as montant_total
-                FROM livraisons
+                FROM {livraisons} l
                 WHERE DATE(date_livraison) >= CURRENT_DATE - INTERVAL '{jours} days'
                 GROUP BY DATE(date_livraison)
                 ORDER BY DATE(date_livraison)
@@ -199,49 +236,127 @@ class ChiffreAffairesEvolution(Resource):
             conn.close()
 
 
+def compute_top_clients(limite, periode):
+    """Meilleurs clients de la période, lus dans le classement (leaderboards.py)"""
+    conn = get_connection()
+    cur = conn.cursor()
+    
+    try:
+        scores = leaderboards.top(cur, periode, "client", "montant", limite)
+        
+        cur.execute("""
+            SELECT id, nom_point_vente, responsable, telephone, adresse
+            FROM clients
+            WHERE id = ANY(%s)
+        """, ([s["entite_id"] for s in scores],))
+        fiches = {row["id"]: row for row in cur.fetchall()}
+        
+        clients = []
+        for score in scores:
+            fiche = fiches.get(score["entite_id"])
+            if not fiche:
+                continue
+            clients.append({
+                **fiche,
+                "nombre_livraisons": score["nb_livraisons"],
+                "quantite_totale": score["quantite"],
+                "montant_total": score["montant"],
+                "montant_moyen": score["montant"] / score["nb_montants"] if score["nb_montants"] else None,
+            })
+        
+        return {"clients": convert_decimal(clients), "limite": limite}
+    finally:
+        conn.close()
+
+
 @stats_ns.route("/clients/top")
 class TopClients(Resource):
     @stats_ns.doc(security="BearerAuth")
     @jwt_required()
     def get(self):
-        """Récupérer les meilleurs clients"""
+        """Récupérer les meilleurs clients (jour, semaine calendaire ou mois en cours)"""
+        limite = request.args.get("limite", default=10, type=int)
+        limite = max(1, min(limite, leaderboards.LEADERBOARD_LIMITE_MAX))
+        periode = request.args.get("periode", "mois")
+        if periode not in ("jour", "semaine"):
+            periode = "mois"
+        
+        try:
+            # Lecture de k lignes du classement: pas de cache, toujours à jour
+            return compute_top_clients(limite, periode), 200
+        except Exception as e:
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+
+
+@stats_ns.route("/leaderboards")
+class Leaderboards(Resource):
+    @stats_ns.doc(
+        security="BearerAuth",
+        params={
+            "periode": "jour, semaine ou mois (défaut: jour)",
+            "entite": "agent ou client (défaut: agent)",
+            "classement": "montant ou terminees (défaut: montant)",
+            "limite": f"Nombre de lignes (défaut: 10, max: {leaderboards.LEADERBOARD_LIMITE_MAX})",
+            "date": "Jour dans la période voulue, AAAA-MM-JJ (défaut: aujourd'hui)",
+        },
+    )
+    @jwt_required()
+    def get(self):
+        """Classement des agents ou des clients sur une période"""
+        periode = request.args.get("periode", "jour")
+        entite = request.args.get("entite", "agent")
+        classement = request.args.get("classement", "montant")
+        limite = request.args.get("limite", default=10, type=int)
+        limite = max(1, min(limite, leaderboards.LEADERBOARD_LIMITE_MAX))
+        
+        if periode not in leaderboards.PERIODES:
+            return {"error": f"periode invalide (valeurs possibles: {', '.join(leaderboards.PERIODES)})"}, 400
+        if entite not in leaderboards.ENTITES:
+            return {"error": f"entite invalide (valeurs possibles: {', '.join(leaderboards.ENTITES)})"}, 400
+        if classement not in leaderboards.CLASSEMENTS:
+            return {"error": f"classement invalide (valeurs possibles: {', '.join(leaderboards.CLASSEMENTS)})"}, 400
+        
+        jour = None
+        if request.args.get("date"):
+            try:
+                jour = datetime.strptime(request.args["date"], "%Y-%m-%d").date()
+            except ValueError:
+                return {"error": "date invalide (format attendu: AAAA-MM-JJ)"}, 400
+        
         conn = get_connection()
         cur = conn.cursor()
         
         try:
-            limite = request.args.get("limite", default=10, type=int)
-            periode = request.args.get("periode", "mois")
+            scores = leaderboards.top(cur, periode, entite, classement, limite, jour)
+            ids = [s["entite_id"] for s in scores]
             
-            if periode == "jour":
-                date_filter = "DATE(l.date_livraison) = CURRENT_DATE"
-            elif periode == "semaine":
-                date_filter = "DATE(l.date_livraison) >= CURRENT_DATE - INTERVAL '7 days'"
+            if entite == "agent":
+                cur.execute("SELECT id, nom FROM agents WHERE id = ANY(%s)", (ids,))
             else:
-                date_filter = "DATE_TRUNC('month', l.date_livraison) = DATE_TRUNC('month', CURRENT_DATE)"
+                cur.execute("SELECT id, nom_point_vente AS nom FROM clients WHERE id = ANY(%s)", (ids,))
+            noms = {row["id"]: row["nom"] for row in cur.fetchall()}
             
-            query = f"""
-                SELECT
-                    c.id,
-                    c.nom_point_vente,
-                    c.responsable,
-                    c.telephone,
-                    c.adresse,
-                    COUNT(l.id) as nombre_livraisons,
-                    SUM(l.quantite) as quantite_totale,
-                    SUM(l.montant_percu) as montant_total,
-                    AVG(l.montant_percu) as montant_moyen
-                FROM clients c
-                LEFT JOIN livraisons l ON c.id = l.client_id AND {date_filter}
-                GROUP BY c.id, c.nom_point_vente, c.responsable, c.telephone, c.adresse
-                HAVING COUNT(l.id) > 0
-                ORDER BY montant_total DESC
-                LIMIT %s
-            """
-            
-            cur.execute(query, (limite,))
-            clients = cur.fetchall()
+            lignes = [
+                {
+                    "rang": s["rang"],
+                    "id": s["entite_id"],
+                    "nom": noms.get(s["entite_id"]),
+                    "nombre_livraisons": s["nb_livraisons"],
+                    "terminees": s["terminees"],
+                    "quantite": s["quantite"],
+                    "montant": s["montant"],
+                }
+                for s in scores
+            ]
             
-            return {"clients": clients, "limite": limite}, 200
+            return {
+                "periode": periode,
+                "debut": leaderboards.debut_periode(periode, jour).isoformat(),
+                "entite": entite,
+                "classement": classement,
+                "limite": limite,
+                "lignes": convert_decimal(lignes),
+            }, 200
             
         except Exception as e:
             return {"error": f"Erreur serveur: {str(e)}"}, 500
@@ -286,15 +401,23 @@ class RapportPeriode(Resource):
     @stats_ns.doc(security="BearerAuth")
     @jwt_required()
     def get(self):
-        """Rapport détaillé sur une période"""
+        """
+        Rapport détaillé sur une période: totaux, percentiles du panier
+        (montant, quantité) et de la durée de livraison, dispersion par agent.
+        histogramme=true ajoute les classes de chaque distribution.
+        """
         conn = get_connection()
         cur = conn.cursor()
         
         try:
-            date_debut = request.args.get("date_debut", required=True)
-            date_fin = request.args.get("date_fin", required=True)
+            date_debut = request.args.get("date_debut")
+            date_fin = request.args.get("date_fin")
+            if not date_debut or not date_fin:
+                return {"error": "date_debut et date_fin requis (AAAA-MM-JJ)"}, 400
+            avec_histogramme = request.args.get("histogramme", "false").lower() in ("1", "true", "oui")
+            livraisons = livraisons_source(cur, date_debut, marge_jours=7)
             
-            cur.execute("""
+            cur.execute(f"""
                 SELECT
                     COUNT(DISTINCT l.id) as total_livraisons,
                     COUNT(DISTINCT l.agent_id) as total_agents,
@@ -304,15 +427,42 @@ class RapportPeriode(Resource):
                     AVG(l.montant_percu) as montant_moyen,
                     MIN(l.montant_percu) as montant_min,
                     MAX(l.montant_percu) as montant_max
-                FROM livraisons l
+                FROM {livraisons} l
                 WHERE DATE(l.date_livraison) BETWEEN %s AND %s
             """, (date_debut, date_fin))
             
             rapport = cur.fetchone()
             
+            # Percentiles lus dans les histogrammes journaliers (sketches.py)
+            histogrammes = fetch_histograms(cur, date_debut, date_fin)
+            distributions = {}
+            for metrique in METRIQUES:
+                distributions[metrique] = resume(histogrammes.get(metrique, {}))
+                if avec_histogramme:
+                    distributions[metrique]["histogramme"] = histogramme_compact(histogrammes.get(metrique, {}))
+            
+            par_agent = fetch_histograms(cur, date_debut, date_fin, ("montant", "duree"), par_agent=True)
+            agent_ids = sorted({agent_id for agent_id, _ in par_agent})
+            noms = {}
+            if agent_ids:
+                cur.execute("SELECT id, nom FROM agents WHERE id = ANY(%s)", (agent_ids,))
+                noms = {row["id"]: row["nom"] for row in cur.fetchall()}
+            
+            dispersion_agents = [
+                {
+                    "agent_id": agent_id or None,
+                    "nom": noms.get(agent_id),
+                    "montant": resume(par_agent.get((agent_id, "montant"), {})),
+                    "duree": resume(par_agent.get((agent_id, "duree"), {})),
+                }
+                for agent_id in agent_ids
+            ]
+            
             return {
                 "periode": f"{date_debut} à {date_fin}",
-                "rapport": rapport
+                "rapport": convert_decimal(rapport),
+                "distributions": distributions,
+                "par_agent": dispersion_agents,
             }, 200
             
         except Exception as e:
@@ -0,0 +1,268 @@
+from flask_restx import Namespace, Resource
+from flask import request
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from db import get_connection
+from datetime import datetime, timedelta
+from decimal import Decimal
+import os
+
+
+def convert_decimal(obj):
+    """Convert Decimal, datetime, date, and time objects to JSON-serializable types"""
+    import datetime as dt
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (dt.datetime, dt.date, dt.time)):
+        return obj.isoformat()
+    if isinstance(obj, dict):
+        return {k: convert_decimal(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [convert_decimal(item) for item in obj]
+    return obj
+
+
+sync_ns = Namespace(
+    "sync",
+    path="/sync",
+    description="Synchronisation différentielle pour les applications mobiles"
+)
+
+# updated_at est posé à l'heure de début de transaction: une transaction
+# longue peut valider une ligne dont updated_at est antérieur au watermark
+# déjà remis. On relit donc une petite fenêtre avant le watermark; les
+# applications appliquent les lignes par id (upsert), les doublons sont sans effet.
+SYNC_OVERLAP_SECONDS = int(os.getenv("SYNC_OVERLAP_SECONDS", "120"))
+
+# Les tombstones plus anciennes sont purgées par archivage.py: un watermark
+# plus ancien impose une resynchronisation complète
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "30"))
+
+
+def _parse_watermark(value, fuseau):
+    """
+    Watermark -> datetime naïf, comparable aux colonnes TIMESTAMP de la base.
+    Un watermark avec fuseau (ex. ...Z, +00:00 ajouté par le client) est
+    ramené à l'heure de la session (`fuseau`, UTC en production).
+    """
+    if not value:
+        return None
+    try:
+        watermark = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if watermark.tzinfo is not None:
+        watermark = watermark.astimezone(fuseau).replace(tzinfo=None)
+    return watermark
+
+
+def _get_scope(cur, user_id, user_role):
+    """Périmètre visible par l'utilisateur: (colonne, id) ou None pour l'admin"""
+    if user_role == "agent":
+        cur.execute("SELECT id FROM agents WHERE user_id = %s", (user_id,))
+        agent = cur.fetchone()
+        return ("agent_id", agent["id"] if agent else 0)
+    if user_role == "client":
+        cur.execute("SELECT id FROM clients WHERE user_id = %s", (user_id,))
+        client = cur.fetchone()
+        return ("client_id", client["id"] if client else 0)
+    return None
+
+
+def _changed_livraisons(cur, scope, since):
+    query = """
+        SELECT
+            l.id,
+            l.commande_id,
+            l.agent_id,
+            l.client_id,
+            l.quantite,
+            l.montant_percu,
+            l.latitude_gps,
+            l.longitude_gps,
+            l.adresse_livraison,
+            CASE WHEN l.photo_blob IS NOT NULL THEN '/blobs/' || l.photo_blob ELSE l.photo_lieu END as photo_lieu,
+            CASE WHEN l.signature_blob IS NOT NULL THEN '/blobs/' || l.signature_blob ELSE l.signature_client END as signature_client,
+            l.date_livraison,
+            l.heure_livraison,
+            l.statut,
+            l.created_at,
+            l.updated_at,
+            a.nom as agent_nom,
+            a.telephone as agent_telephone,
+            c.nom_point_vente,
+            c.responsable,
+            c.telephone as client_telephone,
+            cmd.latitude as order_latitude,
+            cmd.longitude as order_longitude,
+            cmd.montant_total
+        FROM livraisons l
+        LEFT JOIN agents a ON l.agent_id = a.id
+        LEFT JOIN clients c ON l.client_id = c.id
+        LEFT JOIN commandes cmd ON l.commande_id = cmd.id
+        WHERE 1=1
+    """
+    params = []
+    if scope:
+        query += f" AND l.{scope[0]} = %s"
+        params.append(scope[1])
+    if since:
+        query += " AND l.updated_at > %s"
+        params.append(since)
+    query += " ORDER BY l.updated_at, l.id"
+    cur.execute(query, params)
+    return cur.fetchall()
+
+
+def _changed_commandes(cur, scope, since):
+    query = """
+        SELECT
+            c.id,
+            c.client_id,
+            c.agent_id,
+            c.date_commande,
+            c.date_livraison_prevue,
+            c.date_livraison_effective,
+            c.statut,
+            c.montant_total,
+            c.notes,
+            c.adresse_livraison,
+            c.latitude,
+            c.longitude,
+            c.produits,
+            c.created_at,
+            c.updated_at
+        FROM commandes c
+        WHERE 1=1
+    """
+    params = []
+    if scope:
+        query += f" AND c.{scope[0]} = %s"
+        params.append(scope[1])
+    if since:
+        query += " AND c.updated_at > %s"
+        params.append(since)
+    query += " ORDER BY c.updated_at, c.id"
+    cur.execute(query, params)
+    return cur.fetchall()
+
+
+def _changed_notifications(cur, user_id, since):
+    query = """
+        SELECT id, utilisateur_id, titre, message, type_notification, lue, created_at, updated_at
+        FROM notifications
+        WHERE utilisateur_id = %s
+    """
+    params = [user_id]
+    if since:
+        query += " AND updated_at > %s"
+        params.append(since)
+    query += " ORDER BY updated_at, id"
+    cur.execute(query, params)
+    return cur.fetchall()
+
+
+def _changed_produits(cur, since):
+    # Le stock fait partie de la fiche produit côté application
+    query = """
+        SELECT
+            p.id,
+            p.nom,
+            p.description,
+            p.prix_unitaire,
+            p.unite,
+            p.quantite_par_unite,
+            p.actif,
+            COALESCE(s.quantite_disponible, 0) as stock_disponible,
+            GREATEST(p.updated_at, s.updated_at) as updated_at
+        FROM produits p
+        LEFT JOIN stocks s ON p.id = s.produit_id AND s.depot_principal = TRUE
+        WHERE 1=1
+    """
+    params = []
+    if since:
+        query += " AND (p.updated_at > %s OR s.updated_at > %s)"
+        params.extend([since, since])
+    query += " ORDER BY p.id"
+    cur.execute(query, params)
+    return cur.fetchall()
+
+
+def _tombstones(cur, scope, user_id, since):
+    """
+    Identifiants supprimés depuis le watermark, regroupés par table.
+    Les applications appliquent `deleted` avant les lignes modifiées: une
+    livraison réassignée puis rendue au même agent réapparaît ainsi.
+    """
+    query = """
+        SELECT DISTINCT table_name, row_id
+        FROM sync_tombstones
+        WHERE deleted_at > %s
+        AND (
+            table_name = 'produits'
+            OR (table_name = 'notifications' AND utilisateur_id = %s)
+    """
+    params = [since, user_id]
+    if scope:
+        query += f" OR (table_name IN ('livraisons', 'commandes') AND {scope[0]} = %s)"
+        params.append(scope[1])
+    else:
+        query += " OR table_name IN ('livraisons', 'commandes')"
+    query += ")"
+    cur.execute(query, params)
+
+    deleted = {"livraisons": [], "commandes": [], "notifications": [], "produits": []}
+    for row in cur.fetchall():
+        deleted.setdefault(row["table_name"], []).append(row["row_id"])
+    return deleted
+
+
+@sync_ns.route("")
+class Sync(Resource):
+    @sync_ns.doc(
+        security="BearerAuth",
+        params={"watermark": "Watermark renvoyé par la synchronisation précédente (vide = synchronisation complète)"}
+    )
+    @jwt_required()
+    def get(self):
+        """Récupérer les changements visibles depuis le watermark"""
+        user_id = get_jwt_identity()
+        claims = get_jwt()
+        user_role = claims.get("role")
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        try:
+            # Le nouveau watermark est lu avant les requêtes: tout ce qui sera
+            # validé pendant la synchronisation sera repris la fois suivante
+            cur.execute("SELECT LOCALTIMESTAMP AS now, CURRENT_TIMESTAMP AS now_tz")
+            row = cur.fetchone()
+            new_watermark = row["now"]
+
+            watermark = _parse_watermark(request.args.get("watermark"), row["now_tz"].tzinfo)
+            full = watermark is None or \
+                watermark < new_watermark - timedelta(days=SYNC_TOMBSTONE_RETENTION_DAYS)
+            since = None if full else watermark - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+
+            scope = _get_scope(cur, user_id, user_role)
+
+            livraisons = _changed_livraisons(cur, scope, since)
+            commandes = _changed_commandes(cur, scope, since)
+            notifications = _changed_notifications(cur, user_id, since)
+            produits = _changed_produits(cur, since)
+            deleted = {} if full else _tombstones(cur, scope, user_id, since)
+
+            return {
+                "watermark": new_watermark.isoformat(),
+                "full": full,
+                "livraisons": convert_decimal(livraisons),
+                "commandes": convert_decimal(commandes),
+                "notifications": convert_decimal(notifications),
+                "produits": convert_decimal(produits),
+                "deleted": deleted,
+            }, 200
+
+        except Exception as e:
+            return {"error": f"Erreur serveur: {str(e)}"}, 500
+        finally:
+            conn.close()
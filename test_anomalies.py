@@ -0,0 +1,131 @@
+"""
+Tests des contrôles vectorisés de anomalies.py
+
+z-scores, quantiles et scores interquartiles par groupe comparés à un calcul
+groupe par groupe (boucle Python, numpy sur chaque groupe), avec valeurs
+manquantes, petits groupes et groupes constants. Aucune base de données
+n'est nécessaire.
+
+Usage:
+    python -m pytest -q test_anomalies.py
+"""
+import math
+import random
+import statistics
+
+import numpy as np
+import pytest
+
+from anomalies import quantiles_par_groupe, scores_iqr_par_groupe, zscores_par_groupe
+
+K = 3.0
+MIN_GROUPE = 10
+
+
+def _jeu(graine, n=3000):
+    """Groupes de tailles variées (dont < MIN_GROUPE), ~5 % de nan, un groupe constant"""
+    rnd = random.Random(graine)
+    groupes, valeurs = [], []
+    for _ in range(n):
+        g = rnd.choice([1, 2, 3, 5, 8, 13]) if rnd.random() < 0.97 else 100 + rnd.randint(0, 20)
+        groupes.append(g)
+        if rnd.random() < 0.05:
+            valeurs.append(math.nan)
+        elif g == 13:
+            valeurs.append(42.0)
+        else:
+            valeurs.append(rnd.lognormvariate(6, 1) * rnd.choice([1, 1, 1, 8]))
+    return np.array(groupes, dtype=np.int64), np.array(valeurs)
+
+
+def _par_groupe(groupes, valeurs):
+    resultat = {}
+    for g, v in zip(groupes.tolist(), valeurs.tolist()):
+        if not math.isnan(v):
+            resultat.setdefault(g, []).append(v)
+    return resultat
+
+
+def _identiques(obtenus, attendus):
+    assert len(obtenus) == len(attendus)
+    for o, a in zip(obtenus, attendus):
+        if math.isnan(a):
+            assert math.isnan(o)
+        else:
+            assert o == pytest.approx(a, rel=1e-9, abs=1e-9)
+
+
+@pytest.mark.parametrize("graine", [1, 2, 3])
+def test_zscores_identiques_au_calcul_par_groupe(graine):
+    groupes, valeurs = _jeu(graine)
+    stats = {
+        g: (len(xs), statistics.fmean(xs), statistics.stdev(xs) if len(xs) > 1 else 0.0)
+        for g, xs in _par_groupe(groupes, valeurs).items()
+    }
+
+    attendus_z, attendus_moyenne = [], []
+    for g, v in zip(groupes.tolist(), valeurs.tolist()):
+        n, moyenne, ecart_type = stats.get(g, (0, 0.0, 0.0))
+        attendus_moyenne.append(moyenne)
+        if math.isnan(v) or n < MIN_GROUPE or ecart_type == 0:
+            attendus_z.append(math.nan)
+        else:
+            attendus_z.append((v - moyenne) / ecart_type)
+
+    z, moyenne = zscores_par_groupe(groupes, valeurs, min_groupe=MIN_GROUPE)
+    _identiques(z.tolist(), attendus_z)
+    _identiques(moyenne.tolist(), attendus_moyenne)
+
+
+@pytest.mark.parametrize("graine", [4, 5])
+def test_quantiles_identiques_a_numpy(graine):
+    groupes, valeurs = _jeu(graine)
+    membres = _par_groupe(groupes, valeurs)
+    qs = (0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0)
+
+    codes, quantiles, n = quantiles_par_groupe(groupes, valeurs, qs)
+    uniques = np.unique(groupes).tolist()
+    for code, g in enumerate(uniques):
+        xs = membres.get(g, [])
+        assert n[code] == len(xs)
+        for q in qs:
+            if xs:
+                assert quantiles[q][code] == pytest.approx(np.quantile(xs, q), rel=1e-12)
+            else:
+                assert math.isnan(quantiles[q][code])
+    assert [uniques[c] for c in codes.tolist()] == groupes.tolist()
+
+
+@pytest.mark.parametrize("graine", [6, 7, 8])
+def test_scores_iqr_identiques_au_calcul_par_groupe(graine):
+    groupes, valeurs = _jeu(graine)
+    stats = {
+        g: (len(xs), *np.quantile(xs, [0.25, 0.5, 0.75]).tolist())
+        for g, xs in _par_groupe(groupes, valeurs).items()
+    }
+
+    attendus_score, attendus_mediane = [], []
+    for g, v in zip(groupes.tolist(), valeurs.tolist()):
+        n, q1, mediane, q3 = stats.get(g, (0, math.nan, math.nan, math.nan))
+        attendus_mediane.append(mediane)
+        iqr = q3 - q1
+        if math.isnan(v) or n < MIN_GROUPE or not iqr > 0:
+            attendus_score.append(math.nan)
+        else:
+            attendus_score.append(max((q1 - K * iqr - v) / iqr, (v - q3 - K * iqr) / iqr, 0.0))
+
+    score, mediane = scores_iqr_par_groupe(groupes, valeurs, k=K, min_groupe=MIN_GROUPE)
+    _identiques(score.tolist(), attendus_score)
+    _identiques(mediane.tolist(), attendus_mediane)
+    # Le jeu contient bien des valeurs hors bornes
+    assert np.nansum(score > 0) > 0
+
+
+def test_toutes_valeurs_manquantes():
+    groupes = np.array([1, 1, 2], dtype=np.int64)
+    valeurs = np.array([math.nan, math.nan, math.nan])
+    z, _ = zscores_par_groupe(groupes, valeurs, min_groupe=1)
+    score, mediane = scores_iqr_par_groupe(groupes, valeurs, min_groupe=1)
+    assert np.isnan(z).all()
+    assert np.isnan(score).all()
+    assert np.isnan(mediane).all()
@@ -0,0 +1,127 @@
+"""
+Tests des distances géographiques (geo.py)
+
+Matrice des distances et k plus proches comparés à haversine_m appelée paire
+par paire, avec numpy et en Python pur, par blocs, avec points sans
+coordonnées et b vide. Aucune base de données n'est nécessaire.
+
+Usage:
+    python -m pytest -q test_geo.py
+"""
+import math
+import random
+
+import pytest
+
+import geo
+from geo import haversine_m, matrice_distances, plus_proches
+
+LOME = (6.1375, 1.2123)
+
+
+@pytest.fixture(params=["numpy", "python"])
+def moteur(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(geo, "np", None)
+    elif geo.np is None:
+        pytest.skip("numpy absent")
+    return request.param
+
+
+def _points(graine, n, manquants=0.0):
+    rnd = random.Random(graine)
+    points = []
+    for _ in range(n):
+        if rnd.random() < manquants:
+            points.append(rnd.choice([None, (None, None), (LOME[0], None)]))
+        else:
+            points.append((LOME[0] + rnd.uniform(-0.3, 0.3), LOME[1] + rnd.uniform(-0.4, 0.4)))
+    return points
+
+
+def _valide(p):
+    return p is not None and p[0] is not None and p[1] is not None
+
+
+def _distance(p, q):
+    return haversine_m(p[0], p[1], q[0], q[1]) if _valide(p) and _valide(q) else None
+
+
+def _lignes(resultat):
+    return resultat.tolist() if hasattr(resultat, "tolist") else resultat
+
+
+def _manquante(d):
+    return d is None or (isinstance(d, float) and math.isnan(d))
+
+
+def test_haversine_valeurs_connues():
+    assert haversine_m(*LOME, *LOME) == 0.0
+    # Un degré de latitude: pi * R / 180
+    assert haversine_m(0, 0, 1, 0) == pytest.approx(math.pi * geo.RAYON_TERRE_M / 180)
+    # Antipodes
+    assert haversine_m(0, 0, 0, 180) == pytest.approx(math.pi * geo.RAYON_TERRE_M)
+
+
+@pytest.mark.parametrize("bloc", [1, 7, geo.GEO_BLOC])
+def test_matrice_identique_a_haversine(moteur, bloc):
+    a = _points(1, 60, manquants=0.1)
+    b = _points(2, 45, manquants=0.1)
+    matrice = _lignes(matrice_distances(a, b, bloc=bloc))
+    assert len(matrice) == len(a)
+    for p, ligne in zip(a, matrice):
+        assert len(ligne) == len(b)
+        for q, d in zip(b, ligne):
+            attendue = _distance(p, q)
+            if attendue is None:
+                assert _manquante(d)
+            else:
+                assert d == pytest.approx(attendue, rel=1e-9, abs=1e-6)
+
+
+def test_matrice_carree_par_defaut(moteur):
+    a = _points(3, 30)
+    matrice = _lignes(matrice_distances(a))
+    for i, ligne in enumerate(matrice):
+        assert ligne[i] == pytest.approx(0.0, abs=1e-6)
+        for j, d in enumerate(ligne):
+            assert d == pytest.approx(matrice[j][i], rel=1e-12, abs=1e-9)
+
+
+@pytest.mark.parametrize("k", [1, 3, 10, 80])
+def test_plus_proches_identique_au_parcours_complet(moteur, k):
+    a = _points(4, 300, manquants=0.05)
+    b = _points(5, 50, manquants=0.2)
+    indices, distances = plus_proches(a, b, k=k, bloc=64)
+    indices, distances = _lignes(indices), _lignes(distances)
+
+    k_effectif = min(k, len(b))
+    for p, ligne_i, ligne_d in zip(a, indices, distances):
+        attendus = sorted(
+            (d, j) for j, d in ((j, _distance(p, q)) for j, q in enumerate(b)) if d is not None
+        )[:k_effectif]
+        attendus += [(math.inf, -1)] * (k_effectif - len(attendus))
+        assert ligne_i == [j for _, j in attendus]
+        for d, (attendue, _) in zip(ligne_d, attendus):
+            if math.isinf(attendue):
+                assert math.isinf(d)
+            else:
+                assert d == pytest.approx(attendue, rel=1e-9, abs=1e-6)
+
+
+def test_plus_proches_sans_candidat(moteur):
+    a = _points(6, 4)
+    for b, k in (([], 3), (_points(7, 5), 0)):
+        indices, distances = plus_proches(a, b, k=k)
+        assert [list(ligne) for ligne in _lignes(indices)] == [[]] * len(a)
+        assert [list(ligne) for ligne in _lignes(distances)] == [[]] * len(a)
+
+
+def test_matrice_dtype_reduit():
+    if geo.np is None:
+        pytest.skip("numpy absent")
+    a = _points(8, 20)
+    complete = matrice_distances(a)
+    reduite = matrice_distances(a, dtype=geo.np.float32)
+    assert reduite.dtype == geo.np.float32
+    assert geo.np.allclose(reduite, complete, rtol=1e-6, atol=1e-2)
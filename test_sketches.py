@@ -0,0 +1,123 @@
+"""
+Tests des histogrammes de livraisons (sketches.py)
+
+Les percentiles lus dans un histogramme sont comparés aux percentiles exacts
+des valeurs d'origine, sur des jeux aléatoires et après fusion de plusieurs
+histogrammes. Aucune base de données n'est nécessaire.
+
+Usage:
+    python -m pytest -q test_sketches.py
+"""
+import math
+import random
+
+import pytest
+
+from sketches import (
+    SKETCH_CLASSES, SKETCH_RAISON, bornes_classe, histogramme_compact, quantiles, resume, valeur_classe,
+)
+
+QS = (0.0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 1.0)
+# Erreur annoncée par valeur_classe, plus l'arrondi au centime
+ERREUR = (SKETCH_RAISON - 1) / (SKETCH_RAISON + 1)
+
+
+def classe(v):
+    """Copie de sketch_classe() (migration_sketches.sql)"""
+    if v <= 0:
+        return 0
+    return min(SKETCH_CLASSES - 1, 1 + math.floor(math.log(max(v, 1)) / math.log(SKETCH_RAISON)))
+
+
+def histogramme(valeurs):
+    resultat = {}
+    for v in valeurs:
+        c = classe(v)
+        resultat[c] = resultat.get(c, 0) + 1
+    return resultat
+
+
+def exact(valeurs, q):
+    """Valeur de rang q * (n - 1), arrondi inférieur (même rang que quantiles())"""
+    triees = sorted(valeurs)
+    return triees[int(q * (len(triees) - 1))]
+
+
+def _jeux(graine):
+    rnd = random.Random(graine)
+    for _ in range(50):
+        n = rnd.randint(1, 2000)
+        loi = rnd.choice(["lognormale", "uniforme", "entiers"])
+        if loi == "lognormale":
+            yield [1 + rnd.lognormvariate(8, 1.5) for _ in range(n)]
+        elif loi == "uniforme":
+            yield [rnd.uniform(1, 500) for _ in range(n)]
+        else:
+            yield [rnd.randint(1, 40) for _ in range(n)]
+
+
+def _verifier(valeurs, obtenus):
+    for q in QS:
+        attendu = exact(valeurs, q)
+        assert abs(obtenus[q] - attendu) <= ERREUR * attendu + 0.005 + 1e-9, (q, attendu)
+
+
+def test_classe_couvre_ses_bornes():
+    for c in range(1, 120):
+        bas, haut = bornes_classe(c)
+        assert valeur_classe(c) == pytest.approx(bas, rel=ERREUR + 1e-12)
+        assert valeur_classe(c) == pytest.approx(haut, rel=ERREUR + 1e-12)
+        if c > 1:
+            assert classe(bas * (1 + 1e-9)) == c
+        assert classe(haut * (1 - 1e-9)) == c
+
+
+def test_quantiles_proches_des_percentiles_exacts():
+    for valeurs in _jeux(42):
+        _verifier(valeurs, quantiles(histogramme(valeurs), QS))
+
+
+def test_fusion_identique_au_jeu_complet():
+    jeux = list(_jeux(43))
+    fusion = {}
+    for valeurs in jeux:
+        for c, n in histogramme(valeurs).items():
+            fusion[c] = fusion.get(c, 0) + n
+    toutes = [v for valeurs in jeux for v in valeurs]
+    assert fusion == histogramme(toutes)
+    _verifier(toutes, quantiles(fusion, QS))
+
+
+def test_valeurs_nulles_et_inferieures_a_un():
+    # 0 a sa propre classe; ]0, 1[ tombe dans la classe 1
+    h = histogramme([0, 0, 0, 0.5, 1.0])
+    assert h == {0: 3, 1: 2}
+    q = quantiles(h, (0.0, 0.5, 1.0))
+    assert q[0.0] == 0.0
+    assert q[0.5] == 0.0
+    assert q[1.0] == round(valeur_classe(1), 2)
+
+
+def test_histogramme_vide():
+    assert quantiles({}, (0.5, 0.9)) == {0.5: None, 0.9: None}
+    assert quantiles({4: 0}, (0.5,)) == {0.5: None}
+    assert resume({}) == {"n": 0, "p50": None, "p90": None, "p99": None, "iqr": None}
+    assert histogramme_compact({}) == []
+
+
+def test_resume_et_histogramme_compact():
+    rnd = random.Random(44)
+    valeurs = [rnd.uniform(1, 1000) for _ in range(500)]
+    h = histogramme(valeurs)
+    r = resume(h)
+    assert r["n"] == 500
+    _verifier(valeurs, quantiles(h, QS))
+    assert r["p50"] == quantiles(h, (0.5,))[0.5]
+    assert r["iqr"] == pytest.approx(
+        round(quantiles(h, (0.75,))[0.75] - quantiles(h, (0.25,))[0.25], 2), abs=1e-9
+    )
+
+    compact = histogramme_compact({**h, 0: 2, 200: 0})
+    assert compact[0] == [None, 0.0, 2]
+    assert sum(n for _, _, n in compact) == 502
+    assert [bas for bas, _, _ in compact[1:]] == sorted(bas for bas, _, _ in compact[1:])
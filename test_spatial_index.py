@@ -0,0 +1,156 @@
+"""
+Tests de l'index spatial (cartographie/spatial_index.py)
+
+Rayon, rectangle et k plus proches comparés à un parcours complet sur 300
+requêtes aléatoires, puis règles de synchronisation. Aucune base de données
+n'est nécessaire.
+
+Usage:
+    python -m pytest -q test_spatial_index.py
+"""
+import random
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+from cartographie import spatial_index
+from cartographie.spatial_index import Grille, IndexSpatial, distance_km
+
+LOME = (6.1375, 1.2123)
+REQUETES = 300
+
+
+def _points(rnd, n):
+    return {
+        i: (LOME[0] + rnd.uniform(-0.15, 0.15), LOME[1] + rnd.uniform(-0.2, 0.2))
+        for i in range(n)
+    }
+
+
+@pytest.fixture(scope="module")
+def grille():
+    rnd = random.Random(48)
+    points = _points(rnd, 2000)
+    grille = Grille()
+    for ident, (lat, lon) in points.items():
+        grille.placer(ident, lat, lon, {"pair": ident % 2 == 0})
+    return grille, points
+
+
+def _requetes(graine):
+    rnd = random.Random(graine)
+    # Un peu au-delà du nuage de points: requêtes en bordure et hors zone
+    return [
+        (LOME[0] + rnd.uniform(-0.2, 0.2), LOME[1] + rnd.uniform(-0.25, 0.25), rnd)
+        for _ in range(REQUETES)
+    ]
+
+
+def _distances(points, lat, lon):
+    return sorted((distance_km(lat, lon, plat, plon), ident) for ident, (plat, plon) in points.items())
+
+
+def test_rayon_identique_au_parcours_complet(grille):
+    grille, points = grille
+    for lat, lon, rnd in _requetes(1):
+        km = rnd.uniform(0.1, 5)
+        attendus = [(d, ident) for d, ident in _distances(points, lat, lon) if d <= km]
+        obtenus = grille.rayon(lat, lon, km)
+        assert [ident for _, ident in obtenus] == [ident for _, ident in attendus]
+        for (d, _), (attendu, _) in zip(obtenus, attendus):
+            assert d == pytest.approx(attendu, abs=1e-6)
+
+
+def test_plus_proches_identique_au_parcours_complet(grille):
+    grille, points = grille
+    for lat, lon, rnd in _requetes(2):
+        k = rnd.randint(1, 20)
+        km_max = rnd.choice([None, rnd.uniform(0.2, 3)])
+        attendus = [
+            (d, ident) for d, ident in _distances(points, lat, lon)
+            if km_max is None or d <= km_max
+        ][:k]
+        obtenus = grille.plus_proches(lat, lon, k, km_max)
+        assert [ident for _, ident in obtenus] == [ident for _, ident in attendus]
+        for (d, _), (attendu, _) in zip(obtenus, attendus):
+            assert d == pytest.approx(attendu, abs=1e-6)
+
+
+def test_plus_proches_avec_filtre(grille):
+    grille, points = grille
+    pairs = {ident: point for ident, point in points.items() if ident % 2 == 0}
+    for lat, lon, rnd in _requetes(3):
+        k = rnd.randint(1, 10)
+        attendus = [ident for _, ident in _distances(pairs, lat, lon)[:k]]
+        obtenus = grille.plus_proches(lat, lon, k, filtre=lambda ident, infos: infos["pair"])
+        assert [ident for _, ident in obtenus] == attendus
+
+
+def test_rectangle_identique_au_parcours_complet(grille):
+    grille, points = grille
+    for lat, lon, rnd in _requetes(4):
+        sud, nord = lat - rnd.uniform(0, 0.05), lat + rnd.uniform(0, 0.05)
+        ouest, est = lon - rnd.uniform(0, 0.05), lon + rnd.uniform(0, 0.05)
+        attendus = {
+            ident for ident, (plat, plon) in points.items()
+            if sud <= plat <= nord and ouest <= plon <= est
+        }
+        assert set(grille.rectangle(sud, ouest, nord, est)) == attendus
+
+
+def test_index_vide():
+    grille = Grille()
+    assert grille.rayon(*LOME, 5) == []
+    assert grille.plus_proches(*LOME, 5) == []
+    assert grille.rectangle(6.0, 1.0, 6.2, 1.3) == []
+
+
+def test_resultats_serialisent_les_dates():
+    index = IndexSpatial()
+    vu = datetime(2026, 1, 15, 8, 30)
+    index.grilles["agent"].placer(7, LOME[0], LOME[1], {"nom": "Agent", "last_location_update": vu})
+
+    def recente(ident, infos):
+        return infos["last_location_update"] >= vu - timedelta(minutes=30)
+
+    resultats = index.plus_proches(("agent",), LOME[0], LOME[1], 5, filtre=recente)
+    assert [r["id"] for r in resultats] == [7]
+    assert resultats[0]["last_location_update"] == vu.isoformat()
+
+
+# ----- Synchronisation -----
+
+class ConnexionEnPanne:
+    def cursor(self):
+        raise RuntimeError("base indisponible")
+
+
+def test_marques_gardees_si_la_relecture_echoue():
+    index = IndexSpatial()
+    index.invalider("client", 3)
+    index.invalider("agent", 4)
+    with pytest.raises(RuntimeError):
+        index.appliquer_modifications(ConnexionEnPanne())
+    assert index._marques == {"client": {3}, "agent": {4}}
+
+
+def test_erreur_journalisee_une_fois_charge(monkeypatch):
+    @contextmanager
+    def en_panne():
+        yield ConnexionEnPanne()
+
+    monkeypatch.setattr(spatial_index, "pooled_connection", en_panne)
+    index = IndexSpatial()
+
+    # Jamais chargé: l'erreur remonte à la requête
+    with pytest.raises(RuntimeError):
+        index.synchroniser()
+
+    # Chargé: les recherches continuent sur l'état courant
+    index.grilles["client"].placer(1, LOME[0], LOME[1], {})
+    index.charge_a = index.synchronise_a = 1e18
+    index.invalider("client", 2)
+    index.synchroniser()
+    assert index._marques["client"] == {2}
+    assert len(index.grilles["client"]) == 1
@@ -28,23 +28,23 @@ def get_tours():
 
         agent_id = user_result['agent_id']
 
-        # Récupérer les livraisons regroupées par jour pour cet agent
+        # Livraisons regroupées par jour pour cet agent (agrégat journalier, voir rollups.py)
         cur.execute("""
             SELECT
-                DATE(l.date_livraison) as tour_date,
+                r.jour_livraison as tour_date,
                 a.id as agent_id,
                 a.nom as agent_name,
-                COUNT(l.id) as livraisons_count,
-                SUM(CASE WHEN l.statut = 'livree' THEN 1 ELSE 0 END) as completed_count,
-                SUM(CASE WHEN l.statut = 'en_cours' THEN 1 ELSE 0 END) as in_progress_count,
-                SUM(CASE WHEN l.statut = 'en_attente' THEN 1 ELSE 0 END) as pending_count,
-                COALESCE(SUM(l.montant_percu), 0) as total_amount,
-                COALESCE(SUM(l.quantite), 0) as total_quantity
-            FROM livraisons l
-            LEFT JOIN agents a ON l.agent_id = a.id
-            WHERE l.agent_id = %s AND l.date_livraison >= CURRENT_DATE - INTERVAL '30 days'
-            GROUP BY DATE(l.date_livraison), a.id, a.nom
-            ORDER BY DATE(l.date_livraison) DESC, a.nom
+                SUM(r.nb_livraisons) as livraisons_count,
+                COALESCE(SUM(r.nb_livraisons) FILTER (WHERE r.statut = 'livree'), 0) as completed_count,
+                COALESCE(SUM(r.nb_livraisons) FILTER (WHERE r.statut = 'en_cours'), 0) as in_progress_count,
+                COALESCE(SUM(r.nb_livraisons) FILTER (WHERE r.statut = 'en_attente'), 0) as pending_count,
+                COALESCE(SUM(r.montant), 0) as total_amount,
+                COALESCE(SUM(r.quantite), 0) as total_quantity
+            FROM livraisons_rollup_daily r
+            LEFT JOIN agents a ON r.agent_id = a.id
+            WHERE r.agent_id = %s AND r.jour_livraison >= CURRENT_DATE - INTERVAL '30 days'
+            GROUP BY r.jour_livraison, a.id, a.nom
+            ORDER BY r.jour_livraison DESC, a.nom
             LIMIT 30
         """, (agent_id,))
         
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Vues matérialisées des rapports (migration_vues_materialisees.sql)
+
+Rafraîchies avec REFRESH MATERIALIZED VIEW CONCURRENTLY: les rapports
+continuent de lire l'ancienne version pendant le calcul. La date du dernier
+rafraîchissement est gardée dans mv_refresh_log; les rapports la renvoient
+dans l'en-tête X-Data-Refreshed-At.
+
+Usage:
+    python vues.py [--vue mv_livraisons_agent_client_jour] [--complet]
+"""
+import time
+import argparse
+from db import get_connection
+from cache import invalidate, CACHE_TAG_RAPPORTS
+
+# Par agent et statut: agrégat livraisons_rollup_daily (tenu par trigger, sans vue)
+VUES = (
+    "mv_livraisons_agent_client_jour",
+)
+
+REFRESH_HEADER = "X-Data-Refreshed-At"
+
+
+def view_refreshed_at(cur, vue):
+    """Date ISO du dernier rafraîchissement (None si inconnue)"""
+    cur.execute("SELECT refreshed_at FROM mv_refresh_log WHERE vue = %s", (vue,))
+    row = cur.fetchone()
+    return row["refreshed_at"].isoformat() if row else None
+
+
+def refresh_views(vues=VUES, concurrent=True):
+    """
+    Rafraîchir les vues demandées. Une vue déjà en cours de rafraîchissement
+    (cron et demande manuelle simultanés) est sautée.
+    Retourne l'état de chaque vue.
+    """
+    inconnues = [vue for vue in vues if vue not in VUES]
+    if inconnues:
+        raise ValueError(f"Vue inconnue: {', '.join(inconnues)}")
+
+    conn = get_connection()
+    cur = conn.cursor()
+    resultats = []
+
+    try:
+        for vue in vues:
+            cur.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s)) AS verrou", (vue,))
+            if not cur.fetchone()["verrou"]:
+                conn.rollback()
+                resultats.append({"vue": vue, "statut": "deja_en_cours", "refreshed_at": view_refreshed_at(cur, vue)})
+                continue
+
+            # CONCURRENTLY est refusé sur une vue jamais remplie
+            cur.execute("SELECT ispopulated FROM pg_matviews WHERE matviewname = %s", (vue,))
+            row = cur.fetchone()
+            concurrent_vue = concurrent and bool(row and row["ispopulated"])
+
+            debut = time.perf_counter()
+            cur.execute(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrent_vue else ''}{vue}")
+            duree_ms = int((time.perf_counter() - debut) * 1000)
+
+            cur.execute("""
+                INSERT INTO mv_refresh_log (vue, refreshed_at, duree_ms, concurrent)
+                VALUES (%s, CURRENT_TIMESTAMP, %s, %s)
+                ON CONFLICT (vue) DO UPDATE
+                SET refreshed_at = EXCLUDED.refreshed_at, duree_ms = EXCLUDED.duree_ms,
+                    concurrent = EXCLUDED.concurrent
+                RETURNING refreshed_at
+            """, (vue, duree_ms, concurrent_vue))
+            refreshed_at = cur.fetchone()["refreshed_at"]
+            conn.commit()
+
+            resultats.append({
+                "vue": vue,
+                "statut": "rafraichie",
+                "refreshed_at": refreshed_at.isoformat(),
+                "duree_ms": duree_ms,
+                "concurrent": concurrent_vue,
+            })
+
+        return resultats
+
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def views_status():
+    """Contenu de mv_refresh_log"""
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("SELECT vue, refreshed_at, duree_ms, concurrent FROM mv_refresh_log ORDER BY vue")
+        return [
+            {**row, "refreshed_at": row["refreshed_at"].isoformat()}
+            for row in cur.fetchall()
+        ]
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rafraîchir les vues matérialisées des rapports")
+    parser.add_argument("--vue", action="append", choices=VUES, help="Vue à rafraîchir (toutes par défaut)")
+    parser.add_argument("--complet", action="store_true", help="Sans CONCURRENTLY (verrouille la vue)")
+    args = parser.parse_args()
+
+    for resultat in refresh_views(args.vue or VUES, concurrent=not args.complet):
+        if resultat["statut"] == "rafraichie":
+            print(f"✓ {resultat['vue']}: {resultat['duree_ms']} ms")
+        else:
+            print(f"… {resultat['vue']}: rafraîchissement déjà en cours")
+    invalidate(CACHE_TAG_RAPPORTS)